@@ -1,20 +1,273 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+from collections import OrderedDict
+import asyncio
 import os
 import json
+import threading
 from datetime import datetime
+from functools import partial
+import time
 import uuid # Добавляем uuid для генерации уникальных ID заметок
 from fastapi import HTTPException # Добавляем HTTPException для обработки ошибок
 
 from mcp.tools.git_tools import GitTools # Импортируем GitTools
+from mcp.tools.wall_dedup import NoteDedupIndex, note_key
+from mcp.tools.wall_index import created_at_epoch, decode_cursor, encode_cursor, next_page_cursor
+from mcp.tools.wall_refs import NoteRef, NoteRefIndex, split_ref
+from mcp.tools.wall_search import WallSearchIndex, parse_tag_filter
+from mcp.tools.wall_signatures import default_verifier
+from mcp.tools.wall_snapshot import bootstrap_wall
+from mcp.tools.wall_storage import NoteStorage, create_note_storage
+from mcp.tools.wall_trace import read_span
+from bridge.commit_queue import GitCommitQueue
+from bridge.shared_state import StateBackend, shared_state
+from bridge.wall_io import WallIOExecutor, wall_io
+
+# Поле версий, которое меняется при изменении всей стены
+WALL_VERSION_FIELD = "*"
+# Поле версий, которое меняется вместе с любым тредом (ключ кэша межтредовых ответов, например тегов)
+WALL_ANY_THREAD_FIELD = "*thread"
+
+# Канал обновлений поискового индекса: публикации и git pull доходят до индексов всех воркеров
+WALL_NOTES_CHANNEL = "wall_notes"
+
+# Виды P2P-событий, попадающие в поисковый индекс (1 - текстовая заметка; личные сообщения зашифрованы)
+SEARCH_EVENT_KINDS = {int(k) for k in os.getenv("WALL_SEARCH_EVENT_KINDS", "1").split(",") if k.strip()}
+
+# Проверка подписей публикуемых заметок: off - не проверять, warn - только сообщать, enforce - отклонять
+SIGNATURE_POLICIES = ("off", "warn", "enforce")
+
+# Запись стены (заметки, git commit/push, git pull) выполняет один воркер - владелец роли WALL_WRITER_ROLE.
+# Остальные воркеры передают ему запросы через WALL_WRITER_CHANNEL и ждут ответа в WALL_WRITER_REPLIES_CHANNEL.
+WALL_WRITER_ROLE = "wall_writer"
+WALL_WRITER_CHANNEL = "wall_writer_requests"
+WALL_WRITER_REPLIES_CHANNEL = "wall_writer_replies"
+WALL_WRITER_TIMEOUT = float(os.getenv("WALL_WRITER_TIMEOUT", "30"))
+
+# Сколько ключей недавних P2P-событий помнить, чтобы не обрабатывать копии с других релеев
+DEDUP_RECENT_EVENTS = int(os.getenv("WALL_DEDUP_RECENT_EVENTS", "10000"))
 
 # from ..utils.wall_manager import WallManager # TODO: Нужен модуль для управления стеной
 # from ..utils.git_tools import GitTools # TODO: Нужен модуль для работы с Git
 
 class WallAPI:
-    def __init__(self, wall_manager=None, git_tools=None):
+    def __init__(self, wall_manager=None, git_tools=None, storage: Optional[NoteStorage] = None, commit_queue: Optional[GitCommitQueue] = None,
+                 state: Optional[StateBackend] = None, io_executor: Optional[WallIOExecutor] = None):
         self.wall_manager = wall_manager   # Инстанс менеджера стены
         self.git_tools = git_tools if git_tools else GitTools(base_repo_path="wall")         # Инстанс инструментов Git
         self.base_wall_path = os.getenv("WALL_PATH", "wall/threads")
+        self.storage = storage if storage else create_note_storage(self.base_wall_path) # Хранилище заметок (WALL_STORAGE_BACKEND)
+        self.commit_queue = commit_queue if commit_queue else GitCommitQueue(self.git_tools) # Фоновые пакетные коммиты
+        # Версии тредов для инвалидации кэша хранятся в бэкенде состояния, общем для воркеров
+        self.state = state if state else shared_state
+        # Полнотекстовый индекс стены: строится из хранилища при первом поиске, затем пополняется
+        # публикациями (через WALL_NOTES_CHANNEL) и P2P-событиями
+        self.search_index = WallSearchIndex()
+        # Межтредовые индексы тегов и авторов (.index/refs.log), общие для всех писателей стены
+        self.note_refs = NoteRefIndex(self.storage)
+        # Ключи содержимого записанных заметок (.index/dedup.log): повторная заметка не пишется и не коммитится
+        self.note_dedup = NoteDedupIndex(self.storage)
+        self._recent_events: "OrderedDict[bytes, None]" = OrderedDict()
+        self.search_index_ready = False
+        self.state.subscribe(WALL_NOTES_CHANNEL, self._on_wall_notes)
+        # Проверка подписей перед публикацией (WALL_VERIFY_SIGNATURES); проверенные подписи кэшируются
+        # По умолчанию warn: заметки существующих публикаторов (scripts/publish_aizebra_note.py,
+        # create_and_sign_note.py) подписаны заглушками; enforce включается явно
+        self.signature_policy = os.getenv("WALL_VERIFY_SIGNATURES", "warn").lower()
+        if self.signature_policy not in SIGNATURE_POLICIES:
+            print(f"WallAPI: Неизвестная политика WALL_VERIFY_SIGNATURES={self.signature_policy}, используется warn.")
+            self.signature_policy = "warn"
+        self.require_signatures = os.getenv("WALL_REQUIRE_SIGNATURES", "false").lower() == "true"
+        self.signature_verifier = default_verifier()
+        # Файловая работа (чтение, запись, fsync, пересборка индексов) идет в пуле потоков, не в цикле событий
+        self.io = io_executor if io_executor else wall_io
+        # Проверка повтора и запись заметки - одна операция: параллельные публикации идут в разных потоках
+        self._write_lock = threading.Lock()
+        # Пишет ли этот воркер стену (elect_writer); запросы к писателю из этого воркера ждут ответа в _pending_writes
+        self.is_writer = True
+        self._writer_lease = False  # роль писателя захвачена через бэкенд состояния
+        self.worker_id = uuid.uuid4().hex
+        self._pending_writes: Dict[str, asyncio.Future] = {}
+        self.state.subscribe(WALL_WRITER_CHANNEL, self._on_writer_request)
+        self.state.subscribe(WALL_WRITER_REPLIES_CHANNEL, self._on_writer_reply)
+
+    def elect_writer(self) -> bool:
+        """
+        Захватывает роль писателя стены. Писатель один на все воркеры: только он пишет заметки,
+        ведет очередь коммитов и выполняет git pull, остальные передают ему запросы. Хранилище
+        segments не читается из других процессов, поэтому с ним второй воркер не запускается.
+        """
+        self.is_writer = self._writer_lease = self.state.try_acquire(WALL_WRITER_ROLE)
+        if not self.is_writer and self.storage.name == "segments":
+            raise RuntimeError("WALL_STORAGE_BACKEND=segments поддерживает только один воркер моста.")
+        self.storage.set_writer(self.is_writer)
+        print(f"WallAPI: Воркер {'пишет стену' if self.is_writer else 'передает запись стены писателю'}.")
+        return self.is_writer
+
+    async def _still_writer(self) -> bool:
+        """
+        Проверяет, что роль писателя не потеряна: пока соединение с хабом было разорвано, ее мог
+        захватить другой воркер. Потерявший роль воркер дальше передает запись новому писателю.
+        """
+        if self._writer_lease and not await self.state.run(self.state.holds, WALL_WRITER_ROLE):
+            self._writer_lease = False
+            print("WallAPI: Роль писателя стены перешла к другому воркеру, запись передается ему.")
+            self.is_writer = False
+            self.storage.set_writer(False)
+        return self.is_writer
+
+    async def _call_writer(self, op: str, **kwargs: Any) -> Any:
+        """Выполняет операцию записи в воркере-писателе и возвращает ее результат."""
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending_writes[request_id] = future
+        try:
+            await self.state.publish(WALL_WRITER_CHANNEL, {"request_id": request_id, "worker": self.worker_id,
+                                                           "op": op, "kwargs": kwargs})
+            reply = await asyncio.wait_for(future, WALL_WRITER_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Воркер-писатель стены не ответил.")
+        finally:
+            self._pending_writes.pop(request_id, None)
+        if "error" in reply:
+            raise HTTPException(status_code=reply["error"]["status_code"], detail=reply["error"]["detail"])
+        return reply["result"]
+
+    async def _on_writer_request(self, message: Dict[str, Any]) -> None:
+        if not await self._still_writer():
+            return
+        handlers = {"publish": self._write_note, "pull": self.pull_wall, "commit_status": self._commit_status_local}
+        reply: Dict[str, Any] = {"request_id": message["request_id"], "worker": message["worker"]}
+        try:
+            reply["result"] = await handlers[message["op"]](**message["kwargs"])
+        except HTTPException as e:
+            reply["error"] = {"status_code": e.status_code, "detail": e.detail}
+        except Exception as e:
+            reply["error"] = {"status_code": 500, "detail": f"Ошибка писателя стены: {e}"}
+        await self.state.publish(WALL_WRITER_REPLIES_CHANNEL, reply)
+
+    async def _on_writer_reply(self, message: Dict[str, Any]) -> None:
+        if message.get("worker") != self.worker_id:
+            return
+        future = self._pending_writes.get(message["request_id"])
+        if future is not None and not future.done():
+            future.set_result(message)
+
+    def thread_version(self, thread_id: str) -> int:
+        """
+        Текущая версия треда. Входит в ключ кэша чтения, поэтому изменение треда делает старые записи недостижимыми.
+        """
+        return self.state.version_get(thread_id, WALL_VERSION_FIELD)
+
+    def mark_thread_changed(self, thread_id: str) -> int:
+        """
+        Отмечает, что содержимое треда изменилось, и возвращает его новую версию.
+        """
+        self.state.version_bump(WALL_ANY_THREAD_FIELD)
+        return self.state.version_bump(thread_id)
+
+    def wall_version(self) -> int:
+        """
+        Версия стены целиком: растет при изменении любого треда. Ключ кэша ответов по всем тредам.
+        """
+        return self.state.version_get(WALL_ANY_THREAD_FIELD, WALL_VERSION_FIELD)
+
+    def mark_wall_changed(self) -> None:
+        """
+        Отмечает изменение всех тредов (когда затронутые треды неизвестны).
+        """
+        self.state.version_bump(WALL_VERSION_FIELD)
+
+    def thread_of_path(self, path: str, repo_name: str = ".") -> Optional[str]:
+        """
+        Возвращает тред для пути файла относительно репозитория GitTools или None, если путь вне стены.
+        """
+        repo_path = os.path.join(self.git_tools.base_repo_path, repo_name)
+        relative = os.path.relpath(os.path.join(repo_path, path), self.base_wall_path)
+        parts = relative.split(os.sep)
+        if parts[0] in ("", ".", "..") or len(parts) < 2:
+            return None
+        return parts[0]
+
+    async def pull_wall(self, repo_name: str = ".") -> Dict[str, Any]:
+        """
+        Подтягивает стену из удаленного репозитория и инвалидирует измененные треды.
+        """
+        if not await self._still_writer():
+            return await self._call_writer("pull", repo_name=repo_name)
+        # pull не должен идти одновременно с git add/commit/push очереди коммитов (index.lock, полусобранный коммит)
+        result = await self.commit_queue.run_git(self.git_tools.pull_repo, repo_name)
+        if result.get("status") != "success":
+            return result
+
+        changed_files = result.get("changed_files")
+        if changed_files is None:
+            await self.io.run(self._reload_wall)
+            await self.state.run(self.mark_wall_changed)
+            await self._publish_search_update({"reindex": None})
+            print("WallAPI: Не удалось определить измененные файлы после pull, инвалидирована вся стена.")
+            return {"status": "success", "changed_threads": None}
+
+        threads = sorted({t for t in (self.thread_of_path(p, repo_name) for p in changed_files) if t})
+        if threads:
+            await self.io.run(self._reload_threads, threads)
+        for thread_id in threads:
+            await self.state.run(self.mark_thread_changed, thread_id)
+        await self._publish_search_update({"reindex": threads})
+        print(f"WallAPI: После pull изменились треды: {threads}")
+        return {"status": "success", "changed_threads": threads}
+
+    def _reload_wall(self) -> None:
+        """Сбрасывает все треды хранилища и пересобирает индексы стены (в пуле ввода-вывода)."""
+        for thread_id in os.listdir(self.base_wall_path) if os.path.isdir(self.base_wall_path) else []:
+            self.storage.reload(thread_id)
+        self.note_refs.rebuild()
+        self.note_dedup.rebuild()
+
+    async def bootstrap_from_snapshots(self, directory: str) -> Dict[str, Any]:
+        """
+        Восстанавливает пустую стену из снимков каталога directory или доводит до последнего
+        снимка стену, восстановленную ранее (mcp/tools/wall_snapshot.py).
+        """
+        result = await self.io.run(bootstrap_wall, self.base_wall_path, directory)
+        if result["applied"]:
+            await self.io.run(self._reload_snapshot_threads)
+            await self.state.run(self.mark_wall_changed)
+            await self._publish_search_update({"reindex": None})
+        print(f"WallAPI: Снимки стены: {result['status']}, снимок {result['snapshot']}, применены {result['applied']}")
+        return result
+
+    def _reload_snapshot_threads(self) -> None:
+        """
+        Сбрасывает треды после восстановления из снимка. Индексы тегов/авторов и дедупликации
+        пришли в снимке и перечитываются из журналов, без разбора заметок.
+        """
+        for thread_id in os.listdir(self.base_wall_path) if os.path.isdir(self.base_wall_path) else []:
+            self.storage.reload(thread_id)
+        self.note_refs.refresh()
+        self.note_dedup.refresh()
+
+    def _reload_threads(self, threads: List[str]) -> None:
+        """Сбрасывает треды, измененные git pull, и доиндексирует их (в пуле ввода-вывода)."""
+        for thread_id in threads:
+            self.storage.reload(thread_id)
+        self.note_refs.reindex_threads(threads)
+        self.note_dedup.index_threads(threads)
+
+    def check_signature(self, content: Dict[str, Any]) -> None:
+        """
+        Проверяет подпись заметки по политике WALL_VERIFY_SIGNATURES. Неподписанные заметки
+        принимаются, если не задан WALL_REQUIRE_SIGNATURES=true.
+        """
+        if self.signature_policy == "off":
+            return
+        check = self.signature_verifier.verify(content)
+        if check.valid or (check.scheme is None and not self.require_signatures):
+            return
+        if self.signature_policy == "warn":
+            print(f"WallAPI: Подпись заметки {content.get('id')} не прошла проверку: {check.reason}")
+            return
+        raise HTTPException(status_code=400, detail=f"Invalid note signature: {check.reason}")
 
     async def publish_note(self, author_id: str, thread_id: str, content: Dict[str, Any], is_private: bool = False, recipient_user_id: Optional[str] = None) -> Dict[str, Any]:
         """
@@ -23,100 +276,284 @@ class WallAPI:
         """
         print(f"WallAPI: Публикация заметки от {author_id} в тред {thread_id}. Приватное: {is_private}.")
         
-        # TODO: Добавить валидацию подписи заметки перед публикацией, используя verify_wall_signatures.py
-        # if not self.git_tools.verify_signature(content): # Пример вызова
-        #     return {"status": "error", "message": "Invalid note signature"}
+        if self.signature_policy != "off":
+            # Ed25519/Schnorr - десятки микросекунд CPU на заметку: проверяем в пуле, а не в цикле событий
+            await self.io.run(self.check_signature, content)
 
         if is_private and recipient_user_id:
             # TODO: Реализовать логику записи в личный тред пользователя
             # note_id = await self.wall_manager.post_private_message(author_id, recipient_user_id, content)
             print(f"Публикация личного сообщения для {recipient_user_id}.")
             return {"status": "private_note_published", "note_id": "mock_private_note_id"}
-        else:
-            # Реализуем логику записи в общий или скрытый тред и коммита в Git
-            thread_dir = os.path.join(self.base_wall_path, thread_id)
-            os.makedirs(thread_dir, exist_ok=True)
-
-            # Генерируем уникальный ID для заметки и имя файла
-            note_id = content.get("id", str(uuid.uuid4()))
-            # Добавляем created_at, если его нет
-            if "created_at" not in content:
-                content["created_at"] = datetime.utcnow().isoformat() + "Z"
-            
-            filename = f"{note_id}.json"
-            filepath = os.path.join(thread_dir, filename)
+        if not await self._still_writer():
+            return await self._call_writer("publish", author_id=author_id, thread_id=thread_id, content=content)
+        return await self._write_note(author_id, thread_id, content)
+
+    async def _write_note(self, author_id: str, thread_id: str, content: Dict[str, Any]) -> Dict[str, Any]:
+        """Записывает заметку в общий или скрытый тред и ставит ее в очередь коммитов (в воркере-писателе)."""
+        # Ключ содержимого считается до подстановки id и created_at: иначе повтор той же публикации
+        # без них получает новый uuid и время и не распознается как дубликат
+        dedup_key = note_key(content)
+        # Генерируем уникальный ID для заметки и имя файла
+        note_id = content.get("id", str(uuid.uuid4()))
+        # Добавляем created_at, если его нет
+        if "created_at" not in content:
+            content["created_at"] = datetime.utcnow().isoformat() + "Z"
+
+        try:
+            stored_path = await self.io.run(self._store_note, thread_id, note_id, content, dedup_key)
+        except Exception as e:
+            print(f"WallAPI: Ошибка публикации заметки {note_id} в тред {thread_id}: {e}")
+            raise HTTPException(status_code=500, detail=f"Ошибка публикации заметки: {e}")
+        if stored_path is None:
+            print(f"WallAPI: Заметка {note_id} уже есть на стене, повторная публикация пропущена.")
+            return {"status": "note_duplicate", "note_id": note_id, "git_status": "skipped"}
+
+        await self.state.run(self.mark_thread_changed, thread_id)
+        await self._publish_search_update({"thread_id": thread_id, "note_id": note_id, "note": content})
 
+        # Коммит и пуш выполняются фоновой очередью пачками; путь передаем относительно репозитория GitTools
+        git_path = os.path.relpath(os.path.join(self.base_wall_path, stored_path), self.git_tools.base_repo_path)
+        await self.commit_queue.enqueue(note_id, thread_id, git_path, author_id=author_id)
+        print(f"WallAPI: Заметка {note_id} опубликована в тред {thread_id}, коммит в очереди.")
+        return {"status": "note_published", "note_id": note_id, "git_status": "queued"}
+
+    def _store_note(self, thread_id: str, note_id: str, content: Dict[str, Any], dedup_key: bytes) -> Optional[str]:
+        """
+        Записывает заметку на диск и в индексы (в пуле ввода-вывода). Возвращает путь заметки
+        относительно стены или None, если заметка с тем же содержимым уже записана.
+        Кроме ключа опубликованного содержимого запоминается ключ записанной заметки - тот же,
+        что дают ее копия из P2P или git pull и пересборка индекса.
+        """
+        with self._write_lock:
+            if self.is_stored(dedup_key):
+                return None
+            stored_path = self.storage.append(thread_id, note_id, content)
+            self.storage.sync() # Заметка должна быть на диске до ответа клиенту
             try:
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    json.dump(content, f, ensure_ascii=False, indent=2)
-                
-                # Коммит и пуш через GitTools
-                commit_message = f"Add note {note_id} to thread {thread_id} by {author_id}"
-                git_result = await self.git_tools.commit_and_push(repo_name=".", message=commit_message, files_to_add=[os.path.join(thread_id, filename)]) # Передаем относительный путь от base_repo_path (wall)
-
-                if git_result.get("status") == "success":
-                    print(f"WallAPI: Заметка {note_id} опубликована в тред {thread_id} и закоммичена.")
-                    return {"status": "note_published", "note_id": note_id, "git_status": "success"}
-                else:
-                    print(f"WallAPI: Заметка {note_id} опубликована локально, но ошибка Git: {git_result.get("message")}")
-                    raise HTTPException(status_code=500, detail=f"Ошибка Git при публикации: {git_result.get("message")}")
+                self.note_dedup.add_many([dedup_key, note_key(content)])
+            except Exception as e:
+                print(f"WallAPI: Не удалось добавить заметку {note_id} в индекс дедупликации: {e}")
+        try:
+            self.note_refs.add(thread_id, content, note_id=note_id)
+        except Exception as e:
+            # Заметка уже на диске: индекс догонит ее при следующей пересборке
+            print(f"WallAPI: Не удалось добавить заметку {note_id} в индекс тегов и авторов: {e}")
+        return stored_path
 
+    def get_commit_status(self, note_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает состояние Git-коммита опубликованной заметки из очереди этого воркера.
+        """
+        return self.commit_queue.get_status(note_id)
+
+    async def fetch_commit_status(self, note_id: str) -> Optional[Dict[str, Any]]:
+        """Состояние Git-коммита заметки из очереди воркера-писателя (в каком бы воркере ни был запрос)."""
+        if not await self._still_writer():
+            return await self._call_writer("commit_status", note_id=note_id)
+        return self.get_commit_status(note_id)
+
+    async def _commit_status_local(self, note_id: str) -> Optional[Dict[str, Any]]:
+        return self.get_commit_status(note_id)
+
+    async def get_thread_notes(self, thread_id: str, since: Optional[str] = None, limit: int = 50,
+                               cursor: Optional[str] = None, until: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Получает заметки из указанного треда, созданные в [since, until] (ISO 8601 или Unix-время).
+        cursor - курсор next_cursor предыдущей страницы (некорректный курсор - ValueError).
+        """
+        before = decode_cursor(cursor) if cursor else None
+        # Детали запроса пишет трассировка (WALL_TRACE), а не print: stdout на горячем пути - задержка
+        with read_span("get_thread_notes", thread_id=thread_id, limit=limit) as span:
+            try:
+                notes = await self.io.run(self._read_thread, thread_id, since, limit, before, until)
             except Exception as e:
-                print(f"WallAPI: Ошибка публикации заметки {note_id} в тред {thread_id}: {e}")
-                raise HTTPException(status_code=500, detail=f"Ошибка публикации заметки: {e}")
+                print(f"WallAPI: Ошибка чтения треда {thread_id}: {e}")
+                span.set(error=str(e), returned=0)
+                return []
+            if notes is None:
+                span.set(found=False, returned=0)
+                return []
+
+            span.set(returned=len(notes))
+            return notes
 
-    async def get_thread_notes(self, thread_id: str, since: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    def _read_thread(self, thread_id: str, since: Optional[str], limit: int, before: Optional[Tuple[float, str]],
+                     until: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        """Заметки треда или None, если треда нет (в пуле ввода-вывода)."""
+        if not self.storage.has_thread(thread_id):
+            return None
+        return self.storage.query(thread_id, since=since, limit=limit, before=before, until=until)
+
+    async def iter_thread_notes(self, thread_id: str, since: Optional[str] = None, limit: int = 0,
+                                cursor: Optional[str] = None, page_size: int = 500,
+                                until: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
         """
-        Получает заметки из указанного треда.
+        Отдает заметки треда от новых к старым, читая историю страницами по page_size
+        (память не зависит от размера треда). limit - сколько всего отдать, 0 - все.
         """
-        print(f"WallAPI: Запрос на получение заметок из треда {thread_id}")
-        print(f"WallAPI: base_wall_path = {self.base_wall_path}")
+        remaining = limit
+        while True:
+            size = min(page_size, remaining) if limit > 0 else page_size
+            notes = await self.get_thread_notes(thread_id, since=since, limit=size, cursor=cursor, until=until)
+            for note in reversed(notes):
+                yield note
+            if limit > 0:
+                remaining -= len(notes)
+                if remaining <= 0:
+                    return
+            cursor = next_page_cursor(notes, size)
+            if cursor is None:
+                return
 
-        thread_path = os.path.join(self.base_wall_path, thread_id)
-        print(f"WallAPI: thread_path = {thread_path}")
-        print(f"WallAPI: thread_path существует = {os.path.exists(thread_path)}")
-        print(f"WallAPI: thread_path является директорией = {os.path.isdir(thread_path)}")
+    async def _publish_search_update(self, message: Dict[str, Any]) -> None:
+        """
+        Рассылает обновление поискового индекса всем воркерам; если хаб недоступен - применяет локально.
+        """
+        try:
+            await self.state.publish(WALL_NOTES_CHANNEL, message)
+        except Exception as e:
+            print(f"WallAPI: Не удалось разослать обновление поискового индекса: {e}")
+            await self._on_wall_notes(message)
 
-        notes = []
+    async def _on_wall_notes(self, message: Dict[str, Any]) -> None:
+        """Применяет обновление поискового индекса: новая заметка или переиндексация тредов после pull."""
+        if "reindex" not in message:
+            self.search_index.add(message["thread_id"], message["note"], note_id=message.get("note_id"))
+            return
+        if not self.search_index_ready:
+            return  # Индекс еще не построен - при построении он прочитает хранилище целиком
+        threads = message["reindex"]
+        if threads is None:
+            self.search_index.clear()
+            self.search_index_ready = False
+            return
+        await self.io.run(self._reindex_search_threads, threads)
 
-        if not os.path.isdir(thread_path):
-            print(f"WallAPI: Тред не найден: {thread_id}")
-            return []
+    def _reindex_search_threads(self, threads: List[str]) -> None:
+        for thread_id in threads:
+            notes = self.storage.query(thread_id, limit=0) if self.storage.has_thread(thread_id) else []
+            self.search_index.reindex_thread(thread_id, notes)
 
+    def is_stored(self, key: bytes) -> bool:
+        """Заметка с ключом содержимого key уже записана на стену."""
         try:
-            files = os.listdir(thread_path)
-            print(f"WallAPI: Найдено файлов в директории: {len(files)}")
-            json_files = [f for f in files if f.endswith('.json')]
-            print(f"WallAPI: JSON файлов: {json_files}")
-
-            for filename in sorted(json_files):
-                filepath = os.path.join(thread_path, filename)
-                print(f"WallAPI: Читаю файл: {filepath}")
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        print(f"WallAPI: Содержимое файла ({len(content)} символов): {content[:100]}...")
-                        note = json.loads(content)
-                        print(f"WallAPI: Успешно распарсен JSON: ID = {note.get('id', 'N/A')}")
-                        notes.append(note)
-                except json.JSONDecodeError as e:
-                    print(f"WallAPI: Ошибка парсинга JSON в {filepath}: {e}")
-                except Exception as e:
-                    print(f"WallAPI: Ошибка чтения файла {filepath}: {e}")
+            return self.note_dedup.contains(key)
         except Exception as e:
-            print(f"WallAPI: Ошибка чтения директории {thread_path}: {e}")
-            return []
+            # Индекс недоступен - лучше записать копию, чем потерять заметку
+            print(f"WallAPI: Ошибка индекса дедупликации: {e}")
+            return False
+
+    def is_duplicate_event(self, event: Dict[str, Any]) -> bool:
+        """
+        True, если P2P-событие недавно уже пришло (копия через другой релей). Новое событие запоминается.
+        Событие, которое просто уже есть на стене (эхо своей публикации, git pull), дубликатом не считается:
+        его должны получить WebSocket-клиенты и буфер повтора. Проверка только в памяти, без ввода-вывода.
+        """
+        key = note_key(event)
+        if key in self._recent_events:
+            self._recent_events.move_to_end(key)
+            return True
+        self._recent_events[key] = None
+        if len(self._recent_events) > DEDUP_RECENT_EVENTS:
+            self._recent_events.popitem(last=False)
+        return False
+
+    def index_event(self, thread_id: str, event: Dict[str, Any]) -> bool:
+        """Добавляет P2P-событие в поисковый индекс (только виды SEARCH_EVENT_KINDS)."""
+        if event.get("kind") not in SEARCH_EVENT_KINDS:
+            return False
+        return self.search_index.add(thread_id, event)
 
-        if since:
+    def ensure_search_index(self) -> None:
+        """Строит поисковый индекс из всех тредов хранилища, если он еще не построен."""
+        if self.search_index_ready:
+            return
+        started = time.perf_counter()
+        threads = self.storage.threads()
+        for thread_id in threads:
             try:
-                since_dt = datetime.fromisoformat(since.replace('Z', '+00:00'))
-                notes = [note for note in notes if datetime.fromisoformat(note.get('created_at', '').replace('Z', '+00:00')) >= since_dt]
-            except ValueError as e:
-                print(f"WallAPI: Ошибка парсинга даты since: {e}")
-
-        notes = notes[-limit:] if limit > 0 else notes
-        print(f"WallAPI: Возвращено {len(notes)} заметок из треда {thread_id}")
-        return notes
+                notes = self.storage.query(thread_id, limit=0)
+            except Exception as e:
+                print(f"WallAPI: Ошибка чтения треда {thread_id} для поискового индекса: {e}")
+                continue
+            for note in notes:
+                self.search_index.add(thread_id, note)
+        self.search_index_ready = True
+        print(f"WallAPI: Поисковый индекс построен: {len(self.search_index)} заметок из {len(threads)} тредов "
+              f"за {time.perf_counter() - started:.2f} с")
+
+    async def search_notes(self, query: str = "", tags: Optional[List[str]] = None, authors: Optional[List[str]] = None,
+                           thread_id: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                           limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Полнотекстовый поиск по стене. tags - фильтры "<имя>:<значение>" (без имени - тег "t"),
+        since/until - ISO 8601 или Unix-время. Некорректные параметры - ValueError.
+        """
+        since_ts, until_ts = self._time_bounds(since, until)
+        tag_filters = [parse_tag_filter(tag) for tag in tags or []]
+        if not self.search_index_ready:
+            await self.io.run(self.ensure_search_index)
+        return self.search_index.search(query, tags=tag_filters, authors=authors, thread_id=thread_id,
+                                        since=since_ts, until=until_ts, limit=limit, cursor=cursor)
+
+    async def get_notes_by_tag(self, tag: str, since: Optional[str] = None, until: Optional[str] = None,
+                               limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Заметки всех тредов с тегом tag ("<имя>:<значение>", без имени - тег "t") - поиск по индексу,
+        без обхода тредов. Страница как у get_thread_notes: последние limit заметок раньше курсора,
+        от старых к новым; элементы - {"thread_id", "note"}. Возвращает (заметки, курсор следующей
+        страницы или None). Некорректные параметры - ValueError.
+        """
+        name, value = parse_tag_filter(tag)
+        refs = await self.io.run(partial(self.note_refs.by_tag, name, value, *self._time_bounds(since, until),
+                                         limit=limit, before=decode_cursor(cursor) if cursor else None))
+        return await self._load_refs(refs), self._refs_cursor(refs, limit)
+
+    async def get_tag_counts(self, name: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Самые частые теги заметок всех тредов: [{"name", "value", "count"}] (name - только теги с этим именем).
+        """
+        return await self.io.run(partial(self.note_refs.tag_counts, name=name, limit=limit))
+
+    async def get_notes_by_author(self, author: str, since: Optional[str] = None, until: Optional[str] = None,
+                                  limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Заметки всех тредов автора (pubkey или author_id) - поиск по индексу, результат как у get_notes_by_tag.
+        """
+        refs = await self.io.run(partial(self.note_refs.by_author, author, *self._time_bounds(since, until),
+                                         limit=limit, before=decode_cursor(cursor) if cursor else None))
+        return await self._load_refs(refs), self._refs_cursor(refs, limit)
+
+    @staticmethod
+    def _refs_cursor(refs: List[NoteRef], limit: int) -> Optional[str]:
+        """Курсор следующей (более старой) страницы: ключ первой ссылки полной страницы."""
+        if limit <= 0 or len(refs) < limit:
+            return None
+        return encode_cursor(refs[0])
+
+    @staticmethod
+    def _time_bounds(since: Optional[str], until: Optional[str]) -> Tuple[Optional[float], Optional[float]]:
+        bounds = []
+        for name, value in (("since", since), ("until", until)):
+            ts = created_at_epoch(value) if value is not None else None
+            if value is not None and ts is None:
+                raise ValueError(f"'{name}' must be a unix timestamp or ISO 8601 date")
+            bounds.append(ts)
+        return bounds[0], bounds[1]
+
+    async def _load_refs(self, refs: List[NoteRef]) -> List[Dict[str, Any]]:
+        """Читает заметки по ссылкам индекса параллельно в пуле; пропавшие из хранилища пропускаются."""
+        loaded = await self.io.map(self._load_ref, refs)
+        return [item for item in loaded if item is not None]
+
+    def _load_ref(self, ref: NoteRef) -> Optional[Dict[str, Any]]:
+        thread_id, note_id = split_ref(ref)
+        note = self.storage.get(thread_id, note_id, ref[0])
+        if note is None:
+            print(f"WallAPI: Заметка {note_id} из индекса не найдена в треде {thread_id}")
+            return None
+        return {"thread_id": thread_id, "note": note}
 
     async def create_thread(self, owner_id: str, thread_name: str, is_private: bool = False, associated_git_repo_url: Optional[str] = None) -> Dict[str, Any]:
         """
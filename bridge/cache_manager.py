@@ -3,15 +3,20 @@
 """
 
 import asyncio
+import os
+import sys
 import time
 import hashlib
-from typing import Dict, Any, Optional, Callable, Awaitable
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, Awaitable, Tuple
 from dataclasses import dataclass
-from functools import wraps
+from functools import partial, wraps
 import threading
 from concurrent.futures import ThreadPoolExecutor
 import json
 
+from bridge.shared_state import shared_state
+
 
 @dataclass
 class CacheEntry:
@@ -21,11 +26,17 @@ class CacheEntry:
     ttl: int  # Time to live in seconds
     access_count: int = 0
     last_access: float = 0
+    size: int = 0  # Оценка размера в байтах (если кэш ограничен по объему)
+    stale_ttl: int = 0  # Сколько секунд после ttl запись еще можно отдавать как устаревшую
 
     def is_expired(self) -> bool:
         """Проверяет, истек ли срок действия записи"""
         return time.time() - self.timestamp > self.ttl
 
+    def is_dead(self) -> bool:
+        """Проверяет, что запись нельзя отдавать даже как устаревшую"""
+        return time.time() - self.timestamp > self.ttl + self.stale_ttl
+
     def touch(self):
         """Обновляет время последнего доступа"""
         self.last_access = time.time()
@@ -33,13 +44,23 @@ class CacheEntry:
 
 
 class LRUCache:
-    """LRU кэш с поддержкой TTL"""
+    """LRU кэш с поддержкой TTL.
+
+    Записи хранятся в OrderedDict в порядке использования (в конце - самые свежие),
+    поэтому get, put и вытеснение выполняются за O(1). Кэш ограничивается числом
+    записей и, опционально, суммарным размером значений в байтах (max_bytes).
+    """
 
-    def __init__(self, max_size: int = 100, default_ttl: int = 300):
+    def __init__(self, max_size: int = 100, default_ttl: int = 300, max_bytes: Optional[int] = None):
         self.max_size = max_size
+        self.max_bytes = max_bytes
         self.default_ttl = default_ttl
-        self.cache: Dict[str, CacheEntry] = {}
-        self.access_order: Dict[str, float] = {}
+        self.cache: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
         self._lock = threading.Lock()
 
     def _make_key(self, *args, **kwargs) -> str:
@@ -51,65 +72,111 @@ class LRUCache:
         key_str = json.dumps(key_data, sort_keys=True, default=str)
         return hashlib.md5(key_str.encode()).hexdigest()
 
+    @staticmethod
+    def _estimate_size(value: Any) -> int:
+        """Оценивает размер значения в байтах по его JSON-представлению"""
+        try:
+            return len(json.dumps(value, ensure_ascii=False, default=str).encode('utf-8'))
+        except (TypeError, ValueError):
+            return sys.getsizeof(value)
+
+    def _remove(self, key: str):
+        entry = self.cache.pop(key)
+        self.current_bytes -= entry.size
+
     def get(self, key: str) -> Optional[Any]:
         """Получает значение из кэша"""
         with self._lock:
-            if key in self.cache:
-                entry = self.cache[key]
-                if entry.is_expired():
-                    del self.cache[key]
-                    del self.access_order[key]
-                    return None
-
-                entry.touch()
-                self.access_order[key] = entry.last_access
-                return entry.data
-            return None
-
-    def put(self, key: str, value: Any, ttl: Optional[int] = None):
+            entry = self.cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.is_expired():
+                if entry.is_dead():
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            entry.touch()
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return entry.data
+
+    def get_stale(self, key: str) -> Tuple[Optional[Any], bool]:
+        """Получает значение вместе с признаком устаревания (для stale-while-revalidate)"""
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is None or entry.is_dead():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None, False
+
+            entry.touch()
+            self.cache.move_to_end(key)
+            self.hits += 1
+            stale = entry.is_expired()
+            if stale:
+                self.stale_hits += 1
+            return entry.data, stale
+
+    def put(self, key: str, value: Any, ttl: Optional[int] = None, stale_ttl: int = 0):
         """Сохраняет значение в кэш"""
         with self._lock:
             if ttl is None:
                 ttl = self.default_ttl
 
-            entry = CacheEntry(
+            size = self._estimate_size(value) if self.max_bytes else 0
+            if key in self.cache:
+                self._remove(key)
+            if self.max_bytes and size > self.max_bytes:
+                # Значение больше всего кэша - не кэшируем
+                return
+
+            self.cache[key] = CacheEntry(
                 data=value,
                 timestamp=time.time(),
-                ttl=ttl
+                ttl=ttl,
+                size=size,
+                stale_ttl=stale_ttl
             )
+            self.current_bytes += size
 
-            # Если кэш полон, удаляем наименее используемый элемент
-            if len(self.cache) >= self.max_size and key not in self.cache:
-                oldest_key = min(self.access_order, key=self.access_order.get)
-                del self.cache[oldest_key]
-                del self.access_order[oldest_key]
-
-            self.cache[key] = entry
-            self.access_order[key] = time.time()
+            # Вытесняем наименее недавно использованные записи
+            while len(self.cache) > self.max_size or (self.max_bytes and self.current_bytes > self.max_bytes):
+                _, evicted = self.cache.popitem(last=False)
+                self.current_bytes -= evicted.size
+                self.evictions += 1
 
     def clear(self):
         """Очищает кэш"""
         with self._lock:
             self.cache.clear()
-            self.access_order.clear()
+            self.current_bytes = 0
 
     def cleanup_expired(self):
         """Удаляет истекшие записи"""
         with self._lock:
-            expired_keys = [k for k, v in self.cache.items() if v.is_expired()]
+            expired_keys = [k for k, v in self.cache.items() if v.is_dead()]
             for key in expired_keys:
-                del self.cache[key]
-                del self.access_order[key]
+                self._remove(key)
 
     def stats(self) -> Dict[str, Any]:
         """Возвращает статистику кэша"""
         with self._lock:
-            total_access = sum(entry.access_count for entry in self.cache.values())
+            total_access = self.hits + self.misses
             return {
                 'size': len(self.cache),
                 'max_size': self.max_size,
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_hits': self.stale_hits,
+                'evictions': self.evictions,
                 'total_access_count': total_access,
-                'hit_rate': total_access / max(1, sum(len(self.cache) for _ in range(total_access)))
+                'hit_rate': self.hits / total_access if total_access else 0.0
             }
 
 
@@ -164,32 +231,67 @@ class AsyncTaskManager:
                 if not task.done():
                     task.cancel()
             self.tasks.clear()
-        await self.executor.shutdown(wait=True)
+        self.executor.shutdown(wait=True)
+
 
+def cached_async(cache: LRUCache, ttl: Optional[int] = None, stale_while_revalidate: Optional[int] = None):
+    """Декоратор для кэширования результатов асинхронных функций.
 
-def cached_async(cache: LRUCache, ttl: Optional[int] = None):
-    """Декоратор для кэширования результатов асинхронных функций"""
+    Одновременные промахи по одному ключу объединяются (single-flight): функция
+    вызывается один раз, остальные вызовы ждут тот же результат. При
+    stale_while_revalidate=N истекшее значение еще N секунд отдается сразу,
+    а обновление выполняется одной фоновой задачей.
+    """
     def decorator(func: Callable) -> Callable:
+        in_flight: Dict[str, asyncio.Task] = {}
+        # Разделяемый кэш (SharedCache) ходит в хаб вне event loop, локальный LRUCache - напрямую
+        run = getattr(cache, "run", None)
+
+        async def call(method: Callable, *args):
+            return await run(method, *args) if run else method(*args)
+
+        async def compute(cache_key: str, args, kwargs):
+            # Исключения (в т.ч. HTTPException) не кэшируются и передаются всем ожидающим
+            result = await func(*args, **kwargs)
+            await call(partial(cache.put, cache_key, result, ttl, stale_ttl=stale_while_revalidate or 0))
+            return result
+
+        def on_done(cache_key: str, background: bool, task: asyncio.Task):
+            if in_flight.get(cache_key) is task:
+                del in_flight[cache_key]
+            # Забираем исключение, чтобы фоновое обновление без ожидающих не давало
+            # "Task exception was never retrieved"
+            if not task.cancelled() and task.exception() is not None and background:
+                print(f"cached_async: Ошибка фонового обновления {func.__name__}: {task.exception()}")
+
+        def start(cache_key: str, args, kwargs, background: bool = False) -> asyncio.Task:
+            loop = asyncio.get_running_loop()
+            task = in_flight.get(cache_key)
+            if task is None or task.get_loop() is not loop:
+                task = loop.create_task(compute(cache_key, args, kwargs))
+                in_flight[cache_key] = task
+                task.add_done_callback(lambda t: on_done(cache_key, background, t))
+            return task
+
         @wraps(func)
         async def wrapper(*args, **kwargs):
             cache_key = cache._make_key(func.__name__, *args, **kwargs)
-            cached_result = cache.get(cache_key)
-
-            if cached_result is not None:
-                return cached_result
-
-            try:
-                result = await func(*args, **kwargs)
-                cache.put(cache_key, result, ttl)
-                return result
-            except Exception as e:
-                # Не кэшируем исключения, особенно HTTPException
-                if hasattr(e, 'status_code') and e.status_code >= 400:
-                    # Это HTTP ошибка, не кэшируем
-                    raise e
-                # Для других исключений тоже не кэшируем
-                raise e
 
+            if stale_while_revalidate:
+                cached_result, stale = await call(cache.get_stale, cache_key)
+                if cached_result is not None:
+                    if stale:
+                        start(cache_key, args, kwargs, background=True)
+                    return cached_result
+            else:
+                cached_result = await call(cache.get, cache_key)
+                if cached_result is not None:
+                    return cached_result
+
+            # shield: отмена одного ожидающего не отменяет общее вычисление
+            return await asyncio.shield(start(cache_key, args, kwargs))
+
+        wrapper.in_flight = in_flight
         return wrapper
     return decorator
 
@@ -281,9 +383,11 @@ class PerformanceMonitor:
             return stats
 
 
-# Глобальные экземпляры
-api_cache = LRUCache(max_size=200, default_ttl=300)  # 5 минут
-wall_cache = LRUCache(max_size=50, default_ttl=60)   # 1 минута
+# Глобальные экземпляры. Кэши создает бэкенд состояния: при BRIDGE_STATE_BACKEND=socket
+# они общие для всех воркеров uvicorn
+api_cache = shared_state.create_cache("api_cache", max_size=200, default_ttl=300)  # 5 минут
+wall_cache = shared_state.create_cache("wall_cache", max_size=50, default_ttl=60,   # 1 минута
+                                       max_bytes=int(os.getenv("WALL_CACHE_MAX_BYTES", "0")) or None)
 task_manager = AsyncTaskManager(max_workers=4)
 connection_pool = ConnectionPool(max_connections=5)
 performance_monitor = PerformanceMonitor()
@@ -311,5 +415,5 @@ async def shutdown_performance_system():
     """Завершает работу системы производительности"""
     await task_manager.cleanup()
     await connection_pool.cleanup()
-    api_cache.clear()
-    wall_cache.clear()
+    await shared_state.run(api_cache.clear)
+    await shared_state.run(wall_cache.clear)
@@ -0,0 +1,194 @@
+"""
+Фоновая очередь Git-коммитов для публикаций на стену
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Awaitable, Callable, List, Optional
+
+from bridge.cache_manager import performance_monitor
+
+
+class GitCommitQueue:
+    """
+    Группирует заметки, опубликованные за окно batch_window секунд (или до batch_size штук),
+    в один git commit и один git push. Публикация не ждет сети: заметка уже на диске,
+    а ее состояние в Git можно узнать через get_status(). Другие операции Git с тем же
+    репозиторием (git pull) выполняются через run_git - между пачками, а не одновременно с ними.
+    """
+
+    def __init__(self, git_tools, repo_name: str = ".", batch_window: Optional[float] = None,
+                 batch_size: Optional[int] = None, max_attempts: int = 3, max_tracked: int = 10000):
+        self.git_tools = git_tools
+        self.repo_name = repo_name
+        self.batch_window = batch_window if batch_window is not None else float(os.getenv("WALL_COMMIT_WINDOW", "2.0"))
+        self.batch_size = batch_size or int(os.getenv("WALL_COMMIT_BATCH_SIZE", "50"))
+        self.max_attempts = max_attempts
+        self.max_tracked = max_tracked
+        self.committed_batches = 0
+        self.failed_notes = 0
+        self._pending: List[Dict[str, Any]] = []
+        self._in_flight = 0
+        self._states: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._git_lock: Optional[asyncio.Lock] = None
+        self._git_lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = False
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество заметок, ожидающих коммита"""
+        return len(self._pending)
+
+    async def enqueue(self, note_id: str, thread_id: str, path: str, author_id: Optional[str] = None):
+        """Ставит записанную на диск заметку в очередь на коммит"""
+        now = time.time()
+        self._set_state(note_id, {
+            "note_id": note_id,
+            "thread_id": thread_id,
+            "status": "pending",
+            "enqueued_at": now,
+            "committed_at": None,
+            "attempts": 0,
+            "error": None,
+        })
+        self._pending.append({"note_id": note_id, "thread_id": thread_id, "path": path,
+                              "author_id": author_id, "enqueued_at": time.monotonic(), "attempts": 0})
+        performance_monitor.record_metric('git_commit_queue_depth', len(self._pending))
+        self._ensure_worker()
+        self._wakeup.set()
+
+    async def run_git(self, operation: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Выполняет операцию Git с репозиторием очереди, пока коммит пачки не идет"""
+        async with self._repo_lock():
+            return await operation(*args, **kwargs)
+
+    def _repo_lock(self) -> asyncio.Lock:
+        # Блокировка привязана к циклу событий, поэтому создается заново в новом цикле
+        loop = asyncio.get_running_loop()
+        if self._git_lock is None or self._git_lock_loop is not loop:
+            self._git_lock = asyncio.Lock()
+            self._git_lock_loop = loop
+        return self._git_lock
+
+    def get_status(self, note_id: str) -> Optional[Dict[str, Any]]:
+        """Возвращает состояние коммита заметки или None, если заметка неизвестна"""
+        state = self._states.get(note_id)
+        return dict(state) if state else None
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика очереди"""
+        return {
+            'queue_depth': len(self._pending),
+            'in_flight': self._in_flight,
+            'committed_batches': self.committed_batches,
+            'failed_notes': self.failed_notes,
+            'batch_window': self.batch_window,
+            'batch_size': self.batch_size,
+        }
+
+    async def stop(self):
+        """Дожидается коммита оставшихся заметок и останавливает воркер"""
+        self._stopping = True
+        if self._worker is not None and not self._worker.done() and self._loop is asyncio.get_running_loop():
+            self._wakeup.set()
+            await self._worker
+        self._stopping = False
+
+    def _set_state(self, note_id: str, state: Dict[str, Any]):
+        self._states[note_id] = state
+        self._states.move_to_end(note_id)
+        while len(self._states) > self.max_tracked:
+            self._states.popitem(last=False)
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                if self._stopping:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Копим пачку: до batch_size заметок или batch_window секунд с момента первой
+            deadline = self._pending[0]["enqueued_at"] + self.batch_window
+            while len(self._pending) < self.batch_size and not self._stopping:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self._pending[:self.batch_size]
+            del self._pending[:len(batch)]
+            await self._commit_batch(batch)
+
+    async def _commit_batch(self, batch: List[Dict[str, Any]]):
+        self._in_flight = len(batch)
+        for item in batch:
+            self._states.get(item["note_id"], {})["status"] = "committing"
+
+        files = list(dict.fromkeys(item["path"] for item in batch))
+        if len(batch) == 1:
+            item = batch[0]
+            message = f"Add note {item['note_id']} to thread {item['thread_id']} by {item['author_id']}"
+        else:
+            threads = ", ".join(dict.fromkeys(item["thread_id"] for item in batch))
+            message = f"Add {len(batch)} notes to threads {threads}\n\n" + "\n".join(
+                f"{item['note_id']} -> {item['thread_id']}" for item in batch)
+
+        start_time = time.time()
+        try:
+            result = await self.run_git(self.git_tools.commit_and_push, repo_name=self.repo_name, message=message,
+                                        files_to_add=files)
+        except Exception as e:
+            result = {"status": "error", "message": str(e)}
+        commit_time = (time.time() - start_time) * 1000
+
+        performance_monitor.record_metric('git_commit_batch_size', len(batch))
+        performance_monitor.record_metric('git_commit_time', commit_time)
+        self._in_flight = 0
+
+        if result.get("status") == "success":
+            self.committed_batches += 1
+            now = time.time()
+            for item in batch:
+                state = self._states.get(item["note_id"])
+                if state:
+                    state.update(status="committed", committed_at=now, attempts=item["attempts"] + 1, error=None)
+            print(f"GitCommitQueue: Закоммичено {len(batch)} заметок за {commit_time:.0f} мс.")
+            return
+
+        print(f"GitCommitQueue: Ошибка Git для пачки из {len(batch)} заметок: {result.get('message')}")
+        retry = []
+        for item in batch:
+            item["attempts"] += 1
+            state = self._states.get(item["note_id"])
+            if state:
+                state.update(attempts=item["attempts"], error=result.get("message"))
+            if item["attempts"] < self.max_attempts:
+                if state:
+                    state["status"] = "pending"
+                retry.append(item)
+            else:
+                self.failed_notes += 1
+                if state:
+                    state["status"] = "failed"
+        if retry:
+            # Возвращаем пачку в начало очереди, сохраняя порядок, и даем Git паузу
+            self._pending[:0] = retry
+            await asyncio.sleep(0 if self._stopping else min(2 ** retry[0]["attempts"], 30))
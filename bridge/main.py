@@ -1,6 +1,6 @@
-from fastapi import FastAPI, WebSocket, HTTPException
-from fastapi.responses import JSONResponse
-from typing import List, Dict
+from fastapi import FastAPI, WebSocket, HTTPException, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List, Dict, Optional
 import yaml
 import os
 # Меняем импорт SdominantaAgent на новый путь
@@ -10,11 +10,16 @@ import httpx
 from pydantic import BaseModel
 from pynostr.event import Event, EventKind
 from bridge.api.wall import WallAPI # Импортируем WallAPI
-from bridge.error_handler import safe_websocket_send, log_error_with_context, safe_p2p_operation
+from bridge.error_handler import log_error_with_context, safe_p2p_operation
 from bridge.cache_manager import (
     api_cache, wall_cache, task_manager, performance_monitor,
     cached_async, initialize_performance_system, shutdown_performance_system
 )
+from bridge.shared_state import shared_state
+from bridge.ws_broadcaster import WebSocketBroadcaster
+from bridge.ws_codecs import FrameDecodeError, negotiate_codec
+from mcp.tools.wall_codec import encode_note
+from mcp.tools.wall_index import decode_cursor, next_page_cursor
 from bridge.logger import (
     log_manager, log_api_request, log_p2p_event, log_performance_metric,
     log_error, setup_fastapi_logging
@@ -22,18 +27,45 @@ from bridge.logger import (
 import json
 import logging
 import time
+from functools import partial
 
 app = FastAPI()
 
 # Инициализация WallAPI
 wall_api = WallAPI()
 
-connected_websockets: set[WebSocket] = set() # Глобальный набор для хранения активных WebSocket-соединений
+# WebSocket-клиенты этого воркера: у каждого своя очередь и писатель (WS_SEND_QUEUE_SIZE, WS_SLOW_CONSUMER_POLICY)
+ws_broadcaster = WebSocketBroadcaster()
+connected_websockets = ws_broadcaster.clients # WebSocket-соединения этого воркера; события приходят через shared_state
+
+# Канал рассылки P2P-событий WebSocket-клиентам всех воркеров
+P2P_EVENTS_CHANNEL = "p2p_events"
+
+# TTL кэша чтения тредов. Ключ кэша включает версию треда, поэтому TTL может быть большим:
+# публикации, P2P-события и git pull сразу делают старые записи недостижимыми.
+WALL_CACHE_TTL = int(os.getenv("WALL_CACHE_TTL", "3600"))
+
+# Размер страницы, которыми читается тред при потоковой выдаче (format=ndjson)
+WALL_STREAM_PAGE_SIZE = int(os.getenv("WALL_STREAM_PAGE_SIZE", "500"))
+
+# Наибольший размер страницы полнотекстового поиска
+WALL_SEARCH_MAX_LIMIT = int(os.getenv("WALL_SEARCH_MAX_LIMIT", "100"))
+
+# Снимок стены для клиента /ws, чей last_seq уже вытеснен из буфера повтора (WS_REPLAY_BUFFER_SIZE)
+WS_SNAPSHOT_THREADS = [t for t in os.getenv("WS_SNAPSHOT_THREADS", "general").split(",") if t]
+WS_SNAPSHOT_LIMIT = int(os.getenv("WS_SNAPSHOT_LIMIT", "50"))
+
+
+def event_thread_id(event: Dict) -> str:
+    """Определяет thread_id события из tags (["t", <thread>]), по умолчанию 'general'"""
+    for tag in event.get('tags') or []:
+        if isinstance(tag, list) and len(tag) > 1 and tag[0] == 't':
+            return tag[1]
+    return "general"
 
 async def handle_p2p_message(msg: str):
     """Обработка входящих P2P сообщений с улучшенной обработкой ошибок"""
     global known_peers
-    global connected_websockets
 
     logging.info(f"[SERVER AGENT RECEIVED]: {msg}")
 
@@ -43,25 +75,24 @@ async def handle_p2p_message(msg: str):
             event_data = data[2]
             event_pubkey = event_data.get("pubkey")
 
-            if event_pubkey and event_pubkey not in known_peers:
-                known_peers.add(event_pubkey)
-                log_p2p_event("peer_added", peer=event_pubkey, event_data={"old_count": len(known_peers) - 1})
+            # Обращения к разделяемому состоянию идут через shared_state.run: хаб не блокирует event loop
+            if event_pubkey and not await shared_state.run(known_peers.__contains__, event_pubkey):
+                await shared_state.run(known_peers.add, event_pubkey)
+                log_p2p_event("peer_added", peer=event_pubkey,
+                              event_data={"old_count": await shared_state.run(len, known_peers) - 1})
 
-            # Отправляем P2P событие всем подключенным WebSocket-клиентам с безопасной обработкой
-            disconnected_websockets = []
-            for websocket in connected_websockets.copy():
-                success = await safe_websocket_send(websocket, {"type": "p2p_event", "data": event_data})
-                if not success:
-                    disconnected_websockets.append(websocket)
+            # Копия недавно полученного события (другой релей) не рассылается повторно
+            if wall_api.is_duplicate_event(event_data):
+                logging.info(f"Duplicate P2P event skipped: {event_data.get('id')}")
+                return
 
-            # Удаляем отключенные WebSocket соединения
-            for websocket in disconnected_websockets:
-                if websocket in connected_websockets:
-                    connected_websockets.remove(websocket)
-                    logging.warning("Removed disconnected WebSocket from connected_websockets")
+            # Событие из сети меняет тред - кэш чтения этого треда больше не актуален
+            await shared_state.run(wall_api.mark_thread_changed, event_thread_id(event_data))
 
-            # Логируем успешную обработку события
-            log_p2p_event("event_processed", event_data={"event_type": "message", "recipients": len(connected_websockets)})
+            # Рассылаем событие WebSocket-клиентам всех воркеров. Номер seq общий для воркеров:
+            # по нему переподключившийся клиент получает пропущенные события
+            seq = await shared_state.run(shared_state.incr, "p2p_seq")
+            await shared_state.publish(P2P_EVENTS_CHANNEL, {"seq": seq, "event": event_data})
 
     except json.JSONDecodeError as e:
         log_error(e, "P2P message JSON parsing", {"message": msg})
@@ -69,6 +100,20 @@ async def handle_p2p_message(msg: str):
         log_error(e, "P2P message processing", {"message": msg})
 
 
+async def broadcast_p2p_event(message: Dict):
+    """Отправляет P2P событие ({"seq", "event"}) WebSocket-клиентам этого воркера"""
+    event_data = message["event"]
+    # Каждый воркер пополняет свой поисковый индекс
+    wall_api.index_event(event_thread_id(event_data), event_data)
+    # Сообщение сериализуется один раз и ставится в очереди клиентов без ожидания отправки
+    recipients = ws_broadcaster.broadcast_event(event_data, key=event_data.get("id"), seq=message.get("seq"))
+
+    # Логируем успешную обработку события
+    log_p2p_event("event_processed", event_data={"event_type": "message", "recipients": recipients})
+
+shared_state.subscribe(P2P_EVENTS_CHANNEL, broadcast_p2p_event)
+
+
 # Удаляем GemmaRequest, так как Gemma теперь управляется напрямую
 # class GemmaRequest(BaseModel):
 #     prompt: str
@@ -91,10 +136,14 @@ p2p_connection_error = None
 # Ключи агента для сервера. В продакшене использовать Docker Secrets.
 SERVER_AGENT_PRIVATE_KEY = os.getenv("SERVER_AGENT_PRIVATE_KEY", None)
 SERVER_AGENT_PUBLIC_KEY = os.getenv("SERVER_AGENT_PUBLIC_KEY", "3bf6a9d254e1bd3d561f96e8acb11401dbde09e2b9c6f99fee92a1e3393718a0")
-known_peers: set[str] = set() # Глобальный набор для хранения известных публичных ключей пиров
+known_peers = shared_state.create_set("known_peers") # Известные публичные ключи пиров (общие для воркеров)
+
+async def init_p2p_agent(listen: bool = True):
+    """Инициализация и подключение P2P агента с обработкой ошибок.
 
-async def init_p2p_agent():
-    """Инициализация и подключение P2P агента с обработкой ошибок"""
+    listen=False - агент только подключается (для публикации), без подписок:
+    входящие события принимает один воркер и рассылает остальным через shared_state.
+    """
     global sdominanta_agent, p2p_connection_status, p2p_connection_error
 
     if not CONFIG.get('p2p_enabled', False):
@@ -120,15 +169,16 @@ async def init_p2p_agent():
             print(f"!!! SAVE THIS SERVER PRIVATE KEY: {sdominanta_agent.private_key.hex()} !!!")
 
         # Добавляем публичный ключ самого агента сервера в список известных пиров
-        known_peers.add(sdominanta_agent.public_key)
+        await shared_state.run(known_peers.add, sdominanta_agent.public_key)
 
         # Подключаемся к P2P daemon через безопасную операцию с retry
         await safe_p2p_operation(sdominanta_agent.connect, ws_url=daemon_url)
 
-        # Подписываемся на публичные сообщения
-        await sdominanta_agent.subscribe("sub_general", {"kinds": [EventKind.TEXT_NOTE]})
-        # Подписываемся на личные сообщения, адресованные этому агенту
-        await sdominanta_agent.subscribe("sub_dm", {"kinds": [EventKind.ENCRYPTED_DIRECT_MESSAGE], "#p": [sdominanta_agent.public_key]})
+        if listen:
+            # Подписываемся на публичные сообщения
+            await sdominanta_agent.subscribe("sub_general", {"kinds": [EventKind.TEXT_NOTE]})
+            # Подписываемся на личные сообщения, адресованные этому агенту
+            await sdominanta_agent.subscribe("sub_dm", {"kinds": [EventKind.ENCRYPTED_DIRECT_MESSAGE], "#p": [sdominanta_agent.public_key]})
 
         p2p_connection_status = "connected"
         print("P2P agent successfully initialized and connected")
@@ -185,8 +235,23 @@ async def lifespan(app: FastAPI):
     setup_fastapi_logging()
     logging.info("🚀 Инициализация системы Sdominanta.net")
 
-    await init_p2p_agent()
-    await start_p2p_listening()
+    shared_state.start()
+    # Без общего хаба каждый воркер считал бы себя писателем стены (BRIDGE_WORKERS передается uvicorn --workers)
+    if int(os.getenv("BRIDGE_WORKERS", "1")) > 1 and not shared_state.is_shared:
+        raise RuntimeError("BRIDGE_WORKERS > 1 требует BRIDGE_STATE_BACKEND=socket.")
+    wall_api.elect_writer()
+    # Слушает P2P-сеть только один воркер, остальные получают события через shared_state
+    p2p_listener = shared_state.try_acquire("p2p_listener")
+    await init_p2p_agent(listen=p2p_listener)
+    # Новый узел поднимает стену из снимков вместо разбора всех заметок (WALL_BOOTSTRAP_SNAPSHOTS)
+    snapshots_dir = os.getenv("WALL_BOOTSTRAP_SNAPSHOTS")
+    if snapshots_dir and shared_state.try_acquire("wall_bootstrap"):
+        try:
+            await wall_api.bootstrap_from_snapshots(snapshots_dir)
+        except Exception as e:
+            log_error_with_context(e, "wall_bootstrap", {"directory": snapshots_dir})
+    if p2p_listener:
+        await start_p2p_listening()
     await initialize_performance_system()
 
     logging.info("✅ Все системы инициализированы успешно")
@@ -194,7 +259,11 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logging.info("🔄 Начинаем завершение работы системы")
     await stop_p2p_agent()
+    await ws_broadcaster.close()
+    await wall_api.commit_queue.stop()
+    wall_api.storage.close()
     await shutdown_performance_system()
+    shared_state.close()
     logging.info("🛑 Система завершена корректно")
 
 # Обновляем app для использования lifespan
@@ -207,12 +276,7 @@ async def wall_publish(note_signed: Dict): # note_signed теперь это с
     if not sdominanta_agent:
         raise HTTPException(status_code=503, detail="P2P service not enabled or connected.")
     
-    # Определяем thread_id из tags, если есть, иначе используем 'general'
-    thread_id = "general"
-    for tag in note_signed.get('tags', []):
-        if tag[0] == 't':
-            thread_id = tag[1]
-            break
+    thread_id = event_thread_id(note_signed)
 
     # Используем WallAPI для публикации заметки
     return await wall_api.publish_note(
@@ -248,17 +312,52 @@ async def wall_publish(note_signed: Dict): # note_signed теперь это с
 #         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
 
 
-@cached_async(wall_cache, ttl=60)
-async def _get_wall_notes_cached(thread_id: str = "general", since: str = None, limit: int = 50):
-    """Кэшированная версия получения заметок стены"""
-    return await wall_api.get_thread_notes(thread_id=thread_id, since=since, limit=limit)
+@app.get("/api/v1/wall/notes/{note_id}/commit")
+async def wall_note_commit_status(note_id: str):
+    """Возвращает состояние Git-коммита опубликованной заметки (pending, committing, committed, failed)."""
+    status = await wall_api.fetch_commit_status(note_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Note {note_id} is not tracked by the commit queue.")
+    return JSONResponse(status_code=200, content=status)
+
+@cached_async(wall_cache, ttl=WALL_CACHE_TTL, stale_while_revalidate=30)
+async def _get_wall_notes_cached(thread_id: str = "general", since: str = None, limit: int = 50, version: int = 0,
+                                 cursor: str = None, until: str = None):
+    """Кэшированная версия получения заметок стены (version - версия треда, часть ключа кэша)"""
+    return await wall_api.get_thread_notes(thread_id=thread_id, since=since, limit=limit, cursor=cursor, until=until)
+
+async def _stream_wall_notes(thread_id: str, since: str, limit: int, cursor: str, until: str):
+    """Заметки треда построчно в NDJSON, от новых к старым, по мере чтения страниц"""
+    async for note in wall_api.iter_thread_notes(thread_id, since=since, limit=limit, cursor=cursor,
+                                                 page_size=WALL_STREAM_PAGE_SIZE, until=until):
+        yield encode_note(note) + b"\n"
 
 @app.get("/api/v1/wall/threads")
-async def wall_threads(thread_id: str = "general", since: str = None, limit: int = 50):
-    """Получает заметки из указанного треда стены."""
+async def wall_threads(response: Response, thread_id: str = "general", since: str = None, limit: int = 50,
+                       cursor: str = None, format: str = "json", until: str = None):
+    """Получает заметки из указанного треда стены, созданные в [since, until] (ISO 8601 или Unix-время).
+
+    Страница - последние limit заметок раньше курсора cursor; курсор следующей (более старой)
+    страницы возвращается в заголовке X-Next-Cursor. format=ndjson - потоковая выдача
+    от новых к старым (limit=0 - весь тред).
+    """
     start_time = time.time()
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if format == "ndjson":
+        return StreamingResponse(_stream_wall_notes(thread_id, since, limit, cursor, until), media_type="application/x-ndjson")
+    if format != "json":
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
     try:
-        result = await _get_wall_notes_cached(thread_id=thread_id, since=since, limit=limit)
+        result = await _get_wall_notes_cached(thread_id=thread_id, since=since, limit=limit,
+                                              version=await shared_state.run(wall_api.thread_version, thread_id),
+                                              cursor=cursor, until=until)
+        next_cursor = next_page_cursor(result, limit)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         response_time = (time.time() - start_time) * 1000  # в миллисекундах
 
         # Логируем успешный запрос
@@ -279,17 +378,82 @@ async def wall_threads(thread_id: str = "general", since: str = None, limit: int
         log_error(e, "wall_threads_endpoint", {
             'thread_id': thread_id,
             'since': since,
-            'limit': limit
+            'until': until,
+            'limit': limit,
+            'cursor': cursor
         })
         raise
 
+@app.get("/api/v1/wall/search")
+async def wall_search(q: str = "", tag: Optional[List[str]] = Query(None), author: Optional[List[str]] = Query(None),
+                      thread_id: str = None, since: str = None, until: str = None, limit: int = 20, cursor: str = None):
+    """Полнотекстовый поиск по content и тегам заметок всех тредов.
+
+    Все слова q должны встретиться в заметке, "слово*" - поиск по префиксу. tag ("<имя>:<значение>",
+    без имени - тег "t") и author можно повторять. Результаты упорядочены по релевантности (BM25),
+    курсор следующей страницы - next_cursor.
+    """
+    start_time = time.time()
+    if limit < 1 or limit > WALL_SEARCH_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {WALL_SEARCH_MAX_LIMIT}")
+    try:
+        result = await wall_api.search_notes(q, tags=tag, authors=author, thread_id=thread_id,
+                                             since=since, until=until, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    response_time = (time.time() - start_time) * 1000
+    log_performance_metric('wall_search_response_time', response_time, {'query': q, 'total': result["total"]})
+    performance_monitor.record_metric('wall_search_response_time', response_time)
+    return result
+
+@app.get("/api/v1/wall/tags")
+async def wall_tags(name: str = None, limit: int = 100):
+    """Самые частые теги заметок всех тредов: [{"name", "value", "count"}] (name - только теги с этим именем)."""
+    return await _get_wall_tags_cached(name=name, limit=limit, version=await shared_state.run(wall_api.wall_version))
+
+@cached_async(wall_cache, ttl=WALL_CACHE_TTL)
+async def _get_wall_tags_cached(name: str = None, limit: int = 100, version: int = 0):
+    """Кэшированный подсчет тегов (version - версия стены, часть ключа кэша)"""
+    return await wall_api.get_tag_counts(name=name, limit=limit)
+
+async def _wall_index_page(response: Response, lookup, key: str, since: str, until: str, limit: int, cursor: str):
+    """Страница заметок из межтредового индекса; курсор более старой страницы - в X-Next-Cursor."""
+    try:
+        notes, next_cursor = await lookup(key, since=since, until=until, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return notes
+
+@app.get("/api/v1/wall/tags/{tag}")
+async def wall_notes_by_tag(tag: str, response: Response, since: str = None, until: str = None,
+                            limit: int = 50, cursor: str = None):
+    """Заметки всех тредов с тегом tag ("<имя>:<значение>", без имени - тег "t"): [{"thread_id", "note"}]."""
+    return await _wall_index_page(response, wall_api.get_notes_by_tag, tag, since, until, limit, cursor)
+
+@app.get("/api/v1/wall/authors/{pubkey}")
+async def wall_notes_by_author(pubkey: str, response: Response, since: str = None, until: str = None,
+                               limit: int = 50, cursor: str = None):
+    """Заметки всех тредов автора (pubkey или author_id): [{"thread_id", "note"}]."""
+    return await _wall_index_page(response, wall_api.get_notes_by_author, pubkey, since, until, limit, cursor)
+
+@app.post("/api/v1/wall/pull")
+async def wall_pull():
+    """Подтягивает стену из удаленного репозитория и инвалидирует кэш измененных тредов."""
+    result = await wall_api.pull_wall()
+    if result.get("status") != "success":
+        raise HTTPException(status_code=502, detail=f"Git pull failed: {result.get('message')}")
+    return JSONResponse(status_code=200, content=result)
+
 @cached_async(api_cache, ttl=30)
 async def _get_peers_cached():
     """Кэшированная версия получения списка пиров"""
     if not sdominanta_agent:
         raise HTTPException(status_code=503, detail="P2P service not enabled or connected.")
 
-    return list(known_peers)
+    return await shared_state.run(list, known_peers)
 
 @app.get("/api/v1/peers")
 async def peers_list():
@@ -325,7 +489,7 @@ async def _get_p2p_status_cached():
         "status": p2p_connection_status,
         "error": p2p_connection_error,
         "agent_public_key": agent_key,
-        "known_peers_count": len(known_peers),
+        "known_peers_count": await shared_state.run(len, known_peers),
         "daemon_url": os.getenv("P2P_WS_URL", "ws://127.0.0.1:9090") if CONFIG.get('p2p_enabled', False) else None
     }
 
@@ -396,7 +560,7 @@ async def list_files(directory_path: str):
         # Добавляем кэширование для часто запрашиваемых директорий
         if len(contents) <= 50:  # Кэшируем только небольшие директории
             cache_key = f"fs_list_{directory_path}"
-            api_cache.put(cache_key, result, ttl=60)  # Кэш на 1 минуту
+            await shared_state.run(partial(api_cache.put, cache_key, result, ttl=60))  # Кэш на 1 минуту
 
         return JSONResponse(status_code=200, content=result)
     except Exception as e:
@@ -407,8 +571,8 @@ async def performance_stats():
     """Получает статистику производительности системы"""
     try:
         cache_stats = {
-            'api_cache': api_cache.stats(),
-            'wall_cache': wall_cache.stats()
+            'api_cache': await shared_state.run(api_cache.stats),
+            'wall_cache': await shared_state.run(wall_cache.stats)
         }
 
         performance_stats = performance_monitor.get_stats()
@@ -418,6 +582,10 @@ async def performance_stats():
             'cache_stats': cache_stats,
             'performance_stats': performance_stats,
             'active_tasks_count': len(active_tasks),
+            'git_commit_queue': wall_api.commit_queue.stats(),
+            'wall_io': wall_api.io.stats(),
+            'websockets': ws_broadcaster.stats(),
+            'wall_search': dict(wall_api.search_index.stats(), ready=wall_api.search_index_ready),
             'system_health': {
                 'cache_hit_rate': cache_stats['api_cache'].get('hit_rate', 0),
                 'average_response_time': performance_monitor.get_average('wall_threads_response_time', 10),
@@ -432,8 +600,8 @@ async def performance_stats():
 async def clear_cache():
     """Очищает кэш системы"""
     try:
-        api_cache.clear()
-        wall_cache.clear()
+        await shared_state.run(api_cache.clear)
+        await shared_state.run(wall_cache.clear)
         return JSONResponse(status_code=200, content={
             "message": "Cache cleared successfully",
             "cleared_caches": ["api_cache", "wall_cache"]
@@ -443,62 +611,136 @@ async def clear_cache():
         raise HTTPException(status_code=500, detail=f"Failed to clear cache: {e}")
 
 
+async def build_wall_snapshot(threads: List[str]) -> Dict:
+    """Компактный снимок стены для /ws: последние заметки тредов из подписок клиента (или WS_SNAPSHOT_THREADS)"""
+    snapshot = {}
+    for thread_id in threads or WS_SNAPSHOT_THREADS:
+        snapshot[thread_id] = await _get_wall_notes_cached(thread_id=thread_id, limit=WS_SNAPSHOT_LIMIT,
+                                                           version=await shared_state.run(wall_api.thread_version, thread_id))
+    return {"threads": snapshot}
+
+
+def parse_last_seq(value) -> int:
+    """Разбирает курсор last_seq клиента /ws (неотрицательное целое), иначе ValueError"""
+    last_seq = int(value)
+    if isinstance(value, bool) or last_seq < 0:
+        raise ValueError("last_seq must be a non-negative integer")
+    return last_seq
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket-эндпоинт для подписки на события P2P-сети."""
-    await websocket.accept()
-    print(f"WebSocket connection established: {websocket.client}")
-    connected_websockets.add(websocket) # Добавляем WebSocket в набор
+    """WebSocket-эндпоинт для подписки на события P2P-сети.
+
+    ?last_seq=N - продолжить с пропущенных событий.
+    ?encoding=msgpack|cbor или подпротокол sdominanta.<кодек> - бинарные кадры вместо JSON.
+    Живость соединения проверяет uvicorn ping/pong протокола (--ws-ping-interval/--ws-ping-timeout).
+    Прикладной heartbeat - по желанию: при WS_HEARTBEAT_INTERVAL > 0 сервер шлет {"type": "ping", "id"},
+    а при WS_IDLE_TIMEOUT > 0 клиент без входящих сообщений (в т.ч. {"type": "pong", "id"}) отключается.
+    Сжатие permessage-deflate согласует uvicorn (--ws-per-message-deflate).
+    """
+    try:
+        codec, subprotocol = negotiate_codec(websocket.query_params.get("encoding"),
+                                             websocket.scope.get("subprotocols") or [])
+    except ValueError as e:
+        await websocket.accept()
+        await websocket.send_json({"type": "error", "message": f"Unsupported encoding: {e}"})
+        await websocket.close(code=1003)
+        return
+
+    await websocket.accept(subprotocol=subprotocol)
+    print(f"WebSocket connection established: {websocket.client} ({codec.name})")
+    ws_broadcaster.register(websocket, codec) # Регистрируем клиента в рассылке (своя очередь и писатель)
+
+    if websocket.query_params.get("last_seq") is not None:
+        try:
+            await ws_broadcaster.resume(websocket, parse_last_seq(websocket.query_params["last_seq"]), build_wall_snapshot)
+        except ValueError as e:
+            ws_broadcaster.send(websocket, {"type": "error", "message": f"Invalid last_seq: {e}"})
 
     # Подписка на топики P2P и отправка событий клиенту
     try:
         while True:
             try:
                 # Ждем входящих сообщений с таймаутом 10 секунд
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=10.0)
+                received = await asyncio.wait_for(websocket.receive(), timeout=10.0)
+                if received["type"] == "websocket.disconnect":
+                    print(f"WebSocket connection closed normally: {received.get('code')}")
+                    break
+                data = received.get("text") if received.get("text") is not None else received.get("bytes")
                 print(f"Received from WS client: {data}")
+                ws_broadcaster.touch(websocket)
 
-                # Обрабатываем входящее сообщение
+                # Обрабатываем входящее сообщение: текст - JSON, бинарные кадры - кодек соединения
                 try:
-                    message = json.loads(data)
+                    message = json.loads(data) if isinstance(data, str) else codec.loads(data)
                     message_type = message.get("type")
 
-                    if message_type == "ping":
+                    if message_type == "pong":
+                        # Ответ на heartbeat сервера: {"type": "pong", "id": <id из ping>}
+                        ws_broadcaster.pong(websocket, message.get("id"))
+                    elif message_type == "ping":
                         # Отвечаем на ping
-                        await websocket.send_json({
+                        ws_broadcaster.send(websocket, {
                             "type": "pong",
                             "timestamp": asyncio.get_event_loop().time()
                         })
+                    elif message_type == "subscribe":
+                        # {"type": "subscribe", "id": "sub1", "filters": [{"kinds": [1], "#t": ["general"]}]}
+                        try:
+                            ws_broadcaster.subscribe(websocket, message.get("id"), message.get("filters"))
+                            ws_broadcaster.send(websocket, {"type": "subscribed", "id": message.get("id")})
+                        except ValueError as e:
+                            ws_broadcaster.send(websocket, {
+                                "type": "error",
+                                "id": message.get("id"),
+                                "message": f"Invalid subscription: {e}"
+                            })
+                    elif message_type == "unsubscribe":
+                        removed = ws_broadcaster.unsubscribe(websocket, message.get("id"))
+                        ws_broadcaster.send(websocket, {"type": "unsubscribed", "id": message.get("id"), "found": removed})
+                    elif message_type == "resume":
+                        # {"type": "resume", "last_seq": 42} - повтор пропущенного или снимок, если разрыв слишком велик
+                        try:
+                            await ws_broadcaster.resume(websocket, parse_last_seq(message.get("last_seq")), build_wall_snapshot)
+                        except (TypeError, ValueError) as e:
+                            ws_broadcaster.send(websocket, {"type": "error", "message": f"Invalid last_seq: {e}"})
                     elif message_type == "test":
                         # Отвечаем на тестовое сообщение
-                        await websocket.send_json({
+                        ws_broadcaster.send(websocket, {
                             "type": "p2p_event",
                             "data": message.get("data", ""),
                             "received": True
                         })
                     else:
                         # Неизвестный тип сообщения
-                        await websocket.send_json({
+                        ws_broadcaster.send(websocket, {
                             "type": "error",
                             "message": f"Unknown message type: {message_type}"
                         })
 
                 except json.JSONDecodeError:
                     # Сообщение не является корректным JSON
-                    await websocket.send_json({
+                    ws_broadcaster.send(websocket, {
                         "type": "error",
                         "message": "Invalid JSON format"
                     })
+                except FrameDecodeError:
+                    ws_broadcaster.send(websocket, {
+                        "type": "error",
+                        "message": f"Invalid {codec.name} format"
+                    })
                 except Exception as e:
                     print(f"Error processing message: {e}")
-                    await websocket.send_json({
+                    ws_broadcaster.send(websocket, {
                         "type": "error",
                         "message": f"Processing error: {str(e)}"
                     })
 
             except asyncio.TimeoutError:
-                # Таймаут - отправляем heartbeat если нужно
-                pass
+                # Heartbeat отправляет ws_broadcaster; клиент без активности мог быть отключен
+                if websocket not in ws_broadcaster.clients:
+                    break
             except Exception as e:
                 # Проверяем, является ли это нормальным закрытием соединения
                 if isinstance(e, (ConnectionError, OSError)) or (hasattr(e, 'code') and e.code == 1000):
@@ -511,5 +753,4 @@ async def websocket_endpoint(websocket: WebSocket):
     except Exception as e:
         print(f"WebSocket disconnected: {websocket.client} with error: {e}")
     finally:
-        if websocket in connected_websockets:
-            connected_websockets.remove(websocket)  # Удаляем WebSocket из набора при разрыве соединения
+        await ws_broadcaster.unregister(websocket)  # Удаляем клиента из рассылки при разрыве соединения
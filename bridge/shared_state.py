@@ -0,0 +1,610 @@
+"""
+Разделяемое состояние bridge: кэши, набор пиров, версии тредов и рассылка событий.
+
+Бэкенд выбирается переменной BRIDGE_STATE_BACKEND:
+- local  - состояние в памяти процесса (один воркер uvicorn, по умолчанию);
+- socket - состояние хранит хаб на Unix-сокете BRIDGE_STATE_SOCKET, общий для всех
+           воркеров хоста. Хаб запускается отдельным процессом: python -m bridge.shared_state
+
+Недоступный хаб не роняет запросы: кэши и множества ведут себя как пустые, версии равны 0,
+счетчики возвращают None, публикация доставляется только подписчикам своего воркера.
+Ошибкой остается только захват ролей (try_acquire) - без хаба роль не выбрать.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+DEFAULT_SOCKET_PATH = "/tmp/sdominanta-bridge-state.sock"
+
+# Кадр протокола: 4 байта длины (big-endian) + JSON
+_FRAME_HEADER = struct.Struct(">I")
+
+# После неудачного подключения к хабу запросы столько секунд сразу получают отказ
+HUB_RETRY_INTERVAL = float(os.getenv("BRIDGE_STATE_RETRY_INTERVAL", "1.0"))
+
+Subscriber = Callable[[Any], Awaitable[None]]
+
+
+class StateBackendError(ConnectionError):
+    """Хаб разделяемого состояния недоступен или вернул ошибку"""
+
+
+class StateHubError(StateBackendError):
+    """Хаб отклонил операцию (соединение при этом исправно)"""
+
+
+def _encode_frame(payload: Dict[str, Any]) -> bytes:
+    data = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+    return _FRAME_HEADER.pack(len(data)) + data
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise StateBackendError("Соединение с хабом состояния закрыто")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_frame(sock: socket.socket) -> Dict[str, Any]:
+    (size,) = _FRAME_HEADER.unpack(_recv_exact(sock, _FRAME_HEADER.size))
+    return json.loads(_recv_exact(sock, size))
+
+
+class StateBackend:
+    """
+    Базовый интерфейс бэкенда разделяемого состояния.
+    """
+
+    name = "base"
+    is_shared = False
+
+    def create_cache(self, name: str, max_size: int, default_ttl: int, max_bytes: Optional[int] = None):
+        """Создает кэш с интерфейсом LRUCache"""
+        raise NotImplementedError
+
+    def create_set(self, name: str):
+        """Создает множество строк (add, discard, in, len, итерация)"""
+        raise NotImplementedError
+
+    def version_get(self, *fields: str) -> int:
+        """Максимальная версия среди полей (0 для неизвестных)"""
+        raise NotImplementedError
+
+    def version_bump(self, field: str) -> int:
+        """Присваивает полю новую версию из общего монотонного счетчика"""
+        raise NotImplementedError
+
+    def incr(self, name: str) -> int:
+        """Увеличивает именованный счетчик и возвращает новое значение (1, 2, 3, ...; None без хаба)"""
+        raise NotImplementedError
+
+    def try_acquire(self, name: str) -> bool:
+        """Пытается захватить именованную роль (например, слушателя P2P) до конца жизни процесса"""
+        raise NotImplementedError
+
+    def holds(self, name: str) -> bool:
+        """Проверяет, что роль, захваченная try_acquire, все еще за этим процессом"""
+        raise NotImplementedError
+
+    def subscribe(self, channel: str, callback: Subscriber) -> None:
+        """Регистрирует корутину, вызываемую для каждого сообщения канала"""
+        raise NotImplementedError
+
+    async def run(self, func: Callable, *args) -> Any:
+        """Выполняет синхронную операцию состояния (метод кэша, множества, бэкенда) из корутины"""
+        return func(*args)
+
+    async def publish(self, channel: str, message: Any) -> None:
+        """Рассылает сообщение подписчикам канала во всех воркерах"""
+        raise NotImplementedError
+
+    def start(self) -> None:
+        """Запускает фоновые части бэкенда (вызывается из lifespan при работающем loop)"""
+
+    def close(self) -> None:
+        """Освобождает ресурсы бэкенда"""
+
+
+class LocalStateBackend(StateBackend):
+    """
+    Состояние в памяти одного процесса.
+    """
+
+    name = "local"
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._counters: Dict[str, int] = {}
+        self._clock = 0
+        self._subscribers: Dict[str, List[Subscriber]] = {}
+        self._lock = threading.Lock()
+
+    def create_cache(self, name: str, max_size: int, default_ttl: int, max_bytes: Optional[int] = None):
+        from bridge.cache_manager import LRUCache
+        return LRUCache(max_size=max_size, default_ttl=default_ttl, max_bytes=max_bytes)
+
+    def create_set(self, name: str) -> Set[str]:
+        return set()
+
+    def version_get(self, *fields: str) -> int:
+        return max((self._versions.get(field, 0) for field in fields), default=0)
+
+    def version_bump(self, field: str) -> int:
+        with self._lock:
+            self._clock += 1
+            self._versions[field] = self._clock
+            return self._clock
+
+    def incr(self, name: str) -> int:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            return self._counters[name]
+
+    def try_acquire(self, name: str) -> bool:
+        return True
+
+    def holds(self, name: str) -> bool:
+        return True
+
+    def subscribe(self, channel: str, callback: Subscriber) -> None:
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    async def publish(self, channel: str, message: Any) -> None:
+        for callback in list(self._subscribers.get(channel, [])):
+            await callback(message)
+
+
+class SharedCache:
+    """
+    Кэш в хабе состояния с интерфейсом LRUCache. При недоступности хаба ведет себя как пустой кэш.
+    """
+
+    def __init__(self, backend: "SocketStateBackend", name: str, max_size: int, default_ttl: int,
+                 max_bytes: Optional[int] = None):
+        self.backend = backend
+        self.name = name
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        backend.register_cache(name, {"max_size": max_size, "default_ttl": default_ttl, "max_bytes": max_bytes})
+
+    def _make_key(self, *args, **kwargs) -> str:
+        from bridge.cache_manager import LRUCache
+        return LRUCache._make_key(self, *args, **kwargs)
+
+    def _call(self, op: str, default: Any = None, **kwargs) -> Any:
+        return self.backend.call_or(op, default, cache=self.name, **kwargs)
+
+    async def run(self, func: Callable, *args) -> Any:
+        return await self.backend.run(func, *args)
+
+    def get(self, key: str) -> Optional[Any]:
+        return self._call("cache_get", key=key)
+
+    def get_stale(self, key: str) -> Tuple[Optional[Any], bool]:
+        value, stale = self._call("cache_get_stale", default=[None, False], key=key)
+        return value, stale
+
+    def put(self, key: str, value: Any, ttl: Optional[int] = None, stale_ttl: int = 0):
+        self._call("cache_put", key=key, value=value, ttl=ttl, stale_ttl=stale_ttl)
+
+    def clear(self):
+        self._call("cache_clear")
+
+    def cleanup_expired(self):
+        """Истекшие записи чистит сам хаб"""
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._call("cache_stats", default={})
+        stats["shared"] = True
+        return stats
+
+
+class SharedSet:
+    """
+    Множество строк в хабе состояния (подмножество интерфейса set). При недоступности хаба
+    ведет себя как пустое множество.
+    """
+
+    def __init__(self, backend: "SocketStateBackend", name: str):
+        self.backend = backend
+        self.name = name
+
+    def _call(self, op: str, default: Any = None, **kwargs) -> Any:
+        return self.backend.call_or(op, default, set=self.name, **kwargs)
+
+    def add(self, member: str) -> None:
+        self._call("set_add", member=member)
+
+    def discard(self, member: str) -> None:
+        self._call("set_discard", member=member)
+
+    def __contains__(self, member: object) -> bool:
+        return self._call("set_contains", default=False, member=member)
+
+    def __len__(self) -> int:
+        return self._call("set_len", default=0)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._call("set_members", default=[]))
+
+
+class SocketStateBackend(StateBackend):
+    """
+    Клиент хаба состояния на Unix-сокете. Запросы синхронные; из корутин они выполняются
+    через run() в отдельном потоке, чтобы зависший или упавший хаб не останавливал event loop.
+    Сообщения каналов читает отдельное соединение в фоновом потоке.
+    """
+
+    name = "socket"
+    is_shared = True
+
+    def __init__(self, socket_path: Optional[str] = None, timeout: float = 5.0,
+                 retry_interval: float = HUB_RETRY_INTERVAL):
+        self.socket_path = socket_path or os.getenv("BRIDGE_STATE_SOCKET", DEFAULT_SOCKET_PATH)
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._sock: Optional[socket.socket] = None
+        self._down_until = 0.0
+        self._warned_at = 0.0
+        # Один поток: запросы к хабу и так идут по одному соединению под блокировкой
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bridge-state")
+        self._lock = threading.Lock()
+        self._caches: Dict[str, Dict[str, Any]] = {}
+        self._leases: Set[str] = set()
+        self._subscribers: Dict[str, List[Subscriber]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sub_sock: Optional[socket.socket] = None
+        self._sub_thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise StateBackendError(f"Хаб состояния {self.socket_path} недоступен: {e}") from e
+        return sock
+
+    @staticmethod
+    def _request(sock: socket.socket, payload: Dict[str, Any]) -> Any:
+        sock.sendall(_encode_frame(payload))
+        reply = _recv_frame(sock)
+        if not reply.get("ok"):
+            raise StateHubError(reply.get("error", "unknown error"))
+        return reply.get("result")
+
+    def _reconnect(self) -> socket.socket:
+        """Открывает соединение и восстанавливает кэши и роли (хаб мог перезапуститься)"""
+        sock = self._connect()
+        for name, options in self._caches.items():
+            self._request(sock, {"op": "cache_create", "cache": name, **options})
+        for name in list(self._leases):
+            if not self._request(sock, {"op": "lock_acquire", "name": name}):
+                print(f"StateBackend: Роль '{name}' после переподключения захвачена другим воркером.")
+                self._leases.discard(name)
+        return sock
+
+    def call(self, op: str, **kwargs) -> Any:
+        """
+        Выполняет операцию в хабе. Оборванное соединение переоткрывается один раз; после
+        неудачного подключения следующие retry_interval секунд запросы сразу получают отказ.
+        """
+        payload = {"op": op, **kwargs}
+        with self._lock:
+            for attempt in range(2):
+                fresh = self._sock is None
+                if fresh and time.monotonic() < self._down_until:
+                    raise StateBackendError(f"Хаб состояния {self.socket_path} недоступен, операция {op} пропущена")
+                try:
+                    if fresh:
+                        self._sock = self._reconnect()
+                    return self._request(self._sock, payload)
+                except StateHubError:
+                    raise
+                except (OSError, ValueError, struct.error) as e:
+                    # StateBackendError - тоже OSError: хаб недоступен или соединение оборвано
+                    if self._sock is not None:
+                        self._sock.close()
+                        self._sock = None
+                    if fresh or attempt:
+                        self._down_until = time.monotonic() + self.retry_interval
+                        raise StateBackendError(f"Ошибка операции {op}: {e}") from e
+
+    def call_or(self, op: str, default: Any = None, **kwargs) -> Any:
+        """Операция с деградацией: при недоступном хабе возвращает default (предупреждение раз в 10 с)"""
+        try:
+            return self.call(op, **kwargs)
+        except StateHubError:
+            raise
+        except StateBackendError as e:
+            now = time.monotonic()
+            if now - self._warned_at >= 10:
+                self._warned_at = now
+                print(f"StateBackend: Хаб состояния недоступен, работаем без общего состояния: {e}")
+            return default
+
+    async def run(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args))
+
+    def register_cache(self, name: str, options: Dict[str, Any]) -> None:
+        self._caches[name] = options
+        try:
+            self.call("cache_create", cache=name, **options)
+        except StateBackendError as e:
+            # Хаб может стартовать позже воркера - кэш будет создан при подключении
+            print(f"StateBackend: Кэш '{name}' будет создан при подключении к хабу: {e}")
+
+    def create_cache(self, name: str, max_size: int, default_ttl: int, max_bytes: Optional[int] = None) -> SharedCache:
+        return SharedCache(self, name, max_size, default_ttl, max_bytes)
+
+    def create_set(self, name: str) -> SharedSet:
+        return SharedSet(self, name)
+
+    def version_get(self, *fields: str) -> int:
+        return self.call_or("version_get", 0, fields=list(fields))
+
+    def version_bump(self, field: str) -> int:
+        return self.call_or("version_bump", 0, field=field)
+
+    def incr(self, name: str) -> Optional[int]:
+        return self.call_or("incr", None, name=name)
+
+    def try_acquire(self, name: str) -> bool:
+        acquired = self.call("lock_acquire", name=name)
+        if acquired:
+            self._leases.add(name)
+        return acquired
+
+    def holds(self, name: str) -> bool:
+        # Роль теряется, если за время обрыва соединения хаб отдал ее другому воркеру: запрос
+        # переподключается (_reconnect) и узнает об этом. Недоступный хаб роль не отнимает
+        if name not in self._leases:
+            return False
+        try:
+            held = self.call("lock_acquire", name=name)
+        except StateHubError:
+            raise
+        except StateBackendError:
+            return True
+        if not held:
+            self._leases.discard(name)
+        return held
+
+    def subscribe(self, channel: str, callback: Subscriber) -> None:
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    async def publish(self, channel: str, message: Any) -> None:
+        try:
+            await self.run(partial(self.call, "publish", channel=channel, message=message))
+        except StateHubError:
+            raise
+        except StateBackendError as e:
+            print(f"StateBackend: Хаб недоступен, сообщение {channel} доставлено только этому воркеру: {e}")
+            for callback in list(self._subscribers.get(channel, [])):
+                await callback(message)
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._closed = False
+        if self._subscribers and (self._sub_thread is None or not self._sub_thread.is_alive()):
+            self._sub_thread = threading.Thread(target=self._listen, name="bridge-state-sub", daemon=True)
+            self._sub_thread.start()
+
+    def _listen(self):
+        """Фоновый поток: держит соединение-подписку и передает сообщения в event loop"""
+        while not self._closed:
+            try:
+                sock = self._connect()
+                sock.settimeout(None)
+                self._sub_sock = sock
+                self._request(sock, {"op": "subscribe", "channels": list(self._subscribers)})
+                while not self._closed:
+                    frame = _recv_frame(sock)
+                    for callback in self._subscribers.get(frame.get("channel"), []):
+                        asyncio.run_coroutine_threadsafe(callback(frame.get("message")), self._loop)
+            except (OSError, ValueError, struct.error, StateBackendError) as e:
+                if self._closed:
+                    break
+                print(f"StateBackend: Подписка на хаб прервана: {e}. Повтор через 1 с.")
+                time.sleep(1)
+            finally:
+                if self._sub_sock is not None:
+                    self._sub_sock.close()
+                    self._sub_sock = None
+
+    def close(self) -> None:
+        self._closed = True
+        if self._sub_sock is not None:
+            try:
+                self._sub_sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        with self._lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+        self._executor.shutdown(wait=False)
+
+
+class StateHub:
+    """
+    Хаб разделяемого состояния: asyncio-сервер на Unix-сокете, хранящий кэши, множества,
+    версии и роли. Роль освобождается, когда закрывается соединение захватившего ее воркера.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, cleanup_interval: float = 60.0):
+        self.socket_path = socket_path or os.getenv("BRIDGE_STATE_SOCKET", DEFAULT_SOCKET_PATH)
+        self.cleanup_interval = cleanup_interval
+        self.caches: Dict[str, Any] = {}
+        self.sets: Dict[str, Set[str]] = {}
+        self.versions: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+        self.clock = 0
+        self.leases: Dict[str, asyncio.StreamWriter] = {}
+        self.subscribers: Dict[str, Set[asyncio.StreamWriter]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._cleanup_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # Сокет остался от упавшего хаба
+        self._server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        self._cleanup_task = asyncio.create_task(self._cleanup_worker())
+        print(f"StateHub: Хаб состояния слушает {self.socket_path}")
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    async def _cleanup_worker(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            for cache in self.caches.values():
+                cache.cleanup_expired()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                header = await reader.readexactly(_FRAME_HEADER.size)
+                (size,) = _FRAME_HEADER.unpack(header)
+                request = json.loads(await reader.readexactly(size))
+                try:
+                    reply = {"ok": True, "result": self._dispatch(request, writer)}
+                except Exception as e:
+                    reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                writer.write(_encode_frame(reply))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._release(writer)
+            writer.close()
+
+    def _release(self, writer: asyncio.StreamWriter):
+        for name in [name for name, owner in self.leases.items() if owner is writer]:
+            del self.leases[name]
+            print(f"StateHub: Роль '{name}' освобождена.")
+        for subscribers in self.subscribers.values():
+            subscribers.discard(writer)
+
+    def _cache(self, name: str):
+        cache = self.caches.get(name)
+        if cache is None:
+            raise KeyError(f"cache '{name}' is not created")
+        return cache
+
+    def _dispatch(self, request: Dict[str, Any], writer: asyncio.StreamWriter) -> Any:
+        op = request.get("op")
+        if op == "cache_create":
+            if request["cache"] not in self.caches:
+                from bridge.cache_manager import LRUCache
+                self.caches[request["cache"]] = LRUCache(max_size=request["max_size"], default_ttl=request["default_ttl"],
+                                                         max_bytes=request.get("max_bytes"))
+            return True
+        if op == "cache_get":
+            return self._cache(request["cache"]).get(request["key"])
+        if op == "cache_get_stale":
+            return list(self._cache(request["cache"]).get_stale(request["key"]))
+        if op == "cache_put":
+            self._cache(request["cache"]).put(request["key"], request["value"], request.get("ttl"),
+                                              stale_ttl=request.get("stale_ttl", 0))
+            return True
+        if op == "cache_clear":
+            self._cache(request["cache"]).clear()
+            return True
+        if op == "cache_stats":
+            return self._cache(request["cache"]).stats()
+        if op == "set_add":
+            members = self.sets.setdefault(request["set"], set())
+            added = request["member"] not in members
+            members.add(request["member"])
+            return added
+        if op == "set_discard":
+            self.sets.get(request["set"], set()).discard(request["member"])
+            return True
+        if op == "set_contains":
+            return request["member"] in self.sets.get(request["set"], ())
+        if op == "set_len":
+            return len(self.sets.get(request["set"], ()))
+        if op == "set_members":
+            return list(self.sets.get(request["set"], ()))
+        if op == "version_get":
+            return max((self.versions.get(field, 0) for field in request["fields"]), default=0)
+        if op == "version_bump":
+            self.clock += 1
+            self.versions[request["field"]] = self.clock
+            return self.clock
+        if op == "incr":
+            self.counters[request["name"]] = self.counters.get(request["name"], 0) + 1
+            return self.counters[request["name"]]
+        if op == "lock_acquire":
+            owner = self.leases.get(request["name"])
+            if owner is None or owner.is_closing():
+                self.leases[request["name"]] = writer
+                return True
+            return owner is writer
+        if op == "subscribe":
+            for channel in request["channels"]:
+                self.subscribers.setdefault(channel, set()).add(writer)
+            return True
+        if op == "publish":
+            frame = _encode_frame({"channel": request["channel"], "message": request["message"]})
+            subscribers = [w for w in self.subscribers.get(request["channel"], ()) if not w.is_closing()]
+            for subscriber in subscribers:
+                subscriber.write(frame)
+            return len(subscribers)
+        raise ValueError(f"unknown op '{op}'")
+
+
+STATE_BACKENDS = {
+    LocalStateBackend.name: LocalStateBackend,
+    SocketStateBackend.name: SocketStateBackend,
+}
+
+
+def create_state_backend(backend: Optional[str] = None) -> StateBackend:
+    """
+    Создает бэкенд состояния по аргументу или BRIDGE_STATE_BACKEND (local|socket).
+    """
+    backend = backend or os.getenv("BRIDGE_STATE_BACKEND", "local")
+    if backend not in STATE_BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд состояния: {backend}. Доступны: {', '.join(STATE_BACKENDS)}")
+    return STATE_BACKENDS[backend]()
+
+
+# Глобальный экземпляр
+shared_state = create_state_backend()
+
+
+if __name__ == "__main__":
+    # Хаб сам хранит состояние: импортируемый им cache_manager не должен подключаться к хабу
+    os.environ["BRIDGE_STATE_BACKEND"] = LocalStateBackend.name
+    try:
+        asyncio.run(StateHub().serve_forever())
+    except KeyboardInterrupt:
+        pass
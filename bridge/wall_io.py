@@ -0,0 +1,129 @@
+"""
+Пул потоков для файловой работы стены: чтение и запись заметок не блокируют цикл событий
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from bridge.cache_manager import performance_monitor
+
+
+class WallIOExecutor:
+    """
+    Ограниченный пул потоков для блокирующих вызовов хранилища стены (open/read/fsync/listdir).
+    В пуле одновременно не больше max_queue задач (выполняемых и ожидающих потока): остальные
+    вызовы ждут места в цикле событий, не раздувая очередь пула. Задача выполняется в контексте
+    вызвавшей корутины, поэтому span трассировки чтения (wall_trace) виден и в потоке.
+    workers=0 - вызовы выполняются прямо в цикле событий (отладка, сравнительный замер).
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_queue: Optional[int] = None):
+        self.workers = workers if workers is not None else int(os.getenv("WALL_IO_WORKERS", "8"))
+        self.max_queue = max(max_queue or int(os.getenv("WALL_IO_QUEUE_SIZE", "256")), self.workers, 1)
+        self._executor = (ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="wall-io")
+                          if self.workers > 0 else None)
+        # Семафор привязывается к циклу событий при первом ожидании, поэтому у каждого цикла свой
+        self._slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.waiting = 0       # Ждут места в пуле (в цикле событий)
+        self.queued = 0        # Отправлены в пул, ждут свободного потока
+        self.running = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_s = 0.0      # Суммарное ожидание потока
+        self.run_s = 0.0
+
+    def _slot_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(loop)
+        if slots is None:
+            slots = self._slots[loop] = asyncio.Semaphore(self.max_queue)
+        return slots
+
+    async def run(self, func: Callable, *args: Any) -> Any:
+        """Выполняет func(*args) в пуле и возвращает результат"""
+        if self._executor is None:
+            return self._call(contextvars.copy_context(), time.perf_counter(), ["inline"], func, args)
+
+        slots = self._slot_semaphore()
+        self.waiting += 1
+        try:
+            await slots.acquire()
+        finally:
+            self.waiting -= 1
+        state: List[Optional[str]] = [None]
+        try:
+            with self._lock:
+                self.queued += 1
+                self.max_queued = max(self.max_queued, self.queued)
+                depth = self.queued
+            performance_monitor.record_metric('wall_io_queue_depth', depth)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._call, contextvars.copy_context(),
+                                              time.perf_counter(), state, func, args)
+        except asyncio.CancelledError:
+            with self._lock:
+                if state[0] is None:  # Задача снята с очереди пула и не запустится
+                    state[0] = "cancelled"
+                    self.queued -= 1
+            raise
+        finally:
+            slots.release()
+
+    def _call(self, context: contextvars.Context, enqueued: float, state: List[Optional[str]],
+              func: Callable, args: tuple) -> Any:
+        started = time.perf_counter()
+        with self._lock:
+            if state[0] is None:
+                self.queued -= 1
+            state[0] = "started"
+            self.running += 1
+            self.wait_s += started - enqueued
+        ok = False
+        try:
+            result = context.run(func, *args)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self.failed += not ok
+                self.run_s += time.perf_counter() - started
+
+    async def map(self, func: Callable, items: Iterable[Any]) -> List[Any]:
+        """Выполняет func(item) для всех items параллельно; результаты в порядке items"""
+        return list(await asyncio.gather(*(self.run(func, item) for item in items)))
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика пула: глубина очередей, среднее ожидание потока и время выполнения"""
+        with self._lock:
+            completed = self.completed
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'waiting': self.waiting,
+                'queue_depth': self.queued,
+                'running': self.running,
+                'max_queue_depth': self.max_queued,
+                'completed': completed,
+                'failed': self.failed,
+                'avg_wait_ms': round(self.wait_s / completed * 1000, 3) if completed else 0.0,
+                'avg_run_ms': round(self.run_s / completed * 1000, 3) if completed else 0.0,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+
+# Общий пул стены процесса; потоки создаются при первых вызовах
+wall_io = WallIOExecutor()
@@ -0,0 +1,543 @@
+"""
+Рассылка событий WebSocket-клиентам с очередью и писателем на каждое соединение
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+from bridge.cache_manager import performance_monitor
+from bridge.ws_codecs import JSON_CODEC, Frame, FrameCodec
+from bridge.ws_subscriptions import EventFilter, SubscriptionIndex
+
+# Политики для медленных клиентов, у которых переполнилась очередь
+DROP_OLDEST = "drop_oldest"    # выбрасываем самое старое сообщение очереди
+DISCONNECT = "disconnect"      # закрываем соединение (клиент переподключится)
+COALESCE = "coalesce"          # схлопываем сообщения с одинаковым ключом, затем drop_oldest
+SLOW_CONSUMER_POLICIES = (DROP_OLDEST, DISCONNECT, COALESCE)
+
+# Код закрытия "Try Again Later" для отключенных медленных клиентов
+CLOSE_CODE_SLOW_CONSUMER = 1013
+# Код закрытия "Going Away" для клиентов без активности дольше WS_IDLE_TIMEOUT
+CLOSE_CODE_IDLE = 1001
+
+logger = logging.getLogger(__name__)
+
+
+def event_frame(data: Frame, seq: Optional[int] = None, sub_ids: Optional[List[str]] = None,
+                codec: FrameCodec = JSON_CODEC) -> Frame:
+    """Собирает кадр p2p_event вокруг уже закодированного события"""
+    pairs = [("type", codec.dumps("p2p_event"))]
+    if seq is not None:
+        pairs.append(("seq", codec.dumps(int(seq))))
+    if sub_ids is not None:
+        pairs.append(("subscriptions", codec.dumps(sub_ids)))
+    pairs.append(("data", data))
+    return codec.join_map(pairs)
+
+
+class EncodedEvent:
+    """
+    P2P-событие с кэшем кодирования: данные кодируются один раз на кодек, кадр для клиентов
+    без подписок - тоже один раз. Хранится в буфере повтора, так что повтор не кодирует заново.
+    """
+
+    __slots__ = ("event", "seq", "_data", "_frames")
+
+    def __init__(self, event: Dict[str, Any], seq: Optional[int] = None):
+        self.event = event
+        self.seq = seq
+        self._data: Dict[str, Frame] = {}
+        self._frames: Dict[str, Frame] = {}
+
+    def data(self, codec: FrameCodec) -> Frame:
+        data = self._data.get(codec.name)
+        if data is None:
+            data = self._data[codec.name] = codec.dumps(self.event)
+        return data
+
+    def frame(self, codec: FrameCodec, sub_ids: Optional[List[str]] = None) -> Frame:
+        if sub_ids is not None:
+            return event_frame(self.data(codec), self.seq, sub_ids, codec)
+        frame = self._frames.get(codec.name)
+        if frame is None:
+            frame = self._frames[codec.name] = event_frame(self.data(codec), self.seq, codec=codec)
+        return frame
+
+
+class EventRingBuffer:
+    """
+    Кольцевой буфер последних P2P-событий с номерами seq для повтора пропущенного при переподключении.
+    """
+
+    def __init__(self, capacity: Optional[int] = None):
+        self.capacity = capacity or int(os.getenv("WS_REPLAY_BUFFER_SIZE", "1000"))
+        self.entries: Deque[EncodedEvent] = deque(maxlen=self.capacity)
+        self.latest_seq = 0
+
+    def append(self, entry: EncodedEvent):
+        if entry.seq <= self.latest_seq:
+            # Счетчик начался заново (перезапуск хаба состояния) - старая история несравнима
+            self.entries.clear()
+        self.entries.append(entry)
+        self.latest_seq = entry.seq
+
+    def since(self, last_seq: int) -> Optional[List[EncodedEvent]]:
+        """
+        События после last_seq или None, если часть из них уже вытеснена (или курсор из другой эпохи).
+        """
+        if last_seq == self.latest_seq:
+            return []
+        if last_seq > self.latest_seq or not self.entries or last_seq < self.entries[0].seq - 1:
+            return None
+        return [entry for entry in self.entries if entry.seq > last_seq]
+
+
+class ClientConnection:
+    """
+    Одно WebSocket-соединение: ограниченная очередь готовых кадров и задача-писатель,
+    которая отправляет их по одному. Медленный клиент задерживает только свою очередь.
+    Рассылка (droppable) ограничена max_queue и политикой медленных клиентов; ответы, ping и
+    повтор не выбрасываются, но их не больше max_pending - иначе соединение закрывается.
+    """
+
+    def __init__(self, broadcaster: "WebSocketBroadcaster", websocket: WebSocket, codec: FrameCodec = JSON_CODEC):
+        self.broadcaster = broadcaster
+        self.websocket = websocket
+        self.codec = codec  # кодек кадров, согласованный при подключении
+        self.queue: Deque[Tuple[Optional[str], Frame, bool]] = deque()  # (ключ схлопывания, кадр, droppable)
+        self.pending = 0  # кадров в очереди, которые нельзя выбросить
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.subscriptions: Set[str] = set()  # id подписок; без подписок клиент получает все события
+        self.paused = False  # на время отправки снимка живые события не ставятся в очередь
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at  # последнее сообщение от клиента (любое, включая pong)
+        self.pings = 0
+        self.pongs = 0
+        self.rtt_ms: Optional[float] = None
+        self.rtt_avg_ms: Optional[float] = None
+        self._ping_id = 0
+        self._ping_sent_at: Optional[float] = None
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, frame: Frame, key: Optional[str] = None, droppable: bool = True) -> bool:
+        """
+        Ставит сериализованный кадр в очередь без ожидания. Возвращает False, если клиент отключен.
+        """
+        if self.closed or (self.paused and droppable):
+            return False
+
+        if not droppable:
+            if self.pending >= self.broadcaster.max_pending:
+                print(f"WebSocketBroadcaster: Клиент {self.websocket.client} не читает ответы "
+                      f"({self.pending} в очереди), соединение закрывается.")
+                self.broadcaster.drop_client(self, CLOSE_CODE_SLOW_CONSUMER)
+                return False
+            self.pending += 1
+        elif len(self.queue) - self.pending >= self.broadcaster.max_queue:
+            if not self._make_room():
+                return False
+
+        self.queue.append((key, frame, droppable))
+        self._ready.set()
+        return True
+
+    def ping(self):
+        """Ставит в очередь heartbeat {"type": "ping", "id"}; клиент отвечает {"type": "pong", "id"}"""
+        self._ping_id += 1
+        self._ping_sent_at = time.monotonic()
+        self.pings += 1
+        self.enqueue(self.codec.dumps({"type": "ping", "id": self._ping_id, "timestamp": time.time()}), droppable=False)
+
+    def pong(self, ping_id: Any) -> Optional[float]:
+        """Учитывает ответ на heartbeat. Возвращает RTT в мс для ответа на последний ping."""
+        self.last_seen = time.monotonic()
+        if ping_id != self._ping_id or self._ping_sent_at is None:
+            return None
+        self.pongs += 1
+        self.rtt_ms = (self.last_seen - self._ping_sent_at) * 1000
+        self.rtt_avg_ms = self.rtt_ms if self.rtt_avg_ms is None else 0.8 * self.rtt_avg_ms + 0.2 * self.rtt_ms
+        self._ping_sent_at = None
+        return self.rtt_ms
+
+    def _make_room(self) -> bool:
+        policy = self.broadcaster.policy
+        if policy == DISCONNECT:
+            print(f"WebSocketBroadcaster: Клиент {self.websocket.client} не успевает читать, соединение закрывается.")
+            self.broadcaster.drop_client(self, CLOSE_CODE_SLOW_CONSUMER)
+            return False
+
+        if policy == COALESCE and self._coalesce():
+            return True
+
+        # Выбрасываем самый старый кадр рассылки; ответы и повтор остаются в очереди
+        for position, (_, _, droppable) in enumerate(self.queue):
+            if droppable:
+                del self.queue[position]
+                break
+        self.dropped += 1
+        return True
+
+    def _coalesce(self) -> bool:
+        """Оставляет в очереди только последнее сообщение рассылки для каждого ключа"""
+        latest: Dict[str, int] = {}
+        for position, (key, _, droppable) in enumerate(self.queue):
+            if key is not None and droppable:
+                latest[key] = position
+        kept = deque(item for position, item in enumerate(self.queue)
+                     if item[0] is None or not item[2] or latest[item[0]] == position)
+        removed = len(self.queue) - len(kept)
+        self.queue = kept
+        self.coalesced += removed
+        return removed > 0
+
+    async def _write_loop(self):
+        try:
+            while True:
+                if not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                _, frame, droppable = self.queue.popleft()
+                if not droppable:
+                    self.pending -= 1
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"WebSocket send failed for {self.websocket.client}: {e}")
+            self.broadcaster.drop_client(self)
+
+    async def close(self, code: Optional[int] = None):
+        self.closed = True
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        if code is not None:
+            try:
+                await self.websocket.close(code=code)
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            'client': str(self.websocket.client),
+            'encoding': self.codec.name,
+            'queue_depth': len(self.queue),
+            'queue_pending': self.pending,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'subscriptions': len(self.subscriptions),
+            'connected_s': round(now - self.connected_at, 1),
+            'idle_s': round(now - self.last_seen, 1),
+            'pings': self.pings,
+            'pongs': self.pongs,
+            'rtt_ms': round(self.rtt_ms, 2) if self.rtt_ms is not None else None,
+            'rtt_avg_ms': round(self.rtt_avg_ms, 2) if self.rtt_avg_ms is not None else None,
+        }
+
+
+class WebSocketBroadcaster:
+    """
+    Рассылает события всем подключенным клиентам воркера. Сообщение сериализуется один раз
+    на кодек, затем готовый кадр кладется в очередь каждого клиента без ожидания отправки.
+    """
+
+    def __init__(self, max_queue: Optional[int] = None, policy: Optional[str] = None,
+                 max_subscriptions: Optional[int] = None, replay_buffer_size: Optional[int] = None,
+                 heartbeat_interval: Optional[float] = None, idle_timeout: Optional[float] = None,
+                 max_pending: Optional[int] = None):
+        self.max_queue = max_queue or int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+        self.policy = policy or os.getenv("WS_SLOW_CONSUMER_POLICY", DROP_OLDEST)
+        if self.policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Неизвестная политика медленных клиентов: {self.policy}. "
+                             f"Доступны: {', '.join(SLOW_CONSUMER_POLICIES)}")
+        self.max_subscriptions = max_subscriptions or int(os.getenv("WS_MAX_SUBSCRIPTIONS", "20"))
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.subscriptions = SubscriptionIndex()
+        self._firehose: Set[ClientConnection] = set()  # клиенты без подписок
+        self.history = EventRingBuffer(replay_buffer_size)
+        # Жесткий предел ответов, ping и повтора в очереди клиента: по умолчанию помещается
+        # полный повтор буфера и еще max_queue ответов
+        self.max_pending = max_pending or int(os.getenv("WS_MAX_PENDING_FRAMES", "0")) or \
+            self.history.capacity + self.max_queue
+        # Мертвые соединения по умолчанию находит uvicorn: ping/pong протокола WebSocket
+        # (--ws-ping-interval/--ws-ping-timeout), на которые браузеры отвечают сами.
+        # Прикладной heartbeat включается явно: {"type": "ping"} каждые heartbeat_interval секунд,
+        # клиенты без входящих сообщений (в т.ч. pong) дольше idle_timeout отключаются (0 - выключено)
+        self.heartbeat_interval = (heartbeat_interval if heartbeat_interval is not None
+                                   else float(os.getenv("WS_HEARTBEAT_INTERVAL", "0")))
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(os.getenv("WS_IDLE_TIMEOUT", "0"))
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.broadcasts = 0
+        self.disconnected_slow = 0
+        self.reaped_idle = 0
+
+    def register(self, websocket: WebSocket, codec: FrameCodec = JSON_CODEC) -> ClientConnection:
+        """Регистрирует принятое соединение и запускает его писателя"""
+        client = ClientConnection(self, websocket, codec)
+        self.clients[websocket] = client
+        self._firehose.add(client)
+        client.start()
+        self._ensure_heartbeat()
+        return client
+
+    def _ensure_heartbeat(self):
+        if self.heartbeat_interval <= 0:
+            return
+        if (self._heartbeat is None or self._heartbeat.done()
+                or self._heartbeat.get_loop() is not asyncio.get_running_loop()):
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.warning(f"WebSocket heartbeat failed: {e}")
+
+    def heartbeat(self) -> int:
+        """
+        Один такт heartbeat: отключает клиентов без активности дольше idle_timeout, остальным
+        отправляет ping. Возвращает число отключенных клиентов.
+        """
+        now = time.monotonic()
+        reaped = 0
+        for client in list(self.clients.values()):
+            if self.idle_timeout > 0 and now - client.last_seen > self.idle_timeout:
+                print(f"WebSocketBroadcaster: Клиент {client.websocket.client} не отвечает "
+                      f"{now - client.last_seen:.0f} с, соединение закрывается.")
+                self.drop_client(client, CLOSE_CODE_IDLE)
+                reaped += 1
+            else:
+                client.ping()
+        return reaped
+
+    def touch(self, websocket: WebSocket):
+        """Отмечает активность клиента (любое входящее сообщение)"""
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.last_seen = time.monotonic()
+
+    def pong(self, websocket: WebSocket, ping_id: Any) -> Optional[float]:
+        """Принимает ответ клиента на heartbeat, возвращает RTT в мс"""
+        client = self.clients.get(websocket)
+        if client is None:
+            return None
+        rtt = client.pong(ping_id)
+        if rtt is not None:
+            performance_monitor.record_metric('ws_heartbeat_rtt', rtt)
+        return rtt
+
+    def _forget(self, client: ClientConnection):
+        self.subscriptions.remove_client(client, client.subscriptions)
+        client.subscriptions.clear()
+        self._firehose.discard(client)
+
+    async def unregister(self, websocket: WebSocket):
+        client = self.clients.pop(websocket, None)
+        if client is not None:
+            self._forget(client)
+            await client.close()
+
+    def subscribe(self, websocket: WebSocket, sub_id: str, filters: List[Dict[str, Any]]) -> None:
+        """
+        Подписывает клиента на события по фильтрам (повторный sub_id заменяет подписку).
+        Некорректные фильтры или превышение WS_MAX_SUBSCRIPTIONS - ValueError.
+        """
+        client = self.clients.get(websocket)
+        if client is None:
+            raise ValueError("client is not registered")
+        if not isinstance(sub_id, str) or not sub_id:
+            raise ValueError("subscription id must be a non-empty string")
+        if not isinstance(filters, list) or not filters:
+            raise ValueError("filters must be a non-empty list")
+        parsed = [EventFilter.from_dict(f) for f in filters]
+        if sub_id not in client.subscriptions and len(client.subscriptions) >= self.max_subscriptions:
+            raise ValueError(f"too many subscriptions (max {self.max_subscriptions})")
+
+        self.subscriptions.add(client, sub_id, parsed)
+        client.subscriptions.add(sub_id)
+        self._firehose.discard(client)
+
+    def unsubscribe(self, websocket: WebSocket, sub_id: str) -> bool:
+        """Отменяет подписку; клиент без подписок снова получает все события"""
+        client = self.clients.get(websocket)
+        if client is None or sub_id not in client.subscriptions:
+            return False
+        self.subscriptions.remove(client, sub_id)
+        client.subscriptions.discard(sub_id)
+        if not client.subscriptions:
+            self._firehose.add(client)
+        return True
+
+    def drop_client(self, client: ClientConnection, code: Optional[int] = None):
+        """Удаляет клиента из рассылки; закрытие соединения выполняется в фоне"""
+        if self.clients.get(client.websocket) is client:
+            del self.clients[client.websocket]
+        self._forget(client)
+        if code == CLOSE_CODE_SLOW_CONSUMER:
+            self.disconnected_slow += 1
+        elif code == CLOSE_CODE_IDLE:
+            self.reaped_idle += 1
+        if not client.closed:
+            client.closed = True
+            asyncio.get_running_loop().create_task(client.close(code))
+
+    def broadcast(self, message: Dict[str, Any], key: Optional[str] = None) -> int:
+        """
+        Рассылает сообщение всем клиентам. key - ключ схлопывания для политики coalesce.
+        Возвращает число клиентов, которым сообщение поставлено в очередь.
+        """
+        start_time = time.time()
+        frames: Dict[str, Frame] = {}
+        recipients = 0
+        for client in list(self.clients.values()):
+            frame = frames.get(client.codec.name)
+            if frame is None:
+                frame = frames[client.codec.name] = client.codec.dumps(message)
+            if client.enqueue(frame, key):
+                recipients += 1
+        self.broadcasts += 1
+        performance_monitor.record_metric('ws_broadcast_enqueue_time', (time.time() - start_time) * 1000)
+        return recipients
+
+    def broadcast_event(self, event: Dict[str, Any], key: Optional[str] = None, seq: Optional[int] = None) -> int:
+        """
+        Рассылает P2P-событие: клиентам без подписок - всем, остальным - по совпавшим подпискам
+        (кандидаты берутся из индекса подписок). Событие кодируется один раз на кодек, в кадр
+        подставляются только id совпавших подписок. События с seq сохраняются для повтора.
+        """
+        start_time = time.time()
+        encoded = EncodedEvent(event, seq)
+        recipients = 0
+        if seq is not None:
+            self.history.append(encoded)
+
+        for client in list(self._firehose):
+            if client.enqueue(encoded.frame(client.codec), key):
+                recipients += 1
+
+        frames: Dict[Tuple[str, Tuple[str, ...]], Frame] = {}  # клиенты с одинаковыми подписками делят кадр
+        for client, sub_ids in self.subscriptions.match(event).items():
+            frame_key = (client.codec.name, tuple(sub_ids))
+            frame = frames.get(frame_key)
+            if frame is None:
+                frame = frames[frame_key] = encoded.frame(client.codec, sub_ids)
+            if client.enqueue(frame, key):
+                recipients += 1
+
+        self.broadcasts += 1
+        performance_monitor.record_metric('ws_broadcast_enqueue_time', (time.time() - start_time) * 1000)
+        return recipients
+
+    def replay(self, websocket: WebSocket, last_seq: int) -> Optional[int]:
+        """
+        Ставит клиенту в очередь события после last_seq (с учетом его подписок).
+        Возвращает число повторенных событий или None, если разрыв уже вытеснен из буфера.
+        """
+        client = self.clients.get(websocket)
+        entries = self.history.since(last_seq)
+        if client is None or entries is None:
+            return None
+
+        replayed = 0
+        for entry in entries:
+            if client.subscriptions:
+                sub_ids = self.subscriptions.client_matches(client, client.subscriptions, entry.event)
+                if not sub_ids:
+                    continue
+                frame = entry.frame(client.codec, sub_ids)
+            else:
+                frame = entry.frame(client.codec)
+            if client.enqueue(frame, droppable=False):
+                replayed += 1
+        return replayed
+
+    async def resume(self, websocket: WebSocket, last_seq: int,
+                     snapshot: Callable[[List[str]], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Возобновляет поток клиента с курсора last_seq. Если разрыв вытеснен из буфера, клиент
+        получает компактный снимок snapshot(треды из его подписок "#t") и события после снимка.
+        """
+        client = self.clients.get(websocket)
+        if client is None:
+            return {"type": "error", "message": "client is not registered"}
+
+        replayed = self.replay(websocket, last_seq)
+        if replayed is not None:
+            result = {"type": "resumed", "last_seq": last_seq, "seq": self.history.latest_seq, "replayed": replayed}
+            self.send(websocket, result)
+            return result
+
+        # Пока читается снимок, живые события не ставим в очередь, а после снимка повторяем из буфера,
+        # чтобы клиент получил снимок и события строго по порядку seq
+        client.paused = True
+        try:
+            seq = self.history.latest_seq
+            threads = self.subscriptions.client_tag_values(client, client.subscriptions, "t")
+            content = await snapshot(threads)
+            result = {"type": "snapshot", "last_seq": last_seq, "seq": seq, **content}
+            self.send(websocket, result)
+            self.replay(websocket, seq)
+        finally:
+            client.paused = False
+        return result
+
+    def send(self, websocket: WebSocket, message: Dict[str, Any]) -> bool:
+        """Отправляет ответ одному клиенту через его очередь (ответы не выбрасываются)"""
+        client = self.clients.get(websocket)
+        if client is None:
+            return False
+        return client.enqueue(client.codec.dumps(message), droppable=False)
+
+    async def close(self):
+        if self._heartbeat is not None and self._heartbeat.get_loop() is asyncio.get_running_loop():
+            self._heartbeat.cancel()
+        self._heartbeat = None
+        for websocket in list(self.clients):
+            await self.unregister(websocket)
+
+    def stats(self) -> Dict[str, Any]:
+        clients = [client.stats() for client in self.clients.values()]
+        rtts = [c['rtt_avg_ms'] for c in clients if c['rtt_avg_ms'] is not None]
+        return {
+            'connections': len(clients),
+            'policy': self.policy,
+            'max_queue': self.max_queue,
+            'max_pending': self.max_pending,
+            'broadcasts': self.broadcasts,
+            'subscriptions': len(self.subscriptions),
+            'replay_buffer': len(self.history.entries),
+            'latest_seq': self.history.latest_seq,
+            'encodings': {name: sum(1 for c in clients if c['encoding'] == name)
+                          for name in sorted({c['encoding'] for c in clients})},
+            'queued': sum(c['queue_depth'] for c in clients),
+            'dropped': sum(c['dropped'] for c in clients),
+            'coalesced': sum(c['coalesced'] for c in clients),
+            'disconnected_slow': self.disconnected_slow,
+            'heartbeat_interval': self.heartbeat_interval,
+            'idle_timeout': self.idle_timeout,
+            'reaped_idle': self.reaped_idle,
+            'rtt_avg_ms': round(sum(rtts) / len(rtts), 2) if rtts else None,
+            'rtt_max_ms': max(rtts) if rtts else None,
+            'clients': clients,
+        }
@@ -0,0 +1,151 @@
+"""
+Кодеки кадров /ws: JSON (по умолчанию), MessagePack и CBOR (если установлены msgpack / cbor2)
+"""
+
+import json
+import struct
+from typing import Any, List, Optional, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:  # кодек msgpack недоступен
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # кодек cbor недоступен
+    cbor2 = None
+
+# Подпротокол WebSocket для кодека: Sec-WebSocket-Protocol: sdominanta.msgpack
+SUBPROTOCOL_PREFIX = "sdominanta."
+
+Frame = Union[str, bytes]
+
+
+class FrameDecodeError(ValueError):
+    """Входящее сообщение клиента не разбирается выбранным кодеком"""
+
+
+class FrameCodec:
+    """
+    Кодек кадров. join_map собирает объект из уже закодированных значений, поэтому данные
+    события кодируются один раз, а в кадры подставляются только seq и id подписок.
+    """
+
+    name = ""
+    binary = False
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    @property
+    def subprotocol(self) -> str:
+        return SUBPROTOCOL_PREFIX + self.name
+
+    def dumps(self, obj: Any) -> Frame:
+        raise NotImplementedError
+
+    def decode(self, data: Frame) -> Any:
+        raise NotImplementedError
+
+    def loads(self, data: Frame) -> Any:
+        try:
+            return self.decode(data)
+        except Exception as e:
+            raise FrameDecodeError(str(e)) from e
+
+    def join_map(self, pairs: List[Tuple[str, Frame]]) -> Frame:
+        raise NotImplementedError
+
+
+class JsonCodec(FrameCodec):
+    name = "json"
+
+    def dumps(self, obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+    def decode(self, data: Frame) -> Any:
+        return json.loads(data)
+
+    def join_map(self, pairs: List[Tuple[str, str]]) -> str:
+        return "{" + ", ".join(json.dumps(key) + ": " + value for key, value in pairs) + "}"
+
+
+class MsgpackCodec(FrameCodec):
+    name = "msgpack"
+    binary = True
+
+    @classmethod
+    def available(cls) -> bool:
+        return msgpack is not None
+
+    def dumps(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data: Frame) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+    def join_map(self, pairs: List[Tuple[str, bytes]]) -> bytes:
+        size = len(pairs)
+        header = bytes([0x80 | size]) if size < 16 else b"\xde" + struct.pack(">H", size)
+        return header + b"".join(msgpack.packb(key) + value for key, value in pairs)
+
+
+class CborCodec(FrameCodec):
+    name = "cbor"
+    binary = True
+
+    @classmethod
+    def available(cls) -> bool:
+        return cbor2 is not None
+
+    def dumps(self, obj: Any) -> bytes:
+        return cbor2.dumps(obj)
+
+    def decode(self, data: Frame) -> Any:
+        return cbor2.loads(data)
+
+    def join_map(self, pairs: List[Tuple[str, bytes]]) -> bytes:
+        size = len(pairs)
+        header = bytes([0xa0 | size]) if size < 24 else b"\xb8" + bytes([size])
+        return header + b"".join(cbor2.dumps(key) + value for key, value in pairs)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, MsgpackCodec, CborCodec)}
+
+JSON_CODEC = JsonCodec()
+
+
+def available_codecs() -> List[str]:
+    return [name for name, codec in CODECS.items() if codec.available()]
+
+
+def get_codec(name: str) -> FrameCodec:
+    """Кодек по имени. Неизвестный или неустановленный кодек - ValueError."""
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"unknown encoding '{name}', available: {', '.join(available_codecs())}")
+    if not codec.available():
+        raise ValueError(f"encoding '{name}' is not installed on the server")
+    return JSON_CODEC if codec is JsonCodec else codec()
+
+
+def negotiate_codec(encoding: Optional[str] = None,
+                    subprotocols: Optional[List[str]] = None) -> Tuple[FrameCodec, Optional[str]]:
+    """
+    Выбирает кодек соединения: ?encoding=<имя> (ошибка, если недоступен) или первый доступный
+    из предложенных подпротоколов sdominanta.<имя>, иначе JSON.
+    Возвращает (кодек, подпротокол для ответа или None).
+    """
+    if encoding:
+        codec = get_codec(encoding)
+        offered = subprotocols or []
+        return codec, codec.subprotocol if codec.subprotocol in offered else None
+
+    for subprotocol in subprotocols or []:
+        name = subprotocol[len(SUBPROTOCOL_PREFIX):] if subprotocol.startswith(SUBPROTOCOL_PREFIX) else None
+        if name in CODECS and CODECS[name].available():
+            return get_codec(name), subprotocol
+    return JSON_CODEC, None
+
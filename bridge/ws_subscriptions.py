@@ -0,0 +1,214 @@
+"""
+Подписки WebSocket-клиентов на события по фильтрам в стиле Nostr (NIP-01)
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from mcp.tools.wall_index import created_at_epoch
+
+# Поля фильтра, кроме тегов вида "#t"
+FILTER_FIELDS = ("ids", "kinds", "authors", "since", "until", "limit")
+
+
+class EventFilter:
+    """
+    Фильтр событий: {"ids", "kinds", "authors", "#<тег>", "since", "until"}.
+    Внутри поля значения объединяются по ИЛИ, поля между собой - по И.
+    """
+
+    def __init__(self, ids: Optional[Iterable[str]] = None, kinds: Optional[Iterable[int]] = None,
+                 authors: Optional[Iterable[str]] = None, tags: Optional[Dict[str, Iterable[str]]] = None,
+                 since: Optional[float] = None, until: Optional[float] = None, limit: Optional[int] = None):
+        self.ids = set(ids) if ids is not None else None
+        self.kinds = set(kinds) if kinds is not None else None
+        self.authors = set(authors) if authors is not None else None
+        self.tags = {name: set(values) for name, values in (tags or {}).items()}
+        self.since = since
+        self.until = until
+        self.limit = limit
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "EventFilter":
+        """
+        Разбирает фильтр из сообщения клиента. Некорректный фильтр - ValueError.
+        """
+        if not isinstance(data, dict):
+            raise ValueError("filter must be an object")
+
+        tags = {}
+        for key, value in data.items():
+            if key.startswith("#") and len(key) == 2:
+                tags[key[1]] = _string_list(key, value)
+            elif key not in FILTER_FIELDS:
+                raise ValueError(f"unknown filter field '{key}'")
+
+        kinds = data.get("kinds")
+        if kinds is not None and (not isinstance(kinds, list) or not all(isinstance(k, int) for k in kinds)):
+            raise ValueError("'kinds' must be a list of integers")
+
+        bounds = {}
+        for name in ("since", "until"):
+            if data.get(name) is not None:
+                bounds[name] = created_at_epoch(data[name])
+                if bounds[name] is None:
+                    raise ValueError(f"'{name}' must be a unix timestamp or ISO 8601 date")
+
+        limit = data.get("limit")
+        if limit is not None and (not isinstance(limit, int) or limit < 0):
+            raise ValueError("'limit' must be a non-negative integer")
+
+        return cls(
+            ids=_string_list("ids", data["ids"]) if "ids" in data else None,
+            kinds=kinds,
+            authors=_string_list("authors", data["authors"]) if "authors" in data else None,
+            tags=tags,
+            since=bounds.get("since"),
+            until=bounds.get("until"),
+            limit=limit,
+        )
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if self.ids is not None and event.get("id") not in self.ids:
+            return False
+        if self.kinds is not None and event.get("kind") not in self.kinds:
+            return False
+        if self.authors is not None and event.get("pubkey") not in self.authors:
+            return False
+        if self.since is not None or self.until is not None:
+            created_at = created_at_epoch(event.get("created_at"))
+            if created_at is None:
+                return False
+            if self.since is not None and created_at < self.since:
+                return False
+            if self.until is not None and created_at > self.until:
+                return False
+        for name, values in self.tags.items():
+            if not any(value in values for value in event_tag_values(event, name)):
+                return False
+        return True
+
+    def index_keys(self) -> List[Tuple[str, Any]]:
+        """
+        Ключи индекса, по которым фильтр находится для события: самое избирательное поле.
+        Пустой список - фильтр проверяется для каждого события.
+        """
+        if self.ids is not None:
+            return [("id", value) for value in self.ids]
+        if self.authors is not None:
+            return [("author", value) for value in self.authors]
+        if self.tags:
+            name = min(self.tags, key=lambda n: len(self.tags[n]))
+            return [("tag", (name, value)) for value in self.tags[name]]
+        if self.kinds is not None:
+            return [("kind", value) for value in self.kinds]
+        return []
+
+
+def _string_list(name: str, value: Any) -> List[str]:
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f"'{name}' must be a list of strings")
+    return value
+
+
+def event_tag_values(event: Dict[str, Any], name: str) -> List[str]:
+    """Значения тегов события с указанным именем (["t", "general"] -> "general")"""
+    return [tag[1] for tag in event.get("tags") or []
+            if isinstance(tag, list) and len(tag) > 1 and tag[0] == name]
+
+
+class _Entry:
+    """Один фильтр одной подписки клиента, зарегистрированный в индексе"""
+
+    __slots__ = ("client", "sub_id", "filter", "keys")
+
+    def __init__(self, client: Any, sub_id: str, event_filter: EventFilter):
+        self.client = client
+        self.sub_id = sub_id
+        self.filter = event_filter
+        self.keys = event_filter.index_keys()
+
+
+class SubscriptionIndex:
+    """
+    Индекс подписок: id/автор/тег/kind события -> фильтры, которые могут его принять.
+    Маршрутизация события проверяет только кандидатов из индекса, а не все подписки.
+    """
+
+    def __init__(self):
+        self._by_key: Dict[Tuple[str, Any], Set[_Entry]] = {}
+        self._unindexed: Set[_Entry] = set()
+        self._subscriptions: Dict[Tuple[int, str], List[_Entry]] = {}
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def add(self, client: Any, sub_id: str, filters: List[EventFilter]) -> None:
+        """Добавляет (или заменяет) подписку клиента"""
+        self.remove(client, sub_id)
+        entries = [_Entry(client, sub_id, f) for f in filters]
+        for entry in entries:
+            if entry.keys:
+                for key in entry.keys:
+                    self._by_key.setdefault(key, set()).add(entry)
+            else:
+                self._unindexed.add(entry)
+        self._subscriptions[(id(client), sub_id)] = entries
+
+    def remove(self, client: Any, sub_id: str) -> bool:
+        entries = self._subscriptions.pop((id(client), sub_id), None)
+        if entries is None:
+            return False
+        for entry in entries:
+            self._unindexed.discard(entry)
+            for key in entry.keys:
+                bucket = self._by_key.get(key)
+                if bucket is not None:
+                    bucket.discard(entry)
+                    if not bucket:
+                        del self._by_key[key]
+        return True
+
+    def remove_client(self, client: Any, sub_ids: Iterable[str]) -> None:
+        for sub_id in list(sub_ids):
+            self.remove(client, sub_id)
+
+    def client_matches(self, client: Any, sub_ids: Iterable[str], event: Dict[str, Any]) -> List[str]:
+        """Подписки клиента, принимающие событие (для повтора истории одному клиенту)"""
+        return sorted(sub_id for sub_id in sub_ids
+                      if any(entry.filter.matches(event) for entry in self._subscriptions.get((id(client), sub_id), ())))
+
+    def client_tag_values(self, client: Any, sub_ids: Iterable[str], name: str) -> List[str]:
+        """Значения тега name из фильтров подписок клиента (например, треды из "#t")"""
+        values = set()
+        for sub_id in sub_ids:
+            for entry in self._subscriptions.get((id(client), sub_id), ()):
+                values.update(entry.filter.tags.get(name, ()))
+        return sorted(values)
+
+    def _candidates(self, event: Dict[str, Any]) -> Set[_Entry]:
+        keys = [("id", event.get("id")), ("author", event.get("pubkey")), ("kind", event.get("kind"))]
+        keys.extend(("tag", (tag[0], tag[1])) for tag in event.get("tags") or []
+                    if isinstance(tag, list) and len(tag) > 1 and isinstance(tag[0], str) and isinstance(tag[1], str))
+        candidates = set(self._unindexed)
+        for key in keys:
+            try:
+                bucket = self._by_key.get(key)
+            except TypeError:  # нехешируемое значение поля события
+                continue
+            if bucket:
+                candidates.update(bucket)
+        return candidates
+
+    def match(self, event: Dict[str, Any]) -> Dict[Any, List[str]]:
+        """
+        Возвращает {клиент: [id подписок]} для подписок, принимающих событие.
+        """
+        matched: Dict[Any, List[str]] = {}
+        for entry in self._candidates(event):
+            if entry.filter.matches(event):
+                sub_ids = matched.setdefault(entry.client, [])
+                if entry.sub_id not in sub_ids:
+                    sub_ids.append(entry.sub_id)
+        for sub_ids in matched.values():
+            sub_ids.sort()
+        return matched
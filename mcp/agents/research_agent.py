@@ -1,9 +1,9 @@
 import os
 import asyncio
 import httpx # Для запросов в интернет
-import json
 from datetime import datetime
 from ..llm_connector.ollama_client import OllamaClient
+from ..tools.wall_codec import encode_note
 # from ...scripts.create_and_sign_note import create_and_sign_note # Потребуется адаптация
 from typing import Dict, Any, List
 
@@ -70,8 +70,8 @@ class ResearchAgent:
             "signature": "mock_signature"
         }
 
-        with open(note_filename, 'w', encoding='utf-8') as f:
-            json.dump(signed_note, f, ensure_ascii=False, indent=2)
+        with open(note_filename, 'wb') as f:
+            f.write(encode_note(signed_note))
         
         print(f"Truth published to {note_filename}")
         return {"status": "published", "path": note_filename}
@@ -1,5 +1,7 @@
 import asyncio
 import os
+import shutil
+import tempfile
 from typing import List, Dict, Any, Optional
 
 class GitTools:
@@ -7,9 +9,10 @@ class GitTools:
         self.base_repo_path = base_repo_path
         print(f"GitTools initialized. Base repository path: {self.base_repo_path}")
 
-    async def _run_git_command(self, repo_path: str, command: List[str]) -> tuple[int, str, str]:
+    async def _run_git_command(self, repo_path: str, command: List[str],
+                               env: Optional[Dict[str, str]] = None) -> tuple[int, str, str]:
         """
-        Выполняет команду Git в указанной директории репозитория.
+        Выполняет команду Git в указанной директории репозитория (env - дополнительные переменные окружения).
         Возвращает код возврата, stdout и stderr.
         """
         full_command = ["git"] + command
@@ -17,7 +20,8 @@ class GitTools:
             *full_command,
             cwd=repo_path,
             stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+            stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, **env} if env else None
         )
         stdout, stderr = await proc.communicate()
         return proc.returncode, stdout.decode().strip(), stderr.decode().strip()
@@ -59,10 +63,9 @@ class GitTools:
         if not os.path.exists(repo_path):
             return {"status": "error", "message": f"Репозиторий {repo_path} не найден."}
 
-        # Добавляем файлы
+        # Добавляем файлы одной командой (пачка заметок не должна порождать процесс на файл)
         if files_to_add:
-            for f in files_to_add:
-                await self._run_git_command(repo_path, ["add", f])
+            await self._run_git_command(repo_path, ["add", "--"] + list(files_to_add))
         else:
             await self._run_git_command(repo_path, ["add", "."])
         
@@ -84,17 +87,81 @@ class GitTools:
     async def pull_repo(self, repo_name: str) -> Dict[str, Any]:
         """
         Подтягивает изменения из удаленного репозитория.
+        В changed_files возвращает пути, измененные пуллом (None, если их не удалось определить).
         """
         repo_path = os.path.join(self.base_repo_path, repo_name)
         if not os.path.exists(repo_path):
             return {"status": "error", "message": f"Репозиторий {repo_path} не найден."}
 
+        head_code, head_before, _ = await self._run_git_command(repo_path, ["rev-parse", "HEAD"])
         returncode, stdout, stderr = await self._run_git_command(repo_path, ["pull"])
-        if returncode == 0:
-            print(f"GitTools: Изменения в репозитории '{repo_name}' подтянуты.")
-            return {"status": "success", "repo_name": repo_name}
-        else:
+        if returncode != 0:
             print(f"GitTools: Ошибка подтягивания изменений в репозитории '{repo_name}': {stderr}")
             return {"status": "error", "message": stderr}
 
+        changed_files = None
+        _, head_after, _ = await self._run_git_command(repo_path, ["rev-parse", "HEAD"])
+        if head_code == 0 and head_before == head_after:
+            changed_files = []
+        elif head_code == 0:
+            diff_code, diff_out, _ = await self._run_git_command(repo_path, ["diff", "--name-only", head_before, head_after])
+            if diff_code == 0:
+                changed_files = [line for line in diff_out.splitlines() if line]
+        print(f"GitTools: Изменения в репозитории '{repo_name}' подтянуты.")
+        return {"status": "success", "repo_name": repo_name, "changed_files": changed_files}
+
+    async def add_remote(self, repo_name: str, url: str, branch: str = "main") -> Dict[str, Any]:
+        """
+        Назначает репозиторию origin и ветку branch, отслеживающую origin/branch (pull и push без аргументов).
+        """
+        repo_path = os.path.join(self.base_repo_path, repo_name)
+        for command in (["symbolic-ref", "HEAD", f"refs/heads/{branch}"],
+                        ["remote", "add", "origin", url],
+                        ["config", f"branch.{branch}.remote", "origin"],
+                        ["config", f"branch.{branch}.merge", f"refs/heads/{branch}"]):
+            returncode, _, stderr = await self._run_git_command(repo_path, command)
+            if returncode != 0:
+                print(f"GitTools: Ошибка настройки origin репозитория '{repo_name}': {stderr}")
+                return {"status": "error", "message": stderr}
+        return {"status": "success", "repo_name": repo_name, "remote_url": url}
+
+    async def tree_hash(self, repo_name: str) -> Optional[str]:
+        """
+        Хеш дерева рабочей копии (git write-tree после git add -A): меняется при любом изменении
+        файлов треда. Индексирование идет во временный индекс (копия настоящего, чтобы git add
+        не перечитывал неизменные файлы), поэтому индекс репозитория не меняется. None, если хеш
+        не удалось получить.
+        """
+        repo_path = os.path.join(self.base_repo_path, repo_name)
+        returncode, index_path, stderr = await self._run_git_command(repo_path, ["rev-parse", "--git-path", "index"])
+        if returncode == 0:
+            with tempfile.TemporaryDirectory(prefix="sdom-tree-") as tmp:
+                env = {"GIT_INDEX_FILE": os.path.join(tmp, "index")}
+                index_path = os.path.join(repo_path, index_path)
+                if os.path.exists(index_path):
+                    shutil.copyfile(index_path, env["GIT_INDEX_FILE"])
+                returncode, _, stderr = await self._run_git_command(repo_path, ["add", "-A"], env=env)
+                if returncode == 0:
+                    returncode, stdout, stderr = await self._run_git_command(repo_path, ["write-tree"], env=env)
+        if returncode != 0:
+            print(f"GitTools: Не удалось получить хеш дерева репозитория '{repo_name}': {stderr}")
+            return None
+        return stdout
+
+    async def head(self, repo_name: str) -> Optional[str]:
+        """Коммит HEAD репозитория; None для репозитория без коммитов."""
+        returncode, stdout, _ = await self._run_git_command(os.path.join(self.base_repo_path, repo_name),
+                                                            ["rev-parse", "--verify", "-q", "HEAD"])
+        return stdout if returncode == 0 else None
+
+    async def remote_head(self, repo_name: str, branch: str = "main") -> Dict[str, Any]:
+        """
+        Коммит ветки branch в origin без pull (git ls-remote). head None - ветки в origin нет.
+        """
+        repo_path = os.path.join(self.base_repo_path, repo_name)
+        returncode, stdout, stderr = await self._run_git_command(repo_path, ["ls-remote", "origin", f"refs/heads/{branch}"])
+        if returncode != 0:
+            return {"status": "error", "message": stderr}
+        return {"status": "success", "head": stdout.split()[0] if stdout else None}
+
     # Дополнительные методы: управление ветками, слияния, разрешение конфликтов и т.д.
@@ -0,0 +1,68 @@
+"""
+Кодек заметок стены: канонический компактный JSON - ключи отсортированы, без пробелов, UTF-8
+без \\u-экранирования не-ASCII символов. Байты записанной заметки совпадают с ее каноническим видом,
+поэтому хеш и подпись считаются прямо по файлу или строке журнала.
+
+Быстрый бэкенд - orjson (WALL_JSON_BACKEND: auto | orjson | json). Канонический вид задает
+стандартный json: orjson иначе форматирует числа с плавающей точкой, поэтому такие заметки
+(и все, что orjson не сериализует, например целые больше 64 бит) кодируются стандартным json.
+"""
+
+import json
+import os
+from typing import Any, Dict, Union
+
+try:
+    import orjson
+except ImportError:  # Необязательная зависимость: без нее работает стандартный json
+    orjson = None
+
+JSON_BACKEND = os.getenv("WALL_JSON_BACKEND", "auto").lower()
+if JSON_BACKEND == "orjson" and orjson is None:
+    print("wall_codec: WALL_JSON_BACKEND=orjson, но orjson не установлен; используется json.")
+
+_use_orjson = orjson is not None and JSON_BACKEND in ("auto", "orjson")
+
+
+def backend_name() -> str:
+    return "orjson" if _use_orjson else "json"
+
+
+def _has_float(obj: Any) -> bool:
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        kind = type(item)
+        if kind is float:
+            return True
+        if kind is dict:
+            stack.extend(item.values())
+        elif kind is list or kind is tuple:
+            stack.extend(item)
+    return False
+
+
+def encode_note(note: Any) -> bytes:
+    """Канонический компактный JSON заметки (UTF-8)."""
+    if _use_orjson and not _has_float(note):
+        try:
+            return orjson.dumps(note, option=orjson.OPT_SORT_KEYS)
+        except TypeError:  # orjson.JSONEncodeError: нестроковые ключи, большие целые
+            pass
+    return json.dumps(note, sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+                      allow_nan=False).encode("utf-8")
+
+
+def decode_note(data: Union[bytes, str, memoryview]) -> Dict[str, Any]:
+    """
+    Разбирает заметку в любом JSON-виде (в том числе записанную до перехода на кодек с отступами).
+    memoryview (срез отображенного в память сегмента) orjson разбирает без копирования.
+    """
+    if _use_orjson:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # NaN/Infinity и прочее, что понимает только стандартный json
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
@@ -0,0 +1,266 @@
+"""
+Дедупликация заметок стены по содержимому.
+
+Ключ заметки - id события Nostr (это sha256 содержимого по NIP-01) или sha256 канонического JSON
+заметки. Одно и то же событие, пришедшее через /api/v1/wall/publish, P2P-релеи или git pull,
+записывается и коммитится один раз.
+"""
+
+import hashlib
+import math
+import os
+import struct
+import threading
+from typing import Any, Dict, Iterable, List
+
+from mcp.tools.wall_index import INDEX_DIR_NAME
+from mcp.tools.wall_signatures import canonical_json, nostr_event_id
+from mcp.tools.wall_storage import NoteStorage
+
+DEDUP_LOG_NAME = "dedup.log"
+KEY_SIZE = 32
+_KEY_WORDS = struct.Struct("<8I")  # Ключ как восемь независимых 32-битных слов
+
+
+def note_key(note: Dict[str, Any]) -> bytes:
+    """
+    Ключ содержимого заметки (32 байта): id события Nostr, если он совпадает с хешем содержимого,
+    иначе sha256 канонического JSON. Поддельный id не может занять ключ чужого события.
+    """
+    note_id = note.get("id")
+    if isinstance(note_id, str) and len(note_id) == KEY_SIZE * 2 and "pubkey" in note:
+        try:
+            if nostr_event_id(note) == note_id:
+                return bytes.fromhex(note_id)
+        except (TypeError, ValueError):
+            pass
+    return hashlib.sha256(canonical_json(note)).digest()
+
+
+class BloomFilter:
+    """
+    Фильтр Блума над 32-байтовыми ключами-хешами. Ключи уже равномерно распределены, поэтому
+    позиции битов - 32-битные слова самого ключа, без дополнительных хеш-функций (не больше 8).
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(64, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = min(8, max(1, round(self.num_bits / self.capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: bytes) -> List[int]:
+        m = self.num_bits
+        return [word % m for word in _KEY_WORDS.unpack(key)[:self.num_hashes]]
+
+    def update(self, data: bytes) -> None:
+        """Добавляет ключи, записанные подряд (как в журнале)."""
+        bits, m, k = self.bits, self.num_bits, self.num_hashes
+        for words in _KEY_WORDS.iter_unpack(data):
+            for word in words[:k]:
+                pos = word % m
+                bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += len(data) // KEY_SIZE
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class NoteDedupIndex:
+    """
+    Множество ключей заметок, уже записанных на стену.
+
+    На диске - журнал .index/dedup.log из 32-байтовых ключей, который дописывают все писатели;
+    перед проверкой догружаются новые записи (как у NoteRefIndex). В памяти - точное множество:
+    отсортированный буфер ключей (32 байта на ключ) и небольшое множество недавно добавленных,
+    которое периодически вливается в буфер. Перед ним стоит фильтр Блума: новая заметка (обычный
+    случай) отсекается за O(1) без поиска в буфере. Фильтр масштабируемый: заполненный слой
+    не перестраивается, следующий вдвое больше и с вдвое меньшей долей ложных срабатываний.
+    Журнала нет - он строится по тредам хранилища.
+    """
+
+    def __init__(self, storage: NoteStorage, error_rate: float = 0.01):
+        self.storage = storage
+        self.path = os.path.join(storage.base_wall_path, INDEX_DIR_NAME, DEDUP_LOG_NAME)
+        self.error_rate = error_rate
+        self._lock = threading.RLock()
+        self.bloom_rejects = 0
+        self.false_positives = 0
+        self._reset()
+
+    def _reset(self, capacity: int = 1024) -> None:
+        self._sorted = b""
+        self._recent: set = set()
+        self._blooms = [BloomFilter(capacity, self.error_rate)]
+        self._offset = 0
+        self._inode = None
+
+    def __len__(self) -> int:
+        return len(self._sorted) // KEY_SIZE + len(self._recent)
+
+    # --- Журнал ---
+
+    def refresh(self) -> None:
+        """Догружает ключи, дописанные после последнего чтения (в том числе другими процессами)."""
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                self.rebuild()
+                return
+            inode = (st.st_dev, st.st_ino)
+            if inode != self._inode:
+                # Журнал переписан целиком (пересборка) - читаем заново
+                self._reset(capacity=max(1024, 2 * (st.st_size // KEY_SIZE)))
+                self._inode = inode
+            if st.st_size - self._offset >= KEY_SIZE:
+                self._read_tail()
+
+    def _read_tail(self) -> None:
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # Последний ключ может дописываться прямо сейчас: берем только целые записи
+        end = len(data) - len(data) % KEY_SIZE
+        self._absorb(data[:end])
+        self._offset += end
+
+    @staticmethod
+    def _split(data: bytes) -> List[bytes]:
+        return [data[i:i + KEY_SIZE] for i in range(0, len(data), KEY_SIZE)]
+
+    def _absorb(self, data: bytes) -> bytes:
+        """Добавляет в память ключи (записанные подряд), которых еще нет, и возвращает их."""
+        if not len(self):
+            # Первая загрузка: без поштучных проверок, одна сортировка и одна сборка фильтра
+            self._sorted = b"".join(sorted(set(self._split(data))))
+            self._blooms = [BloomFilter(max(1024, 2 * len(self)), self.error_rate)]
+            self._blooms[0].update(self._sorted)
+            return self._sorted
+        new, batch = [], set()
+        for key in self._split(data):
+            if key not in batch and not self._contains(key):
+                batch.add(key)
+                new.append(key)
+        new_data = b"".join(new)
+        self._recent.update(new)
+        self._bloom_update(new_data)
+        if len(self._recent) > max(4096, len(self._sorted) // KEY_SIZE // 8):
+            self._merge()
+        return new_data
+
+    def _bloom_update(self, data: bytes) -> None:
+        pos = 0
+        while pos < len(data):
+            bloom = self._blooms[-1]
+            room = bloom.capacity - bloom.count
+            if room <= 0:
+                self._blooms.append(BloomFilter(2 * bloom.capacity, bloom.error_rate / 2))
+                continue
+            chunk = data[pos:pos + room * KEY_SIZE]
+            bloom.update(chunk)
+            pos += len(chunk)
+
+    def _bloom_contains(self, key: bytes) -> bool:
+        return any(key in bloom for bloom in self._blooms)
+
+    def _merge(self) -> None:
+        """Вливает недавние ключи в отсортированный буфер."""
+        self._sorted = b"".join(sorted(self._split(self._sorted) + list(self._recent)))
+        self._recent = set()
+
+    def _in_sorted(self, key: bytes) -> bool:
+        lo, hi = 0, len(self._sorted) // KEY_SIZE
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = self._sorted[mid * KEY_SIZE:(mid + 1) * KEY_SIZE]
+            if probe == key:
+                return True
+            if probe < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return False
+
+    def _contains(self, key: bytes) -> bool:
+        return self._bloom_contains(key) and (key in self._recent or self._in_sorted(key))
+
+    def _write(self, data: bytes) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def _scan(self, threads: Iterable[str]) -> List[bytes]:
+        keys = []
+        for thread_id in threads:
+            try:
+                notes = self.storage.query(thread_id, limit=0) if self.storage.has_thread(thread_id) else []
+            except Exception as e:
+                print(f"NoteDedupIndex: Ошибка чтения треда {thread_id}: {e}")
+                continue
+            keys.extend(note_key(note) for note in notes)
+        return keys
+
+    def rebuild(self) -> int:
+        """Строит журнал заново по всем тредам хранилища и возвращает число ключей."""
+        with self._lock:
+            keys = sorted(set(self._scan(self.storage.threads())))
+            self._write(b"".join(keys))
+            self._reset()
+            self.refresh()
+            print(f"NoteDedupIndex: Индекс дедупликации пересобран ({len(keys)} заметок).")
+            return len(keys)
+
+    # --- Проверка и пополнение ---
+
+    def contains(self, key: bytes) -> bool:
+        """Заметка с таким ключом уже есть на стене."""
+        with self._lock:
+            self.refresh()
+            if not self._bloom_contains(key):
+                self.bloom_rejects += 1
+                return False
+            if key in self._recent or self._in_sorted(key):
+                return True
+            self.false_positives += 1
+            return False
+
+    def add(self, key: bytes) -> bool:
+        """Запоминает ключ записанной заметки. Возвращает False, если он уже был."""
+        return self.add_many([key]) == 1
+
+    def add_many(self, keys: Iterable[bytes]) -> int:
+        """Запоминает ключи и возвращает число новых."""
+        with self._lock:
+            self.refresh()
+            data = self._absorb(b"".join(keys))
+            if data:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                # Ключи пишутся одним write в режиме дозаписи, записи процессов не перемешиваются
+                with open(self.path, 'ab') as f:
+                    f.write(data)
+                    f.flush()
+                    st = os.fstat(f.fileno())
+                if (st.st_dev, st.st_ino) == self._inode and st.st_size == self._offset + len(data):
+                    self._offset = st.st_size  # Других записей не было: свои ключи уже в памяти
+                else:
+                    self.refresh()
+            return len(data) // KEY_SIZE
+
+    def index_threads(self, threads: Iterable[str]) -> int:
+        """Добавляет ключи заметок тредов, измененных в обход WallAPI (git pull); возвращает число новых."""
+        return self.add_many(self._scan(sorted(set(threads))))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "keys": len(self),
+                "bloom_bytes": sum(len(bloom.bits) for bloom in self._blooms),
+                "bloom_layers": len(self._blooms),
+                "bloom_rejects": self.bloom_rejects,
+                "false_positives": self.false_positives,
+            }
@@ -0,0 +1,267 @@
+import os
+import json
+import base64
+import binascii
+from bisect import insort
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+from mcp.tools.wall_codec import decode_note
+
+# Индексы тредов хранятся рядом с тредами, в скрытой директории,
+# чтобы не попадать в листинг заметок и в glob "**/*.json" валидатора.
+INDEX_DIR_NAME = ".index"
+
+
+def note_created_at(note: Dict[str, Any]) -> Any:
+    """
+    Возвращает время создания заметки (Nostr created_at или timestamp WallManager).
+    """
+    return note.get("created_at", note.get("timestamp"))
+
+
+def created_at_epoch(created_at: Any) -> Optional[float]:
+    """
+    Переводит created_at (Unix-время числом/строкой или ISO 8601) в секунды эпохи; None, если не разобрать.
+    """
+    if isinstance(created_at, bool) or created_at is None:
+        return None
+    if isinstance(created_at, (int, float)):
+        return float(created_at)
+    try:
+        return float(created_at)
+    except (TypeError, ValueError):
+        pass
+    try:
+        parsed = datetime.fromisoformat(str(created_at).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)  # Заметки пишутся в UTC
+    return parsed.timestamp()
+
+
+def note_sort_key(created_at: Any) -> float:
+    """
+    Ключ сортировки заметки: created_at в секундах эпохи (ISO и Unix-время сравниваются верно).
+    Неразбираемая дата - 0, такие заметки оказываются в начале треда.
+    """
+    epoch = created_at_epoch(created_at)
+    return epoch if epoch is not None else 0.0
+
+
+def note_page_key(note: Dict[str, Any]) -> Tuple[float, str]:
+    """
+    Ключ keyset-пагинации: (ключ сортировки created_at, id) - полный порядок заметок треда.
+    """
+    return note_sort_key(note_created_at(note)), str(note.get("id", ""))
+
+
+def entry_ts(entry: Dict[str, Any]) -> float:
+    return entry["ts"]
+
+
+def entry_page_key(entry: Dict[str, Any]) -> Tuple[float, str]:
+    return entry["ts"], str(entry["id"])
+
+
+def encode_cursor(page_key: Tuple[float, str]) -> str:
+    """
+    Непрозрачный курсор страницы: base64url от JSON [ключ created_at, id].
+    """
+    raw = json.dumps(list(page_key), ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """
+    Разбирает курсор страницы. Некорректный курсор - ValueError.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key, note_id = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError(f"invalid cursor: {e}") from e
+    if isinstance(key, bool) or not isinstance(key, (int, float)) or not isinstance(note_id, str):
+        raise ValueError("invalid cursor")
+    return float(key), note_id
+
+
+def next_page_cursor(notes: List[Dict[str, Any]], limit: int) -> Optional[str]:
+    """
+    Курсор следующей (более старой) страницы или None, если страница последняя.
+    """
+    if limit <= 0 or len(notes) < limit:
+        return None
+    return encode_cursor(note_page_key(notes[0]))
+
+
+class ThreadIndex:
+    """
+    Персистентный индекс заметок одного треда, упорядоченный по (created_at, id).
+
+    Каждая строка файла <thread>.idx - JSON-запись {"id", "file", "created_at", "ts"},
+    где ts - created_at в секундах эпохи, вычисленный один раз при индексации:
+    since/until и курсоры ищутся по нему двоичным поиском.
+    Рядом лежит <thread>.meta с mtime директории треда на момент последней
+    синхронизации: если директорию меняли в обход индекса (git pull, ручная
+    запись), индекс пересобирается.
+
+    Файлы индекса пишет только процесс-писатель стены (persist=True). Остальные воркеры
+    при изменении треда перечитывают сохраненный писателем индекс, а если он отстал -
+    пересобирают индекс только в памяти.
+    """
+
+    def __init__(self, base_wall_path: str, thread_id: str, persist: bool = True):
+        self.thread_id = thread_id
+        self.persist = persist
+        self.thread_path = os.path.join(base_wall_path, thread_id)
+        index_dir = os.path.join(base_wall_path, INDEX_DIR_NAME)
+        self.index_path = os.path.join(index_dir, f"{thread_id}.idx")
+        self.meta_path = os.path.join(index_dir, f"{thread_id}.meta")
+        self.entries: Optional[List[Dict[str, Any]]] = None
+        self._files: set = set()
+        self._synced_mtime_ns: Optional[int] = None
+
+    def _dir_mtime_ns(self) -> Optional[int]:
+        try:
+            return os.stat(self.thread_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self) -> List[Dict[str, Any]]:
+        """
+        Возвращает записи индекса, при необходимости загружая или пересобирая его.
+        """
+        dir_mtime = self._dir_mtime_ns()
+        if self.entries is not None and dir_mtime == self._synced_mtime_ns:
+            return self.entries
+
+        # Директорию изменил писатель (другой воркер): его индекс уже на диске и сверен с .meta
+        if self._load_from_disk(dir_mtime):
+            return self.entries
+
+        return self.rebuild()
+
+    def _load_from_disk(self, dir_mtime: Optional[int]) -> bool:
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.loads(f.read())
+            if meta.get("dir_mtime_ns") != dir_mtime:
+                return False
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                entries = [json.loads(line) for line in f.read().splitlines() if line]
+            if len(entries) != meta.get("count"):
+                return False
+        except (OSError, ValueError, AttributeError):
+            return False
+
+        legacy = [entry for entry in entries if "ts" not in entry]
+        for entry in legacy:
+            entry["ts"] = note_sort_key(entry.get("created_at"))
+        self.entries = entries
+        self._files = {entry["file"] for entry in entries}
+        self._synced_mtime_ns = dir_mtime
+        if legacy:
+            # Индекс старого формата (без ts, упорядочен по строке created_at) переписывается один раз
+            entries.sort(key=entry_page_key)
+            self._write_index()
+        return True
+
+    def rebuild(self) -> List[Dict[str, Any]]:
+        """
+        Полностью пересобирает индекс по файлам заметок треда.
+        """
+        entries = []
+        try:
+            filenames = [f for f in os.listdir(self.thread_path) if f.endswith('.json')]
+        except OSError:
+            filenames = []
+
+        for filename in sorted(filenames):
+            try:
+                with open(os.path.join(self.thread_path, filename), 'rb') as f:
+                    note = decode_note(f.read())
+            except (OSError, ValueError):
+                continue
+            if not isinstance(note, dict):
+                continue
+            entries.append(self._make_entry(note, filename))
+
+        entries.sort(key=entry_page_key)
+        self.entries = entries
+        self._files = {entry["file"] for entry in entries}
+        self._synced_mtime_ns = self._dir_mtime_ns()
+        self._write_index()
+        print(f"ThreadIndex: Индекс треда {self.thread_id} пересобран ({len(entries)} заметок).")
+        return entries
+
+    def add(self, note: Dict[str, Any], filename: str) -> None:
+        """
+        Добавляет только что записанную заметку в индекс.
+        """
+        if self.entries is None:
+            self.load()
+            if filename in self._files:
+                return
+
+        if filename not in self._files:
+            entry = self._make_entry(note, filename)
+            if not self.entries or entry_page_key(self.entries[-1]) <= entry_page_key(entry):
+                self.entries.append(entry)
+                self._append_entry(entry)
+            else:
+                # Заметка "из прошлого": вставляем на место и переписываем индекс
+                insort(self.entries, entry, key=entry_page_key)
+                self._write_index(with_meta=False)
+            self._files.add(filename)
+
+        self._synced_mtime_ns = self._dir_mtime_ns()
+        self._write_meta()
+
+    @staticmethod
+    def _make_entry(note: Dict[str, Any], filename: str) -> Dict[str, Any]:
+        created_at = note_created_at(note)
+        return {
+            "id": note.get("id", filename[:-len('.json')]),
+            "file": filename,
+            "created_at": created_at,
+            "ts": note_sort_key(created_at),
+        }
+
+    def _append_entry(self, entry: Dict[str, Any]) -> None:
+        if not self.persist:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"ThreadIndex: Не удалось дописать индекс {self.index_path}: {e}")
+
+    def _write_index(self, with_meta: bool = True) -> None:
+        if not self.persist:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in self.entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"ThreadIndex: Не удалось записать индекс {self.index_path}: {e}")
+            return
+        if with_meta:
+            self._write_meta()
+
+    def _write_meta(self) -> None:
+        if not self.persist:
+            return
+        try:
+            tmp_path = self.meta_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({"dir_mtime_ns": self._synced_mtime_ns, "count": len(self.entries)}))
+            os.replace(tmp_path, self.meta_path)
+        except OSError as e:
+            print(f"ThreadIndex: Не удалось записать метаданные индекса {self.meta_path}: {e}")
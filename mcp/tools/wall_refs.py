@@ -0,0 +1,240 @@
+"""
+Межтредовые вторичные индексы стены: значение тега -> заметки и автор -> заметки
+"""
+
+import json
+import os
+import threading
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from mcp.tools.wall_index import INDEX_DIR_NAME, note_created_at, note_sort_key
+from mcp.tools.wall_search import note_author, note_tags
+from mcp.tools.wall_storage import NoteStorage, PageKey
+
+REFS_LOG_NAME = "refs.log"
+
+# Ссылка на заметку: (created_at в секундах эпохи, "<тред>/<id>"). Тот же вид, что у ключа
+# keyset-пагинации треда, поэтому курсоры страниц кодируются encode_cursor.
+NoteRef = Tuple[float, str]
+
+
+def make_ref(thread_id: str, note_id: str, ts: float) -> NoteRef:
+    return ts, f"{thread_id}/{note_id}"
+
+
+def split_ref(ref: NoteRef) -> Tuple[str, str]:
+    """Ссылка -> (тред, id заметки). Тред может быть вложенным ("user_profiles/abc"), id заметки "/" не содержит"""
+    thread_id, _, note_id = ref[1].rpartition("/")
+    return thread_id, note_id
+
+
+class NoteRefIndex:
+    """
+    Индексы заметок всех тредов по значению тега и по автору.
+
+    Хранятся журналом .index/refs.log: строка JSON {"thread", "id", "ts", "author", "tags"}
+    на заметку. Журнал дописывают все процессы, публикующие заметки (воркеры bridge, WallManager);
+    перед каждым запросом индекс догружает новые строки с последней прочитанной позиции, поэтому
+    видит записи других процессов без перечитывания тредов. Журнала нет - он строится по
+    всем тредам хранилища; после git pull затронутые треды переиндексируются (reindex_threads).
+    """
+
+    def __init__(self, storage: NoteStorage):
+        self.storage = storage
+        self.path = os.path.join(storage.base_wall_path, INDEX_DIR_NAME, REFS_LOG_NAME)
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._by_tag: Dict[Tuple[str, str], List[NoteRef]] = {}
+        self._by_author: Dict[str, List[NoteRef]] = {}
+        self._offset = 0
+        self._inode: Optional[Tuple[int, int]] = None
+
+    @staticmethod
+    def make_record(thread_id: str, note: Dict[str, Any], note_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        note_id = str(note.get("id") or note_id or "")
+        if not note_id:
+            return None
+        return {
+            "thread": thread_id,
+            "id": note_id,
+            "ts": note_sort_key(note_created_at(note)),
+            "author": note_author(note),
+            "tags": [list(tag) for tag in sorted(set(note_tags(note)))],
+        }
+
+    # --- Журнал ---
+
+    def refresh(self) -> None:
+        """Догружает строки журнала, дописанные после последнего чтения (в том числе другими процессами)."""
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                self.rebuild()
+                return
+            inode = (st.st_dev, st.st_ino)
+            if inode != self._inode:
+                # Журнал переписан целиком (переиндексация) - читаем заново
+                self._reset()
+                self._inode = inode
+            if st.st_size > self._offset:
+                self._read_tail()
+
+    def _read_tail(self) -> None:
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # Последняя строка может дописываться прямо сейчас: разбираем только завершенные
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print(f"NoteRefIndex: Пропущена поврежденная строка журнала {self.path}")
+                continue
+            self._apply(record)
+        self._offset += end
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        key = f"{record['thread']}/{record['id']}"
+        old = self._records.get(key)
+        if old == record:
+            return
+        if old is not None:
+            self._unlink(old)
+        self._records[key] = record
+        ref = make_ref(record["thread"], record["id"], record["ts"])
+        for name, value in record["tags"]:
+            self._insert(self._by_tag.setdefault((name, value), []), ref)
+        self._insert(self._by_author.setdefault(record["author"], []), ref)
+
+    @staticmethod
+    def _insert(refs: List[NoteRef], ref: NoteRef) -> None:
+        if not refs or refs[-1] <= ref:
+            refs.append(ref)  # Обычный случай: новая заметка - самая свежая
+        else:
+            insort(refs, ref)
+
+    def _unlink(self, record: Dict[str, Any]) -> None:
+        ref = make_ref(record["thread"], record["id"], record["ts"])
+        for name, value in record["tags"]:
+            self._discard(self._by_tag, (name, value), ref)
+        self._discard(self._by_author, record["author"], ref)
+
+    @staticmethod
+    def _discard(index: Dict[Any, List[NoteRef]], key: Any, ref: NoteRef) -> None:
+        refs = index.get(key)
+        if refs is None:
+            return
+        i = bisect_left(refs, ref)
+        if i < len(refs) and refs[i] == ref:
+            del refs[i]
+        if not refs:
+            del index[key]
+
+    def add(self, thread_id: str, note: Dict[str, Any], note_id: Optional[str] = None) -> bool:
+        """
+        Индексирует только что записанную заметку: дописывает строку в журнал.
+        Возвращает False, если заметка без id или уже проиндексирована.
+        """
+        record = self.make_record(thread_id, note, note_id)
+        if record is None:
+            return False
+        with self._lock:
+            self.refresh()
+            if self._records.get(f"{thread_id}/{record['id']}") == record:
+                return False
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Строка пишется одним write в режиме дозаписи, строки процессов не перемешиваются
+            with open(self.path, 'ab') as f:
+                f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n")
+            self.refresh()
+            return True
+
+    def _scan(self, threads: Iterable[str]) -> List[Dict[str, Any]]:
+        records = []
+        for thread_id in threads:
+            try:
+                notes = self.storage.query(thread_id, limit=0) if self.storage.has_thread(thread_id) else []
+            except Exception as e:
+                print(f"NoteRefIndex: Ошибка чтения треда {thread_id}: {e}")
+                continue
+            records.extend(r for r in (self.make_record(thread_id, note) for note in notes) if r is not None)
+        return records
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n")
+        os.replace(tmp_path, self.path)
+
+    def rebuild(self) -> int:
+        """Строит журнал заново по всем тредам хранилища и возвращает число заметок."""
+        with self._lock:
+            records = self._scan(self.storage.threads())
+            self._write(records)
+            self._reset()
+            self.refresh()
+            print(f"NoteRefIndex: Индекс тегов и авторов пересобран ({len(records)} заметок).")
+            return len(records)
+
+    def reindex_threads(self, threads: Iterable[str]) -> None:
+        """Перечитывает заметки тредов, измененных в обход WallAPI (git pull), и переписывает журнал."""
+        threads = set(threads)
+        with self._lock:
+            self.refresh()
+            records = [r for r in self._records.values() if r["thread"] not in threads]
+            records.extend(self._scan(sorted(threads)))
+            self._write(records)
+            self._reset()
+            self.refresh()
+
+    # --- Запросы ---
+
+    def by_tag(self, name: str, value: str, since_ts: Optional[float] = None, until_ts: Optional[float] = None,
+               limit: int = 50, before: Optional[PageKey] = None) -> List[NoteRef]:
+        """Ссылки на заметки с тегом [name, value] (страница - см. _page)."""
+        with self._lock:
+            self.refresh()
+            return self._page(self._by_tag.get((name, value), []), since_ts, until_ts, limit, before)
+
+    def by_author(self, author: str, since_ts: Optional[float] = None, until_ts: Optional[float] = None,
+                  limit: int = 50, before: Optional[PageKey] = None) -> List[NoteRef]:
+        """Ссылки на заметки автора, pubkey или author_id (страница - см. _page)."""
+        with self._lock:
+            self.refresh()
+            return self._page(self._by_author.get(author, []), since_ts, until_ts, limit, before)
+
+    @staticmethod
+    def _page(refs: List[NoteRef], since_ts: Optional[float] = None, until_ts: Optional[float] = None,
+              limit: int = 50, before: Optional[PageKey] = None) -> List[NoteRef]:
+        """
+        Последние limit ссылок (от старых к новым), созданных в [since_ts, until_ts]
+        и строго раньше ключа курсора before. limit=0 - все.
+        """
+        start = bisect_left(refs, (since_ts,)) if since_ts is not None else 0
+        end = bisect_right(refs, (until_ts, "\U0010ffff")) if until_ts is not None else len(refs)
+        if before is not None:
+            end = min(end, bisect_left(refs, tuple(before)))
+        if limit > 0:
+            start = max(start, end - limit)
+        return refs[start:end]
+
+    def tag_counts(self, name: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Самые частые теги (только с именем name, если задано): [{"name", "value", "count"}]."""
+        with self._lock:
+            self.refresh()
+            counts = [{"name": n, "value": v, "count": len(refs)}
+                      for (n, v), refs in self._by_tag.items() if name is None or n == name]
+        counts.sort(key=lambda c: (-c["count"], c["name"], c["value"]))
+        return counts[:limit] if limit > 0 else counts
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"notes": len(self._records), "tags": len(self._by_tag), "authors": len(self._by_author)}
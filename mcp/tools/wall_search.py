@@ -0,0 +1,404 @@
+"""
+Полнотекстовый поиск по стене: инвертированный индекс по content и тегам заметок.
+
+Индекс поддерживается инкрементально (add / remove_thread), ранжирует по BM25,
+фильтрует по тегам, авторам, треду и времени и отдает результаты страницами по курсору.
+"""
+
+import base64
+import binascii
+import json
+import math
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from heapq import nlargest
+from operator import itemgetter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from mcp.tools.wall_codec import decode_note, encode_note
+from mcp.tools.wall_index import note_created_at, note_sort_key
+
+# Токен - последовательность юникодных букв и цифр: кириллица и латиница разбираются одинаково
+TOKEN_RE = re.compile(r"\w+")
+# Терм запроса; "*" в конце - поиск по префиксу (T2* -> t2, t2x, ...)
+QUERY_TERM_RE = re.compile(r"(\w+)(\*?)")
+
+# Однобуквенные слова (предлоги, союзы) не индексируются, числа - индексируются
+MIN_TOKEN_LENGTH = 2
+MIN_PREFIX_LENGTH = 2
+# Префикс раскрывается не более чем в столько самых частых термов
+MAX_PREFIX_EXPANSIONS = 64
+
+# Теги-ссылки на события и ключи (hex) не содержат текста: по ним только фильтруют
+REFERENCE_TAGS = ("e", "p")
+
+# Параметры BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Точность сравнения оценок (в курсоре оценка округлена до 6 знаков)
+SCORE_EPSILON = 1e-6
+
+SearchKey = Tuple[float, float, str]
+
+
+def normalize_text(text: str) -> str:
+    """Приводит текст к виду индекса: нижний регистр, "ё" -> "е"."""
+    return text.lower().replace("ё", "е")
+
+
+def tokenize(text: Any) -> List[str]:
+    """Разбивает текст на термы индекса (не строка - пустой список)."""
+    if not isinstance(text, str):
+        return []
+    return [t for t in TOKEN_RE.findall(normalize_text(text)) if len(t) >= MIN_TOKEN_LENGTH or t.isdigit()]
+
+
+def parse_query(query: str) -> List[Tuple[str, bool]]:
+    """
+    Разбирает строку запроса в список (терм, префиксный ли). Все термы должны встретиться в заметке.
+    """
+    terms = []
+    for token, star in QUERY_TERM_RE.findall(normalize_text(query or "")):
+        prefix = bool(star) and len(token) >= MIN_PREFIX_LENGTH
+        if prefix or len(token) >= MIN_TOKEN_LENGTH or token.isdigit():
+            if (token, prefix) not in terms:
+                terms.append((token, prefix))
+    return terms
+
+
+def note_author(note: Dict[str, Any]) -> str:
+    """Автор заметки: Nostr pubkey или author_id WallManager."""
+    return str(note.get("pubkey") or note.get("author_id") or "")
+
+
+def note_tags(note: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """Теги заметки парами (имя, значение): ["t", "general"] -> ("t", "general")."""
+    return [(tag[0], tag[1]) for tag in note.get("tags") or []
+            if isinstance(tag, list) and len(tag) > 1 and isinstance(tag[0], str) and isinstance(tag[1], str)]
+
+
+def parse_tag_filter(value: str) -> Tuple[str, str]:
+    """Фильтр тега из запроса: "t:general" -> ("t", "general"), без имени - тег "t"."""
+    name, sep, tag_value = value.partition(":")
+    if not sep:
+        return "t", value
+    if not name or not tag_value:
+        raise ValueError(f"invalid tag filter '{value}', expected <name>:<value>")
+    return name, tag_value
+
+
+def encode_search_cursor(key: SearchKey) -> str:
+    """Курсор страницы поиска: base64url от JSON [оценка, created_at, id] последнего результата."""
+    raw = json.dumps(list(key), ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip("=")
+
+
+def decode_search_cursor(cursor: str) -> SearchKey:
+    """Разбирает курсор поиска. Некорректный курсор - ValueError."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        score, ts, note_id = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as e:
+        raise ValueError(f"invalid cursor: {cursor}") from e
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (score, ts)) or not isinstance(note_id, str):
+        raise ValueError(f"invalid cursor: {cursor}")
+    return float(score), float(ts), note_id
+
+
+def _contains(docs: array, doc: int) -> int:
+    """Позиция документа в отсортированном списке вхождений или -1."""
+    i = bisect_left(docs, doc)
+    return i if i < len(docs) and docs[i] == doc else -1
+
+
+class WallSearchIndex:
+    """
+    Инвертированный индекс заметок стены.
+
+    Документ - заметка треда с порядковым номером. Списки вхождений терма - массивы номеров
+    документов (по возрастанию) и частот терма, поэтому проверка вхождения - двоичный поиск.
+    Замененные и удаленные документы помечаются и вычищаются перестроением, когда их
+    становится больше, чем живых. Сама заметка хранится в компактном JSON для выдачи результатов.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._tag_postings: Dict[Tuple[str, str], array] = {}
+        self._author_postings: Dict[str, array] = {}
+        self._docs: List[Optional[bytes]] = []
+        self._ids: List[Optional[str]] = []
+        self._threads: List[str] = []
+        self._ts = array('d')
+        self._lengths = array('I')
+        self._by_thread: Dict[str, Dict[str, int]] = {}
+        self._live = 0
+        self._total_length = 0
+        self._vocabulary: Optional[List[str]] = None  # отсортированные термы для префиксного поиска
+
+    def __len__(self) -> int:
+        return self._live
+
+    def add(self, thread_id: str, note: Dict[str, Any], note_id: Optional[str] = None) -> bool:
+        """
+        Индексирует заметку треда. Заметка с тем же id в треде заменяется; повтор без изменений
+        пропускается. Возвращает True, если индекс изменился.
+        """
+        note_id = str(note.get("id") or note_id or "")
+        if not note_id:
+            return False
+        stored = encode_note(note)
+        with self._lock:
+            thread_docs = self._by_thread.setdefault(sys.intern(thread_id), {})
+            existing = thread_docs.get(note_id)
+            if existing is not None:
+                if self._docs[existing] == stored:
+                    return False
+                self._delete(existing)
+            self._append(thread_id, note_id, note, stored, thread_docs)
+            self._maybe_compact()
+            return True
+
+    def _append(self, thread_id: str, note_id: str, note: Dict[str, Any], stored: bytes,
+                thread_docs: Dict[str, int]) -> None:
+        doc = len(self._docs)
+        tags = note_tags(note)
+        tokens = tokenize(note.get("content"))
+        for name, value in tags:
+            if name not in REFERENCE_TAGS:
+                tokens.extend(tokenize(value))
+
+        frequencies: Dict[str, int] = {}
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        for token, tf in frequencies.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = (array('I'), array('H'))
+                self._vocabulary = None
+            posting[0].append(doc)
+            posting[1].append(min(tf, 0xFFFF))
+
+        for key in set(tags):
+            self._tag_postings.setdefault(key, array('I')).append(doc)
+        self._author_postings.setdefault(sys.intern(note_author(note)), array('I')).append(doc)
+
+        self._docs.append(stored)
+        self._ids.append(note_id)
+        self._threads.append(sys.intern(thread_id))
+        self._ts.append(note_sort_key(note_created_at(note)))
+        self._lengths.append(len(tokens))
+        thread_docs[note_id] = doc
+        self._live += 1
+        self._total_length += len(tokens)
+
+    def _delete(self, doc: int) -> None:
+        self._docs[doc] = None
+        self._ids[doc] = None
+        self._live -= 1
+        self._total_length -= self._lengths[doc]
+
+    def remove_thread(self, thread_id: str) -> int:
+        """Убирает из индекса все заметки треда и возвращает их число."""
+        with self._lock:
+            docs = self._by_thread.pop(thread_id, {})
+            for doc in docs.values():
+                self._delete(doc)
+            self._maybe_compact()
+            return len(docs)
+
+    def reindex_thread(self, thread_id: str, notes: Iterable[Dict[str, Any]]) -> None:
+        """Заменяет заметки треда в индексе (после git pull)."""
+        with self._lock:
+            self.remove_thread(thread_id)
+            for note in notes:
+                self.add(thread_id, note)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def _maybe_compact(self) -> None:
+        deleted = len(self._docs) - self._live
+        if deleted > max(1024, self._live):
+            self.compact()
+
+    def compact(self) -> None:
+        """Перестраивает индекс без удаленных документов."""
+        with self._lock:
+            live = [(self._threads[doc], self._ids[doc], self._docs[doc])
+                    for doc in range(len(self._docs)) if self._docs[doc] is not None]
+            self._reset()
+            for thread_id, note_id, stored in live:
+                thread_docs = self._by_thread.setdefault(thread_id, {})
+                self._append(thread_id, note_id, decode_note(stored), stored, thread_docs)
+
+    def _expand(self, token: str, prefix: bool) -> List[str]:
+        if not prefix:
+            return [token] if token in self._postings else []
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        vocabulary = self._vocabulary
+        matches = []
+        i = bisect_left(vocabulary, token)
+        while i < len(vocabulary) and vocabulary[i].startswith(token):
+            matches.append(vocabulary[i])
+            i += 1
+        if len(matches) > MAX_PREFIX_EXPANSIONS:
+            matches = nlargest(MAX_PREFIX_EXPANSIONS, matches, key=lambda t: len(self._postings[t][0]))
+        return matches
+
+    def search(self, query: str = "", tags: Optional[Iterable[Tuple[str, str]]] = None,
+               authors: Optional[Iterable[str]] = None, thread_id: Optional[str] = None,
+               since: Optional[float] = None, until: Optional[float] = None, limit: int = 20,
+               cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Ищет заметки, содержащие все термы запроса, и возвращает
+        {"total", "results": [{"thread_id", "score", "note"}], "next_cursor"}.
+
+        Результаты упорядочены по BM25, затем от новых к старым. Значения одного тега
+        объединяются по ИЛИ, разные теги, авторы и тред - по И. Пустой запрос с фильтрами
+        возвращает заметки по фильтрам от новых к старым. Без запроса и фильтров - ValueError.
+        """
+        after = decode_search_cursor(cursor) if cursor else None
+        terms = parse_query(query)
+        tag_groups: Dict[str, List[str]] = {}
+        for name, value in tags or ():
+            tag_groups.setdefault(name, []).append(value)
+        author_set = set(authors) if authors else None
+        if not terms and not tag_groups and author_set is None and thread_id is None:
+            raise ValueError("search query or filter is required")
+
+        with self._lock:
+            has_filters = bool(tag_groups) or author_set is not None or thread_id is not None
+            filtered = self._filter_candidates(tag_groups, author_set, thread_id) if has_filters else None
+            candidates = self._match_terms(terms, filtered) if terms else filtered
+            tag_lists = [[self._tag_postings[(name, v)] for v in values if (name, v) in self._tag_postings]
+                         for name, values in tag_groups.items()]
+            author_lists = [self._author_postings[a] for a in author_set if a in self._author_postings] if author_set else []
+
+            # Фильтры применяются по очереди, только заданные: на частых термах кандидатов сотни тысяч
+            items = list(candidates.items())
+            doc_ids, doc_ts, doc_threads = self._ids, self._ts, self._threads
+            if len(self._docs) > self._live:
+                items = [item for item in items if doc_ids[item[0]] is not None]
+            if thread_id is not None:
+                items = [item for item in items if doc_threads[item[0]] == thread_id]
+            if since is not None:
+                items = [item for item in items if doc_ts[item[0]] >= since]
+            if until is not None:
+                items = [item for item in items if doc_ts[item[0]] <= until]
+            for lists in tag_lists:
+                items = [item for item in items if any(_contains(docs, item[0]) >= 0 for docs in lists)]
+            if author_set is not None:
+                items = [item for item in items if any(_contains(docs, item[0]) >= 0 for docs in author_lists)]
+            total = len(items)
+
+            if after is not None:
+                items = [item for item in items if item[1] < after[0] - SCORE_EPSILON
+                         or (item[1] <= after[0] + SCORE_EPSILON and self._sort_key(*item) < after)]
+            page = self._top(items, limit + 1, by_score=bool(terms)) if limit > 0 else []
+            results = [{"thread_id": doc_threads[doc], "score": key[0], "note": decode_note(self._docs[doc])}
+                       for key, doc in page[:limit]]
+
+        next_cursor = encode_search_cursor(page[limit - 1][0]) if limit > 0 and len(page) > limit else None
+        return {"total": total, "results": results, "next_cursor": next_cursor}
+
+    def _sort_key(self, doc: int, score: float) -> SearchKey:
+        """Порядок выдачи: оценка, затем от новых к старым; оценка округлена, чтобы пережить курсор."""
+        return round(score, 6), self._ts[doc], self._ids[doc]
+
+    def _top(self, items: List[Tuple[int, float]], n: int, by_score: bool) -> List[Tuple[SearchKey, int]]:
+        """
+        Первые n результатов по ключу _sort_key. Сначала отбор по одному числу (оценка или время),
+        полный ключ строится только для претендентов на страницу.
+        """
+        doc_ts = self._ts
+        primary = itemgetter(1) if by_score else (lambda item: doc_ts[item[0]])
+        if len(items) > n:
+            cutoff = primary(nlargest(n, items, key=primary)[-1]) - SCORE_EPSILON
+            items = [item for item in items if primary(item) >= cutoff]
+        return sorted(((self._sort_key(doc, score), doc) for doc, score in items), reverse=True)[:n]
+
+    def _match_terms(self, terms: List[Tuple[str, bool]], filtered: Optional[Dict[int, float]] = None) -> Dict[int, float]:
+        """
+        Документы, содержащие все термы, с оценкой BM25. filtered - кандидаты по фильтрам:
+        если их меньше, чем вхождений самого редкого терма, обходятся они.
+        """
+        doc_count = max(self._live, 1)
+        avg_length = self._total_length / doc_count or 1.0
+        groups = []
+        for token, prefix in terms:
+            expansions = self._expand(token, prefix)
+            if not expansions:
+                return {}
+            groups.append([(self._postings[t], self._idf(len(self._postings[t][0]), doc_count)) for t in expansions])
+        # Обходим самый редкий терм, остальные проверяем двоичным поиском
+        groups.sort(key=lambda group: sum(len(posting[0]) for posting, _ in group))
+
+        lengths = self._lengths
+        norm = BM25_K1 * (1 - BM25_B)
+        length_factor = BM25_K1 * BM25_B / avg_length
+
+        def term_score(tf: int, doc: int, idf: float) -> float:
+            return idf * tf * (BM25_K1 + 1) / (tf + norm + length_factor * lengths[doc])
+
+        if filtered is not None and len(filtered) < sum(len(posting[0]) for posting, _ in groups[0]):
+            scores = dict(filtered)
+            rest = groups
+        else:
+            (docs, tfs), idf = groups[0][0]
+            weight = idf * (BM25_K1 + 1)
+            scores = {doc: weight * tf / (tf + norm + length_factor * lengths[doc]) for doc, tf in zip(docs, tfs)}
+            for (docs, tfs), idf in groups[0][1:]:
+                for doc, tf in zip(docs, tfs):
+                    scores[doc] = scores.get(doc, 0.0) + term_score(tf, doc, idf)
+            rest = groups[1:]
+
+        for group in rest:
+            next_scores: Dict[int, float] = {}
+            for doc, score in scores.items():
+                found = False
+                for (docs, tfs), idf in group:
+                    i = _contains(docs, doc)
+                    if i >= 0:
+                        score += term_score(tfs[i], doc, idf)
+                        found = True
+                if found:
+                    next_scores[doc] = score
+            scores = next_scores
+            if not scores:
+                break
+        return scores
+
+    @staticmethod
+    def _idf(df: int, doc_count: int) -> float:
+        return math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+    def _filter_candidates(self, tag_groups: Dict[str, List[str]], authors: Optional[set],
+                           thread_id: Optional[str]) -> Dict[int, float]:
+        """Кандидаты запроса без термов: самый узкий из фильтров, оценка 0."""
+        options = []
+        if thread_id is not None:
+            options.append(list(self._by_thread.get(thread_id, {}).values()))
+        if authors is not None:
+            options.append([doc for a in authors for doc in self._author_postings.get(a, ())])
+        for name, values in tag_groups.items():
+            options.append([doc for v in values for doc in self._tag_postings.get((name, v), ())])
+        return dict.fromkeys(min(options, key=len), 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "notes": self._live,
+                "deleted": len(self._docs) - self._live,
+                "threads": len(self._by_thread),
+                "terms": len(self._postings),
+                "postings": sum(len(docs) for docs, _ in self._postings.values()),
+            }
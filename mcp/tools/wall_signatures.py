@@ -0,0 +1,281 @@
+"""
+Проверка подписей заметок стены.
+
+Поддерживаемые форматы:
+- ncp_signature (signature_alg "ed25519-jcs"): Ed25519 над каноническим JSON заметки без ncp_signature,
+  ключ - public_key_b64 подписи или ключ key_id из CONTEXT_SEED.json;
+- {"author": {"public_key_b64"}, "payload", "signature"} (create_and_sign_note.py): Ed25519 над каноническим JSON payload;
+- события Nostr {"id", "pubkey", "sig", ...}: id = sha256 сериализации NIP-01, подпись BIP-340 Schnorr над id.
+
+Успешные проверки запоминаются в кэше (для Nostr ключ - id события), повторно заметка не проверяется.
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    from nacl.exceptions import BadSignatureError
+    from nacl.signing import VerifyKey
+except ImportError:  # Ed25519 недоступен
+    VerifyKey = None
+    BadSignatureError = Exception
+
+try:
+    from coincurve import PublicKeyXOnly
+except ImportError:  # Schnorr (Nostr) недоступен; coincurve ставится вместе с pynostr
+    PublicKeyXOnly = None
+
+try:
+    import rfc8785
+except ImportError:  # JCS совпадает с каноническим видом wall_codec для строк, целых и bool
+    rfc8785 = None
+
+from mcp.tools.wall_codec import encode_note
+
+SCHEME_NCP = "ed25519-jcs"
+SCHEME_ED25519 = "ed25519"
+SCHEME_NOSTR = "nostr-schnorr"
+
+# Меньше подписей проверяем в одном процессе: запуск пула дороже самой проверки
+PARALLEL_MIN_NOTES = 256
+
+# (схема, публичный ключ, подписанное сообщение, подпись) - задание для процесса проверки
+RawCheck = Tuple[str, bytes, bytes, bytes]
+
+
+@dataclass
+class SignatureCheck:
+    """Результат проверки подписи заметки"""
+    valid: bool
+    scheme: Optional[str] = None  # None - подписи в известном формате нет
+    reason: str = ""
+    cached: bool = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"valid": self.valid, "scheme": self.scheme, "reason": self.reason, "cached": self.cached}
+
+
+def canonical_json(obj: Any) -> bytes:
+    """Канонический JSON (RFC 8785 JCS), которым подписываются заметки Ed25519."""
+    if rfc8785 is not None:
+        return rfc8785.dumps(obj)
+    return encode_note(obj)
+
+
+def nostr_event_id(event: Dict[str, Any]) -> str:
+    """id события Nostr: sha256 от [0, pubkey, created_at, kind, tags, content] (NIP-01)."""
+    serialized = json.dumps([0, event.get("pubkey"), event.get("created_at"), event.get("kind"),
+                             event.get("tags"), event.get("content")], separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def load_seed_public_keys(path: str) -> Dict[str, str]:
+    """Ключи подписантов {key_id: public_key_b64} из CONTEXT_SEED.json; нет файла - пустой словарь."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            seed = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {k["key_id"]: k["public_key_b64"] for k in seed.get("public_keys", [])
+            if isinstance(k, dict) and k.get("key_id") and k.get("public_key_b64")}
+
+
+def _decode_signature(value: Any) -> bytes:
+    """Подпись Ed25519 в hex (HexEncoder) или base64."""
+    if not isinstance(value, str):
+        raise ValueError("signature must be a string")
+    if len(value) == 128:
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            pass
+    return base64.b64decode(value, validate=True)
+
+
+def _hex_bytes(value: Any, size: int, name: str) -> bytes:
+    if not isinstance(value, str) or len(value) != size * 2:
+        raise ValueError(f"'{name}' must be {size * 2} hex characters")
+    return bytes.fromhex(value)
+
+
+def prepare_check(note: Dict[str, Any], public_keys: Optional[Dict[str, str]] = None) -> Union[SignatureCheck, Tuple[str, RawCheck]]:
+    """
+    Разбирает подпись заметки: возвращает (ключ кэша, задание проверки) или готовый
+    SignatureCheck, если подписи нет или она заведомо некорректна (формат, id).
+    """
+    try:
+        if isinstance(note.get("ncp_signature"), dict):
+            ncp = note["ncp_signature"]
+            if ncp.get("signature_alg", SCHEME_NCP) != SCHEME_NCP:
+                return SignatureCheck(False, SCHEME_NCP, f"unsupported signature_alg '{ncp.get('signature_alg')}'")
+            key_b64 = ncp.get("public_key_b64") or (public_keys or {}).get(ncp.get("key_id"))
+            if not key_b64:
+                return SignatureCheck(False, SCHEME_NCP, f"unknown key_id '{ncp.get('key_id')}'")
+            message = canonical_json({k: v for k, v in note.items() if k != "ncp_signature"})
+            raw = (SCHEME_NCP, base64.b64decode(key_b64, validate=True), message, _decode_signature(ncp.get("signature")))
+        elif isinstance(note.get("author"), dict) and "payload" in note and "signature" in note:
+            key_b64 = note["author"].get("public_key_b64")
+            if not key_b64:
+                return SignatureCheck(False, SCHEME_ED25519, "author.public_key_b64 is missing")
+            raw = (SCHEME_ED25519, base64.b64decode(key_b64, validate=True), canonical_json(note["payload"]),
+                   _decode_signature(note["signature"]))
+        elif "sig" in note and "pubkey" in note:
+            event_id = _hex_bytes(note.get("id"), 32, "id")
+            pubkey = _hex_bytes(note.get("pubkey"), 32, "pubkey")
+            sig = _hex_bytes(note.get("sig"), 64, "sig")
+            if nostr_event_id(note) != note["id"]:
+                return SignatureCheck(False, SCHEME_NOSTR, "id does not match event content")
+            # id - хеш содержимого, поэтому проверенное событие однозначно задается id и подписью
+            return f"{SCHEME_NOSTR}:{note['id']}:{note['sig']}", (SCHEME_NOSTR, pubkey, event_id, sig)
+        else:
+            return SignatureCheck(False, None, "note is not signed")
+    except (ValueError, TypeError, binascii.Error) as e:
+        scheme = SCHEME_NCP if "ncp_signature" in note else SCHEME_NOSTR if "sig" in note else SCHEME_ED25519
+        return SignatureCheck(False, scheme, f"malformed signature: {e}")
+
+    scheme, public_key, message, signature = raw
+    digest = hashlib.sha256(public_key + signature + message).hexdigest()
+    return f"{scheme}:{digest}", raw
+
+
+def verify_raw(check: RawCheck) -> Optional[str]:
+    """Проверяет подпись; None - подпись верна, иначе причина отказа."""
+    scheme, public_key, message, signature = check
+    if scheme == SCHEME_NOSTR:
+        if PublicKeyXOnly is None:
+            return "coincurve is not installed"
+        try:
+            return None if PublicKeyXOnly(public_key).verify(signature, message) else "bad signature"
+        except ValueError as e:
+            return f"malformed public key: {e}"
+    if VerifyKey is None:
+        return "PyNaCl is not installed"
+    try:
+        VerifyKey(public_key).verify(message, signature)
+        return None
+    except BadSignatureError:
+        return "bad signature"
+    except (ValueError, TypeError) as e:
+        return f"malformed public key: {e}"
+
+
+def _verify_batch(checks: List[RawCheck]) -> List[Optional[str]]:
+    return [verify_raw(check) for check in checks]
+
+
+class VerifiedSignatureCache:
+    """
+    Кэш успешно проверенных подписей (LRU по числу ключей). С path ключи дописываются в файл
+    и читаются при создании: повторный прогон по всей стене не проверяет уже проверенное.
+    Неверные подписи не кэшируются.
+    """
+
+    def __init__(self, max_size: int = 100_000, path: Optional[str] = None):
+        self.max_size = max_size
+        self.path = path
+        self._keys: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            self._remember(line.strip())
+            except OSError:
+                pass
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def _remember(self, key: str) -> None:
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+    def add_many(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                self._remember(key)
+        if self.path and keys:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(key + "\n" for key in keys))
+            except OSError as e:
+                print(f"VerifiedSignatureCache: Не удалось дописать кэш {self.path}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self._keys), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+class SignatureVerifier:
+    """
+    Проверка подписей заметок с кэшем. verify_many раздает непроверенные подписи пулу процессов.
+    """
+
+    def __init__(self, public_keys: Optional[Dict[str, str]] = None, cache: Optional[VerifiedSignatureCache] = None):
+        self.public_keys = public_keys or {}
+        self.cache = cache if cache is not None else VerifiedSignatureCache()
+
+    def verify(self, note: Dict[str, Any]) -> SignatureCheck:
+        return self.verify_many([note])[0]
+
+    def verify_many(self, notes: List[Dict[str, Any]], jobs: int = 1) -> List[SignatureCheck]:
+        """Проверяет подписи заметок и возвращает результаты в том же порядке."""
+        results: List[Optional[SignatureCheck]] = [None] * len(notes)
+        pending: List[Tuple[int, str, RawCheck]] = []
+        for i, note in enumerate(notes):
+            prepared = prepare_check(note, self.public_keys) if isinstance(note, dict) else \
+                SignatureCheck(False, None, "note must be a JSON object")
+            if isinstance(prepared, SignatureCheck):
+                results[i] = prepared
+                continue
+            key, raw = prepared
+            if key in self.cache:
+                results[i] = SignatureCheck(True, raw[0], cached=True)
+            else:
+                pending.append((i, key, raw))
+
+        checks = [raw for _, _, raw in pending]
+        if jobs > 1 and len(checks) >= PARALLEL_MIN_NOTES:
+            chunk_size = max(1, min(1000, len(checks) // (jobs * 4)))
+            chunks = [checks[i:i + chunk_size] for i in range(0, len(checks), chunk_size)]
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                reasons = [reason for chunk in pool.map(_verify_batch, chunks) for reason in chunk]
+        else:
+            reasons = _verify_batch(checks)
+
+        verified = []
+        for (i, key, raw), reason in zip(pending, reasons):
+            results[i] = SignatureCheck(reason is None, raw[0], reason or "")
+            if reason is None:
+                verified.append(key)
+        self.cache.add_many(verified)
+        return results
+
+
+def default_verifier() -> SignatureVerifier:
+    """Проверяющий с ключами из WALL_SEED_PATH (CONTEXT_SEED.json) и кэшем на WALL_SIGNATURE_CACHE_SIZE подписей."""
+    public_keys = load_seed_public_keys(os.getenv("WALL_SEED_PATH", "CONTEXT_SEED.json"))
+    cache = VerifiedSignatureCache(max_size=int(os.getenv("WALL_SIGNATURE_CACHE_SIZE", "100000")))
+    return SignatureVerifier(public_keys=public_keys, cache=cache)
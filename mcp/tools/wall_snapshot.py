@@ -0,0 +1,486 @@
+"""
+Снимки стены для быстрого запуска нового узла.
+
+Снимок - zip-архив: файлы стены (треды, .index с индексами тредов, журналами тегов/авторов
+и дедупликации) под префиксом wall/ и MANIFEST.json. Манифест содержит полное состояние стены
+(путь -> sha256 и размер), хеш этого состояния (tree_sha256) и список файлов архива с sha256
+их содержимого. Узел, восстановленный из снимка, сразу отвечает из готовых индексов, не разбирая
+заметки.
+
+Дельта-снимок N+1 содержит только файлы, изменившиеся после снимка N, и список удаленных.
+Журналы, в которые только дописывают (сегменты, refs.log, dedup.log, индексы тредов), хранятся
+хвостом, дописанным после снимка N. Восстановленный узел помнит номер и tree_sha256 своего снимка
+в .index/SNAPSHOT и принимает только дельту, построенную от него.
+
+Архив читается через mmap (SnapshotReader): манифест и нужные файлы читаются без загрузки
+архива целиком, файлы несжатого снимка (compression=ZIP_STORED) - без копирования.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import zipfile
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from mcp.tools.wall_dedup import DEDUP_LOG_NAME, KEY_SIZE
+from mcp.tools.wall_index import INDEX_DIR_NAME
+
+SNAPSHOT_FORMAT = "sdominanta-wall-snapshot"
+SNAPSHOT_VERSION = 1
+MANIFEST_NAME = "MANIFEST.json"
+MEMBER_PREFIX = "wall/"
+MARKER_NAME = "SNAPSHOT"  # .index/SNAPSHOT: снимок, из которого восстановлен узел
+NODE_LOCAL_NAMES = (MARKER_NAME, "archiver.state")  # Состояние узла в .index, не попадающее в снимок
+LINE_JOURNAL_SUFFIXES = (".log", ".idx", ".jsonl")  # Журналы строк: в снимок попадают целые строки
+CHUNK_SIZE = 1 << 20
+
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+
+class SnapshotError(ValueError):
+    """Снимок поврежден, не того формата или не подходит к состоянию стены"""
+
+
+def snapshot_filename(number: int, delta: bool) -> str:
+    return f"snapshot-{number:08d}-{'delta' if delta else 'full'}.zip"
+
+
+def _marker_path(base_wall_path: str) -> str:
+    return os.path.join(base_wall_path, INDEX_DIR_NAME, MARKER_NAME)
+
+
+def _relpath(path: str, base: str) -> str:
+    return os.path.relpath(path, base).replace(os.sep, "/")
+
+
+def _is_wall_file(relpath: str) -> bool:
+    return not relpath.endswith(".tmp") and relpath not in {f"{INDEX_DIR_NAME}/{name}" for name in NODE_LOCAL_NAMES}
+
+
+def _hash_file(path: str, length: Optional[int] = None) -> str:
+    """sha256 первых length байт файла (всего файла, если length не задан)."""
+    digest = hashlib.sha256()
+    remaining = length
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def _stable_length(path: str, relpath: str, size: int) -> int:
+    """
+    Сколько байт журнала брать в снимок: запись, которую дописывают прямо сейчас, отбрасывается,
+    как ее отбросило бы само хранилище после сбоя.
+    """
+    name = relpath.rsplit("/", 1)[-1]
+    if relpath == f"{INDEX_DIR_NAME}/{DEDUP_LOG_NAME}":
+        return size - size % KEY_SIZE
+    if not name.endswith(LINE_JOURNAL_SUFFIXES) or size == 0:
+        return size
+    with open(path, 'rb') as f:
+        position = size
+        while position > 0:
+            start = max(0, position - 65536)
+            f.seek(start)
+            chunk = f.read(position - start)
+            newline = chunk.rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+    return 0
+
+
+def scan_wall(base_wall_path: str, previous: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Состояние стены: относительный путь -> {"sha256", "size", "mtime_ns"}.
+    Хеш файла, у которого размер и mtime совпали с previous, не пересчитывается.
+    """
+    previous = previous or {}
+    files: Dict[str, Dict[str, Any]] = {}
+    for root, dirs, names in os.walk(base_wall_path):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            relpath = _relpath(path, base_wall_path)
+            if not _is_wall_file(relpath):
+                continue
+            st = os.stat(path)
+            size = _stable_length(path, relpath, st.st_size)
+            old = previous.get(relpath)
+            if old is not None and old["size"] == size and old.get("mtime_ns") == st.st_mtime_ns:
+                files[relpath] = dict(old)
+            else:
+                files[relpath] = {"sha256": _hash_file(path, size), "size": size, "mtime_ns": st.st_mtime_ns}
+    return files
+
+
+def _is_node_local(relpath: str) -> bool:
+    """.index/<thread>.meta хранит mtime директории треда - у каждого узла свой (см. _rebase_thread_indexes)."""
+    return relpath.startswith(INDEX_DIR_NAME + "/") and relpath.endswith(".meta")
+
+
+def tree_sha256(files: Dict[str, Dict[str, Any]]) -> str:
+    """Хеш состояния стены: одинаков у узлов с одинаковыми заметками и индексами."""
+    digest = hashlib.sha256()
+    for relpath in sorted(p for p in files if not _is_node_local(p)):
+        digest.update(f"{relpath}\0{files[relpath]['sha256']}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _copy_into(zf: zipfile.ZipFile, name: str, path: str, start: int, length: int,
+               digest: Optional[Any] = None) -> str:
+    """Пишет байты файла [start, start + length) в архив; возвращает sha256 записанного."""
+    member_digest = hashlib.sha256()
+    with open(path, 'rb') as src, zf.open(name, "w", force_zip64=True) as dst:
+        src.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = src.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise SnapshotError(f"{path}: файл укоротился во время снимка")
+            dst.write(chunk)
+            member_digest.update(chunk)
+            if digest is not None:
+                digest.update(chunk)
+            remaining -= len(chunk)
+    return member_digest.hexdigest()
+
+
+def build_snapshot(base_wall_path: str, out_path: str, number: int, base_manifest: Optional[Dict[str, Any]] = None,
+                   compression: int = zipfile.ZIP_DEFLATED, compresslevel: Optional[int] = 6) -> Dict[str, Any]:
+    """
+    Пишет снимок стены номер number в out_path и возвращает его манифест.
+    С base_manifest (манифест снимка number - 1) снимок - дельта от него.
+    """
+    base_files = base_manifest["files"] if base_manifest else {}
+    files = scan_wall(base_wall_path, previous=base_files)
+    entries: Dict[str, Dict[str, Any]] = {}
+    tmp_path = out_path + ".tmp"
+    with zipfile.ZipFile(tmp_path, "w", compression=compression, compresslevel=compresslevel,
+                         allowZip64=True) as zf:
+        for relpath, info in files.items():
+            old = base_files.get(relpath)
+            if old is not None and old["sha256"] == info["sha256"] and old["size"] == info["size"]:
+                continue
+            path = os.path.join(base_wall_path, relpath)
+            name = MEMBER_PREFIX + relpath
+            if old is not None and info["size"] > old["size"] and _hash_file(path, old["size"]) == old["sha256"]:
+                # Файл только дописан: в архив идет хвост, sha256 файла досчитывается по нему
+                digest = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    remaining = old["size"]
+                    while remaining > 0:
+                        chunk = f.read(min(CHUNK_SIZE, remaining))
+                        digest.update(chunk)
+                        remaining -= len(chunk)
+                member_sha = _copy_into(zf, name, path, old["size"], info["size"] - old["size"], digest)
+                entries[relpath] = {"mode": "append", "from": old["size"], "base_sha256": old["sha256"],
+                                    "sha256": member_sha}
+                info["sha256"] = digest.hexdigest()
+            else:
+                member_sha = _copy_into(zf, name, path, 0, info["size"])
+                entries[relpath] = {"mode": "full", "sha256": member_sha}
+                info["sha256"] = member_sha  # Файл мог измениться между обходом и копированием
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "snapshot": number,
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "base": ({"snapshot": base_manifest["snapshot"], "tree_sha256": base_manifest["tree_sha256"]}
+                     if base_manifest else None),
+            "threads": sorted({p.split("/", 1)[0] for p in files if "/" in p and not p.startswith(".")}),
+            "tree_sha256": tree_sha256(files),
+            "files": files,
+            "entries": entries,
+            "deleted": sorted(set(base_files) - set(files)),
+        }
+        zf.writestr(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, sort_keys=True))
+    os.replace(tmp_path, out_path)
+    return manifest
+
+
+class SnapshotReader:
+    """
+    Снимок, отображенный в память. Манифест проверяется при открытии; view() отдает содержимое
+    несжатого файла архива без копирования, open() - поток (в том числе сжатого).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.zip = zipfile.ZipFile(self._file)
+            manifest = json.loads(self.zip.read(MANIFEST_NAME))
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            if getattr(self, "_map", None) is not None:
+                self._map.close()
+            self._file.close()
+            raise SnapshotError(f"{path}: не снимок стены: {e}")
+        if manifest.get("format") != SNAPSHOT_FORMAT or manifest.get("version") != SNAPSHOT_VERSION:
+            self.close()
+            raise SnapshotError(f"{path}: неподдерживаемый формат {manifest.get('format')} v{manifest.get('version')}")
+        self.manifest: Dict[str, Any] = manifest
+
+    @property
+    def is_delta(self) -> bool:
+        return self.manifest["base"] is not None
+
+    def open(self, relpath: str):
+        return self.zip.open(MEMBER_PREFIX + relpath)
+
+    def view(self, relpath: str) -> Optional[memoryview]:
+        """Содержимое несжатого файла архива прямо из отображения; None, если файл сжат."""
+        info = self.zip.getinfo(MEMBER_PREFIX + relpath)
+        if info.compress_type != zipfile.ZIP_STORED:
+            return None
+        header = _LOCAL_HEADER.unpack_from(self._map, info.header_offset)
+        if header[0] != b"PK\x03\x04":
+            raise SnapshotError(f"{self.path}: поврежден заголовок {relpath}")
+        start = info.header_offset + _LOCAL_HEADER.size + header[-2] + header[-1]
+        return memoryview(self._map)[start:start + info.file_size]
+
+    def chunks(self, relpath: str) -> Iterator[Any]:
+        """Содержимое файла архива кусками (без копирования, если он не сжат)."""
+        view = self.view(relpath)
+        if view is not None:
+            for start in range(0, len(view), CHUNK_SIZE):
+                yield view[start:start + CHUNK_SIZE]
+            view.release()
+            return
+        with self.open(relpath) as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def verify(self) -> List[str]:
+        """Проверяет sha256 всех файлов архива; возвращает список ошибок."""
+        errors = []
+        for relpath, entry in self.manifest["entries"].items():
+            try:
+                digest = hashlib.sha256()
+                for chunk in self.chunks(relpath):
+                    digest.update(chunk)
+            except (KeyError, zipfile.BadZipFile, OSError, EOFError) as e:  # CRC, обрыв архива
+                errors.append(f"{relpath}: {e}")
+                continue
+            if digest.hexdigest() != entry["sha256"]:
+                errors.append(f"{relpath}: sha256 не совпадает с манифестом")
+        return errors
+
+    def close(self) -> None:
+        self.zip.close()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> "SnapshotReader":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def read_marker(base_wall_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_marker_path(base_wall_path), 'r', encoding='utf-8') as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_marker(base_wall_path: str, manifest: Dict[str, Any]) -> None:
+    path = _marker_path(base_wall_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        f.write(json.dumps({"snapshot": manifest["snapshot"], "tree_sha256": manifest["tree_sha256"]}))
+    os.replace(path + ".tmp", path)
+
+
+def _extract(reader: SnapshotReader, relpath: str, target: str, append: bool = False, fsync: bool = True) -> str:
+    """Пишет файл архива в target (или дописывает в конец); возвращает sha256 записанного."""
+    digest = hashlib.sha256()
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'ab' if append else 'wb') as f:
+        for chunk in reader.chunks(relpath):
+            f.write(chunk)
+            digest.update(chunk)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    return digest.hexdigest()
+
+
+def _rebase_thread_indexes(base_wall_path: str, threads: List[str]) -> None:
+    """
+    Индекс треда (.index/<thread>.meta) помнит mtime директории треда. После восстановления
+    mtime другой, а содержимое то же, что у узла-источника: переносим индекс на новый mtime,
+    иначе первый же запрос пересобрал бы его, разбирая все заметки.
+    """
+    index_dir = os.path.join(base_wall_path, INDEX_DIR_NAME)
+    for thread_id in threads:
+        meta_path = os.path.join(index_dir, f"{thread_id}.meta")
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.loads(f.read())
+            meta["dir_mtime_ns"] = os.stat(os.path.join(base_wall_path, thread_id)).st_mtime_ns
+        except (OSError, ValueError):
+            continue
+        with open(meta_path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(json.dumps(meta))
+        os.replace(meta_path + ".tmp", meta_path)
+
+
+def restore_snapshot(path: str, base_wall_path: str, verify: bool = True) -> Dict[str, Any]:
+    """
+    Восстанавливает стену из полного снимка: файлы распаковываются рядом и подменяют
+    base_wall_path одним переименованием. При ошибке текущая стена не трогается.
+    """
+    with SnapshotReader(path) as reader:
+        manifest = reader.manifest
+        if reader.is_delta:
+            raise SnapshotError(f"{path}: дельта-снимок, нужен полный")
+        base = os.path.normpath(base_wall_path)
+        staging = base + ".restore"
+        shutil.rmtree(staging, ignore_errors=True)
+        try:
+            for relpath, entry in manifest["entries"].items():
+                # Staging не виден до переименования: вместо fsync каждого файла - один sync перед подменой
+                written = _extract(reader, relpath, os.path.join(staging, relpath), fsync=False)
+                if verify and written != entry["sha256"]:
+                    raise SnapshotError(f"{path}: {relpath}: sha256 не совпадает с манифестом")
+            os.makedirs(staging, exist_ok=True)
+            _rebase_thread_indexes(staging, manifest["threads"])
+            _write_marker(staging, manifest)
+            if hasattr(os, "sync"):
+                os.sync()
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+    previous = base + ".previous"
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(base):
+        os.replace(base, previous)
+    os.replace(staging, base)
+    shutil.rmtree(previous, ignore_errors=True)
+    return manifest
+
+
+def apply_delta(path: str, base_wall_path: str, verify: bool = True) -> Dict[str, Any]:
+    """
+    Переводит стену со снимка N (по .index/SNAPSHOT) на дельту N+1. Каждый файл заменяется
+    атомарно или дописывается; повторное применение прерванной дельты безопасно.
+    """
+    marker = read_marker(base_wall_path)
+    with SnapshotReader(path) as reader:
+        manifest = reader.manifest
+        base = manifest["base"]
+        if base is None:
+            raise SnapshotError(f"{path}: полный снимок, а не дельта")
+        if marker is None or marker.get("snapshot") != base["snapshot"] or marker.get("tree_sha256") != base["tree_sha256"]:
+            raise SnapshotError(f"{path}: дельта от снимка {base['snapshot']}, а стена "
+                                f"{'не из снимка' if marker is None else 'из снимка %s' % marker.get('snapshot')}")
+
+        touched = set()
+        for relpath, entry in manifest["entries"].items():
+            target = os.path.join(base_wall_path, relpath)
+            expected = manifest["files"][relpath]
+            touched.add(relpath.split("/", 1)[0])
+            if entry["mode"] == "append":
+                size = os.path.getsize(target) if os.path.exists(target) else -1
+                if size == expected["size"] and _hash_file(target) == expected["sha256"]:
+                    continue  # Уже дописан при прерванном применении
+                if size != entry["from"] or (verify and _hash_file(target) != entry["base_sha256"]):
+                    raise SnapshotError(f"{path}: {relpath} отличается от снимка {base['snapshot']}")
+                written = _extract(reader, relpath, target, append=True)
+            else:
+                written = _extract(reader, relpath, target + ".tmp")
+                os.replace(target + ".tmp", target)
+            if verify and written != entry["sha256"]:
+                raise SnapshotError(f"{path}: {relpath}: sha256 не совпадает с манифестом")
+
+        for relpath in manifest["deleted"]:
+            touched.add(relpath.split("/", 1)[0])
+            try:
+                os.remove(os.path.join(base_wall_path, relpath))
+            except FileNotFoundError:
+                pass
+
+    _rebase_thread_indexes(base_wall_path, sorted(touched & set(manifest["threads"])))
+    _write_marker(base_wall_path, manifest)
+    return manifest
+
+
+def list_snapshots(directory: str) -> List[Tuple[int, bool, str]]:
+    """Снимки каталога: (номер, дельта ли, путь), по возрастанию номера."""
+    found = []
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        parts = name[:-len(".zip")].split("-") if name.endswith(".zip") else []
+        if len(parts) == 3 and parts[0] == "snapshot" and parts[1].isdigit() and parts[2] in ("full", "delta"):
+            found.append((int(parts[1]), parts[2] == "delta", os.path.join(directory, name)))
+    return sorted(found)
+
+
+def create_next_snapshot(base_wall_path: str, directory: str, delta: bool = True, **kwargs: Any) -> Tuple[str, Dict[str, Any]]:
+    """
+    Пишет в directory следующий по номеру снимок: дельту от последнего (delta=True и он есть)
+    или полный. Возвращает (путь, манифест).
+    """
+    os.makedirs(directory, exist_ok=True)
+    snapshots = list_snapshots(directory)
+    base_manifest = None
+    if delta and snapshots:
+        with SnapshotReader(snapshots[-1][2]) as reader:
+            base_manifest = reader.manifest
+    number = snapshots[-1][0] + 1 if snapshots else 1
+    path = os.path.join(directory, snapshot_filename(number, base_manifest is not None))
+    return path, build_snapshot(base_wall_path, path, number, base_manifest=base_manifest, **kwargs)
+
+
+def bootstrap_wall(base_wall_path: str, directory: str) -> Dict[str, Any]:
+    """
+    Доводит стену узла до последнего снимка каталога. Пустая стена (без тредов) восстанавливается
+    из последнего полного снимка и следующих за ним дельт; стена из снимка получает дельты после
+    своего номера. Стену не из снимка (например, git clone) не трогает.
+    """
+    snapshots = list_snapshots(directory)
+    marker = read_marker(base_wall_path)
+    applied: List[int] = []
+    if marker is None:
+        has_threads = os.path.isdir(base_wall_path) and any(
+            not name.startswith(".") and os.path.isdir(os.path.join(base_wall_path, name))
+            for name in os.listdir(base_wall_path))
+        fulls = [s for s in snapshots if not s[1]]
+        if has_threads or not fulls:
+            return {"status": "skipped", "snapshot": None, "applied": applied}
+        number, _, path = fulls[-1]
+        restore_snapshot(path, base_wall_path)
+        applied.append(number)
+        current = number
+    else:
+        current = marker["snapshot"]
+
+    for number, is_delta, path in snapshots:
+        if number <= current:
+            continue
+        if not is_delta or number != current + 1:
+            print(f"wall_snapshot: Цепочка дельт прервана на снимке {number}, стена остается на снимке {current}.")
+            break
+        apply_delta(path, base_wall_path)
+        applied.append(number)
+        current = number
+
+    status = "up_to_date" if not applied else ("restored" if marker is None else "updated")
+    return {"status": status, "snapshot": current, "applied": applied}
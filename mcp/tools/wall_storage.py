@@ -0,0 +1,777 @@
+import os
+import json
+import heapq
+import mmap
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from mcp.tools.wall_codec import decode_note, encode_note
+from mcp.tools.wall_index import (
+    ThreadIndex, created_at_epoch, entry_page_key, entry_ts, note_created_at, note_sort_key
+)
+from mcp.tools.wall_trace import current_span
+
+# Ключ keyset-пагинации (секунды эпохи created_at, id), см. wall_index.note_page_key
+PageKey = Tuple[float, str]
+
+# Файлы заметок страницы читаются параллельно (WALL_READ_WORKERS потоков) начиная с READ_PARALLEL_MIN
+# файлов: чтение отпускает GIL, а на меньших страницах пул дороже выигрыша. JSON разбирается в вызывающем потоке.
+READ_WORKERS = int(os.getenv("WALL_READ_WORKERS", "4"))
+READ_PARALLEL_MIN = 64
+
+
+def parse_time_bound(value: Optional[str], name: str = "since") -> Optional[float]:
+    """
+    Разбирает границу since/until (ISO 8601 или Unix-время) в секунды эпохи.
+    Некорректное значение отключает фильтр.
+    """
+    if value is None or value == "":
+        return None
+    epoch = created_at_epoch(value)
+    if epoch is None:
+        print(f"NoteStorage: Ошибка парсинга даты {name}: {value!r}")
+    return epoch
+
+
+def read_files(paths: List[str]) -> List[Any]:
+    """Читает файлы подряд; вместо содержимого нечитаемого файла - исключение."""
+    contents: List[Any] = []
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                contents.append(f.read())
+        except OSError as e:
+            contents.append(e)
+    return contents
+
+
+def iter_records_reversed(buf: Any, start: int, end: int) -> Iterator[Tuple[int, int]]:
+    """
+    Границы (начало, конец без \\n) строк-записей buf[start:end] от последней к первой.
+    Поиск переводов строки идет по буферу (bytes или mmap) без копирования и разбора JSON.
+    """
+    stop = end - 1
+    while stop >= start:
+        begin = buf.rfind(b"\n", start, stop) + 1 or start
+        yield begin, stop
+        stop = begin - 1
+
+
+def in_time_range(ts: float, since_ts: Optional[float], until_ts: Optional[float]) -> bool:
+    return (since_ts is None or ts >= since_ts) and (until_ts is None or ts <= until_ts)
+
+
+class NoteStorage:
+    """
+    Базовый интерфейс хранилища заметок стены.
+    """
+
+    name = "base"
+
+    def __init__(self, base_wall_path: str):
+        self.base_wall_path = base_wall_path
+
+    def has_thread(self, thread_id: str) -> bool:
+        return os.path.isdir(os.path.join(self.base_wall_path, thread_id))
+
+    def threads(self) -> List[str]:
+        """
+        Треды стены (служебные директории вроде .index пропускаются).
+        """
+        if not os.path.isdir(self.base_wall_path):
+            return []
+        return sorted(t for t in os.listdir(self.base_wall_path) if not t.startswith(".") and self.has_thread(t))
+
+    def get(self, thread_id: str, note_id: str, ts: float) -> Optional[Dict[str, Any]]:
+        """
+        Заметка треда по id и ключу created_at (ts из индекса): двоичный поиск по времени, без обхода треда.
+        """
+        for note in self.query(thread_id, since=repr(ts), until=repr(ts), limit=0):
+            if str(note.get("id")) == note_id:
+                return note
+        return None
+
+    def append(self, thread_id: str, note_id: str, note: Dict[str, Any]) -> str:
+        """
+        Сохраняет заметку и возвращает путь измененного файла относительно base_wall_path.
+        """
+        raise NotImplementedError
+
+    def query(self, thread_id: str, since: Optional[str] = None, limit: int = 50,
+              before: Optional[PageKey] = None, until: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Возвращает последние limit заметок треда (по created_at, id), созданные в [since, until].
+        before - ключ курсора: только заметки строго раньше него (следующая страница истории).
+        """
+        raise NotImplementedError
+
+    def sync(self) -> None:
+        """
+        Гарантирует, что все записанные заметки сброшены на диск.
+        """
+
+    def reload(self, thread_id: str) -> None:
+        """
+        Сбрасывает состояние треда в памяти после изменения его файлов в обход хранилища (git pull).
+        """
+
+    def set_writer(self, is_writer: bool) -> None:
+        """
+        Отмечает, пишет ли этот процесс стену. Служебные файлы хранилища (индексы) пишет только писатель.
+        """
+
+    def close(self) -> None:
+        self.sync()
+
+
+class FileNoteStorage(NoteStorage):
+    """
+    Хранилище "один JSON-файл на заметку" (исходный формат wall/threads/<thread>/<id>.json).
+    """
+
+    name = "files"
+
+    def __init__(self, base_wall_path: str):
+        super().__init__(base_wall_path)
+        self._thread_indexes: Dict[str, ThreadIndex] = {}
+        self.persist_index = True
+        # Индексы тредов меняются и читаются из потоков пула ввода-вывода
+        self._lock = threading.RLock()
+        self._reader: Optional[ThreadPoolExecutor] = None
+
+    def _get_thread_index(self, thread_id: str) -> ThreadIndex:
+        """
+        Возвращает (и кэширует) индекс заметок треда.
+        """
+        index = self._thread_indexes.get(thread_id)
+        if index is None:
+            index = ThreadIndex(self.base_wall_path, thread_id, persist=self.persist_index)
+            self._thread_indexes[thread_id] = index
+        return index
+
+    def set_writer(self, is_writer: bool) -> None:
+        with self._lock:
+            self.persist_index = is_writer
+            for index in self._thread_indexes.values():
+                index.persist = is_writer
+
+    def reload(self, thread_id: str) -> None:
+        with self._lock:
+            self._thread_indexes.pop(thread_id, None)
+
+    def append(self, thread_id: str, note_id: str, note: Dict[str, Any]) -> str:
+        thread_dir = os.path.join(self.base_wall_path, thread_id)
+        os.makedirs(thread_dir, exist_ok=True)
+        filename = f"{note_id}.json"
+        data = encode_note(note)
+        with self._lock:
+            thread_index = self._get_thread_index(thread_id)
+            thread_index.load()
+            with open(os.path.join(thread_dir, filename), 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            thread_index.add(note, filename)
+        return os.path.join(thread_id, filename)
+
+    def query(self, thread_id: str, since: Optional[str] = None, limit: int = 50,
+              before: Optional[PageKey] = None, until: Optional[str] = None) -> List[Dict[str, Any]]:
+        thread_path = os.path.join(self.base_wall_path, thread_id)
+        since_ts, until_ts = parse_time_bound(since), parse_time_bound(until, "until")
+        span = current_span()
+        with self._lock:
+            entries = self._get_thread_index(thread_id).load()
+            span.set(indexed=len(entries))
+
+            # since/until, курсор и limit - двоичный поиск по ts в индексе, до чтения файлов
+            start = bisect_left(entries, since_ts, key=entry_ts) if since_ts is not None else 0
+            end = bisect_right(entries, until_ts, key=entry_ts) if until_ts is not None else len(entries)
+            if before is not None:
+                end = min(end, bisect_left(entries, before, key=entry_page_key))
+            if limit > 0:
+                start = max(start, end - limit)
+            entries = entries[start:end]
+
+        paths = [os.path.join(thread_path, entry["file"]) for entry in entries]
+        notes = []
+        timed = span.active
+        for filepath, content in zip(paths, self._read_files(paths)):
+            if isinstance(content, OSError):
+                print(f"NoteStorage: Ошибка чтения файла {filepath}: {content}")
+                continue
+            try:
+                if timed:
+                    started = time.perf_counter()
+                    note = decode_note(content)
+                    span.add_read(len(content), time.perf_counter() - started)
+                    if span.notes:
+                        span.note("%s: %d байт, id=%s", filepath, len(content), note.get("id", "N/A"))
+                else:
+                    note = decode_note(content)
+                notes.append(note)
+            except json.JSONDecodeError as e:
+                print(f"NoteStorage: Ошибка парсинга JSON в {filepath}: {e}")
+            except Exception as e:
+                print(f"NoteStorage: Ошибка чтения файла {filepath}: {e}")
+        return notes
+
+    def _read_files(self, paths: List[str]) -> List[Any]:
+        """
+        Содержимое файлов (bytes) или исключение чтения, в порядке paths. Длинный список делится
+        на READ_WORKERS кусков, каждый поток читает свой кусок подряд.
+        """
+        if READ_WORKERS <= 1 or len(paths) < READ_PARALLEL_MIN:
+            return read_files(paths)
+        with self._lock:
+            if self._reader is None:
+                self._reader = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="wall-read")
+        size = -(-len(paths) // READ_WORKERS)
+        chunks = self._reader.map(read_files, [paths[i:i + size] for i in range(0, len(paths), size)])
+        return [content for chunk in chunks for content in chunk]
+
+    def close(self) -> None:
+        super().close()
+        if self._reader is not None:
+            self._reader.shutdown(wait=True)
+            self._reader = None
+
+
+# --- Сегментированный append-only журнал ---
+
+SEGMENTS_DIR_NAME = "segments"
+MANIFEST_NAME = "MANIFEST"
+
+
+@dataclass
+class SegmentBlock:
+    """Блок разреженного индекса: SPARSE_EVERY подряд идущих записей сегмента"""
+    n: int  # Номер первой записи блока в сегменте
+    offset: int
+    length: int = 0
+    count: int = 0
+    min_key: Optional[float] = None  # Секунды эпохи created_at
+    max_key: Optional[float] = None
+    ordered: bool = True  # Записи блока идут по неубыванию created_at: хвост читается с конца до нужного числа
+
+    def extend(self, key: float, size: int):
+        self.count += 1
+        self.length += size
+        if self.max_key is not None and key < self.max_key:
+            self.ordered = False
+        self.min_key = key if self.min_key is None or key < self.min_key else self.min_key
+        self.max_key = key if self.max_key is None or key > self.max_key else self.max_key
+
+    def to_json(self) -> str:
+        return json.dumps({"n": self.n, "offset": self.offset, "length": self.length, "count": self.count,
+                           "min": self.min_key, "max": self.max_key, "ordered": self.ordered}, ensure_ascii=False)
+
+
+@dataclass(eq=False)
+class Segment:
+    """Файл сегмента журнала треда и его разреженный индекс"""
+    number: int
+    path: str
+    size: int = 0
+    count: int = 0
+    compacted: bool = False
+    blocks: List[SegmentBlock] = field(default_factory=list)
+    # Отображение файла в память для чтения; у активного сегмента пересоздается, когда файл вырос
+    mapped: Optional[mmap.mmap] = field(default=None, repr=False)
+
+    @property
+    def sidx_path(self) -> str:
+        return self.path[:-len('.log')] + '.sidx'
+
+
+class SegmentedThread:
+    """
+    Журнал одного треда: упорядоченный набор сегментов, последний из которых активен.
+    """
+
+    def __init__(self, storage: "SegmentedNoteStorage", thread_id: str):
+        self.storage = storage
+        self.thread_id = thread_id
+        self.dir = os.path.join(storage.base_wall_path, thread_id, SEGMENTS_DIR_NAME)
+        self.lock = threading.RLock()
+        self.segments: List[Segment] = []
+        self.next_number = 1
+        self._active_file = None
+        self._unsynced = 0
+        self._last_fsync = time.monotonic()
+        self._compacting = False
+        self._load()
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.dir, f"{number:08d}.log")
+
+    # --- Загрузка и восстановление ---
+
+    def _load(self):
+        os.makedirs(self.dir, exist_ok=True)
+        manifest_path = os.path.join(self.dir, MANIFEST_NAME)
+        compacted = set()
+        numbers = None
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.loads(f.read())
+            numbers = manifest["segments"]
+            compacted = set(manifest.get("compacted", []))
+            self.next_number = manifest.get("next", 1)
+        except (OSError, ValueError, KeyError):
+            pass
+
+        on_disk = sorted(int(name[:-len('.log')]) for name in os.listdir(self.dir)
+                         if name.endswith('.log') and name[:-len('.log')].isdigit())
+        if numbers is None:
+            numbers = on_disk
+        else:
+            # Сегменты вне манифеста - остатки прерванной компакции
+            for number in set(on_disk) - set(numbers):
+                self._remove_segment_files(Segment(number=number, path=self._segment_path(number)))
+
+        for position, number in enumerate(numbers):
+            segment = Segment(number=number, path=self._segment_path(number), compacted=number in compacted)
+            if os.path.exists(segment.path):
+                self._load_segment(segment, is_last=position == len(numbers) - 1)
+                self.segments.append(segment)
+            self.next_number = max(self.next_number, number + 1)
+
+        if not self.segments:
+            self._open_new_segment()
+        self._write_manifest()
+
+    def _load_segment(self, segment: Segment, is_last: bool):
+        """Читает разреженный индекс сегмента и досканирует хвост, не попавший в него"""
+        stale_sidx = False
+        try:
+            with open(segment.sidx_path, 'r', encoding='utf-8') as f:
+                for line in f.read().splitlines():
+                    data = json.loads(line)
+                    if isinstance(data["min"], str) or isinstance(data["max"], str):
+                        raise ValueError("строковые ключи created_at (индекс до перехода на секунды эпохи)")
+                    # Индекс без флага ordered (записан до его появления) читается блоками целиком
+                    segment.blocks.append(SegmentBlock(n=data["n"], offset=data["offset"], length=data["length"],
+                                                       count=data["count"], min_key=data["min"], max_key=data["max"],
+                                                       ordered=data.get("ordered", False)))
+        except (OSError, ValueError, KeyError):
+            segment.blocks = []
+            stale_sidx = True
+
+        file_size = os.path.getsize(segment.path)
+        persisted_blocks = len(segment.blocks)
+        # Отбрасываем блоки, выходящие за пределы файла (индекс записан раньше данных)
+        while segment.blocks and segment.blocks[-1].offset + segment.blocks[-1].length > file_size:
+            segment.blocks.pop()
+        # В активный сегмент будут дописывать, поэтому его неполный блок пересобирается из данных
+        if is_last and segment.blocks and segment.blocks[-1].count < self.storage.sparse_every:
+            segment.blocks.pop()
+
+        indexed_blocks = len(segment.blocks)
+        offset = segment.blocks[-1].offset + segment.blocks[-1].length if segment.blocks else 0
+        count = segment.blocks[-1].n + segment.blocks[-1].count if segment.blocks else 0
+
+        with open(segment.path, 'rb') as f:
+            f.seek(offset)
+            tail = f.read()
+
+        for line in tail.split(b"\n")[:-1]:
+            try:
+                note = decode_note(line)
+            except ValueError:
+                break
+            self._index_record(segment, count, offset, note_sort_key(note_created_at(note)), len(line) + 1)
+            offset += len(line) + 1
+            count += 1
+
+        if offset < file_size:
+            # Оборванная запись после сбоя: обрезаем сегмент до последней целой строки
+            print(f"SegmentedNoteStorage: Обрезаю поврежденный хвост {segment.path} ({file_size - offset} байт).")
+            with open(segment.path, 'r+b') as f:
+                f.truncate(offset)
+
+        segment.size = offset
+        segment.count = count
+        if indexed_blocks != persisted_blocks or stale_sidx:
+            self._rewrite_sidx(segment, include_partial=not is_last)
+        else:
+            self._persist_blocks(segment, segment.blocks[indexed_blocks:])
+
+    # --- Запись ---
+
+    def _index_record(self, segment: Segment, n: int, offset: int, key: float, size: int) -> Optional[SegmentBlock]:
+        """Добавляет запись в разреженный индекс, возвращает блок, если он заполнился"""
+        if not segment.blocks or segment.blocks[-1].count >= self.storage.sparse_every:
+            segment.blocks.append(SegmentBlock(n=n, offset=offset))
+        block = segment.blocks[-1]
+        block.extend(key, size)
+        return block if block.count >= self.storage.sparse_every else None
+
+    def _persist_blocks(self, segment: Segment, blocks: List[SegmentBlock]):
+        complete = [b for b in blocks if b.count >= self.storage.sparse_every]
+        if not complete:
+            return
+        with open(segment.sidx_path, 'a', encoding='utf-8') as f:
+            for block in complete:
+                f.write(block.to_json() + "\n")
+
+    def _rewrite_sidx(self, segment: Segment, include_partial: bool):
+        complete = [b for b in segment.blocks if include_partial or b.count >= self.storage.sparse_every]
+        tmp_path = segment.sidx_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for block in complete:
+                f.write(block.to_json() + "\n")
+        os.replace(tmp_path, segment.sidx_path)
+
+    @staticmethod
+    def _remove_segment_files(segment: Segment):
+        for path in (segment.path, segment.sidx_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _allocate_number(self) -> int:
+        with self.lock:
+            number = self.next_number
+            self.next_number += 1
+            return number
+
+    def _open_new_segment(self):
+        number = self._allocate_number()
+        segment = Segment(number=number, path=self._segment_path(number))
+        # Номер никогда не переиспользуется, поэтому файл всегда создается заново
+        open(segment.path, 'wb').close()
+        self.segments.append(segment)
+
+    def _active(self):
+        if self._active_file is None:
+            self._active_file = open(self.segments[-1].path, 'ab')
+        return self._active_file
+
+    def append(self, note: Dict[str, Any]) -> None:
+        record = encode_note(note) + b"\n"
+        with self.lock:
+            segment = self.segments[-1]
+            if segment.count and segment.size + len(record) > self.storage.segment_max_bytes:
+                self._rotate()
+                segment = self.segments[-1]
+
+            f = self._active()
+            f.write(record)
+            f.flush()
+
+            full_block = self._index_record(segment, segment.count, segment.size,
+                                            note_sort_key(note_created_at(note)), len(record))
+            segment.size += len(record)
+            segment.count += 1
+            if full_block is not None:
+                self._persist_blocks(segment, [full_block])
+
+            self._unsynced += 1
+            if (self._unsynced >= self.storage.fsync_batch
+                    or time.monotonic() - self._last_fsync >= self.storage.fsync_interval):
+                self._fsync()
+
+    def _fsync(self):
+        if self._active_file is not None and self._unsynced:
+            os.fsync(self._active_file.fileno())
+        self._unsynced = 0
+        self._last_fsync = time.monotonic()
+
+    def sync(self):
+        with self.lock:
+            self._fsync()
+
+    def _rotate(self):
+        """Запечатывает активный сегмент и открывает новый"""
+        sealed = self.segments[-1]
+        self._fsync()
+        if self._active_file is not None:
+            self._active_file.close()
+            self._active_file = None
+        # Неполный последний блок запечатанного сегмента тоже попадает в .sidx
+        if sealed.blocks and sealed.blocks[-1].count < self.storage.sparse_every:
+            with open(sealed.sidx_path, 'a', encoding='utf-8') as f:
+                f.write(sealed.blocks[-1].to_json() + "\n")
+        self._open_new_segment()
+        self._write_manifest()
+        self._maybe_compact()
+
+    def _write_manifest(self):
+        manifest = {
+            "segments": [s.number for s in self.segments],
+            "compacted": [s.number for s in self.segments if s.compacted],
+            "next": self.next_number,
+        }
+        tmp_path = os.path.join(self.dir, MANIFEST_NAME + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(manifest))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.dir, MANIFEST_NAME))
+
+    def close(self):
+        with self.lock:
+            self._fsync()
+            if self._active_file is not None:
+                self._active_file.close()
+                self._active_file = None
+            for segment in self.segments:
+                segment.mapped = None
+
+    # --- Чтение ---
+
+    def query(self, since: Optional[str], limit: int, before: Optional[PageKey] = None,
+              until: Optional[str] = None) -> List[Dict[str, Any]]:
+        since_ts, until_ts = parse_time_bound(since), parse_time_bound(until, "until")
+        try:
+            return self._query(since_ts, until_ts, limit, before)
+        except FileNotFoundError:
+            # Сегмент удален фоновой компакцией между снимком и чтением - повторяем по новому снимку
+            return self._query(since_ts, until_ts, limit, before)
+
+    def _query(self, since_ts: Optional[float], until_ts: Optional[float], limit: int,
+               before: Optional[PageKey] = None) -> List[Dict[str, Any]]:
+        with self.lock:
+            blocks = [(s, b.n, b.offset, b.length, b.count, b.min_key, b.max_key, b.ordered, i)
+                      for i, s in enumerate(self.segments) for b in s.blocks]
+
+        # Идем от новых блоков к старым, держа кучу из limit лучших записей по (ключ, id, порядок).
+        # Блок, максимальный ключ которого меньше худшей записи кучи, не читается;
+        # блок, целиком лежащий вне [since, until] или после курсора before, - тоже.
+        # Записи блока разбираются с конца; в упорядоченном блоке разбор останавливается, как только
+        # ключ стал меньше since или худшей записи полной кучи, - остальные записи блока еще старше.
+        heap: List[Tuple[float, str, Tuple[int, int], Dict[str, Any]]] = []
+        span = current_span()
+        for segment, n, offset, length, count, min_key, max_key, ordered, segment_pos in reversed(blocks):
+            if limit > 0 and len(heap) >= limit and max_key is not None and max_key < heap[0][0]:
+                continue
+            if min_key is not None and not self._block_in_range(min_key, max_key, since_ts, until_ts, before):
+                continue
+            buf, start = self._read_block(segment, offset, length)
+            view = memoryview(buf)
+            decoded_bytes, parse_s = 0, 0.0
+            i = count
+            for begin, end in iter_records_reversed(buf, start, start + length):
+                i -= 1
+                if span.active:
+                    started = time.perf_counter()
+                    note = decode_note(view[begin:end])
+                    parse_s += time.perf_counter() - started
+                    decoded_bytes += end - begin + 1
+                else:
+                    note = decode_note(view[begin:end])
+                key = note_sort_key(note_created_at(note))
+                if ordered and ((since_ts is not None and key < since_ts)
+                                or (limit > 0 and len(heap) >= limit and key < heap[0][0])):
+                    break
+                if not in_time_range(key, since_ts, until_ts):
+                    continue
+                item = (key, str(note.get("id", "")), (segment_pos, n + i), note)
+                if before is not None and item[:2] >= before:
+                    continue
+                if limit <= 0:
+                    heap.append(item)
+                elif len(heap) < limit:
+                    heapq.heappush(heap, item)
+                elif item[:3] > heap[0][:3]:
+                    heapq.heapreplace(heap, item)
+            view.release()
+            if span.active:
+                span.add_read(decoded_bytes, parse_s)
+                if span.notes:
+                    span.note("%s: блок %d, разобрано %d из %d байт", segment.path, n, decoded_bytes, length)
+
+        ordered = sorted(heap, key=lambda item: item[:3])
+        # Повторно доставленные заметки (один id) возвращаем один раз, в последней версии
+        latest = {item[3].get("id", id(item[3])): item[2] for item in ordered}
+        return [item[3] for item in ordered if latest[item[3].get("id", id(item[3]))] == item[2]]
+
+    def _read_block(self, segment: Segment, offset: int, length: int) -> Tuple[Any, int]:
+        """
+        Буфер с блоком и смещение блока в нем. С mmap это отображение всего сегмента (без копирования
+        в память процесса, разбираются только нужные записи), иначе - прочитанные байты блока.
+        """
+        if not self.storage.use_mmap:
+            with open(segment.path, 'rb') as f:
+                f.seek(offset)
+                return f.read(length), 0
+        mapped = segment.mapped
+        if mapped is None or len(mapped) < offset + length:
+            # Активный сегмент дописан после отображения - отображаем заново. Старое отображение
+            # не закрываем: его еще могут читать другие потоки, оно закроется с последней ссылкой
+            with open(segment.path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            segment.mapped = mapped
+        return mapped, offset
+
+    @staticmethod
+    def _block_in_range(min_key: float, max_key: float, since_ts: Optional[float], until_ts: Optional[float],
+                        before: Optional[PageKey]) -> bool:
+        if since_ts is not None and max_key < since_ts:
+            return False
+        if until_ts is not None and min_key > until_ts:
+            return False
+        return before is None or min_key <= before[0]
+
+    # --- Компакция ---
+
+    def _maybe_compact(self):
+        fresh = [s for s in self.segments[:-1] if not s.compacted]
+        if len(fresh) >= self.storage.compact_min_segments and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self.compact, args=(fresh,), daemon=True,
+                             name=f"wall-compact-{self.thread_id}").start()
+
+    def compact(self, segments: Optional[List[Segment]] = None):
+        """
+        Сливает запечатанные сегменты в новые, отсортированные по created_at, без дублей id.
+        """
+        try:
+            with self.lock:
+                if segments is None:
+                    segments = [s for s in self.segments[:-1] if not s.compacted]
+                if not segments:
+                    return
+
+            records = []
+            for segment_pos, segment in enumerate(segments):
+                with open(segment.path, 'rb') as f:
+                    for n, line in enumerate(f.read().split(b"\n")[:-1]):
+                        note = decode_note(line)
+                        records.append((note_sort_key(note_created_at(note)), (segment_pos, n), note.get("id"), line))
+
+            latest = {record[2]: record[1] for record in records if record[2] is not None}
+            records = [r for r in records if r[2] is None or latest[r[2]] == r[1]]
+            records.sort(key=lambda r: r[:2])
+
+            new_segments = []
+            current = None
+            out = None
+            for key, _, _, line in records:
+                size = len(line) + 1
+                if current is None or (current.count and current.size + size > self.storage.segment_max_bytes):
+                    if out is not None:
+                        self._finish_compacted(current, out)
+                    number = self._allocate_number()
+                    current = Segment(number=number, path=self._segment_path(number), compacted=True)
+                    new_segments.append(current)
+                    out = open(current.path, 'wb')
+                out.write(line + b"\n")
+                self._index_record(current, current.count, current.size, key, size)
+                current.size += size
+                current.count += 1
+            if out is not None:
+                self._finish_compacted(current, out)
+
+            with self.lock:
+                position = self.segments.index(segments[0])
+                remaining = [s for s in self.segments if s not in segments]
+                self.segments = remaining[:position] + new_segments + remaining[position:]
+                self._write_manifest()
+
+            for segment in segments:
+                self._remove_segment_files(segment)
+                segment.mapped = None
+            print(f"SegmentedNoteStorage: Тред {self.thread_id}: {len(segments)} сегментов сжато в {len(new_segments)}.")
+        except Exception as e:
+            print(f"SegmentedNoteStorage: Ошибка компакции треда {self.thread_id}: {e}")
+        finally:
+            self._compacting = False
+
+    def _finish_compacted(self, segment: Segment, out):
+        out.flush()
+        os.fsync(out.fileno())
+        out.close()
+        with open(segment.sidx_path, 'w', encoding='utf-8') as f:
+            for block in segment.blocks:
+                f.write(block.to_json() + "\n")
+
+
+class SegmentedNoteStorage(NoteStorage):
+    """
+    Хранилище на append-only журналах: wall/threads/<thread>/segments/<N>.log.
+
+    Заметки дописываются строками компактного JSON в активный сегмент, который
+    ротируется по размеру. Для каждого сегмента ведется разреженный индекс
+    (.sidx): смещение и min/max created_at каждых sparse_every записей, что позволяет
+    читать хвост треда, не разбирая его целиком. fsync выполняется пачками,
+    оборванная запись отрезается при открытии, запечатанные сегменты сжимаются в фоне.
+    """
+
+    name = "segments"
+
+    def __init__(self, base_wall_path: str, segment_max_bytes: Optional[int] = None, sparse_every: int = 64,
+                 fsync_batch: Optional[int] = None, fsync_interval: Optional[float] = None,
+                 compact_min_segments: int = 4, use_mmap: Optional[bool] = None):
+        super().__init__(base_wall_path)
+        self.segment_max_bytes = segment_max_bytes or int(os.getenv("WALL_SEGMENT_MAX_BYTES", str(4 * 1024 * 1024)))
+        self.sparse_every = sparse_every
+        self.fsync_batch = fsync_batch or int(os.getenv("WALL_FSYNC_BATCH", "32"))
+        self.fsync_interval = fsync_interval if fsync_interval is not None else float(os.getenv("WALL_FSYNC_INTERVAL", "0.05"))
+        self.compact_min_segments = compact_min_segments
+        # Чтение сегментов через mmap (WALL_SEGMENT_MMAP=false - обычный read блоков)
+        self.use_mmap = os.getenv("WALL_SEGMENT_MMAP", "true").lower() == "true" if use_mmap is None else use_mmap
+        self._threads: Dict[str, SegmentedThread] = {}
+        self._lock = threading.Lock()
+
+    def _get_thread(self, thread_id: str) -> SegmentedThread:
+        with self._lock:
+            thread = self._threads.get(thread_id)
+            if thread is None:
+                thread = SegmentedThread(self, thread_id)
+                self._threads[thread_id] = thread
+            return thread
+
+    def has_thread(self, thread_id: str) -> bool:
+        return os.path.isdir(os.path.join(self.base_wall_path, thread_id, SEGMENTS_DIR_NAME))
+
+    def append(self, thread_id: str, note_id: str, note: Dict[str, Any]) -> str:
+        note.setdefault("id", note_id)
+        self._get_thread(thread_id).append(note)
+        # Коммитим директорию целиком: ротация и компакция создают и удаляют файлы
+        return os.path.join(thread_id, SEGMENTS_DIR_NAME)
+
+    def query(self, thread_id: str, since: Optional[str] = None, limit: int = 50,
+              before: Optional[PageKey] = None, until: Optional[str] = None) -> List[Dict[str, Any]]:
+        if not self.has_thread(thread_id):
+            return []
+        return self._get_thread(thread_id).query(since, limit, before, until)
+
+    def compact(self, thread_id: str) -> None:
+        """Синхронно сжимает запечатанные сегменты треда"""
+        self._get_thread(thread_id).compact()
+
+    def reload(self, thread_id: str) -> None:
+        with self._lock:
+            thread = self._threads.pop(thread_id, None)
+        if thread is not None:
+            thread.close()
+
+    def sync(self) -> None:
+        for thread in list(self._threads.values()):
+            thread.sync()
+
+    def close(self) -> None:
+        for thread in list(self._threads.values()):
+            thread.close()
+
+
+STORAGE_BACKENDS = {
+    FileNoteStorage.name: FileNoteStorage,
+    SegmentedNoteStorage.name: SegmentedNoteStorage,
+}
+
+
+def create_note_storage(base_wall_path: str, backend: Optional[str] = None) -> NoteStorage:
+    """
+    Создает хранилище заметок. Бэкенд выбирается аргументом или WALL_STORAGE_BACKEND (files|segments).
+    """
+    backend = backend or os.getenv("WALL_STORAGE_BACKEND", FileNoteStorage.name)
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд хранилища стены: {backend}")
+    return STORAGE_BACKENDS[backend](base_wall_path)
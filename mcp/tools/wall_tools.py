@@ -3,11 +3,17 @@ import json
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 
+from mcp.tools.wall_index import note_page_key
+from mcp.tools.wall_refs import NoteRefIndex
+from mcp.tools.wall_storage import NoteStorage, create_note_storage
+
 # from .git_tools import GitTools # TODO: Импортировать GitTools
 
 class WallManager:
-    def __init__(self, base_wall_path: str = "Sdominanta.net/wall/threads"):
+    def __init__(self, base_wall_path: str = "Sdominanta.net/wall/threads", storage: Optional[NoteStorage] = None):
         self.base_wall_path = base_wall_path
+        self.storage = storage if storage else create_note_storage(base_wall_path) # Хранилище заметок (WALL_STORAGE_BACKEND)
+        self.note_refs = NoteRefIndex(self.storage) # Межтредовые индексы тегов и авторов, общие с bridge
         # self.git_tools = GitTools(base_repo_path=base_wall_path) # Инстанс GitTools
         print(f"WallManager initialized. Base wall path: {self.base_wall_path}")
 
@@ -27,11 +33,7 @@ class WallManager:
         """
         Публикует новую заметку в указанный тред.
         """
-        thread_path = self._get_thread_path(thread_id)
-        os.makedirs(thread_path, exist_ok=True) # Убедимся, что директория треда существует
-
         note_id = f"note_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{os.urandom(4).hex()}"
-        note_filename = os.path.join(thread_path, f"{note_id}.json")
 
         note_data = {
             "id": note_id,
@@ -42,8 +44,8 @@ class WallManager:
             "recipient_user_id": recipient_user_id
         }
 
-        with open(note_filename, 'w', encoding='utf-8') as f:
-            json.dump(note_data, f, ensure_ascii=False, indent=2)
+        self.storage.append(thread_id, note_id, note_data)
+        self.note_refs.add(thread_id, note_data)
         
         # TODO: После сохранения заметки, возможно, нужно сделать Git commit и push через self.git_tools
         # await self.git_tools.commit_and_push(thread_id, f"Add note {note_id}")
@@ -53,31 +55,31 @@ class WallManager:
 
     async def get_notes_from_thread(self, thread_id: str, user_id: str, since: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
         """
-        Получает заметки из указанного треда, фильтруя по правам доступа и другим параметрам.
+        Получает последние limit заметок треда (от старых к новым), фильтруя по правам доступа и другим параметрам.
+        Хранилище читается страницами по limit заметок от новых к старым, пока не наберется limit видимых.
         """
-        thread_path = self._get_thread_path(thread_id)
-        if not os.path.exists(thread_path):
+        if not self.storage.has_thread(thread_id):
             return []
 
-        notes = []
-        for filename in sorted(os.listdir(thread_path)):
-            if filename.endswith(".json"):
-                note_file_path = os.path.join(thread_path, filename)
-                with open(note_file_path, 'r', encoding='utf-8') as f:
-                    note = json.load(f)
-                    
-                    # Проверка прав доступа для приватных сообщений
-                    if note.get("is_private") and note.get("recipient_user_id") != user_id and note.get("author_id") != user_id:
-                        continue # Пропускаем приватные сообщения не для этого пользователя
-
-                    # TODO: Добавить проверку на "скрытые" треды, если есть отдельный механизм прав
-
-                    notes.append(note)
-                    if len(notes) >= limit:
-                        break # Ограничение по количеству
-        
-        # TODO: Фильтрация по 'since' (дата/время)
-        return notes
+        notes: List[Dict[str, Any]] = []
+        before = None
+        while True:
+            page = self.storage.query(thread_id, since=since, limit=limit, before=before)
+            # Пропускаем приватные сообщения не для этого пользователя
+            # TODO: Добавить проверку на "скрытые" треды, если есть отдельный механизм прав
+            visible = [note for note in page if self._can_read(note, user_id)]
+            notes = visible + notes
+            if limit <= 0 or len(notes) >= limit or len(page) < limit:
+                break
+            before = note_page_key(page[0])
+        return notes[-limit:] if limit > 0 else notes
+
+    @staticmethod
+    def _can_read(note: Dict[str, Any], user_id: str) -> bool:
+        """
+        Проверка прав доступа: приватное сообщение видят только автор и получатель.
+        """
+        return not note.get("is_private") or user_id in (note.get("recipient_user_id"), note.get("author_id"))
 
     async def create_user_profile(self, user_id: str, initial_data: Dict[str, Any]) -> Dict[str, Any]:
         """
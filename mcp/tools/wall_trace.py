@@ -0,0 +1,118 @@
+"""
+Трассировка пути чтения стены с уровнями (WALL_TRACE: off | request | note).
+
+request - одна структурная запись на запрос (логгер wall.trace, INFO): число прочитанных файлов,
+байты, время разбора JSON и общее время. note - дополнительно запись DEBUG на каждый файл.
+При off чтение получает NULL_SPAN, у которого все методы пустые, а хранилище не засекает время
+и не форматирует сообщения, проверив один флаг.
+"""
+
+import contextvars
+import logging
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator
+
+TRACE_OFF, TRACE_REQUEST, TRACE_NOTE = 0, 1, 2
+TRACE_LEVELS = {"off": TRACE_OFF, "request": TRACE_REQUEST, "note": TRACE_NOTE}
+
+logger = logging.getLogger("wall.trace")
+
+
+def _parse_level(value: str) -> int:
+    level = TRACE_LEVELS.get(value.strip().lower())
+    if level is None:
+        print(f"wall_trace: неизвестный уровень WALL_TRACE={value!r}; трассировка выключена.")
+        return TRACE_OFF
+    return level
+
+
+_level = _parse_level(os.getenv("WALL_TRACE", "off"))
+
+
+def trace_level() -> int:
+    return _level
+
+
+def set_trace_level(value: str) -> None:
+    """Меняет уровень на ходу (off | request | note)."""
+    global _level
+    _level = _parse_level(value)
+
+
+class _NullSpan:
+    """Выключенная трассировка: ничего не считает и не пишет"""
+    active = False
+    notes = False
+
+    def add_read(self, nbytes: int, parse_s: float = 0.0) -> None:
+        pass
+
+    def note(self, message: str, *args: Any) -> None:
+        pass
+
+    def set(self, **fields: Any) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+@dataclass
+class ReadSpan:
+    """Счетчики одного запроса чтения"""
+    name: str
+    fields: Dict[str, Any] = field(default_factory=dict)
+    notes: bool = False  # Писать ли детали по каждому файлу
+    files: int = 0
+    bytes_read: int = 0
+    parse_s: float = 0.0
+    started: float = field(default_factory=time.perf_counter)
+    active = True
+
+    def add_read(self, nbytes: int, parse_s: float = 0.0) -> None:
+        self.files += 1
+        self.bytes_read += nbytes
+        self.parse_s += parse_s
+
+    def note(self, message: str, *args: Any) -> None:
+        if self.notes:
+            logger.debug(f"{self.name}: {message}", *args, extra={"extra_data": self.fields})
+
+    def set(self, **fields: Any) -> None:
+        self.fields.update(fields)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.fields, span=self.name, files=self.files, bytes_read=self.bytes_read,
+                    parse_ms=round(self.parse_s * 1000, 3),
+                    elapsed_ms=round((time.perf_counter() - self.started) * 1000, 3))
+
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("wall_trace_span", default=NULL_SPAN)
+
+
+def current_span():
+    """Span текущего запроса (NULL_SPAN, если трассировка выключена или запроса нет)."""
+    return _current_span.get()
+
+
+@contextmanager
+def read_span(name: str, **fields: Any) -> Iterator[Any]:
+    """
+    Открывает span запроса чтения; по выходе пишет одну запись с его счетчиками.
+    Хранилище находит span через current_span(), поэтому его не нужно передавать параметром.
+    """
+    if _level == TRACE_OFF:
+        yield NULL_SPAN
+        return
+    span = ReadSpan(name, fields, notes=_level >= TRACE_NOTE)
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+        data = span.to_dict()
+        logger.info(f"{name}: {data['files']} файлов, {data['bytes_read']} байт за {data['elapsed_ms']} мс",
+                    extra={"extra_data": data})
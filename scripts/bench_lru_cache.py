@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк bridge.cache_manager.LRUCache: время get/put/вытеснения не должно
+расти с размером кэша.
+
+Запуск из корня репозитория:
+    python -m scripts.bench_lru_cache --sizes 1000 10000 100000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+from typing import Dict, List
+
+from bridge.cache_manager import LRUCache
+
+
+def bench_size(size: int, ops: int, max_bytes: bool) -> Dict[str, float]:
+    cache = LRUCache(max_size=size, default_ttl=3600, max_bytes=size * 64 if max_bytes else None)
+    value = {"id": "note", "content": "x" * 16}
+    for i in range(size):
+        cache.put(f"k{i}", value)
+
+    # put новых ключей в полный кэш: каждая вставка вытесняет самую старую запись
+    t0 = time.perf_counter()
+    for i in range(size, size + ops):
+        cache.put(f"k{i}", value)
+    put_evict = time.perf_counter() - t0
+
+    keys = [f"k{random.randrange(ops, size + ops)}" for _ in range(ops)]
+    t0 = time.perf_counter()
+    for key in keys:
+        cache.get(key)
+    get_hit = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for i in range(ops):
+        cache.get(f"missing{i}")
+    get_miss = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    cache.stats()
+    stats_time = time.perf_counter() - t0
+
+    return {
+        "put_evict_us": put_evict / ops * 1e6,
+        "get_hit_us": get_hit / ops * 1e6,
+        "get_miss_us": get_miss / ops * 1e6,
+        "stats_us": stats_time * 1e6,
+        "evictions": cache.stats()["evictions"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark LRUCache operations against cache size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--ops", type=int, default=50000, help="Operations measured per size")
+    parser.add_argument("--max-bytes", action="store_true", help="Bound the cache by byte size as well")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    results: Dict[int, Dict[str, float]] = {size: bench_size(size, args.ops, args.max_bytes) for size in args.sizes}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'entries':>8} {'put+evict us':>13} {'get hit us':>11} {'get miss us':>12} {'stats us':>9}")
+    for size, r in results.items():
+        print(f"{size:>8} {r['put_evict_us']:>13.2f} {r['get_hit_us']:>11.2f} {r['get_miss_us']:>12.2f} {r['stats_us']:>9.2f}")
+
+    put_times: List[float] = [r["put_evict_us"] for r in results.values()]
+    print(f"put+evict ratio largest/smallest: {put_times[-1] / put_times[0]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк кодека заметок mcp.tools.wall_codec: скорость кодирования и разбора
+бэкендами json и orjson и размер заметки на диске против прежнего json.dump(indent=2).
+
+Запуск из корня репозитория:
+    python -m scripts.bench_note_codec --notes 20000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+from typing import Any, Dict, List
+
+from mcp.tools import wall_codec
+from mcp.tools.wall_codec import decode_note, encode_note
+
+WORDS = ["стена", "заметка", "агент", "сеть", "истина", "wall", "note", "relay", "event", "signal"]
+
+
+def make_notes(count: int, seed: int = 1) -> List[Dict[str, Any]]:
+    rnd = random.Random(seed)
+    return [{
+        "id": f"{rnd.getrandbits(256):064x}",
+        "pubkey": f"{rnd.getrandbits(256):064x}",
+        "created_at": 1700000000 + i,
+        "kind": 1,
+        "tags": [["t", rnd.choice(["general", "dev", "system"])], ["agent", f"agent{rnd.randrange(50)}"]],
+        "content": " ".join(rnd.choice(WORDS) for _ in range(rnd.randrange(10, 60))),
+        "sig": f"{rnd.getrandbits(512):0128x}",
+    } for i in range(count)]
+
+
+def bench_backend(notes: List[Dict[str, Any]], use_orjson: bool) -> Dict[str, float]:
+    wall_codec._use_orjson = use_orjson
+    t0 = time.perf_counter()
+    encoded = [encode_note(note) for note in notes]
+    encode_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for data in encoded:
+        decode_note(data)
+    decode_s = time.perf_counter() - t0
+
+    total_bytes = sum(len(data) for data in encoded)
+    return {
+        "encode_notes_per_s": round(len(notes) / encode_s),
+        "decode_notes_per_s": round(len(notes) / decode_s),
+        "encode_mb_per_s": round(total_bytes / encode_s / 1e6, 1),
+        "decode_mb_per_s": round(total_bytes / decode_s / 1e6, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark wall note codec backends")
+    parser.add_argument("--notes", type=int, default=20000)
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    notes = make_notes(args.notes)
+    default_backend = wall_codec._use_orjson
+    results: Dict[str, Any] = {"json": bench_backend(notes, False)}
+    if wall_codec.orjson is not None:
+        results["orjson"] = bench_backend(notes, True)
+    wall_codec._use_orjson = default_backend
+
+    compact = sum(len(encode_note(note)) for note in notes)
+    indented = sum(len(json.dumps(note, ensure_ascii=False, indent=2).encode("utf-8")) for note in notes)
+    results["size"] = {"canonical_bytes": compact, "indent2_bytes": indented,
+                       "ratio": round(indented / compact, 2)}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'backend':>8} {'encode/s':>10} {'decode/s':>10} {'enc MB/s':>9} {'dec MB/s':>9}")
+    for backend in ("json", "orjson"):
+        r = results.get(backend)
+        if r:
+            print(f"{backend:>8} {r['encode_notes_per_s']:>10} {r['decode_notes_per_s']:>10} "
+                  f"{r['encode_mb_per_s']:>9} {r['decode_mb_per_s']:>9}")
+    size = results["size"]
+    print(f"size: canonical {size['canonical_bytes']} B, indent=2 {size['indent2_bytes']} B (x{size['ratio']})")
+
+
+if __name__ == "__main__":
+    main()
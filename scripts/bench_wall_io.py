@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк отзывчивости цикла событий при файловой работе стены (bridge/wall_io.py).
+
+Смешанная нагрузка на одну WallAPI: тяжелые читатели целиком читают большой тред, публикатор
+пишет заметки с fsync, а легкие запросы читают последние заметки маленького треда. Замеряются
+задержка легких запросов (с ожиданием занятого цикла), задержка цикла событий (опоздание asyncio.sleep) и пропускная способность.
+Сравниваются вызовы хранилища прямо в цикле (workers=0, как было раньше) и пул потоков.
+--disk-latency-ms добавляет задержку на каждый прочитанный файл, имитируя медленный диск.
+
+Запуск из корня репозитория:
+    python -m scripts.bench_wall_io --notes 3000 --seconds 5 --disk-latency-ms 0.2
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List
+from unittest.mock import AsyncMock
+
+from bridge.api.wall import WallAPI
+from bridge.shared_state import LocalStateBackend
+from bridge.wall_io import WallIOExecutor
+from mcp.tools import wall_storage
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summary_ms(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50_ms": round(percentile(values, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(max(values, default=0.0) * 1000, 2),
+        "mean_ms": round(statistics.fmean(values) * 1000, 2) if values else 0.0,
+    }
+
+
+def make_wall(path: str, notes: int, workers: int) -> WallAPI:
+    os.environ["WALL_PATH"] = path
+    os.environ.setdefault("WALL_STORAGE_BACKEND", "files")
+    os.environ["WALL_VERIFY_SIGNATURES"] = "off"
+    wall = WallAPI(git_tools=AsyncMock(), state=LocalStateBackend(), io_executor=WallIOExecutor(workers=workers))
+    wall.commit_queue = AsyncMock()
+    wall.git_tools.base_repo_path = path
+    if not wall.storage.has_thread("big"):
+        for i in range(notes):
+            wall.storage.append("big", f"b{i}", {"id": f"b{i}", "created_at": 1700000000 + i, "content": "x" * 300})
+        for i in range(100):
+            wall.storage.append("small", f"s{i}", {"id": f"s{i}", "created_at": 1700000000 + i, "content": "y"})
+        wall.storage.sync()
+    return wall
+
+
+async def run_load(wall: WallAPI, seconds: float, heavy_readers: int, light_clients: int) -> Dict[str, Any]:
+    deadline = time.perf_counter() + seconds
+    light, lags = [], []
+    counters = {"heavy_reads": 0, "published": 0}
+
+    # Между запросами каждый клиент отдает управление, как отдельные HTTP-запросы сервера
+    async def heavy():
+        while time.perf_counter() < deadline:
+            await wall.get_thread_notes("big", limit=0)
+            counters["heavy_reads"] += 1
+            await asyncio.sleep(0)
+
+    async def publisher():
+        n = 0
+        while time.perf_counter() < deadline:
+            n += 1
+            await wall.publish_note("bench", "small", {"id": f"p{id(wall)}-{n}", "created_at": 1800000000 + n})
+            counters["published"] += 1
+            await asyncio.sleep(0)
+
+    async def client():
+        # Задержка считается от момента, когда запрос должен был начаться: ожидание занятого цикла входит в нее
+        while time.perf_counter() < deadline:
+            issued = time.perf_counter() + 0.005
+            await asyncio.sleep(0.005)
+            await wall.get_thread_notes("small", limit=10)
+            light.append(time.perf_counter() - issued)
+
+    async def ticker():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - started - 0.005)
+
+    await asyncio.gather(*(heavy() for _ in range(heavy_readers)), publisher(),
+                         *(client() for _ in range(light_clients)), ticker())
+    return {
+        "light_requests": len(light),
+        "light_latency": summary_ms(light),
+        "loop_lag": summary_ms(lags),
+        "heavy_reads_per_s": round(counters["heavy_reads"] / seconds, 2),
+        "published_per_s": round(counters["published"] / seconds, 1),
+        "io": wall.io.stats(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark event-loop latency under wall file I/O")
+    parser.add_argument("--notes", type=int, default=3000, help="Notes in the big thread")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--heavy-readers", type=int, default=2)
+    parser.add_argument("--light-clients", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=8, help="Pool size for the offloaded run")
+    parser.add_argument("--disk-latency-ms", type=float, default=0.0, help="Extra delay per file read")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    if args.disk_latency_ms > 0:
+        read_files = wall_storage.read_files
+        delay = args.disk_latency_ms / 1000
+
+        def slow_read_files(paths):
+            time.sleep(delay * len(paths))
+            return read_files(paths)
+
+        wall_storage.read_files = slow_read_files
+
+    results: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode, workers in (("inline", 0), ("pool", args.workers)):
+            wall = make_wall(tmp, args.notes, workers)
+            results[mode] = asyncio.run(run_load(wall, args.seconds, args.heavy_readers, args.light_clients))
+            wall.io.shutdown()
+            wall.storage.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':>7} {'light p50':>10} {'light p99':>10} {'lag p99':>9} {'lag max':>9} {'heavy/s':>8} {'pub/s':>7}")
+    for mode, r in results.items():
+        print(f"{mode:>7} {r['light_latency']['p50_ms']:>10} {r['light_latency']['p99_ms']:>10} "
+              f"{r['loop_lag']['p99_ms']:>9} {r['loop_lag']['max_ms']:>9} "
+              f"{r['heavy_reads_per_s']:>8} {r['published_per_s']:>7}")
+    print(f"pool: max queue depth {results['pool']['io']['max_queue_depth']}, "
+          f"avg wait {results['pool']['io']['avg_wait_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
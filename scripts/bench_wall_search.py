@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк полнотекстового поиска по стене: построение индекса и запросы по 1M заметок.
+
+Запуск из корня репозитория:
+    python -m scripts.bench_wall_search --notes 1000000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+import resource
+from typing import Dict, List
+
+from mcp.tools.wall_search import WallSearchIndex
+
+# Словарь заметок: частые слова встречаются почти везде, редкие - в единицах заметок (распределение Ципфа)
+WORDS_RU = ["стена", "заметка", "формула", "агент", "сеть", "узел", "подпись", "тред", "поиск", "ключ",
+            "событие", "память", "граница", "энтропия", "сигнал", "модель", "ёлка", "проверка", "истина", "слой"]
+WORDS_EN = ["aleph", "wall", "note", "agent", "relay", "nostr", "commit", "signal", "entropy", "truth"]
+THREADS = ["general", "dev", "aleph", "ops", "research"]
+AUTHORS = [f"{i:064x}" for i in range(50)]
+
+QUERIES = {
+    "common word": {"query": "заметка"},
+    "rare word": {"query": "w12345"},
+    "two words": {"query": "формула aleph"},
+    "prefix T2*": {"query": "T2*"},
+    "word + tag": {"query": "энтропия", "tags": [("t", "dev")]},
+    "word + author": {"query": "сигнал", "authors": [AUTHORS[7]]},
+    "filter only": {"query": "", "authors": [AUTHORS[3]]},
+}
+
+
+VOCABULARY = WORDS_RU + WORDS_EN + [f"t2{chr(97 + i)}" for i in range(10)]
+
+
+def make_note(i: int, rng: random.Random, vocabulary: List[str], weights: List[float]) -> Dict:
+    words = rng.choices(vocabulary, weights=weights, k=12)
+    # Уникальное слово на заметку: словарь индекса растет с числом заметок, как у живой стены
+    words.append(f"w{i}")
+    return {
+        "id": f"bench_{i:08d}",
+        "pubkey": AUTHORS[i % len(AUTHORS)],
+        "created_at": 1735689600 + i,
+        "kind": 1,
+        "tags": [["t", THREADS[i % len(THREADS)]]],
+        "content": " ".join(words),
+        "sig": "0" * 128,
+    }
+
+
+def bench(notes: int, limit: int, repeat: int, seed: int) -> Dict[str, float]:
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+    index = WallSearchIndex()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    for i in range(notes):
+        note = make_note(i, rng, VOCABULARY, weights)
+        index.add(note["tags"][0][1], note)
+    build = time.perf_counter() - t0
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before  # КиБ в Linux
+
+    results = {"build_notes_per_sec": notes / build, "rss_growth_mb": rss_growth / 1024}
+    for name, params in QUERIES.items():
+        index.search(limit=limit, **params)  # Первый префиксный запрос строит отсортированный словарь
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            result = index.search(limit=limit, **params)
+        results[f"{name} ms"] = (time.perf_counter() - t0) / repeat * 1000
+        results[f"{name} total"] = result["total"]
+
+    cursor = None
+    t0 = time.perf_counter()
+    for _ in range(5):
+        cursor = index.search("формула", limit=limit, cursor=cursor)["next_cursor"]
+    results["page 5 of common word ms"] = (time.perf_counter() - t0) / 5 * 1000
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark wall full-text search")
+    parser.add_argument("--notes", type=int, default=1_000_000, help="Notes to index")
+    parser.add_argument("--limit", type=int, default=20, help="Results per page")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    results = bench(args.notes, args.limit, args.repeat, args.seed)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"notes={args.notes} limit={args.limit}")
+    print(f"build: {results['build_notes_per_sec']:.0f} notes/s, RSS +{results['rss_growth_mb']:.0f} MB")
+    print(f"{'query':<28} {'ms':>10} {'matches':>10}")
+    for name in QUERIES:
+        print(f"{name:<28} {results[name + ' ms']:>10.2f} {results[name + ' total']:>10}")
+    print(f"{'page 5 of common word':<28} {results['page 5 of common word ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
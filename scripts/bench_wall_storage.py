@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк хранилищ стены: files (один JSON на заметку) против segments (журнал),
+segments - с чтением через mmap, segments-read - с чтением блоков read().
+export peak - пик памяти Python (tracemalloc) при выгрузке треда страницами по 500 заметок.
+
+Запуск из корня репозитория:
+    python -m scripts.bench_wall_storage --notes 20000 --limit 50
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+from mcp.tools.wall_index import decode_cursor, next_page_cursor
+from mcp.tools.wall_storage import STORAGE_BACKENDS
+
+# Варианты замера: имя -> (бэкенд, параметры хранилища)
+VARIANTS = {
+    "files": ("files", {}),
+    "segments": ("segments", {"use_mmap": True}),
+    "segments-read": ("segments", {"use_mmap": False}),
+}
+
+
+def make_note(i: int, start: datetime) -> Dict:
+    return {
+        "id": f"bench_{i:08d}",
+        "pubkey": "3bf6a9d254e1bd3d561f96e8acb11401dbde09e2b9c6f99fee92a1e3393718a0",
+        "created_at": (start + timedelta(seconds=i)).isoformat() + "Z",
+        "kind": 1,
+        "tags": [["t", "bench"]],
+        "content": f"Заметка бенчмарка #{i} " + "x" * 200,
+        "sig": "0" * 128,
+    }
+
+
+def export_peak_mb(storage: Any, page_size: int = 500) -> float:
+    """Пик памяти Python при выгрузке треда страницами (как iter_thread_notes)"""
+    tracemalloc.start()
+    cursor = None
+    while True:
+        page = storage.query("bench", limit=page_size, before=decode_cursor(cursor) if cursor else None)
+        cursor = next_page_cursor(page, page_size)
+        if cursor is None:
+            break
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1e6
+
+
+def bench_backend(backend: str, notes: int, limit: int, **storage_kwargs: Any) -> Dict[str, float]:
+    start = datetime(2025, 1, 1)
+    since = (start + timedelta(seconds=notes - limit * 2)).isoformat() + "Z"
+    with tempfile.TemporaryDirectory() as base, contextlib.redirect_stdout(io.StringIO()):
+        storage = STORAGE_BACKENDS[backend](base, **storage_kwargs)
+        t0 = time.perf_counter()
+        for i in range(notes):
+            note = make_note(i, start)
+            storage.append("bench", note["id"], note)
+        storage.sync()
+        publish = time.perf_counter() - t0
+        storage.close()
+
+        # Холодное чтение: новый экземпляр хранилища (индексы читаются с диска)
+        cold_storage = STORAGE_BACKENDS[backend](base, **storage_kwargs)
+        t0 = time.perf_counter()
+        cold_storage.query("bench", limit=limit)
+        cold_tail = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for _ in range(20):
+            cold_storage.query("bench", limit=limit)
+        warm_tail = (time.perf_counter() - t0) / 20
+
+        t0 = time.perf_counter()
+        cold_storage.query("bench", since=since, limit=limit)
+        since_tail = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        full = cold_storage.query("bench", limit=0)
+        full_read = time.perf_counter() - t0
+        assert len(full) == notes
+        del full
+        export_peak = export_peak_mb(cold_storage)
+        cold_storage.close()
+
+    return {
+        "publish_per_sec": notes / publish,
+        "cold_tail_ms": cold_tail * 1000,
+        "warm_tail_ms": warm_tail * 1000,
+        "since_tail_ms": since_tail * 1000,
+        "full_read_per_sec": notes / full_read,
+        "export_peak_mb": export_peak,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark wall storage backends")
+    parser.add_argument("--notes", type=int, default=5000, help="Notes to publish per backend")
+    parser.add_argument("--limit", type=int, default=50, help="Tail read size")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    results = {name: bench_backend(backend, args.notes, args.limit, **kwargs)
+               for name, (backend, kwargs) in VARIANTS.items()}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"notes={args.notes} limit={args.limit}")
+    print(f"{'backend':<14} {'publish/s':>10} {'cold tail ms':>13} {'warm tail ms':>13} {'since ms':>9} "
+          f"{'full read/s':>12} {'export peak MB':>15}")
+    for backend, r in results.items():
+        print(f"{backend:<14} {r['publish_per_sec']:>10.0f} {r['cold_tail_ms']:>13.2f} {r['warm_tail_ms']:>13.2f} "
+              f"{r['since_tail_ms']:>9.2f} {r['full_read_per_sec']:>12.0f} {r['export_peak_mb']:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
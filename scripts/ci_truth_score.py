@@ -16,6 +16,8 @@ except Exception as e:  # pragma: no cover
     print(json.dumps({"ok": False, "error": f"requests_missing: {e}"}, ensure_ascii=False))
     sys.exit(0)
 
+from mcp.tools.wall_codec import decode_note
+
 
 def sha256_hex_stream(url: str, timeout: int = 15) -> Tuple[str, bytes | None]:
     h = hashlib.sha256()
@@ -76,7 +78,7 @@ def main() -> int:
         return 0
 
     try:
-        note = json.loads(note_path.read_text(encoding="utf-8"))
+        note = decode_note(note_path.read_bytes())
     except Exception as e:
         print(json.dumps({"ok": False, "error": f"note_parse_error: {e}"}, ensure_ascii=False))
         return 0
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Миграция стены из формата "один JSON-файл на заметку" в сегментированный журнал.
+
+Запуск из корня репозитория:
+    python -m scripts.migrate_wall_storage --base wall/threads [--delete-source]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+from typing import Dict, List, Optional
+
+from mcp.tools.wall_index import INDEX_DIR_NAME
+from mcp.tools.wall_storage import FileNoteStorage, SegmentedNoteStorage
+
+
+def discover_threads(base: str) -> List[str]:
+    """Треды - директории верхнего уровня с JSON-заметками"""
+    threads = []
+    for name in sorted(os.listdir(base)):
+        path = os.path.join(base, name)
+        if name.startswith('.') or not os.path.isdir(path):
+            continue
+        if any(f.endswith('.json') for f in os.listdir(path)):
+            threads.append(name)
+    return threads
+
+
+def migrate_thread(source: FileNoteStorage, target: SegmentedNoteStorage, thread_id: str,
+                   delete_source: bool = False, dry_run: bool = False) -> Dict[str, int]:
+    notes = source.query(thread_id, limit=0)
+    existing = set()
+    if target.has_thread(thread_id):
+        existing = {note.get("id") for note in target.query(thread_id, limit=0)}
+
+    migrated = 0
+    for note in notes:
+        if note.get("id") in existing:
+            continue
+        if not dry_run:
+            target.append(thread_id, note.get("id"), note)
+        migrated += 1
+
+    if not dry_run:
+        target.sync()
+        if delete_source:
+            thread_path = os.path.join(source.base_wall_path, thread_id)
+            for name in os.listdir(thread_path):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(thread_path, name))
+            for suffix in ('.idx', '.meta'):
+                index_path = os.path.join(source.base_wall_path, INDEX_DIR_NAME, thread_id + suffix)
+                if os.path.exists(index_path):
+                    os.remove(index_path)
+
+    return {"notes": len(notes), "migrated": migrated, "skipped": len(notes) - migrated}
+
+
+def migrate_wall(base: str, threads: Optional[List[str]] = None, delete_source: bool = False,
+                 dry_run: bool = False) -> Dict[str, Dict[str, int]]:
+    source = FileNoteStorage(base)
+    target = SegmentedNoteStorage(base)
+    results = {}
+    try:
+        for thread_id in threads or discover_threads(base):
+            results[thread_id] = migrate_thread(source, target, thread_id, delete_source, dry_run)
+    finally:
+        target.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Migrate wall threads to segmented append-only storage")
+    parser.add_argument("--base", default="wall/threads", help="Base path to wall threads")
+    parser.add_argument("--thread", action="append", dest="threads", help="Thread to migrate (repeatable, default: all)")
+    parser.add_argument("--delete-source", action="store_true", help="Remove per-note JSON files after migration")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be migrated")
+    args = parser.parse_args()
+
+    results = migrate_wall(args.base, args.threads, args.delete_source, args.dry_run)
+    for thread_id, stats in results.items():
+        print(f"{thread_id}: {stats['migrated']} migrated, {stats['skipped']} already present ({stats['notes']} total)")
+    print("OK", sum(stats["migrated"] for stats in results.values()))
+
+
+if __name__ == "__main__":
+    main()
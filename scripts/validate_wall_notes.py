@@ -1,55 +1,201 @@
 #!/usr/bin/env python3
+"""
+Проверка заметок wall/threads/**/*.json по схеме wall/WALL_NOTE.schema.json.
+
+Валидатор схемы компилируется один раз (в каждом процессе пула), заметки проверяются
+параллельно (--jobs). Инкрементальный режим проверяет только изменившиеся файлы:
+--since-rev <git-ревизия> или --manifest <файл> с хешами содержимого уже проверенных заметок.
+
+    python -m scripts.validate_wall_notes --base . --jobs 0 --manifest .wall-validate.json --stats -
+"""
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
+import os
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
 try:
-    from jsonschema import validate as jsonschema_validate  # type: ignore
-    from jsonschema import ValidationError  # type: ignore
+    from jsonschema.exceptions import best_match  # type: ignore
+    from jsonschema.validators import validator_for  # type: ignore
 except Exception:
-    jsonschema_validate = None
-    ValidationError = Exception  # type: ignore
+    validator_for = None
+    best_match = None
+
+from mcp.tools.wall_codec import decode_note
+
+NOTES_GLOB = "**/*.json"
+# Меньше файлов проверяем в одном процессе: запуск пула дороже самой проверки
+PARALLEL_MIN_FILES = 200
+MANIFEST_VERSION = 1
+
+_validator = None  # Скомпилированный валидатор процесса пула
 
 
 def load_json(path: Path) -> Dict[str, Any]:
     return json.loads(path.read_text(encoding="utf-8"))
 
 
-def validate_notes(base: Path) -> tuple[int, List[str]]:
+def file_sha256(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def compile_validator(schema: Dict[str, Any]):
+    """Валидатор под версию схемы ($schema), собранный один раз."""
+    if validator_for is None:  # pragma: no cover
+        raise SystemExit("jsonschema package not available; install requirements.txt")
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+def _init_worker(schema: Dict[str, Any]) -> None:
+    global _validator
+    _validator = compile_validator(schema)
+
+
+def _validate_file(path: Path) -> Optional[str]:
+    """Ошибка проверки файла ("<путь>: <сообщение>") или None."""
+    try:
+        note = decode_note(path.read_bytes())
+        error = best_match(_validator.iter_errors(note))
+        if error is not None:
+            return f"{path}: {error.message}"
+    except Exception as e:  # pragma: no cover
+        return f"{path}: {e}"
+    return None
+
+
+def _validate_chunk(paths: List[Path]) -> List[Optional[str]]:
+    return [_validate_file(path) for path in paths]
+
+
+def validate_files(files: List[Path], schema: Dict[str, Any], jobs: int = 1) -> List[Optional[str]]:
+    """
+    Проверяет файлы и возвращает ошибку (или None) для каждого, в порядке files.
+    jobs > 1 - пул процессов, файлы раздаются пачками.
+    """
+    if jobs <= 1 or len(files) < PARALLEL_MIN_FILES:
+        _init_worker(schema)
+        return _validate_chunk(files)
+    chunk_size = max(1, min(500, len(files) // (jobs * 4)))
+    chunks = [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(schema,)) as pool:
+        return [result for chunk in pool.map(_validate_chunk, chunks) for result in chunk]
+
+
+def git_changed_files(base: Path, notes_dir: Path, since_rev: str) -> List[Path]:
+    """Заметки, измененные после ревизии since_rev (коммиты, рабочее дерево и неотслеживаемые файлы)."""
+    rel = os.path.relpath(notes_dir, base)
+    commands = [["git", "diff", "--name-only", "--relative", "--no-renames", since_rev, "--", rel],
+                ["git", "ls-files", "--others", "--exclude-standard", "--", rel]]
+    names = set()
+    for command in commands:
+        result = subprocess.run(command, cwd=base, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise SystemExit(f"git_failed: {' '.join(command)}: {result.stderr.strip()}")
+        names.update(line for line in result.stdout.splitlines() if line)
+    # Удаленные файлы проверять не нужно; glob-фильтр тот же, что у полной проверки
+    return sorted(p for p in (base / name for name in names) if p.is_file() and p.match("*.json")
+                  and notes_dir in p.parents)
+
+
+def load_manifest(path: Path, schema_hash: str) -> Dict[str, str]:
+    """Хеши проверенных файлов из манифеста; другая схема или формат - пустой манифест."""
+    try:
+        manifest = load_json(path)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("schema_sha256") != schema_hash:
+        return {}
+    return manifest.get("files", {})
+
+
+def save_manifest(path: Path, schema_hash: str, files: Dict[str, str]) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps({"version": MANIFEST_VERSION, "schema_sha256": schema_hash,
+                                    "files": dict(sorted(files.items()))}, indent=1), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def validate_notes(base: Path, jobs: int = 1, since_rev: Optional[str] = None,
+                   manifest_path: Optional[Path] = None, stats: Optional[Dict[str, Any]] = None) -> Tuple[int, List[str]]:
+    """
+    Проверяет заметки стены и возвращает (число проверенных файлов, ошибки).
+    since_rev / manifest_path - проверять только изменившиеся файлы; stats заполняется статистикой прогона.
+    """
+    started = time.perf_counter()
     schema_path = base / "wall" / "WALL_NOTE.schema.json"
     notes_dir = base / "wall" / "threads"
     if not schema_path.exists():
         raise SystemExit(f"schema_not_found: {schema_path}")
+    stats = stats if stats is not None else {}
+    stats.update({"mode": "full", "jobs": jobs, "files_total": 0, "files_validated": 0, "errors": 0})
     if not notes_dir.exists():
         return 0, []
 
     schema = load_json(schema_path)
-    errors: List[str] = []
-    files = sorted(notes_dir.glob("**/*.json"))
-    for f in files:
-        try:
-            note = load_json(f)
-            if jsonschema_validate is None:  # pragma: no cover
-                raise SystemExit("jsonschema package not available; install requirements.txt")
-            jsonschema_validate(note, schema)
-        except ValidationError as e:  # type: ignore
-            errors.append(f"{f}: {e.message}")
-        except Exception as e:  # pragma: no cover
-            errors.append(f"{f}: {e}")
+    compile_validator(schema)  # Ошибка в самой схеме - до запуска пула
+    files = sorted(notes_dir.glob(NOTES_GLOB))
+    stats["files_total"] = len(files)
+
+    hashes: Dict[str, str] = {}
+    if since_rev:
+        stats["mode"] = f"since-rev:{since_rev}"
+        files = git_changed_files(base, notes_dir, since_rev)
+    elif manifest_path is not None:
+        stats["mode"] = "manifest"
+        schema_hash = file_sha256(schema_path)
+        known = load_manifest(manifest_path, schema_hash)
+        hashes = {str(f.relative_to(base)): file_sha256(f) for f in files}
+        files = [f for f in files if known.get(str(f.relative_to(base))) != hashes[str(f.relative_to(base))]]
+    stats["scan_s"] = round(time.perf_counter() - started, 4)
+
+    validate_started = time.perf_counter()
+    results = validate_files(files, schema, jobs)
+    errors = [error for error in results if error is not None]
+    validate_s = time.perf_counter() - validate_started
+
+    if manifest_path is not None and not since_rev:
+        # В манифест попадают только прошедшие проверку файлы: ошибочные будут проверены снова
+        failed = {str(f.relative_to(base)) for f, error in zip(files, results) if error is not None}
+        save_manifest(manifest_path, file_sha256(schema_path), {k: v for k, v in hashes.items() if k not in failed})
 
+    stats.update({
+        "files_validated": len(files),
+        "errors": len(errors),
+        "validate_s": round(validate_s, 4),
+        "files_per_s": round(len(files) / validate_s, 1) if validate_s > 0 else None,
+        "elapsed_s": round(time.perf_counter() - started, 4),
+    })
     return len(files), errors
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Validate WALL notes against schema")
     parser.add_argument("--base", type=str, default=".", help="Project root containing wall/")
+    parser.add_argument("--jobs", type=int, default=1, help="Worker processes (0 = CPU count)")
+    incremental = parser.add_mutually_exclusive_group()
+    incremental.add_argument("--since-rev", type=str, help="Validate only notes changed since this git revision")
+    incremental.add_argument("--manifest", type=str, help="Content-hash manifest: validate only new or changed notes")
+    parser.add_argument("--stats", type=str, help="Write JSON timing stats to this file ('-' for stdout)")
     args = parser.parse_args()
 
     base = Path(args.base).resolve()
-    count, errors = validate_notes(base)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    stats: Dict[str, Any] = {}
+    count, errors = validate_notes(base, jobs=jobs, since_rev=args.since_rev,
+                                   manifest_path=Path(args.manifest) if args.manifest else None, stats=stats)
+    if args.stats == "-":
+        print(json.dumps(stats))
+    elif args.stats:
+        Path(args.stats).write_text(json.dumps(stats, indent=2), encoding="utf-8")
+
     if errors:
         print("FAIL", len(errors), "errors of", count, "files")
         for err in errors:
@@ -60,5 +206,3 @@ def main() -> None:
 
 if __name__ == "__main__":
     main()
-
-
@@ -1,57 +1,112 @@
+#!/usr/bin/env python3
+"""
+Проверка подписей заметок стены (mcp/tools/wall_signatures.py): Ed25519 (ncp_signature,
+формат create_and_sign_note.py) и Nostr (BIP-340 Schnorr).
+
+Без --note проверяются все wall/threads/**/*.json. Подписи проверяются пулом процессов (--jobs);
+с --cache уже проверенные подписи запоминаются в файле и при следующем прогоне не проверяются.
+
+    python -m scripts.verify_wall_signatures --base . --jobs 0 --cache .wall-signatures --stats -
+"""
+from __future__ import annotations
+
 import argparse
 import json
-import base64
-from typing import Dict, Any
-
-# try:
-#     from nacl.signing import VerifyKey # TODO: Установить PyNaCl
-#     from nacl.exceptions import BadSignatureError
-#     from nacl.encoding import HexEncoder
-# except ImportError:
-#     print("Ошибка: Библиотека PyNaCl не найдена. Установите ее: pip install pynacl")
-#     exit(1)
-
-def verify_signature_pseudocode(signed_note: Dict[str, Any]) -> bool:
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from mcp.tools.wall_codec import decode_note
+from mcp.tools.wall_signatures import SignatureVerifier, VerifiedSignatureCache, load_seed_public_keys
+
+NOTES_GLOB = "**/*.json"
+
+
+def load_notes(files: List[Path]) -> Tuple[List[Path], List[Dict[str, Any]], List[str]]:
+    """Читает заметки; нечитаемые файлы сразу попадают в ошибки."""
+    paths, notes, errors = [], [], []
+    for path in files:
+        try:
+            notes.append(decode_note(path.read_bytes()))
+            paths.append(path)
+        except (OSError, ValueError) as e:
+            errors.append(f"{path}: {e}")
+    return paths, notes, errors
+
+
+def verify_wall(files: List[Path], verifier: SignatureVerifier, jobs: int = 1, require_signed: bool = False,
+                stats: Optional[Dict[str, Any]] = None) -> Tuple[int, List[str]]:
     """
-    Проверяет цифровую подпись заметки.
-    Возвращает True, если подпись действительна, иначе False.
+    Проверяет подписи заметок и возвращает (число файлов, ошибки).
+    Неподписанные заметки - ошибка только при require_signed.
     """
-    # TODO: Извлечь payload, подпись и публичный ключ из signed_note
-    # payload = json.dumps(signed_note["payload"], sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
-    # signature = HexEncoder.decode(signed_note["signature"])
-    # public_key_b64 = signed_note["author"]["public_key_b64"]
-    # verify_key = VerifyKey(base64.b64decode(public_key_b64))
-
-    try:
-        # TODO: Выполнить проверку подписи
-        # verify_key.verify(payload, signature)
-        # print("Псевдокод: Подпись действительна.")
-        return True # Заглушка
-    except Exception: # BadSignatureError
-        # print("Псевдокод: Подпись недействительна.")
-        return False # Заглушка
+    started = time.perf_counter()
+    paths, notes, errors = load_notes(files)
+    load_s = time.perf_counter() - started
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Verify a Wall note's digital signature.")
-    parser.add_argument("--note", required=True, help="Path to the signed note JSON file.")
-    
+    verify_started = time.perf_counter()
+    results = verifier.verify_many(notes, jobs=jobs)
+    verify_s = time.perf_counter() - verify_started
+
+    unsigned = 0
+    for path, check in zip(paths, results):
+        if check.scheme is None:
+            unsigned += 1
+            if require_signed:
+                errors.append(f"{path}: {check.reason}")
+        elif not check.valid:
+            errors.append(f"{path}: {check.scheme}: {check.reason}")
+
+    if stats is not None:
+        stats.update({
+            "files": len(files),
+            "jobs": jobs,
+            "valid": sum(1 for check in results if check.valid),
+            "cached": sum(1 for check in results if check.cached),
+            "unsigned": unsigned,
+            "errors": len(errors),
+            "load_s": round(load_s, 4),
+            "verify_s": round(verify_s, 4),
+            "notes_per_s": round(len(notes) / verify_s, 1) if verify_s > 0 else None,
+        })
+    return len(files), errors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Verify WALL note signatures")
+    parser.add_argument("--note", action="append", help="Signed note JSON file (repeatable); default: whole wall")
+    parser.add_argument("--base", type=str, default=".", help="Project root containing wall/ and CONTEXT_SEED.json")
+    parser.add_argument("--seedfile", type=str, help="Seed with public_keys (default: <base>/CONTEXT_SEED.json)")
+    parser.add_argument("--jobs", type=int, default=1, help="Worker processes (0 = CPU count)")
+    parser.add_argument("--cache", type=str, help="File of already verified signatures, updated after the run")
+    parser.add_argument("--require-signed", action="store_true", help="Treat unsigned notes as errors")
+    parser.add_argument("--stats", type=str, help="Write JSON stats to this file ('-' for stdout)")
     args = parser.parse_args()
 
-    try:
-        with open(args.note, 'r', encoding='utf-8') as f:
-            note_data = json.load(f)
-        
-        if verify_signature_pseudocode(note_data):
-            print(f"Подпись заметки в {args.note} действительна.")
-        else:
-            print(f"Подпись заметки в {args.note} НЕ действительна.")
-            exit(1)
-    except FileNotFoundError:
-        print(f"Ошибка: Файл заметки не найден по пути: {args.note}")
-        exit(1)
-    except json.JSONDecodeError:
-        print(f"Ошибка: Неверный формат JSON в файле: {args.note}")
-        exit(1)
-    except Exception as e:
-        print(f"Произошла непредвиденная ошибка: {e}")
-        exit(1)
+    base = Path(args.base).resolve()
+    if args.note:
+        files = [Path(note) for note in args.note]
+    else:
+        files = sorted((base / "wall" / "threads").glob(NOTES_GLOB))
+    public_keys = load_seed_public_keys(args.seedfile or str(base / "CONTEXT_SEED.json"))
+    verifier = SignatureVerifier(public_keys=public_keys, cache=VerifiedSignatureCache(max_size=10_000_000, path=args.cache))
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+
+    stats: Dict[str, Any] = {}
+    count, errors = verify_wall(files, verifier, jobs=jobs, require_signed=args.require_signed, stats=stats)
+    if args.stats == "-":
+        print(json.dumps(stats))
+    elif args.stats:
+        Path(args.stats).write_text(json.dumps(stats, indent=2), encoding="utf-8")
+
+    if errors:
+        print("FAIL", len(errors), "errors of", count, "files")
+        for err in errors:
+            print("-", err)
+        raise SystemExit(1)
+    print("OK", count)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,235 @@
 import asyncio
 import argparse
+import json
 import os
-from typing import Dict, Any, Optional
+import time
+import zipfile
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
 
-# from ..mcp.tools.git_tools import GitTools # TODO: Импортировать GitTools
-# from ..mcp.tools.wall_tools import WallManager # TODO: Импортировать WallManager
+from mcp.tools.git_tools import GitTools
+from mcp.tools.wall_index import INDEX_DIR_NAME
+from mcp.tools.wall_storage import SEGMENTS_DIR_NAME
+from mcp.tools.wall_snapshot import SnapshotError, SnapshotReader, bootstrap_wall, create_next_snapshot, restore_snapshot
 
-async def archive_wall_pseudocode(
+# .index/archiver.state: хеши деревьев тредов после прошлого запуска. Не .json, чтобы glob "**/*.json"
+# валидатора и проверки подписей не принимал состояние архиватора за заметку
+ARCHIVER_STATE_NAME = "archiver.state"
+LEGACY_ARCHIVER_STATE_NAME = "archiver.json"
+DEFAULT_CONCURRENCY = int(os.getenv("WALL_ARCHIVER_CONCURRENCY", "4"))
+
+
+def discover_threads(base_wall_path: str) -> Tuple[List[str], List[str]]:
+    """
+    Треды стены: (git-репозитории, директории с заметками без репозитория). Директории без
+    файлов (например, user_profiles) - пространства имен, треды ищутся внутри них.
+    """
+    repos: List[str] = []
+    unversioned: List[str] = []
+
+    def walk(relpath: str) -> None:
+        path = os.path.join(base_wall_path, relpath)
+        for name in sorted(os.listdir(path)):
+            child = os.path.join(path, name)
+            if name.startswith(".") or not os.path.isdir(child):
+                continue
+            thread_id = f"{relpath}/{name}" if relpath else name
+            if os.path.exists(os.path.join(child, ".git")):
+                repos.append(thread_id)
+            elif os.path.isdir(os.path.join(child, SEGMENTS_DIR_NAME)) or any(
+                    not entry.startswith(".") and os.path.isfile(os.path.join(child, entry)) for entry in os.listdir(child)):
+                unversioned.append(thread_id)
+            else:
+                walk(thread_id)
+
+    if os.path.isdir(base_wall_path):
+        walk("")
+    return repos, unversioned
+
+
+def load_archiver_state(path: str) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.loads(f.read()).get("threads", {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def save_archiver_state(path: str, threads: Dict[str, Dict[str, Any]]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        f.write(json.dumps({"threads": threads}, ensure_ascii=False, sort_keys=True))
+    os.replace(path + ".tmp", path)
+    try:
+        os.remove(os.path.join(os.path.dirname(path), LEGACY_ARCHIVER_STATE_NAME))  # Состояние под прежним именем
+    except OSError:
+        pass
+
+
+async def sync_thread(git_tools: GitTools, thread_id: str, previous: Optional[Dict[str, Any]], message: str,
+                      remote_url: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Синхронизирует один тред: pull, если в origin есть новые коммиты, и commit/push, если тред
+    изменился локально. Тред, у которого с прошлого запуска не изменились ни дерево файлов,
+    ни HEAD, ни origin, пропускается. remote_url - origin для треда, еще не бывшего репозиторием.
+    """
+    result: Dict[str, Any] = {"thread_id": thread_id}
+    if remote_url is not None:
+        init_result = await git_tools.init_repo(thread_id)
+        if init_result["status"] == "success":
+            init_result = await git_tools.add_remote(thread_id, remote_url)
+        if init_result["status"] != "success":
+            return {**result, "status": "error", "message": init_result.get("message")}
+
+    tree = await git_tools.tree_hash(thread_id)
+    head = await git_tools.head(thread_id)
+    remote = await git_tools.remote_head(thread_id)
+    if tree is None or remote["status"] != "success":
+        return {**result, "status": "error", "message": remote.get("message", "tree hash failed")}
+    if previous and previous.get("tree") == tree and previous.get("head") == head == remote["head"]:
+        return {**result, "status": "skipped", "state": previous}
+
+    result.update(pulled=0, pushed=False)
+    if remote["head"] is not None and remote["head"] != head:
+        pull_result = await git_tools.pull_repo(thread_id)
+        if pull_result["status"] != "success":
+            return {**result, "status": "error", "message": pull_result.get("message")}
+        changed = pull_result.get("changed_files")
+        result["pulled"] = len(changed) if changed is not None else None
+
+    if previous is None or previous.get("tree") != tree or previous.get("head") != head or remote["head"] is None:
+        push_result = await git_tools.commit_and_push(thread_id, message)
+        if push_result["status"] != "success":
+            return {**result, "status": "error", "message": push_result.get("message")}
+        result["pushed"] = True
+
+    result["state"] = {"tree": await git_tools.tree_hash(thread_id), "head": await git_tools.head(thread_id)}
+    result["status"] = "synced"
+    return result
+
+
+async def archive_wall(
     base_wall_path: str = "Sdominanta.net/wall/threads",
-    remote_repo_url: Optional[str] = None
+    remote_repo_url: Optional[str] = None,
+    concurrency: Optional[int] = None,
+    state_path: Optional[str] = None,
+    git_tools: Optional[GitTools] = None,
 ) -> Dict[str, Any]:
     """
-    Архивирует и синхронизирует данные Стены с удаленным Git-репозиторием.
-    """
-    # git_tools = GitTools(base_repo_path=base_wall_path) # Инициализация GitTools
-    # wall_manager = WallManager(base_wall_path=base_wall_path) # Инициализация WallManager
+    Архивирует и синхронизирует данные Стены с удаленными Git-репозиториями.
 
-    print(f"Псевдокод: Запуск архивации и синхронизации Стены из {base_wall_path}...")
+    Каждый тред - отдельный репозиторий. Треды синхронизируются параллельно, не больше
+    concurrency одновременно (WALL_ARCHIVER_CONCURRENCY). Хеши деревьев и HEAD тредов
+    запоминаются в state_path (по умолчанию .index/archiver.state), и неизменившиеся треды
+    при следующем запуске пропускаются. Тред без репозитория инициализируется с origin
+    <remote_repo_url>/<тред>.git, если задан remote_repo_url. Результат содержит статус и
+    время синхронизации каждого треда.
+    """
+    git_tools = git_tools or GitTools(base_repo_path=base_wall_path)
+    state_path = state_path or os.path.join(base_wall_path, INDEX_DIR_NAME, ARCHIVER_STATE_NAME)
+    previous = load_archiver_state(state_path)
+    repos, unversioned = discover_threads(base_wall_path)
+    semaphore = asyncio.Semaphore(max(1, concurrency or DEFAULT_CONCURRENCY))
+    message = f"Auto archive {datetime.utcnow().isoformat()}"
+    print(f"WallArchiver: Синхронизация {len(repos)} тредов из {base_wall_path}...")
 
-    # TODO: Пройтись по всем тредам (Git-репозиториям) на стене
-    # Для каждого треда:
-    # 1. Выполнить git pull, чтобы получить последние изменения
-    # 2. Выполнить git add, git commit и git push, чтобы отправить новые локальные изменения
-    #    (это предполагает, что Мост или агенты уже создали/обновили файлы)
+    async def run(thread_id: str, remote_url: Optional[str]) -> Dict[str, Any]:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await sync_thread(git_tools, thread_id, previous.get(thread_id), message, remote_url)
+            except Exception as e:
+                result = {"thread_id": thread_id, "status": "error", "message": str(e)}
+            result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        print(f"WallArchiver: {thread_id}: {result['status']} за {result['elapsed_ms']} мс"
+              + (f" ({result['message']})" if result.get("message") else ""))
+        return result
 
-    # Заглушка для демонстрации
-    mock_thread_ids = ["general", "research", "user_profiles/testuser"] 
+    started = time.perf_counter()
+    jobs = [run(thread_id, None) for thread_id in repos]
     results = []
+    for thread_id in unversioned:
+        if remote_repo_url:
+            jobs.append(run(thread_id, f"{remote_repo_url.rstrip('/')}/{thread_id}.git"))
+        else:
+            results.append({"thread_id": thread_id, "status": "no_repo", "elapsed_ms": 0.0})
+    results = list(await asyncio.gather(*jobs)) + results
 
-    for thread_id in mock_thread_ids:
-        # TODO: Реализовать Git pull
-        # pull_result = await git_tools.pull_repo(thread_id)
-        # print(f"Псевдокод: Pull для треда {thread_id}: {pull_result['status']}")
+    # Треды с ошибкой не запоминаются: в следующий раз они синхронизируются полностью
+    save_archiver_state(state_path, {r["thread_id"]: r.pop("state") for r in results if "state" in r})
+    counts = {status: sum(r["status"] == status for r in results) for status in ("synced", "skipped", "error", "no_repo")}
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    print(f"WallArchiver: Синхронизировано {counts['synced']}, пропущено {counts['skipped']}, "
+          f"ошибок {counts['error']} за {elapsed_ms} мс.")
+    return {"status": "success" if not counts["error"] else "error", "results": results,
+            "counts": counts, "elapsed_ms": elapsed_ms}
 
-        # TODO: Реализовать Git add, commit, push
-        # commit_push_result = await git_tools.commit_and_push(thread_id, f"Auto archive {datetime.utcnow().isoformat()}")
-        # print(f"Псевдокод: Commit/Push для треда {thread_id}: {commit_push_result['status']}")
-        
-        results.append({"thread_id": thread_id, "status": "synced_mock"}) # Заглушка
 
-    print("Псевдокод: Архивация и синхронизация Стены завершены.")
-    return {"status": "success", "results": results}
+def snapshot_wall(base_wall_path: str, out_dir: str, full: bool = False, store: bool = False) -> Dict[str, Any]:
+    """
+    Пишет в out_dir следующий снимок стены (mcp/tools/wall_snapshot.py): дельту от последнего
+    снимка каталога или полный, если снимков нет или задан full.
+    """
+    path, manifest = create_next_snapshot(
+        base_wall_path, out_dir, delta=not full,
+        compression=zipfile.ZIP_STORED if store else zipfile.ZIP_DEFLATED,
+        compresslevel=None if store else 6,
+    )
+    print(f"Снимок {manifest['snapshot']} ({'дельта' if manifest['base'] else 'полный'}): {path}, "
+          f"файлов в архиве {len(manifest['entries'])}, удалено {len(manifest['deleted'])}, "
+          f"размер {os.path.getsize(path)} байт")
+    return {"status": "success", "path": path, "snapshot": manifest["snapshot"], "tree_sha256": manifest["tree_sha256"]}
+
+
+def verify_snapshot(path: str) -> Dict[str, Any]:
+    """Проверяет sha256 всех файлов снимка по его манифесту."""
+    with SnapshotReader(path) as reader:
+        errors = reader.verify()
+        manifest = reader.manifest
+    status = "success" if not errors else "error"
+    print(f"Снимок {manifest['snapshot']}: {'поврежден' if errors else 'цел'}")
+    for error in errors:
+        print(f"  {error}")
+    return {"status": status, "snapshot": manifest["snapshot"], "errors": errors}
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Archive and synchronize Wall data with Git repository.")
     parser.add_argument("--base-path", default="Sdominanta.net/wall/threads", help="Base path to Wall threads.")
-    parser.add_argument("--remote-url", help="Remote Git repository URL for archiving.")
-    
+    parser.add_argument("--remote-url", help="Base URL for remotes of threads that are not git repositories yet.")
+    parser.add_argument("--concurrency", type=int, help="Threads synced in parallel (WALL_ARCHIVER_CONCURRENCY).")
+    commands = parser.add_subparsers(dest="command")
+    snapshot_parser = commands.add_parser("snapshot", help="Write the next wall snapshot (delta from the last one).")
+    snapshot_parser.add_argument("--out-dir", required=True, help="Directory with snapshots.")
+    snapshot_parser.add_argument("--full", action="store_true", help="Write a full snapshot even if a base exists.")
+    snapshot_parser.add_argument("--store", action="store_true", help="Do not compress (zero-copy reads via mmap).")
+    restore_parser = commands.add_parser("restore", help="Restore the wall from a snapshot or bring it up to date.")
+    restore_parser.add_argument("source", help="Full snapshot file or directory with snapshots.")
+    verify_parser = commands.add_parser("verify", help="Check snapshot checksums.")
+    verify_parser.add_argument("path", help="Snapshot file.")
+
     args = parser.parse_args()
 
     try:
-        asyncio.run(archive_wall_pseudocode(base_wall_path=args.base_path, remote_repo_url=args.remote_url))
+        if args.command == "snapshot":
+            snapshot_wall(args.base_path, args.out_dir, full=args.full, store=args.store)
+        elif args.command == "restore":
+            if os.path.isdir(args.source):
+                print(json.dumps(bootstrap_wall(args.base_path, args.source), ensure_ascii=False))
+            else:
+                restore_snapshot(args.source, args.base_path)
+                print(f"Стена восстановлена из {args.source}")
+        elif args.command == "verify":
+            if verify_snapshot(args.path)["status"] != "success":
+                exit(1)
+        else:
+            result = asyncio.run(archive_wall(base_wall_path=args.base_path, remote_repo_url=args.remote_url,
+                                              concurrency=args.concurrency))
+            if result["status"] != "success":
+                exit(1)
+    except SnapshotError as e:
+        print(f"Ошибка снимка: {e}")
+        exit(1)
     except KeyboardInterrupt:
         print("\nАрхивация прервана.")
     except Exception as e:
@@ -20,6 +20,10 @@ setup(
         'python-dotenv',
         'httpx',
     ],
+    extras_require={
+        'ws': ['msgpack', 'cbor2'],
+        'fast-json': ['orjson'],
+    },
     entry_points={
         'console_scripts': [
             'sdom-mcp=mcp.main:main',
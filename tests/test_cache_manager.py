@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Тесты для bridge.cache_manager
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from bridge.cache_manager import LRUCache, cached_async
+
+
+class TestLRUCache:
+    """Тесты LRUCache"""
+
+    def test_evicts_least_recently_used(self):
+        """Вытесняется запись, к которой дольше всего не обращались"""
+        cache = LRUCache(max_size=3)
+        for key in ("a", "b", "c"):
+            cache.put(key, key)
+        cache.get("a")
+        cache.put("d", "d")
+
+        assert cache.get("b") is None
+        assert [cache.get(k) for k in ("a", "c", "d")] == ["a", "c", "d"]
+        assert cache.stats()["evictions"] == 1
+
+    def test_overwrite_does_not_evict(self):
+        """Перезапись существующего ключа не вытесняет другие записи"""
+        cache = LRUCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.put("a", 3)
+
+        assert cache.get("a") == 3
+        assert cache.get("b") == 2
+
+    def test_hit_and_miss_counters(self):
+        """hit_rate считается по реальным попаданиям и промахам"""
+        cache = LRUCache(max_size=10)
+        cache.put("a", 1)
+        cache.get("a")
+        cache.get("a")
+        cache.get("missing")
+
+        stats = cache.stats()
+        assert stats["hits"] == 2
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 2 / 3
+
+    def test_expired_entry_is_a_miss(self):
+        cache = LRUCache(max_size=10, default_ttl=0)
+        cache.put("a", 1)
+        time.sleep(0.01)
+
+        assert cache.get("a") is None
+        assert cache.stats()["misses"] == 1
+        assert cache.stats()["size"] == 0
+
+    def test_byte_size_bound(self):
+        """При max_bytes кэш ограничен суммарным размером значений"""
+        cache = LRUCache(max_size=1000, max_bytes=100)
+        for i in range(10):
+            cache.put(f"k{i}", "x" * 30)  # ~32 байта в JSON
+
+        stats = cache.stats()
+        assert stats["bytes"] <= 100
+        assert stats["size"] == 3
+        assert cache.get("k9") is not None
+
+        cache.put("huge", "x" * 1000)
+        assert cache.get("huge") is None
+
+
+class TestCachedAsync:
+    """Тесты декоратора cached_async"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_misses_are_coalesced(self):
+        """Одновременные промахи по одному ключу выполняют функцию один раз"""
+        cache = LRUCache(max_size=10)
+        calls = 0
+
+        @cached_async(cache, ttl=60)
+        async def load(thread_id):
+            nonlocal calls
+            calls += 1
+            result = [thread_id, calls]
+            await asyncio.sleep(0.05)
+            return result
+
+        results = await asyncio.gather(*(load("general") for _ in range(20)), load("other"))
+
+        assert calls == 2
+        assert all(r == ["general", 1] for r in results[:20])
+        assert load.in_flight == {}
+
+    @pytest.mark.asyncio
+    async def test_exception_is_shared_and_not_cached(self):
+        cache = LRUCache(max_size=10)
+        calls = 0
+
+        @cached_async(cache, ttl=60)
+        async def load():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(load(), load(), load(), return_exceptions=True)
+        assert calls == 1
+        assert all(isinstance(r, ValueError) for r in results)
+
+        with pytest.raises(ValueError):
+            await load()
+        assert calls == 2
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_does_not_cancel_computation(self):
+        cache = LRUCache(max_size=10)
+
+        @cached_async(cache, ttl=60)
+        async def load():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        first = asyncio.create_task(load())
+        second = asyncio.create_task(load())
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        assert await second == "done"
+
+    @pytest.mark.asyncio
+    async def test_stale_while_revalidate(self):
+        """Истекшее значение отдается сразу, обновление идет одной фоновой задачей"""
+        cache = LRUCache(max_size=10)
+        calls = 0
+
+        @cached_async(cache, ttl=0, stale_while_revalidate=60)
+        async def load():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.02)
+            return calls
+
+        assert await load() == 1
+        await asyncio.sleep(0.01)
+
+        stale = await asyncio.gather(*(load() for _ in range(10)))
+        assert stale == [1] * 10
+        assert cache.stats()["stale_hits"] == 10
+
+        await asyncio.sleep(0.05)
+        assert calls == 2
+        assert await load() == 2
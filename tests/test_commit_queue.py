@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Тесты для фоновой очереди Git-коммитов стены
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from bridge.api.wall import WallAPI
+from bridge.commit_queue import GitCommitQueue
+from bridge.main import app
+
+
+def make_git_tools(status="success"):
+    git_tools = Mock()
+    git_tools.base_repo_path = "wall"
+    git_tools.commit_and_push = AsyncMock(return_value={"status": status, "message": "boom"})
+    return git_tools
+
+
+class TestGitCommitQueue:
+    """Тесты GitCommitQueue"""
+
+    @pytest.mark.asyncio
+    async def test_notes_within_window_share_one_commit(self):
+        """Заметки внутри окна уходят одним коммитом"""
+        git_tools = make_git_tools()
+        queue = GitCommitQueue(git_tools, batch_window=0.05, batch_size=100)
+
+        for i in range(5):
+            await queue.enqueue(f"n{i}", "general", f"threads/general/n{i}.json")
+        assert queue.queue_depth == 5
+        assert queue.get_status("n0")["status"] == "pending"
+
+        await queue.stop()
+        git_tools.commit_and_push.assert_awaited_once()
+        assert len(git_tools.commit_and_push.call_args.kwargs["files_to_add"]) == 5
+        assert queue.get_status("n4")["status"] == "committed"
+        assert queue.queue_depth == 0
+
+    @pytest.mark.asyncio
+    async def test_batch_size_splits_commits(self):
+        """Пачка ограничена batch_size"""
+        git_tools = make_git_tools()
+        queue = GitCommitQueue(git_tools, batch_window=10, batch_size=2)
+
+        for i in range(5):
+            await queue.enqueue(f"n{i}", "general", "threads/general/segments")
+        await queue.stop()
+
+        assert git_tools.commit_and_push.await_count == 3
+        # Один и тот же путь добавляется в git один раз
+        assert git_tools.commit_and_push.call_args_list[0].kwargs["files_to_add"] == ["threads/general/segments"]
+
+    @pytest.mark.asyncio
+    async def test_failed_commit_is_retried_then_marked_failed(self):
+        """После max_attempts неудач заметка помечается failed"""
+        git_tools = make_git_tools(status="error")
+        queue = GitCommitQueue(git_tools, batch_window=0, batch_size=10, max_attempts=2)
+
+        await queue.enqueue("n0", "general", "threads/general/n0.json")
+        await queue.stop()
+
+        status = queue.get_status("n0")
+        assert status["status"] == "failed"
+        assert status["attempts"] == 2
+        assert status["error"] == "boom"
+        assert queue.stats()["failed_notes"] == 1
+
+    @pytest.mark.asyncio
+    async def test_pull_waits_for_commit(self, tmp_path, monkeypatch):
+        """git pull стены не выполняется одновременно с коммитом пачки"""
+        monkeypatch.setenv("WALL_PATH", str(tmp_path))
+        monkeypatch.setenv("WALL_STORAGE_BACKEND", "files")
+        log = []
+
+        async def commit_and_push(**kwargs):
+            log.append("commit_start")
+            await asyncio.sleep(0.05)
+            log.append("commit_end")
+            return {"status": "success"}
+
+        async def pull_repo(repo_name):
+            log.append("pull")
+            return {"status": "success", "changed_files": []}
+
+        git_tools = make_git_tools()
+        git_tools.commit_and_push, git_tools.pull_repo = commit_and_push, pull_repo
+        queue = GitCommitQueue(git_tools, batch_window=0, batch_size=10)
+        wall = WallAPI(git_tools=git_tools, commit_queue=queue)
+
+        await queue.enqueue("n0", "general", "threads/general/n0.json")
+        while not log:
+            await asyncio.sleep(0.001)
+        await wall.pull_wall()
+        await queue.stop()
+        assert log == ["commit_start", "commit_end", "pull"]
+
+
+class TestPublishPipeline:
+    """Тесты публикации через очередь"""
+
+    def test_publish_returns_before_commit(self, tmp_path, monkeypatch):
+        """publish_note не ждет git: заметка на диске, коммит в очереди"""
+        monkeypatch.setenv("WALL_PATH", str(tmp_path / "threads"))
+        git_tools = make_git_tools()
+        git_tools.base_repo_path = str(tmp_path)
+        wall_api = WallAPI(git_tools=git_tools, commit_queue=GitCommitQueue(git_tools, batch_window=60))
+
+        async def publish():
+            result = await wall_api.publish_note("author", "general", {"id": "n1", "content": "hi"})
+            status = wall_api.get_commit_status("n1")
+            await wall_api.commit_queue.stop()
+            return result, status
+
+        result, status = asyncio.run(publish())
+        assert result["git_status"] == "queued"
+        assert status["status"] == "pending"
+        assert (tmp_path / "threads" / "general" / "n1.json").exists()
+        assert git_tools.commit_and_push.call_args.kwargs["files_to_add"] == ["threads/general/n1.json"]
+
+    def test_commit_status_endpoint(self):
+        """Эндпоинт статуса коммита заметки"""
+        client = TestClient(app)
+        with patch('bridge.main.wall_api') as mock_wall_api:
+            mock_wall_api.fetch_commit_status = AsyncMock(return_value={"note_id": "n1", "status": "committed"})
+            response = client.get("/api/v1/wall/notes/n1/commit")
+            assert response.status_code == 200
+            assert response.json()["status"] == "committed"
+
+            mock_wall_api.fetch_commit_status = AsyncMock(return_value=None)
+            assert client.get("/api/v1/wall/notes/unknown/commit").status_code == 404
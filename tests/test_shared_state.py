@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Тесты разделяемого состояния bridge (хаб на Unix-сокете и его клиенты)
+"""
+
+import asyncio
+import socket
+import tempfile
+import threading
+import time
+
+import pytest
+
+from bridge.cache_manager import LRUCache, cached_async
+from bridge.shared_state import (
+    LocalStateBackend, SharedCache, SharedSet, SocketStateBackend, StateBackendError, StateHub, create_state_backend
+)
+
+
+@pytest.fixture
+def hub():
+    """Хаб в отдельном потоке со своим event loop (клиенты синхронные)"""
+    socket_path = tempfile.mktemp(prefix="sdom-state-", suffix=".sock")
+    hub = StateHub(socket_path)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(hub.start(), loop).result(5)
+    yield hub
+    asyncio.run_coroutine_threadsafe(hub.stop(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestStateBackends:
+    """Тесты бэкендов состояния"""
+
+    def test_local_backend_uses_process_structures(self):
+        backend = create_state_backend("local")
+        assert isinstance(backend, LocalStateBackend)
+        assert isinstance(backend.create_cache("c", max_size=10, default_ttl=60), LRUCache)
+        assert backend.create_set("s") == set()
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            create_state_backend("redis")
+
+    def test_workers_share_cache_and_peers(self, hub):
+        """Два воркера видят одни и те же записи кэша и набор пиров"""
+        worker_a = SocketStateBackend(hub.socket_path)
+        worker_b = SocketStateBackend(hub.socket_path)
+        cache_a = worker_a.create_cache("wall_cache", max_size=10, default_ttl=60)
+        cache_b = worker_b.create_cache("wall_cache", max_size=10, default_ttl=60)
+        assert isinstance(cache_a, SharedCache)
+
+        cache_a.put("k", [{"id": "n1"}])
+        assert cache_b.get("k") == [{"id": "n1"}]
+        assert cache_b.stats()["hits"] == 1
+        cache_b.clear()
+        assert cache_a.get("k") is None
+
+        peers_a, peers_b = worker_a.create_set("known_peers"), worker_b.create_set("known_peers")
+        assert isinstance(peers_a, SharedSet)
+        peers_a.add("peer1")
+        assert "peer1" in peers_b
+        assert len(peers_b) == 1
+        assert list(peers_b) == ["peer1"]
+
+        worker_a.close()
+        worker_b.close()
+
+    def test_versions_are_shared_and_monotonic(self, hub):
+        worker_a = SocketStateBackend(hub.socket_path)
+        worker_b = SocketStateBackend(hub.socket_path)
+
+        first = worker_a.version_bump("general")
+        second = worker_b.version_bump("*")
+        assert second > first
+        assert worker_b.version_get("general") == first
+        assert worker_a.version_get("general", "*") == second
+        assert worker_a.version_get("unknown") == 0
+
+        # Счетчик seq событий общий: номера не повторяются между воркерами
+        assert [worker_a.incr("p2p_seq"), worker_b.incr("p2p_seq"), worker_a.incr("p2p_seq")] == [1, 2, 3]
+
+    def test_role_is_released_on_disconnect(self, hub):
+        """Роль слушателя P2P достается одному воркеру и переходит после его остановки"""
+        worker_a = SocketStateBackend(hub.socket_path)
+        worker_b = SocketStateBackend(hub.socket_path)
+
+        assert worker_a.try_acquire("p2p_listener")
+        assert worker_a.try_acquire("p2p_listener")
+        assert not worker_b.try_acquire("p2p_listener")
+
+        worker_a.close()
+        assert wait_for(lambda: worker_b.try_acquire("p2p_listener"))
+
+    def test_cache_survives_missing_hub(self):
+        """Без хаба разделяемый кэш работает как пустой, а не роняет запрос"""
+        backend = SocketStateBackend(tempfile.mktemp(suffix=".sock"))
+        cache = backend.create_cache("api_cache", max_size=10, default_ttl=60)
+        cache.put("k", 1)
+        assert cache.get("k") is None
+        assert cache.get_stale("k") == (None, False)
+
+    def test_set_and_versions_survive_missing_hub(self):
+        """Множество и версии деградируют так же, как кэш; роль без хаба не захватить"""
+        backend = SocketStateBackend(tempfile.mktemp(suffix=".sock"))
+        peers = backend.create_set("known_peers")
+        peers.add("peer1")
+        assert "peer1" not in peers and len(peers) == 0 and list(peers) == []
+        assert backend.version_bump("general") == 0 and backend.version_get("general") == 0
+        assert backend.incr("p2p_seq") is None
+        with pytest.raises(StateBackendError):
+            backend.try_acquire("p2p_listener")
+
+    @pytest.mark.asyncio
+    async def test_hung_hub_does_not_block_loop(self):
+        """Хаб, который принял соединение и молчит, не останавливает event loop воркера"""
+        socket_path = tempfile.mktemp(suffix=".sock")
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen()
+        backend = SocketStateBackend(socket_path, timeout=0.5)
+        peers = backend.create_set("known_peers")
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        started = time.monotonic()
+        assert not await backend.run(peers.__contains__, "peer1")  # Ждет ответа timeout
+        assert await backend.run(backend.incr, "p2p_seq") is None  # Повторное подключение отложено
+        elapsed = time.monotonic() - started
+        task.cancel()
+        assert 0.5 <= elapsed < 0.9 and ticks >= 20
+        backend.close()
+        server.close()
+
+    @pytest.mark.asyncio
+    async def test_publish_without_hub_is_delivered_locally(self):
+        backend = SocketStateBackend(tempfile.mktemp(suffix=".sock"))
+        received = []
+
+        async def deliver(message):
+            received.append(message)
+
+        backend.subscribe("p2p_events", deliver)
+        await backend.publish("p2p_events", {"id": "e1"})
+        assert received == [{"id": "e1"}]
+        backend.close()
+
+    @pytest.mark.asyncio
+    async def test_broadcast_reaches_every_worker(self, hub):
+        """Сообщение канала получают подписчики во всех воркерах, включая отправителя"""
+        received = {"a": [], "b": []}
+        workers = {}
+        for name in received:
+            worker = SocketStateBackend(hub.socket_path)
+
+            async def deliver(message, name=name):
+                received[name].append(message)
+
+            worker.subscribe("p2p_events", deliver)
+            worker.start()
+            workers[name] = worker
+
+        # Ждем, пока оба соединения-подписки зарегистрируются в хабе
+        for _ in range(200):
+            if len(hub.subscribers.get("p2p_events", ())) == 2:
+                break
+            await asyncio.sleep(0.01)
+
+        await workers["a"].publish("p2p_events", {"id": "e1"})
+        for _ in range(200):
+            if received["a"] and received["b"]:
+                break
+            await asyncio.sleep(0.01)
+
+        assert received == {"a": [{"id": "e1"}], "b": [{"id": "e1"}]}
+        for worker in workers.values():
+            worker.close()
+
+    @pytest.mark.asyncio
+    async def test_cached_async_over_shared_cache(self, hub):
+        worker_a = SocketStateBackend(hub.socket_path)
+        worker_b = SocketStateBackend(hub.socket_path)
+        calls = 0
+
+        async def load(thread_id):
+            nonlocal calls
+            calls += 1
+            return [thread_id]
+
+        load_a = cached_async(worker_a.create_cache("wall_cache", 10, 60), ttl=60)(load)
+        load_b = cached_async(worker_b.create_cache("wall_cache", 10, 60), ttl=60)(load)
+
+        assert await load_a("general") == ["general"]
+        assert await load_b("general") == ["general"]
+        assert calls == 1
+
+
+class TestWallWriter:
+    """Стену пишет один воркер; остальные передают ему публикации и запросы статуса коммита"""
+
+    @staticmethod
+    async def make_walls(hub, tmp_path, monkeypatch):
+        from unittest.mock import AsyncMock, Mock
+        from bridge.api.wall import WALL_WRITER_CHANNEL, WallAPI
+
+        monkeypatch.setenv("WALL_PATH", str(tmp_path))
+        monkeypatch.setenv("WALL_STORAGE_BACKEND", "files")
+        monkeypatch.setenv("WALL_VERIFY_SIGNATURES", "off")
+        walls = []
+        for _ in range(2):
+            state = SocketStateBackend(hub.socket_path)
+            wall = WallAPI(git_tools=AsyncMock(), state=state)
+            wall.git_tools.base_repo_path = str(tmp_path)
+            wall.commit_queue = Mock(enqueue=AsyncMock(), get_status=Mock(return_value={"status": "pending"}))
+            state.start()
+            walls.append(wall)
+        assert walls[0].elect_writer() and not walls[1].elect_writer()
+        for _ in range(200):
+            if len(hub.subscribers.get(WALL_WRITER_CHANNEL, ())) == 2:
+                break
+            await asyncio.sleep(0.01)
+        return walls
+
+    @pytest.mark.asyncio
+    async def test_publish_is_forwarded_to_writer(self, hub, tmp_path, monkeypatch):
+        from unittest.mock import AsyncMock
+        from bridge.api.wall import WallAPI
+
+        walls = await self.make_walls(hub, tmp_path, monkeypatch)
+        writer, follower = walls
+
+        result = await follower.publish_note("a", "general", {"id": "n1", "created_at": 1700000000})
+        assert result["status"] == "note_published"
+        assert (await follower.publish_note("a", "general", {"id": "n1", "created_at": 1700000000}))["status"] \
+            == "note_duplicate"
+        writer.commit_queue.enqueue.assert_awaited_once()
+        follower.commit_queue.enqueue.assert_not_called()
+        assert await follower.fetch_commit_status("n1") == {"status": "pending"}
+
+        monkeypatch.setenv("WALL_STORAGE_BACKEND", "segments")
+        segments = WallAPI(git_tools=AsyncMock(), state=SocketStateBackend(hub.socket_path))
+        with pytest.raises(RuntimeError):
+            segments.elect_writer()
+        for wall in walls + [segments]:
+            wall.state.close()
+            wall.storage.close()
+
+    @pytest.mark.asyncio
+    async def test_lost_lease_demotes_writer(self, hub, tmp_path, monkeypatch):
+        """Писатель, чью роль хаб отдал другому воркеру за время обрыва, перестает писать стену"""
+        writer, follower = await self.make_walls(hub, tmp_path, monkeypatch)
+        writer.state._sock.close()  # Обрыв соединения: хаб освобождает роль
+        for _ in range(200):
+            if follower.elect_writer():
+                break
+            await asyncio.sleep(0.01)
+        assert follower.is_writer
+
+        result = await writer.publish_note("a", "general", {"id": "n1", "created_at": 1700000000})
+        assert result["status"] == "note_published" and not writer.is_writer
+        follower.commit_queue.enqueue.assert_awaited_once()
+        writer.commit_queue.enqueue.assert_not_called()
+        for wall in (writer, follower):
+            wall.state.close()
+            wall.storage.close()
@@ -0,0 +1,79 @@
+"""
+Тесты проверки заметок стены по схеме (scripts/validate_wall_notes.py)
+"""
+
+import json
+import subprocess
+import pytest
+
+from scripts import validate_wall_notes
+from scripts.validate_wall_notes import validate_notes
+
+SCHEMA = {
+    "$schema": "http://json-schema.org/draft-07/schema#",
+    "type": "object",
+    "required": ["id", "content"],
+    "properties": {"id": {"type": "string"}, "content": {"type": "string"}},
+}
+
+
+def write_note(base, thread, name, note):
+    path = base / "wall" / "threads" / thread / f"{name}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(note), encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def wall(tmp_path):
+    (tmp_path / "wall").mkdir()
+    (tmp_path / "wall" / "WALL_NOTE.schema.json").write_text(json.dumps(SCHEMA), encoding="utf-8")
+    for i in range(5):
+        write_note(tmp_path, "general", f"n{i}", {"id": f"n{i}", "content": "ok"})
+    write_note(tmp_path, "dev", "bad", {"id": 1})
+    return tmp_path
+
+
+class TestValidateWallNotes:
+    """Полная, параллельная и инкрементальная проверка"""
+
+    def test_parallel_matches_serial(self, wall, monkeypatch):
+        serial = validate_notes(wall)
+        monkeypatch.setattr(validate_wall_notes, "PARALLEL_MIN_FILES", 1)
+        stats = {}
+        assert validate_notes(wall, jobs=2, stats=stats) == serial
+        assert serial[0] == 6 and len(serial[1]) == 1 and "bad.json" in serial[1][0]
+        assert stats["files_validated"] == 6 and stats["errors"] == 1 and stats["jobs"] == 2
+
+    def test_manifest_skips_unchanged(self, wall):
+        manifest = wall / "manifest.json"
+        assert validate_notes(wall, manifest_path=manifest)[0] == 6
+
+        # Проверенные без ошибок файлы пропускаются, ошибочный проверяется снова
+        stats = {}
+        count, errors = validate_notes(wall, manifest_path=manifest, stats=stats)
+        assert count == 1 and len(errors) == 1 and stats["files_total"] == 6
+
+        write_note(wall, "general", "n0", {"id": "n0", "content": "changed"})
+        write_note(wall, "dev", "bad", {"id": "bad", "content": "fixed"})
+        assert validate_notes(wall, manifest_path=manifest) == (2, [])
+        assert validate_notes(wall, manifest_path=manifest) == (0, [])
+
+        # Изменение схемы делает манифест недействительным
+        (wall / "wall" / "WALL_NOTE.schema.json").write_text(json.dumps(dict(SCHEMA, title="v2")), encoding="utf-8")
+        assert validate_notes(wall, manifest_path=manifest)[0] == 6
+
+    def test_since_rev(self, wall):
+        def git(*args):
+            subprocess.run(["git", *args], cwd=wall, check=True, capture_output=True)
+
+        git("init", "-q")
+        git("-c", "user.name=t", "-c", "user.email=t@t", "add", ".")
+        git("-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q", "-m", "init")
+        assert validate_notes(wall, since_rev="HEAD") == (0, [])
+
+        write_note(wall, "general", "n1", {"id": "n1"})
+        write_note(wall, "general", "new", {"id": "new", "content": "ok"})
+        (wall / "wall" / "threads" / "general" / "n2.json").unlink()
+        count, errors = validate_notes(wall, since_rev="HEAD")
+        assert count == 2 and len(errors) == 1 and "n1.json" in errors[0]
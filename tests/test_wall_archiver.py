@@ -0,0 +1,152 @@
+"""
+Тесты архиватора стены (scripts/wall_archiver.py) на локальных bare-репозиториях
+"""
+
+import asyncio
+import subprocess
+import pytest
+
+from mcp.tools.git_tools import GitTools
+from scripts.wall_archiver import archive_wall, discover_threads, sync_thread
+
+
+def git(*args, cwd):
+    return subprocess.run(["git", "-c", "user.name=t", "-c", "user.email=t@t", *args], cwd=cwd, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+@pytest.fixture
+def wall(tmp_path, monkeypatch):
+    """Стена из двух тредов-клонов; у каждого свой bare-репозиторий в remotes/"""
+    for name, value in (("GIT_AUTHOR_NAME", "archiver"), ("GIT_AUTHOR_EMAIL", "a@a"),
+                        ("GIT_COMMITTER_NAME", "archiver"), ("GIT_COMMITTER_EMAIL", "a@a")):
+        monkeypatch.setenv(name, value)
+    monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+    monkeypatch.setenv("GIT_CONFIG_KEY_0", "init.defaultBranch")
+    monkeypatch.setenv("GIT_CONFIG_VALUE_0", "main")
+    remotes = tmp_path / "remotes"
+    base = tmp_path / "threads"
+    for thread_id in ("general", "research"):
+        git("init", "--bare", "-b", "main", str(remotes / f"{thread_id}.git"), cwd=tmp_path)
+        git("clone", str(remotes / f"{thread_id}.git"), str(base / thread_id), cwd=tmp_path)
+        (base / thread_id / "n0.json").write_text('{"id":"n0"}')
+    return base, remotes
+
+
+def remote_files(remotes, thread_id):
+    return git("ls-tree", "--name-only", "main", cwd=remotes / f"{thread_id}.git").splitlines()
+
+
+def statuses(result):
+    return {r["thread_id"]: r["status"] for r in result["results"]}
+
+
+class TestWallArchiver:
+    """Параллельная синхронизация тредов и пропуск неизменившихся"""
+
+    def test_incremental_sync(self, wall, tmp_path):
+        base, remotes = wall
+        result = asyncio.run(archive_wall(str(base)))
+        assert result["status"] == "success" and statuses(result) == {"general": "synced", "research": "synced"}
+        assert remote_files(remotes, "general") == ["n0.json"]
+        assert all(r["elapsed_ms"] >= 0 for r in result["results"])
+        # Состояние архиватора не попадает под glob заметок "**/*.json"
+        assert (base / ".index" / "archiver.state").exists()
+        assert not list((base / ".index").glob("*.json"))
+
+        # Ничего не изменилось: ни pull, ни push
+        result = asyncio.run(archive_wall(str(base)))
+        assert statuses(result) == {"general": "skipped", "research": "skipped"}
+
+        # Новая заметка в одном треде и новый коммит в origin другого
+        (base / "general" / "n1.json").write_text('{"id":"n1"}')
+        git("clone", str(remotes / "research.git"), "other", cwd=tmp_path)
+        (tmp_path / "other" / "r1.json").write_text('{"id":"r1"}')
+        git("add", ".", cwd=tmp_path / "other")
+        git("commit", "-m", "r1", cwd=tmp_path / "other")
+        git("push", "origin", "main", cwd=tmp_path / "other")
+
+        result = asyncio.run(archive_wall(str(base)))
+        by_thread = {r["thread_id"]: r for r in result["results"]}
+        assert by_thread["general"]["status"] == "synced" and by_thread["general"]["pushed"]
+        assert by_thread["research"]["status"] == "synced" and by_thread["research"]["pulled"] == 1
+        assert not by_thread["research"]["pushed"]
+        assert remote_files(remotes, "general") == ["n0.json", "n1.json"]
+        assert (base / "research" / "r1.json").exists()
+        assert statuses(asyncio.run(archive_wall(str(base)))) == {"general": "skipped", "research": "skipped"}
+
+    def test_unversioned_thread(self, wall, tmp_path):
+        base, remotes = wall
+        (base / "user_profiles" / "alice").mkdir(parents=True)
+        (base / "user_profiles" / "alice" / "p0.json").write_text('{"id":"p0"}')
+        (base / ".index").mkdir()
+        assert discover_threads(str(base)) == (["general", "research"], ["user_profiles/alice"])
+
+        assert statuses(asyncio.run(archive_wall(str(base))))["user_profiles/alice"] == "no_repo"
+        git("init", "--bare", "-b", "main", str(remotes / "user_profiles" / "alice.git"), cwd=tmp_path)
+        result = asyncio.run(archive_wall(str(base), remote_repo_url=str(remotes)))
+        assert statuses(result)["user_profiles/alice"] == "synced"
+        assert remote_files(remotes, "user_profiles/alice") == ["p0.json"]
+        assert statuses(asyncio.run(archive_wall(str(base))))["user_profiles/alice"] == "skipped"
+
+    def test_failed_thread_is_retried(self, wall):
+        base, remotes = wall
+        (remotes / "research.git").rename(remotes / "moved.git")
+        result = asyncio.run(archive_wall(str(base)))
+        assert result["status"] == "error"
+        assert statuses(result) == {"general": "synced", "research": "error"}
+        (remotes / "moved.git").rename(remotes / "research.git")
+        assert statuses(asyncio.run(archive_wall(str(base)))) == {"general": "skipped", "research": "synced"}
+
+
+class TestTreeHash:
+    """Хеш дерева считается во временном индексе и не трогает индекс репозитория"""
+
+    def test_index_is_untouched(self, wall):
+        base, _ = wall
+        repo = base / "general"
+        git("add", "n0.json", cwd=repo)
+        git("commit", "-m", "n0", cwd=repo)
+        (repo / "n1.json").write_text('{"id":"n1"}')
+        tools = GitTools(base_repo_path=str(base))
+
+        first = asyncio.run(tools.tree_hash("general"))
+        assert first and git("status", "--porcelain", cwd=repo) == "?? n1.json"
+        assert first != git("rev-parse", "HEAD^{tree}", cwd=repo)
+        assert asyncio.run(tools.tree_hash("general")) == first
+        (repo / "n1.json").write_text('{"id":"n1","v":2}')
+        assert asyncio.run(tools.tree_hash("general")) != first
+        assert git("status", "--porcelain", cwd=repo) == "?? n1.json"
+
+
+class TestArchiverConcurrency:
+    """Одновременно синхронизируется не больше concurrency тредов"""
+
+    def test_bounded(self, tmp_path):
+        for i in range(6):
+            (tmp_path / f"t{i}" / ".git").mkdir(parents=True)
+
+        class SlowGit:
+            active = peak = 0
+
+            async def tree_hash(self, thread_id):
+                SlowGit.active += 1
+                SlowGit.peak = max(SlowGit.peak, SlowGit.active)
+                await asyncio.sleep(0.01)
+                SlowGit.active -= 1
+                return "tree"
+
+            async def head(self, thread_id):
+                return "c1"
+
+            async def remote_head(self, thread_id):
+                return {"status": "success", "head": "c1"}
+
+            async def commit_and_push(self, thread_id, message):
+                return {"status": "success"}
+
+        previous = {"tree": "tree", "head": "c1"}
+        assert asyncio.run(sync_thread(SlowGit(), "t0", previous, "m"))["status"] == "skipped"
+        result = asyncio.run(archive_wall(str(tmp_path), concurrency=2, git_tools=SlowGit()))
+        assert result["counts"]["synced"] == 6 and all(not r["pulled"] for r in result["results"])
+        assert SlowGit.peak == 2
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Тесты событийной инвалидации кэша тредов стены
+"""
+
+import subprocess
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from bridge.api.wall import WallAPI
+from bridge.cache_manager import wall_cache
+from bridge.main import app, handle_p2p_message
+from bridge.shared_state import LocalStateBackend
+from mcp.tools.git_tools import GitTools
+
+
+@pytest.fixture
+def wall(tmp_path, monkeypatch):
+    """WallAPI поверх временной стены с замоканным Git"""
+    monkeypatch.setenv("WALL_PATH", str(tmp_path / "threads"))
+    monkeypatch.setenv("WALL_STORAGE_BACKEND", "files")
+    git_tools = Mock()
+    git_tools.base_repo_path = str(tmp_path)
+    git_tools.commit_and_push = AsyncMock(return_value={"status": "success"})
+    return WallAPI(git_tools=git_tools, state=LocalStateBackend())
+
+
+def note(note_id, thread_id="general"):
+    return {"id": note_id, "created_at": f"2024-01-01T00:00:0{note_id[-1]}Z", "tags": [["t", thread_id]], "content": note_id}
+
+
+class TestThreadVersions:
+    """Тесты версий тредов WallAPI"""
+
+    def test_versions_are_per_thread(self, wall):
+        assert wall.thread_version("general") == 0
+        wall.mark_thread_changed("general")
+
+        assert wall.thread_version("general") > 0
+        assert wall.thread_version("other") == 0
+
+        before = wall.thread_version("general")
+        wall.mark_wall_changed()
+        assert wall.thread_version("other") > before
+        assert wall.thread_version("general") > before
+
+    def test_thread_of_path(self, wall):
+        assert wall.thread_of_path("threads/general/n1.json") == "general"
+        assert wall.thread_of_path("threads/general/segments") == "general"
+        assert wall.thread_of_path("README.md") is None
+        assert wall.thread_of_path("threads/.index") is None
+
+    @pytest.mark.asyncio
+    async def test_publish_bumps_version(self, wall):
+        await wall.publish_note("author", "general", note("n1"))
+        assert wall.thread_version("general") > 0
+        assert wall.thread_version("other") == 0
+        await wall.commit_queue.stop()
+
+    @pytest.mark.asyncio
+    async def test_pull_bumps_only_changed_threads(self, wall):
+        wall.git_tools.pull_repo = AsyncMock(return_value={
+            "status": "success", "changed_files": ["threads/news/n1.json", "README.md"]})
+
+        result = await wall.pull_wall()
+        assert result["changed_threads"] == ["news"]
+        assert wall.thread_version("news") > 0
+        assert wall.thread_version("general") == 0
+
+    @pytest.mark.asyncio
+    async def test_pull_without_diff_invalidates_everything(self, wall):
+        wall.git_tools.pull_repo = AsyncMock(return_value={"status": "success", "changed_files": None})
+
+        await wall.pull_wall()
+        assert wall.thread_version("general") > 0
+
+
+class TestCachedThreadReads:
+    """Кэш /api/v1/wall/threads остается свежим без ожидания TTL"""
+
+    def test_publish_is_visible_immediately(self, wall):
+        wall_cache.clear()
+        client = TestClient(app)
+        agent = Mock(public_key="server_key")
+        with patch('bridge.main.wall_api', wall), patch('bridge.main.sdominanta_agent', agent):
+            assert client.get('/api/v1/wall/threads?thread_id=general').json() == []
+
+            client.post('/api/v1/wall/publish', json=note("n1"))
+            notes = client.get('/api/v1/wall/threads?thread_id=general').json()
+            assert [n["id"] for n in notes] == ["n1"]
+
+    @pytest.mark.asyncio
+    async def test_p2p_event_bumps_thread_version(self, wall):
+        with patch('bridge.main.wall_api', wall), \
+             patch('bridge.main.known_peers', set()), \
+             patch('bridge.main.connected_websockets', set()):
+            await handle_p2p_message('["EVENT", "sub", {"pubkey": "peer", "tags": [["t", "news"]]}]')
+
+        assert wall.thread_version("news") > 0
+        assert wall.thread_version("general") == 0
+
+
+class TestGitToolsPull:
+    """pull_repo сообщает измененные файлы"""
+
+    @pytest.mark.asyncio
+    async def test_pull_reports_changed_files(self, tmp_path):
+        def git(*args, cwd):
+            subprocess.run(["git", "-c", "user.name=t", "-c", "user.email=t@t", *args], cwd=cwd, check=True,
+                           capture_output=True)
+
+        origin = tmp_path / "origin.git"
+        git("init", "--bare", "-b", "main", str(origin), cwd=tmp_path)
+        git("clone", str(origin), "writer", cwd=tmp_path)
+        git("clone", str(origin), "reader", cwd=tmp_path)
+        writer = tmp_path / "writer"
+        git("checkout", "-b", "main", cwd=writer)
+        (writer / "threads" / "general").mkdir(parents=True)
+        (writer / "threads" / "general" / "n1.json").write_text("{}")
+        git("add", ".", cwd=writer)
+        git("commit", "-m", "n1", cwd=writer)
+        git("push", "origin", "main", cwd=writer)
+
+        result = await GitTools(base_repo_path=str(tmp_path)).pull_repo("reader")
+        assert result["status"] == "success"
+        assert result["changed_files"] is None or result["changed_files"] == ["threads/general/n1.json"]
+
+        (writer / "threads" / "general" / "n2.json").write_text("{}")
+        git("add", ".", cwd=writer)
+        git("commit", "-m", "n2", cwd=writer)
+        git("push", "origin", "main", cwd=writer)
+
+        result = await GitTools(base_repo_path=str(tmp_path)).pull_repo("reader")
+        assert result["changed_files"] == ["threads/general/n2.json"]
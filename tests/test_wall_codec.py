@@ -0,0 +1,64 @@
+"""
+Тесты канонического кодека заметок стены (mcp/tools/wall_codec.py)
+"""
+
+import hashlib
+import json
+import random
+import pytest
+
+from mcp.tools import wall_codec
+from mcp.tools.wall_codec import decode_note, encode_note
+from mcp.tools.wall_dedup import note_key
+from mcp.tools.wall_storage import FileNoteStorage, SegmentedNoteStorage
+
+NOTE = {"id": "n1", "pubkey": "alice", "created_at": 1700000000, "kind": 1,
+        "tags": [["t", "general"]], "content": "Привет, \"стена\"\n\t\u0001 😀", "sig": "0" * 128}
+
+
+def random_note(rnd):
+    text = "".join(rnd.choice("abcЯё \"\\\n\t\u0000\u001f 😀/<>") for _ in range(rnd.randrange(30)))
+    return {
+        "id": f"n{rnd.randrange(1000)}",
+        text or "k": text,
+        "n": rnd.randrange(-2 ** 63, 2 ** 63),
+        "f": rnd.choice([0.1, 1.5, -0.0, 1e16, 1e-7, 123456.789, 1e300]),
+        "nested": {"b": [True, False, None], "a": [[text]]},
+    }
+
+
+class TestWallCodec:
+    """Канонический вид и совместимость бэкендов"""
+
+    def test_canonical(self):
+        data = encode_note(NOTE)
+        assert data == json.dumps(NOTE, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        assert data.startswith(b'{"content":"') and "Привет".encode("utf-8") in data
+        assert decode_note(data) == NOTE
+        # Заметки, записанные до кодека (с отступами), читаются так же
+        assert decode_note(json.dumps(NOTE, ensure_ascii=False, indent=2)) == NOTE
+        with pytest.raises(ValueError):
+            encode_note({"score": float("nan")})
+
+    def test_backends_identical(self, monkeypatch):
+        pytest.importorskip("orjson")
+        rnd = random.Random(7)
+        notes = [random_note(rnd) for _ in range(300)] + [NOTE, {"big": 2 ** 70}, {1: "нестроковый ключ"}]
+        monkeypatch.setattr(wall_codec, "_use_orjson", True)
+        fast = [encode_note(note) for note in notes]
+        monkeypatch.setattr(wall_codec, "_use_orjson", False)
+        assert [encode_note(note) for note in notes] == fast
+
+    @pytest.mark.parametrize("storage_class", [FileNoteStorage, SegmentedNoteStorage])
+    def test_stored_bytes_are_canonical(self, tmp_path, storage_class):
+        """Хеш содержимого считается прямо по записанным байтам"""
+        storage = storage_class(str(tmp_path))
+        path = storage.append("general", NOTE["id"], NOTE)
+        storage.sync()
+        if storage_class is FileNoteStorage:
+            stored = (tmp_path / path).read_bytes()
+        else:
+            stored = next((tmp_path / "general").rglob("*.log")).read_bytes().rstrip(b"\n")
+        storage.close()
+        assert stored == encode_note(NOTE)
+        assert hashlib.sha256(stored).digest() == note_key(NOTE)
@@ -0,0 +1,135 @@
+"""
+Тесты дедупликации заметок стены по содержимому (mcp/tools/wall_dedup.py)
+"""
+
+import asyncio
+import json
+import os
+import pytest
+from unittest.mock import AsyncMock, patch
+from coincurve import PrivateKey
+
+from bridge import main
+from bridge.api.wall import WallAPI
+from bridge.shared_state import LocalStateBackend
+from mcp.tools.wall_dedup import BloomFilter, NoteDedupIndex, note_key
+from mcp.tools.wall_signatures import nostr_event_id
+from mcp.tools.wall_storage import FileNoteStorage, SegmentedNoteStorage
+
+
+def make_event(content, created_at=1700000000, private_key=None):
+    private_key = private_key or PrivateKey()
+    event = {"pubkey": private_key.public_key_xonly.format().hex(), "created_at": created_at, "kind": 1,
+             "tags": [["t", "general"]], "content": content}
+    event["id"] = nostr_event_id(event)
+    event["sig"] = private_key.sign_schnorr(bytes.fromhex(event["id"])).hex()
+    return event
+
+
+class TestNoteKey:
+    """Ключ содержимого и фильтр Блума"""
+
+    def test_note_key(self):
+        event = make_event("привет")
+        assert note_key(event) == bytes.fromhex(event["id"])
+        # Поддельный id не занимает ключ события: ключ - хеш канонического JSON
+        forged = dict(make_event("другое"), id=event["id"])
+        assert note_key(forged) != note_key(event)
+        assert note_key({"a": 1, "b": "ё"}) == note_key({"b": "ё", "a": 1})
+
+    def test_bloom_filter(self):
+        keys = [os.urandom(32) for _ in range(2000)]
+        bloom = BloomFilter(2000, error_rate=0.01)
+        bloom.update(b"".join(keys))
+        assert all(key in bloom for key in keys)
+        false_positives = sum(os.urandom(32) in bloom for _ in range(2000))
+        assert false_positives < 100
+
+
+class TestNoteDedupIndex:
+    """Журнал ключей поверх хранилища"""
+
+    @pytest.fixture(params=[FileNoteStorage, SegmentedNoteStorage])
+    def storage(self, request, tmp_path):
+        storage = request.param(str(tmp_path))
+        yield storage
+        storage.close()
+
+    def test_add_and_share(self, storage):
+        first, second = NoteDedupIndex(storage), NoteDedupIndex(storage)
+        key, other = note_key(make_event("a")), note_key(make_event("b"))
+        assert not first.contains(key)
+        assert first.add(key) and not first.add(key)
+        # Второй процесс-писатель видит ключ, дочитывая журнал
+        assert second.contains(key)
+        assert second.add_many([key, other, other]) == 1
+        assert first.contains(other) and first.stats()["keys"] == 2
+
+    def test_growth_and_merge(self, storage):
+        index = NoteDedupIndex(storage)
+        keys = [os.urandom(32) for _ in range(6000)]
+        for key in keys[:10]:
+            index.add(key)
+        index.add_many(keys)  # Недавние ключи вливаются в отсортированный буфер, фильтр растет слоями
+        assert len(index) == 6000 and index.stats()["bloom_layers"] > 1
+        assert all(index.contains(key) for key in keys[::97])
+        assert not index.contains(os.urandom(32))
+        assert NoteDedupIndex(storage).contains(keys[-1])
+
+    def test_rebuild_and_pull(self, storage):
+        events = [make_event(f"n{i}", created_at=i) for i in range(3)]
+        for event in events[:2]:
+            storage.append("general", event["id"], event)
+        index = NoteDedupIndex(storage)
+        # Журнала нет - ключи собираются по тредам хранилища
+        assert index.contains(note_key(events[0])) and not index.contains(note_key(events[2]))
+        storage.append("general", events[2]["id"], events[2])  # Заметка пришла git pull
+        assert index.index_threads(["general"]) == 1
+        assert index.contains(note_key(events[2]))
+
+
+class TestWallDedup:
+    """Повторные заметки не пишутся, не коммитятся и не рассылаются"""
+
+    @pytest.fixture
+    def wall(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("WALL_PATH", str(tmp_path))
+        monkeypatch.setenv("WALL_STORAGE_BACKEND", "files")
+        wall = WallAPI(git_tools=AsyncMock(), state=LocalStateBackend())
+        wall.commit_queue = AsyncMock()
+        wall.git_tools.base_repo_path = str(tmp_path)
+        return wall
+
+    def test_publish_twice(self, wall):
+        event = make_event("один раз")
+        assert asyncio.run(wall.publish_note("a", "general", dict(event)))["status"] == "note_published"
+        result = asyncio.run(wall.publish_note("a", "general", dict(event)))
+        assert result == {"status": "note_duplicate", "note_id": event["id"], "git_status": "skipped"}
+        assert wall.commit_queue.enqueue.await_count == 1
+        assert len(wall.storage.query("general", limit=0)) == 1
+
+    def test_retry_without_id_and_created_at(self, wall):
+        """Повтор публикации без id и created_at не получает новый uuid и время и отбрасывается"""
+        content = {"content": "повтор", "tags": [["t", "general"]]}
+        first = asyncio.run(wall.publish_note("a", "general", dict(content)))
+        assert first["status"] == "note_published"
+        result = asyncio.run(wall.publish_note("a", "general", dict(content)))
+        assert result["status"] == "note_duplicate"
+        assert wall.commit_queue.enqueue.await_count == 1
+        stored = wall.storage.query("general", limit=0)
+        assert len(stored) == 1 and "created_at" in stored[0]
+        # Записанная заметка (с подставленным created_at) тоже известна индексу
+        assert wall.is_stored(note_key(stored[0]))
+
+    def test_p2p_duplicates(self, wall):
+        published, relayed = make_event("своя"), make_event("чужая")
+        asyncio.run(wall.publish_note("a", "general", dict(published)))
+        message = json.dumps(["EVENT", "sub", relayed])
+        with patch.object(main, "wall_api", wall), patch.object(main, "known_peers", set()), \
+             patch.object(main.shared_state, "publish", AsyncMock()) as publish:
+            asyncio.run(main.handle_p2p_message(message))
+            asyncio.run(main.handle_p2p_message(message))  # Копия с другого релея
+            # Эхо своей публикации уже на стене, но клиентам рассылается; его копия с другого релея - нет
+            asyncio.run(main.handle_p2p_message(json.dumps(["EVENT", "sub", published])))
+            asyncio.run(main.handle_p2p_message(json.dumps(["EVENT", "sub", published])))
+        assert [call.args[1]["event"]["id"] for call in publish.await_args_list] == [relayed["id"], published["id"]]
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Тесты для персистентного индекса тредов стены
+"""
+
+import asyncio
+import json
+import os
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from bridge.api.wall import WallAPI
+from mcp.tools.wall_index import ThreadIndex
+from mcp.tools.wall_storage import FileNoteStorage
+
+
+def write_note(thread_path, note_id, created_at):
+    """Записывает заметку в тред в текущем формате (один файл на заметку)"""
+    os.makedirs(thread_path, exist_ok=True)
+    with open(os.path.join(thread_path, f"{note_id}.json"), 'w', encoding='utf-8') as f:
+        json.dump({"id": note_id, "created_at": created_at, "content": note_id}, f)
+
+
+class TestThreadIndex:
+    """Тесты ThreadIndex"""
+
+    def test_rebuild_orders_by_created_at(self, tmp_path):
+        """Индекс упорядочен по created_at, а не по имени файла"""
+        thread_path = tmp_path / "general"
+        write_note(thread_path, "b", "2024-01-01T00:00:00Z")
+        write_note(thread_path, "a", "2024-01-02T00:00:00Z")
+
+        entries = ThreadIndex(str(tmp_path), "general").load()
+        assert [e["id"] for e in entries] == ["b", "a"]
+
+    def test_index_persisted_and_reused(self, tmp_path):
+        """Свежий индекс читается с диска без повторного разбора заметок"""
+        write_note(tmp_path / "general", "n1", "2024-01-01T00:00:00Z")
+        ThreadIndex(str(tmp_path), "general").load()
+
+        with patch.object(ThreadIndex, 'rebuild', side_effect=AssertionError("rebuild")):
+            entries = ThreadIndex(str(tmp_path), "general").load()
+        assert [e["id"] for e in entries] == ["n1"]
+
+    def test_external_change_triggers_rebuild(self, tmp_path):
+        """Файл, добавленный в обход индекса, подхватывается"""
+        index = ThreadIndex(str(tmp_path), "general")
+        write_note(tmp_path / "general", "n1", "2024-01-01T00:00:00Z")
+        index.load()
+
+        write_note(tmp_path / "general", "n2", "2024-01-02T00:00:00Z")
+        os.utime(tmp_path / "general", ns=(0, 1))
+        assert [e["id"] for e in index.load()] == ["n1", "n2"]
+
+    def test_add_out_of_order(self, tmp_path):
+        """Заметка с ранним created_at встает на свое место"""
+        index = ThreadIndex(str(tmp_path), "general")
+        write_note(tmp_path / "general", "late", "2024-01-02T00:00:00Z")
+        index.load()
+
+        write_note(tmp_path / "general", "early", "2024-01-01T00:00:00Z")
+        index.add({"id": "early", "created_at": "2024-01-01T00:00:00Z"}, "early.json")
+
+        assert [e["id"] for e in ThreadIndex(str(tmp_path), "general").load()] == ["early", "late"]
+
+    def test_unix_and_iso_created_at_share_order(self, tmp_path):
+        """Unix-время (Nostr) и ISO 8601 упорядочиваются по моменту, а не как строки"""
+        write_note(tmp_path / "general", "iso", "2024-01-01T00:00:00Z")   # 1704067200
+        write_note(tmp_path / "general", "unix", 1704067100)
+        write_note(tmp_path / "general", "unix_str", "1704067300")
+
+        entries = ThreadIndex(str(tmp_path), "general").load()
+        assert [e["id"] for e in entries] == ["unix", "iso", "unix_str"]
+        assert entries[1]["ts"] == 1704067200.0
+
+    def test_legacy_index_gets_timestamps(self, tmp_path):
+        """Индекс без ts дополняется без разбора файлов заметок"""
+        write_note(tmp_path / "general", "b", 1704067300)
+        write_note(tmp_path / "general", "a", "2024-01-01T00:00:00Z")
+        index = ThreadIndex(str(tmp_path), "general")
+        index.load()
+        legacy = [{"id": e["id"], "file": e["file"], "created_at": e["created_at"]} for e in reversed(index.entries)]
+        with open(index.index_path, 'w', encoding='utf-8') as f:
+            f.write("".join(json.dumps(e) + "\n" for e in legacy))
+
+        with patch.object(ThreadIndex, 'rebuild', side_effect=AssertionError("rebuild")):
+            entries = ThreadIndex(str(tmp_path), "general").load()
+        assert [(e["id"], e["ts"]) for e in entries] == [("a", 1704067200.0), ("b", 1704067300.0)]
+        with open(index.index_path, 'r', encoding='utf-8') as f:
+            assert all("ts" in json.loads(line) for line in f)
+
+    def test_reader_reloads_writer_index(self, tmp_path):
+        """Воркер-читатель подхватывает индекс писателя без пересборки и не пишет файлы индекса"""
+        writer, reader = FileNoteStorage(str(tmp_path)), FileNoteStorage(str(tmp_path))
+        reader.set_writer(False)
+        writer.append("general", "n0", {"id": "n0", "created_at": 1700000000})
+        assert [n["id"] for n in reader.query("general", limit=0)] == ["n0"]
+
+        index_path = Path(writer._get_thread_index("general").index_path)
+        with patch.object(ThreadIndex, 'rebuild', side_effect=AssertionError("rebuild")):
+            for i in range(1, 6):
+                writer.append("general", f"n{i}", {"id": f"n{i}", "created_at": 1700000000 + i})
+                assert reader.query("general", limit=1)[0]["id"] == f"n{i}"
+
+        # Индекс писателя отстал от директории: читатель пересобирает его только в памяти
+        write_note(tmp_path / "general", "ext", 1700000100)
+        os.utime(tmp_path / "general", ns=(0, 1))
+        before = index_path.stat().st_mtime_ns, index_path.read_text(encoding='utf-8')
+        assert reader.query("general", limit=1)[0]["id"] == "ext"
+        assert (index_path.stat().st_mtime_ns, index_path.read_text(encoding='utf-8')) == before
+
+
+class TestWallAPIIndex:
+    """Тесты чтения треда через индекс"""
+
+    @pytest.fixture
+    def wall_api(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("WALL_PATH", str(tmp_path))
+        monkeypatch.setenv("WALL_STORAGE_BACKEND", "files")
+        api = WallAPI(git_tools=AsyncMock())
+        api.git_tools.commit_and_push = AsyncMock(return_value={"status": "success"})
+        api.git_tools.base_repo_path = str(tmp_path)
+        return api
+
+    def test_publish_then_read(self, wall_api):
+        """Опубликованные заметки сразу видны через индекс"""
+        for i in range(3):
+            asyncio.run(wall_api.publish_note("author", "general", {"id": f"n{i}", "created_at": f"2024-01-0{i + 1}T00:00:00Z"}))
+
+        notes = asyncio.run(wall_api.get_thread_notes("general", limit=2))
+        assert [n["id"] for n in notes] == ["n1", "n2"]
+
+    def test_since_and_limit_read_only_returned_notes(self, wall_api, tmp_path):
+        """since+limit открывает только возвращаемые файлы"""
+        for i in range(1, 10):
+            write_note(tmp_path / "general", f"n{i}", f"2024-01-0{i}T00:00:00Z")
+        asyncio.run(wall_api.get_thread_notes("general"))
+
+        real_open = open
+        opened = []
+
+        def tracking_open(path, *args, **kwargs):
+            opened.append(os.path.basename(str(path)))
+            return real_open(path, *args, **kwargs)
+
+        with patch('builtins.open', side_effect=tracking_open):
+            notes = asyncio.run(wall_api.get_thread_notes("general", since="2024-01-05T00:00:00Z", limit=2))
+
+        assert [n["id"] for n in notes] == ["n8", "n9"]
+        assert sorted(f for f in opened if f.endswith('.json')) == ["n8.json", "n9.json"]
+
+    def test_since_until_accept_unix_time(self, wall_api, tmp_path):
+        """since/until принимают Unix-время и ISO 8601, заметки с числовым created_at не теряются"""
+        for i in range(1, 10):
+            write_note(tmp_path / "general", f"n{i}", 1704067200 + i * 86400)  # 2024-01-0{i+1}
+
+        notes = asyncio.run(wall_api.get_thread_notes("general", since="2024-01-04T00:00:00Z",
+                                                      until=str(1704067200 + 5 * 86400), limit=0))
+        assert [n["id"] for n in notes] == ["n3", "n4", "n5"]
+
+        notes = asyncio.run(wall_api.get_thread_notes("general", since="not a date", limit=2))
+        assert [n["id"] for n in notes] == ["n8", "n9"]
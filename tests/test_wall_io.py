@@ -0,0 +1,137 @@
+"""
+Тесты пула ввода-вывода стены (bridge/wall_io.py)
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+import pytest
+from unittest.mock import AsyncMock
+
+from bridge.api.wall import WallAPI
+from bridge.shared_state import LocalStateBackend
+from bridge.wall_io import WallIOExecutor
+from mcp.tools import wall_storage
+from mcp.tools.wall_storage import FileNoteStorage
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+class TestWallIOExecutor:
+    """Выполнение в потоках, ограничение очереди и метрики"""
+
+    def test_run_in_worker(self):
+        io = WallIOExecutor(workers=2)
+
+        async def main():
+            request_id.set("r1")
+            name, seen = await io.run(lambda: (threading.current_thread().name, request_id.get()))
+            with pytest.raises(ZeroDivisionError):
+                await io.run(lambda: 1 / 0)
+            return name, seen
+
+        name, seen = asyncio.run(main())
+        io.shutdown()
+        # Контекст корутины (span трассировки) виден в потоке пула
+        assert name.startswith("wall-io") and seen == "r1"
+        stats = io.stats()
+        assert stats["completed"] == 2 and stats["failed"] == 1 and stats["queue_depth"] == 0
+
+    def test_bounded_queue(self):
+        io = WallIOExecutor(workers=1, max_queue=2)
+        release = threading.Event()
+
+        async def main():
+            tasks = [asyncio.ensure_future(io.run(release.wait)) for _ in range(5)]
+            await asyncio.sleep(0.05)
+            stats = io.stats()
+            release.set()
+            await asyncio.gather(*tasks)
+            return stats
+
+        stats = asyncio.run(main())
+        io.shutdown()
+        assert stats["running"] == 1 and stats["queue_depth"] == 1 and stats["waiting"] == 3
+        assert io.stats()["max_queue_depth"] <= 2 and io.stats()["completed"] == 5
+
+    def test_cancel_queued(self):
+        io = WallIOExecutor(workers=1)
+        release = threading.Event()
+
+        async def main():
+            running = asyncio.ensure_future(io.run(release.wait))
+            queued = asyncio.ensure_future(io.run(time.sleep, 0))
+            await asyncio.sleep(0.05)
+            queued.cancel()
+            await asyncio.sleep(0)
+            release.set()
+            await running
+
+        asyncio.run(main())
+        io.shutdown()
+        assert io.stats()["queue_depth"] == 0 and io.stats()["completed"] == 1
+
+    def test_loop_stays_responsive(self):
+        """Медленное чтение в пуле не останавливает другие корутины"""
+        io = WallIOExecutor(workers=2)
+
+        async def main():
+            lags = []
+
+            async def ticker():
+                for _ in range(20):
+                    started = time.perf_counter()
+                    await asyncio.sleep(0.01)
+                    lags.append(time.perf_counter() - started - 0.01)
+
+            await asyncio.gather(io.run(time.sleep, 0.2), ticker())
+            return max(lags)
+
+        assert asyncio.run(main()) < 0.1
+        io.shutdown()
+
+
+class TestWallAPIOffload:
+    """WallAPI выполняет файловую работу в пуле"""
+
+    @pytest.fixture(params=["files", "segments"])
+    def wall(self, request, tmp_path, monkeypatch):
+        monkeypatch.setenv("WALL_PATH", str(tmp_path))
+        monkeypatch.setenv("WALL_STORAGE_BACKEND", request.param)
+        monkeypatch.setenv("WALL_VERIFY_SIGNATURES", "off")
+        wall = WallAPI(git_tools=AsyncMock(), state=LocalStateBackend(), io_executor=WallIOExecutor(workers=4))
+        wall.commit_queue = AsyncMock()
+        wall.git_tools.base_repo_path = str(tmp_path)
+        yield wall
+        wall.io.shutdown()
+        wall.storage.close()
+
+    def test_concurrent_publish_and_read(self, wall):
+        notes = [{"id": f"n{i}", "created_at": 1700000000 + i, "content": f"заметка {i}"} for i in range(20)]
+
+        async def main():
+            # Каждая заметка публикуется дважды одновременно: записывается ровно одна копия
+            results = await asyncio.gather(*(wall.publish_note("a", "general", dict(note)) for note in notes * 2))
+            return results, await wall.get_thread_notes("general", limit=0)
+
+        results, stored = asyncio.run(main())
+        statuses = [result["status"] for result in results]
+        assert statuses.count("note_published") == 20 and statuses.count("note_duplicate") == 20
+        assert sorted(note["id"] for note in stored) == sorted(note["id"] for note in notes)
+        assert wall.io.stats()["completed"] >= 41
+
+
+class TestParallelReads:
+    """FileNoteStorage читает длинные страницы несколькими потоками"""
+
+    def test_parallel_page(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(wall_storage, "READ_WORKERS", 4)
+        storage = FileNoteStorage(str(tmp_path))
+        for i in range(150):
+            storage.append("general", f"n{i:03d}", {"id": f"n{i:03d}", "created_at": 1700000000 + i})
+        (tmp_path / "general" / "n007.json").unlink()  # Пропавший файл пропускается, порядок сохраняется
+        notes = storage.query("general", limit=0)
+        assert [note["id"] for note in notes] == [f"n{i:03d}" for i in range(150) if i != 7]
+        assert storage._reader is not None
+        storage.close()
@@ -0,0 +1,128 @@
+"""
+Тесты межтредовых индексов тегов и авторов (mcp/tools/wall_refs.py)
+"""
+
+import asyncio
+import json
+import os
+import pytest
+from unittest.mock import AsyncMock, patch
+from fastapi.testclient import TestClient
+
+from bridge.api.wall import WallAPI
+from bridge.main import app
+from bridge.cache_manager import wall_cache
+from bridge.shared_state import LocalStateBackend
+from mcp.tools.wall_refs import NoteRefIndex, make_ref, split_ref
+from mcp.tools.wall_storage import FileNoteStorage, SegmentedNoteStorage
+from mcp.tools.wall_tools import WallManager
+
+
+def make_note(note_id, created_at, pubkey="alice", tags=None):
+    return {"id": note_id, "pubkey": pubkey, "created_at": created_at, "kind": 1,
+            "tags": tags or [], "content": f"Заметка {note_id}", "sig": "0" * 128}
+
+
+def publish(storage, index, thread_id, note):
+    storage.append(thread_id, note["id"], note)
+    index.add(thread_id, note)
+
+
+class TestNoteRefIndex:
+    """Индексы тегов и авторов поверх хранилища"""
+
+    @pytest.fixture(params=[FileNoteStorage, SegmentedNoteStorage])
+    def storage(self, request, tmp_path):
+        storage = request.param(str(tmp_path))
+        yield storage
+        storage.close()
+
+    def test_lookup_across_threads(self, storage):
+        index = NoteRefIndex(storage)
+        publish(storage, index, "general", make_note("a", 1, tags=[["agent", "AIZebra"], ["t", "general"]]))
+        publish(storage, index, "system", make_note("b", 2, pubkey="bob", tags=[["agent", "AIZebra"]]))
+        publish(storage, index, "dev", make_note("c", 3, tags=[["t", "dev"]]))
+
+        assert [split_ref(r) for r in index.by_tag("agent", "AIZebra")] == [("general", "a"), ("system", "b")]
+        assert [split_ref(r) for r in index.by_author("alice")] == [("general", "a"), ("dev", "c")]
+        assert [split_ref(r) for r in index.by_author("alice", since_ts=2)] == [("dev", "c")]
+        refs = index.by_tag("agent", "AIZebra", limit=1)
+        assert [split_ref(r) for r in index.by_tag("agent", "AIZebra", before=refs[0])] == [("general", "a")]
+        assert storage.get("system", "b", refs[0][0])["pubkey"] == "bob"
+        assert index.tag_counts(name="agent") == [{"name": "agent", "value": "AIZebra", "count": 2}]
+
+    def test_nested_thread_ref(self, storage):
+        """Ссылка на заметку вложенного треда разбирается по последнему слешу"""
+        index = NoteRefIndex(storage)
+        publish(storage, index, "user_profiles/abc", make_note("p", 1, pubkey="carol"))
+
+        assert split_ref(make_ref("user_profiles/abc", "p", 1.0)) == ("user_profiles/abc", "p")
+        ref = index.by_author("carol")[0]
+        assert storage.get(*split_ref(ref), ref[0])["pubkey"] == "carol"
+
+    def test_log_shared_between_writers(self, storage):
+        """Второй процесс-писатель видит записи первого, дочитывая журнал"""
+        first, second = NoteRefIndex(storage), NoteRefIndex(storage)
+        publish(storage, first, "general", make_note("a", 1))
+        assert len(second.by_author("alice")) == 1
+        publish(storage, second, "general", make_note("b", 2))
+        assert len(first.by_author("alice")) == 2
+        assert not first.add("general", make_note("b", 2))
+
+    def test_rebuild_and_reindex(self, storage):
+        for i in range(3):
+            note = make_note(f"n{i}", i, tags=[["t", "general"]])
+            storage.append("general", note["id"], note)
+        index = NoteRefIndex(storage)
+        # Журнала нет - индекс строится по тредам хранилища
+        assert len(index.by_tag("t", "general")) == 3
+
+        note = make_note("pulled", 10, pubkey="carol")
+        storage.append("general", note["id"], note)  # Заметка пришла в обход индекса (git pull)
+        assert index.by_author("carol") == []
+        index.reindex_threads(["general"])
+        assert [split_ref(r) for r in index.by_author("carol")] == [("general", "pulled")]
+        assert len(index.by_tag("t", "general")) == 3
+
+
+class TestWallWriters:
+    """Индексы пополняются публикациями WallAPI и WallManager"""
+
+    def test_wall_manager_post_note(self, tmp_path):
+        manager = WallManager(base_wall_path=str(tmp_path))
+        note_id = asyncio.run(manager.post_note("general", "agent_x", {"text": "привет"}))
+        assert [split_ref(r) for r in manager.note_refs.by_author("agent_x")] == [("general", note_id)]
+        with open(os.path.join(str(tmp_path), ".index", "refs.log"), encoding="utf-8") as f:
+            assert json.loads(f.readline())["author"] == "agent_x"
+
+    def test_endpoints(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("WALL_PATH", str(tmp_path))
+        monkeypatch.setenv("WALL_STORAGE_BACKEND", "files")
+        monkeypatch.setenv("WALL_VERIFY_SIGNATURES", "off")  # Подписи тестовых заметок поддельные
+        wall = WallAPI(git_tools=AsyncMock(), state=LocalStateBackend())
+        wall.commit_queue = AsyncMock()
+        wall.git_tools.base_repo_path = str(tmp_path)
+        for i in range(5):
+            note = make_note(f"n{i}", 1700000000 + i, tags=[["agent", "AIZebra"]])
+            asyncio.run(wall.publish_note("alice", ["general", "system"][i % 2], note))
+
+        wall_cache.clear()
+        with patch('bridge.main.wall_api', wall):
+            client = TestClient(app)
+            first = client.get("/api/v1/wall/tags/agent:AIZebra?limit=3")
+            assert [(n["thread_id"], n["note"]["id"]) for n in first.json()] == [
+                ("general", "n2"), ("system", "n3"), ("general", "n4")]
+            second = client.get(f"/api/v1/wall/tags/agent:AIZebra?limit=3&cursor={first.headers['X-Next-Cursor']}")
+            assert [n["note"]["id"] for n in second.json()] == ["n0", "n1"]
+            assert "X-Next-Cursor" not in second.headers
+
+            assert len(client.get("/api/v1/wall/authors/alice?limit=0").json()) == 5
+            assert client.get("/api/v1/wall/authors/nobody").json() == []
+            assert client.get("/api/v1/wall/tags").json() == [{"name": "agent", "value": "AIZebra", "count": 5}]
+            # Ответ кэшируется до изменения любого треда
+            with patch.object(wall.note_refs, "tag_counts", side_effect=AssertionError("повторный подсчет")):
+                assert client.get("/api/v1/wall/tags").json()[0]["count"] == 5
+            asyncio.run(wall.publish_note("alice", "dev", make_note("n5", 1700000005, tags=[["agent", "AIZebra"]])))
+            assert client.get("/api/v1/wall/tags").json() == [{"name": "agent", "value": "AIZebra", "count": 6}]
+            assert client.get("/api/v1/wall/tags/agent:?limit=3").status_code == 400
+            assert client.get("/api/v1/wall/authors/alice?since=вчера").status_code == 400
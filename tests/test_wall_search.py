@@ -0,0 +1,149 @@
+"""
+Тесты полнотекстового поиска по стене (mcp/tools/wall_search.py, /api/v1/wall/search)
+"""
+
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+from fastapi.testclient import TestClient
+
+from bridge.api.wall import WallAPI
+from bridge.main import app
+from bridge.shared_state import LocalStateBackend
+from mcp.tools.wall_search import WallSearchIndex, decode_search_cursor, parse_query, tokenize
+
+
+def make_note(note_id, content, created_at=1700000000, pubkey="alice", tags=None):
+    return {"id": note_id, "pubkey": pubkey, "created_at": created_at, "kind": 1,
+            "tags": tags if tags is not None else [["t", "general"]], "content": content, "sig": "0" * 128}
+
+
+def ids(result):
+    return [r["note"]["id"] for r in result["results"]]
+
+
+class TestTokenizer:
+    """Разбор текста и запросов"""
+
+    def test_cyrillic_and_latin(self):
+        assert tokenize("Ёжик и T2* в Sdominanta.net, 2025!") == ["ежик", "t2", "sdominanta", "net", "2025"]
+
+    def test_query_prefix(self):
+        assert parse_query("T2* ёлка t2*") == [("t2", True), ("елка", False)]
+
+
+class TestWallSearchIndex:
+    """Инвертированный индекс: ранжирование, фильтры, пагинация, замена заметок"""
+
+    @pytest.fixture
+    def index(self):
+        index = WallSearchIndex()
+        index.add("general", make_note("a", "Формула T2* и ALEPH", created_at=1, tags=[["t", "general"], ["t", "aleph"]]))
+        index.add("general", make_note("b", "Ёлка, ёлка и снова ёлка", created_at=2, pubkey="bob"))
+        index.add("dev", make_note("c", "T2x: новая формула", created_at=3, tags=[["t", "dev"]]))
+        index.add("dev", make_note("d", "Обычная заметка про елку", created_at=4, pubkey="bob", tags=[["t", "dev"]]))
+        return index
+
+    def test_all_terms_required(self, index):
+        assert ids(index.search("формула aleph")) == ["a"]
+        assert ids(index.search("формула нет_такого")) == []
+
+    def test_ranking_by_term_frequency(self, index):
+        # "ё" и "е" не различаются; три вхождения ранжируются выше одного
+        assert ids(index.search("ЕЛКА")) == ["b"]
+        assert ids(index.search("елк*")) == ["b", "d"]
+
+    def test_prefix_search(self, index):
+        assert sorted(ids(index.search("T2*"))) == ["a", "c"]
+
+    def test_tags_are_indexed(self, index):
+        assert ids(index.search("aleph")) == ["a"]
+
+    def test_filters(self, index):
+        assert ids(index.search("формула", tags=[("t", "dev")])) == ["c"]
+        assert ids(index.search("", authors=["bob"])) == ["d", "b"]
+        assert ids(index.search("елк*", thread_id="dev")) == ["d"]
+        assert ids(index.search("формула", since=2)) == ["c"]
+        with pytest.raises(ValueError):
+            index.search("")
+
+    def test_cursor_pagination(self, index):
+        first = index.search("", authors=["alice", "bob"], limit=3)
+        assert first["total"] == 4 and ids(first) == ["d", "c", "b"]
+        second = index.search("", authors=["alice", "bob"], limit=3, cursor=first["next_cursor"])
+        assert ids(second) == ["a"] and second["next_cursor"] is None
+        with pytest.raises(ValueError):
+            decode_search_cursor("!!!")
+
+    def test_replace_and_remove_thread(self, index):
+        assert not index.add("general", make_note("a", "Формула T2* и ALEPH", created_at=1,
+                                                  tags=[["t", "general"], ["t", "aleph"]]))
+        assert index.add("general", make_note("a", "Исправленный текст", created_at=1))
+        assert ids(index.search("aleph")) == []
+        assert ids(index.search("исправленный")) == ["a"]
+
+        assert index.remove_thread("dev") == 2
+        assert ids(index.search("формула")) == []
+        index.compact()
+        assert index.stats()["deleted"] == 0
+        assert sorted(ids(index.search("", thread_id="general"))) == ["a", "b"]
+
+
+class TestWallAPISearch:
+    """Построение индекса из хранилища и пополнение публикациями и P2P-событиями"""
+
+    @pytest.fixture
+    def wall(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("WALL_PATH", str(tmp_path))
+        monkeypatch.setenv("WALL_STORAGE_BACKEND", "files")
+        monkeypatch.setenv("WALL_VERIFY_SIGNATURES", "off")  # Подписи тестовых заметок поддельные
+        wall = WallAPI(git_tools=AsyncMock(), state=LocalStateBackend())
+        wall.commit_queue = AsyncMock()
+        wall.git_tools.base_repo_path = str(tmp_path)
+        for i, content in enumerate(["Первая заметка про ALEPH", "Вторая заметка"]):
+            note = make_note(f"n{i}", content, created_at=1700000000 + i)
+            wall.storage.append("general", note["id"], note)
+        return wall
+
+    def test_build_and_incremental_updates(self, wall):
+        result = asyncio.run(wall.search_notes("заметка"))
+        assert wall.search_index_ready and result["total"] == 2
+
+        note = make_note("n2", "Третья заметка про aleph", pubkey="carol", tags=[["t", "dev"]])
+        asyncio.run(wall.publish_note("carol", "dev", note))
+        assert wall.index_event("general", make_note("p2p", "Заметка из сети", pubkey="dave"))
+        assert not wall.index_event("general", dict(make_note("dm", "зашифровано"), kind=4))
+
+        result = asyncio.run(wall.search_notes("aleph", tags=["dev"]))
+        assert [(r["thread_id"], r["note"]["id"]) for r in result["results"]] == [("dev", "n2")]
+        assert asyncio.run(wall.search_notes("заметка"))["total"] == 4
+        assert ids(asyncio.run(wall.search_notes("", authors=["dave"]))) == ["p2p"]
+
+        with pytest.raises(ValueError):
+            asyncio.run(wall.search_notes("заметка", since="вчера"))
+
+
+class TestWallSearchEndpoint:
+    """/api/v1/wall/search"""
+
+    def test_search_endpoint(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("WALL_PATH", str(tmp_path))
+        monkeypatch.setenv("WALL_STORAGE_BACKEND", "files")
+        monkeypatch.setenv("WALL_VERIFY_SIGNATURES", "off")  # Подписи тестовых заметок поддельные
+        wall = WallAPI(git_tools=AsyncMock(), state=LocalStateBackend())
+        for i in range(5):
+            note = make_note(f"n{i}", f"Заметка номер {i} про поиск", created_at=1700000000 + i)
+            wall.storage.append("general", note["id"], note)
+
+        with patch('bridge.main.wall_api', wall):
+            client = TestClient(app)
+            first = client.get("/api/v1/wall/search", params={"q": "поиск", "tag": "t:general", "limit": 3})
+            assert first.status_code == 200
+            assert first.json()["total"] == 5 and len(first.json()["results"]) == 3
+
+            second = client.get("/api/v1/wall/search", params={"q": "поиск", "limit": 3, "cursor": first.json()["next_cursor"]})
+            assert len(second.json()["results"]) == 2
+
+            assert client.get("/api/v1/wall/search").status_code == 400
+            assert client.get("/api/v1/wall/search", params={"q": "поиск", "limit": 0}).status_code == 400
+            assert client.get("/api/v1/wall/search", params={"q": "поиск", "cursor": "!!!"}).status_code == 400
@@ -0,0 +1,152 @@
+"""
+Тесты проверки подписей заметок стены (mcp/tools/wall_signatures.py)
+"""
+
+import asyncio
+import base64
+import json
+import threading
+import pytest
+from unittest.mock import AsyncMock
+from coincurve import PrivateKey
+from fastapi import HTTPException
+from nacl.encoding import HexEncoder
+from nacl.signing import SigningKey
+
+from bridge.api.wall import WallAPI
+from bridge.shared_state import LocalStateBackend
+from mcp.tools import wall_signatures
+from mcp.tools.wall_signatures import (SignatureVerifier, VerifiedSignatureCache, canonical_json,
+                                       load_seed_public_keys, nostr_event_id)
+
+
+def make_nostr_event(private_key, content, created_at=1700000000):
+    event = {"pubkey": private_key.public_key_xonly.format().hex(), "created_at": created_at, "kind": 1,
+             "tags": [["t", "general"]], "content": content}
+    event["id"] = nostr_event_id(event)
+    event["sig"] = private_key.sign_schnorr(bytes.fromhex(event["id"])).hex()
+    return event
+
+
+def make_ed25519_note(signing_key, payload):
+    """Формат scripts/create_and_sign_note.py"""
+    return {"id": "n1", "author": {"key_id": "k1", "public_key_b64": base64.b64encode(bytes(signing_key.verify_key)).decode()},
+            "payload": payload,
+            "signature": signing_key.sign(canonical_json(payload), encoder=HexEncoder).signature.decode()}
+
+
+class TestSignatureVerifier:
+    """Форматы подписей и кэш проверенных подписей"""
+
+    def test_nostr(self):
+        verifier = SignatureVerifier()
+        event = make_nostr_event(PrivateKey(), "Привет, стена")
+        assert verifier.verify(event).valid
+
+        assert verifier.verify(dict(event, content="подмена")).reason == "id does not match event content"
+        other = make_nostr_event(PrivateKey(), "Привет, стена")
+        check = verifier.verify(dict(event, sig=other["sig"]))
+        assert not check.valid and check.reason == "bad signature"
+        assert "malformed" in verifier.verify(dict(event, pubkey="alice")).reason
+
+    def test_ed25519_payload(self):
+        verifier = SignatureVerifier()
+        note = make_ed25519_note(SigningKey.generate(), {"text": "ёж", "n": 1})
+        assert verifier.verify(note).valid
+        note["payload"]["n"] = 2
+        assert verifier.verify(note).reason == "bad signature"
+
+    def test_ncp_signature_of_repo_note(self):
+        """Подписанная заметка репозитория проверяется ключом dev-local из CONTEXT_SEED.json"""
+        with open("wall/threads/hello-world/315eede86e28ced1.json", encoding="utf-8") as f:
+            note = json.load(f)
+        assert not SignatureVerifier().verify(note).valid  # Ключ key_id неизвестен
+        verifier = SignatureVerifier(public_keys=load_seed_public_keys("CONTEXT_SEED.json"))
+        check = verifier.verify(note)
+        assert check.valid and check.scheme == "ed25519-jcs"
+        assert not verifier.verify(dict(note, thread="other")).valid
+
+    def test_unsigned(self):
+        check = SignatureVerifier().verify({"id": "x", "content": "без подписи"})
+        assert not check.valid and check.scheme is None
+
+    def test_cache(self, tmp_path):
+        path = str(tmp_path / "verified")
+        verifier = SignatureVerifier(cache=VerifiedSignatureCache(path=path))
+        event = make_nostr_event(PrivateKey(), "кэш")
+        bad = dict(event, sig=make_nostr_event(PrivateKey(), "кэш")["sig"])
+        assert [c.cached for c in verifier.verify_many([event, bad])] == [False, False]
+        assert verifier.verify(event).cached
+        assert not verifier.verify(bad).cached and len(verifier.cache) == 1
+
+        # Проверенные подписи читаются из файла новым процессом
+        reloaded = SignatureVerifier(cache=VerifiedSignatureCache(path=path))
+        assert reloaded.verify(event).cached
+
+        small = VerifiedSignatureCache(max_size=1)
+        small.add_many(["a", "b"])
+        assert "a" not in small and "b" in small
+
+    def test_parallel_matches_serial(self, monkeypatch):
+        keys = [PrivateKey() for _ in range(3)]
+        notes = [make_nostr_event(keys[i % 3], f"заметка {i}") for i in range(12)]
+        notes[5]["sig"] = notes[6]["sig"]
+        serial = [c.valid for c in SignatureVerifier().verify_many(notes)]
+        monkeypatch.setattr(wall_signatures, "PARALLEL_MIN_NOTES", 1)
+        assert [c.valid for c in SignatureVerifier().verify_many(notes, jobs=2)] == serial
+        assert serial.count(False) == 1 and not serial[5]
+
+
+class TestPublishSignatures:
+    """Проверка подписи в WallAPI.publish_note"""
+
+    def make_wall(self, tmp_path, monkeypatch, policy, require=False):
+        monkeypatch.setenv("WALL_PATH", str(tmp_path))
+        monkeypatch.setenv("WALL_STORAGE_BACKEND", "files")
+        monkeypatch.setenv("WALL_VERIFY_SIGNATURES", policy)
+        monkeypatch.setenv("WALL_REQUIRE_SIGNATURES", "true" if require else "false")
+        wall = WallAPI(git_tools=AsyncMock(), state=LocalStateBackend())
+        wall.commit_queue = AsyncMock()
+        return wall
+
+    def test_enforce(self, tmp_path, monkeypatch):
+        wall = self.make_wall(tmp_path, monkeypatch, "enforce")
+        event = make_nostr_event(PrivateKey(), "подписано")
+        assert asyncio.run(wall.publish_note("alice", "general", dict(event)))["status"] == "note_published"
+        with pytest.raises(HTTPException) as e:
+            asyncio.run(wall.publish_note("alice", "general", dict(event, content="подмена")))
+        assert e.value.status_code == 400
+        assert wall.storage.query("general", limit=0) == [event]
+        # Неподписанная заметка принимается, пока подпись не обязательна
+        asyncio.run(wall.publish_note("alice", "general", {"id": "plain", "content": "без подписи"}))
+
+    def test_verified_off_the_event_loop(self, tmp_path, monkeypatch):
+        wall = self.make_wall(tmp_path, monkeypatch, "enforce")
+        threads = []
+        verify = wall.signature_verifier.verify
+
+        def record(note):
+            threads.append(threading.current_thread().name)
+            return verify(note)
+
+        monkeypatch.setattr(wall.signature_verifier, "verify", record)
+        asyncio.run(wall.publish_note("alice", "general", make_nostr_event(PrivateKey(), "в пуле")))
+        assert threads and threads[0].startswith("wall-io")
+
+    def test_default_policy_is_warn(self, tmp_path, monkeypatch):
+        """Без WALL_VERIFY_SIGNATURES заметка с неверной подписью публикуется (enforce - по явному выбору)"""
+        self.make_wall(tmp_path, monkeypatch, "enforce")
+        monkeypatch.delenv("WALL_VERIFY_SIGNATURES")
+        wall = WallAPI(git_tools=AsyncMock(), state=LocalStateBackend())
+        wall.commit_queue = AsyncMock()
+        assert wall.signature_policy == "warn"
+        event = make_nostr_event(PrivateKey(), "подписано")
+        assert asyncio.run(wall.publish_note("alice", "general", dict(event, content="подмена")))["status"] \
+            == "note_published"
+
+    def test_require_and_warn(self, tmp_path, monkeypatch):
+        wall = self.make_wall(tmp_path, monkeypatch, "enforce", require=True)
+        with pytest.raises(HTTPException):
+            asyncio.run(wall.publish_note("alice", "general", {"id": "plain", "content": "без подписи"}))
+        wall = self.make_wall(tmp_path, monkeypatch, "warn", require=True)
+        asyncio.run(wall.publish_note("alice", "general", {"id": "plain", "content": "без подписи"}))
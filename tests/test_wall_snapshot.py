@@ -0,0 +1,205 @@
+"""
+Тесты снимков стены (mcp/tools/wall_snapshot.py)
+"""
+
+import asyncio
+import os
+import zipfile
+import pytest
+from unittest.mock import AsyncMock
+
+from bridge.api.wall import WallAPI
+from bridge.shared_state import LocalStateBackend
+from mcp.tools.wall_dedup import NoteDedupIndex
+from mcp.tools.wall_index import ThreadIndex
+from mcp.tools.wall_refs import NoteRefIndex
+from mcp.tools.wall_snapshot import (
+    SnapshotError, SnapshotReader, apply_delta, bootstrap_wall, build_snapshot, create_next_snapshot,
+    read_marker, restore_snapshot, scan_wall, tree_sha256,
+)
+
+
+def make_wall(path, backend):
+    os.environ["WALL_PATH"] = str(path)
+    os.environ["WALL_STORAGE_BACKEND"] = backend
+    os.environ["WALL_VERIFY_SIGNATURES"] = "off"
+    wall = WallAPI(git_tools=AsyncMock(), state=LocalStateBackend())
+    wall.commit_queue = AsyncMock()
+    wall.git_tools.base_repo_path = str(path)
+    return wall
+
+
+def publish(wall, thread_id, start, count):
+    async def main():
+        for i in range(start, start + count):
+            await wall.publish_note("a", thread_id, {"id": f"{thread_id}-{i}", "created_at": 1700000000 + i,
+                                                     "author_id": f"author{i % 2}", "tags": [["t", "snap"]]})
+    asyncio.run(main())
+
+
+def no_rebuilds(monkeypatch):
+    """Восстановленная стена отвечает из индексов снимка: пересборка - ошибка теста"""
+    def fail(*args, **kwargs):
+        raise AssertionError("индекс пересобран после восстановления")
+    for cls in (ThreadIndex, NoteRefIndex, NoteDedupIndex):
+        monkeypatch.setattr(cls, "rebuild", fail)
+
+
+@pytest.fixture(params=["files", "segments"])
+def source(request, tmp_path, monkeypatch):
+    monkeypatch.setenv("WALL_PATH", str(tmp_path / "source"))
+    wall = make_wall(tmp_path / "source", request.param)
+    publish(wall, "general", 0, 10)
+    publish(wall, "research", 0, 5)
+    asyncio.run(wall.get_thread_notes("general", limit=0))  # Индекс треда в снимок
+    wall.storage.sync()
+    yield wall
+    wall.storage.close()
+
+
+def read_all(wall):
+    async def main():
+        general = await wall.get_thread_notes("general", limit=0)
+        tagged, _ = await wall.get_notes_by_tag("t:snap", limit=100)
+        return [n["id"] for n in general], sorted(item["note"]["id"] for item in tagged)
+    return asyncio.run(main())
+
+
+class TestSnapshotRoundTrip:
+    """Полный снимок и дельта восстанавливают стену без пересборки индексов"""
+
+    def test_full_restore(self, source, tmp_path, monkeypatch):
+        out = tmp_path / "snapshots"
+        path, manifest = create_next_snapshot(source.base_wall_path, str(out))
+        assert os.path.basename(path) == "snapshot-00000001-full.zip" and manifest["base"] is None
+        assert set(manifest["threads"]) == {"general", "research"}
+        with SnapshotReader(path) as reader:
+            assert reader.verify() == []
+
+        target = tmp_path / "node" / "threads"
+        restore_snapshot(path, str(target))
+        assert read_marker(str(target))["snapshot"] == 1
+        assert tree_sha256(scan_wall(str(target))) == manifest["tree_sha256"]
+
+        no_rebuilds(monkeypatch)
+        restored = make_wall(target, source.storage.name)
+        assert read_all(restored) == read_all(source)
+        assert asyncio.run(restored.publish_note("a", "general", {"id": "general-3", "created_at": 1700000003,
+                                                                  "author_id": "author1", "tags": [["t", "snap"]]})
+                           )["status"] == "note_duplicate"
+        assert len(restored.note_dedup) == 15
+        restored.storage.close()
+
+    def test_delta(self, source, tmp_path, monkeypatch):
+        out = tmp_path / "snapshots"
+        full_path, _ = create_next_snapshot(source.base_wall_path, str(out))
+        target = tmp_path / "node" / "threads"
+        restore_snapshot(full_path, str(target))
+
+        publish(source, "general", 10, 5)
+        publish(source, "ideas", 0, 2)
+        asyncio.run(source.get_thread_notes("general", limit=0))
+        source.storage.sync()
+        research = os.path.join(source.base_wall_path, "research")
+        for name in sorted(os.listdir(research)):
+            if name.endswith(".json"):
+                os.remove(os.path.join(research, name))
+                break
+        asyncio.run(source.get_thread_notes("research", limit=0))  # Источник переиндексирует тред до снимка
+
+        delta_path, delta = create_next_snapshot(source.base_wall_path, str(out))
+        assert os.path.basename(delta_path) == "snapshot-00000002-delta.zip"
+        assert delta["base"]["snapshot"] == 1
+        modes = {entry["mode"] for entry in delta["entries"].values()}
+        assert "append" in modes  # Журналы refs.log/dedup.log переданы хвостом
+        assert len(delta["entries"]) < len(delta["files"])
+        assert os.path.getsize(delta_path) < os.path.getsize(full_path)
+
+        apply_delta(delta_path, str(target))
+        apply_delta_again = bootstrap_wall(str(target), str(out))
+        assert apply_delta_again["status"] == "up_to_date" and apply_delta_again["snapshot"] == 2
+        assert tree_sha256(scan_wall(str(target))) == delta["tree_sha256"]
+
+        no_rebuilds(monkeypatch)
+        restored = make_wall(target, source.storage.name)
+        assert read_all(restored) == read_all(source)
+        restored.storage.close()
+
+
+class TestSnapshotErrors:
+    """Поврежденный или чужой снимок не трогает стену"""
+
+    def test_corrupted_member(self, source, tmp_path):
+        path = tmp_path / "s.zip"
+        build_snapshot(source.base_wall_path, str(path), 1, compression=zipfile.ZIP_STORED, compresslevel=None)
+        with SnapshotReader(str(path)) as reader:
+            name = next(p for p in reader.manifest["entries"] if p.startswith("general/"))
+            view = reader.view(name)
+            corrupted = bytes(view)
+            view.release()
+        data = path.read_bytes()
+        offset = data.index(corrupted)
+        path.write_bytes(data[:offset] + bytes([data[offset] ^ 0xFF]) + data[offset + 1:])
+
+        with SnapshotReader(str(path)) as reader:
+            assert reader.verify()
+        target = tmp_path / "node"
+        (target / "general").mkdir(parents=True)
+        (target / "general" / "keep.json").write_text("{}")
+        with pytest.raises(SnapshotError):
+            restore_snapshot(str(path), str(target))
+        assert os.listdir(target / "general") == ["keep.json"]
+        assert not os.path.exists(str(target) + ".restore")
+
+    def test_not_a_snapshot(self, tmp_path):
+        path = tmp_path / "bad.zip"
+        path.write_bytes(b"not a zip")
+        with pytest.raises(SnapshotError):
+            SnapshotReader(str(path))
+
+    def test_delta_base_mismatch(self, source, tmp_path):
+        out = tmp_path / "snapshots"
+        create_next_snapshot(source.base_wall_path, str(out))
+        publish(source, "general", 10, 1)
+        source.storage.sync()
+        delta_path, _ = create_next_snapshot(source.base_wall_path, str(out))
+        with pytest.raises(SnapshotError):
+            apply_delta(delta_path, source.base_wall_path)  # Стена не из снимка
+        target = tmp_path / "node"
+        with pytest.raises(SnapshotError):
+            restore_snapshot(delta_path, str(target))  # Дельта без полного снимка
+
+
+class TestBootstrap:
+    """Запуск узла: пустая стена восстанавливается из цепочки снимков, склонированная не трогается"""
+
+    def test_chain(self, source, tmp_path):
+        out = tmp_path / "snapshots"
+        create_next_snapshot(source.base_wall_path, str(out))
+        publish(source, "general", 10, 3)
+        source.storage.sync()
+        _, last = create_next_snapshot(source.base_wall_path, str(out))
+
+        target = tmp_path / "node" / "threads"
+        result = bootstrap_wall(str(target), str(out))
+        assert result == {"status": "restored", "snapshot": 2, "applied": [1, 2]}
+        assert tree_sha256(scan_wall(str(target))) == last["tree_sha256"]
+        assert bootstrap_wall(source.base_wall_path, str(out))["status"] == "skipped"
+
+    def test_wall_api_bootstrap(self, source, tmp_path):
+        out = tmp_path / "snapshots"
+        create_next_snapshot(source.base_wall_path, str(out))
+        node = make_wall(tmp_path / "node", source.storage.name)
+        result = asyncio.run(node.bootstrap_from_snapshots(str(out)))
+        assert result["status"] == "restored"
+        assert read_all(node) == read_all(source)
+        node.storage.close()
+
+    def test_torn_journal_tail(self, tmp_path):
+        wall = tmp_path / "wall"
+        (wall / ".index").mkdir(parents=True)
+        (wall / ".index" / "refs.log").write_bytes(b'{"id": "a"}\n{"id": "b')
+        (wall / ".index" / "dedup.log").write_bytes(b"k" * 40)
+        files = scan_wall(str(wall))
+        assert files[".index/refs.log"]["size"] == len(b'{"id": "a"}\n')
+        assert files[".index/dedup.log"]["size"] == 32
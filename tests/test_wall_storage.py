@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Тесты для бэкендов хранилища стены
+"""
+
+import asyncio
+import json
+import os
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from bridge.api.wall import WallAPI
+from bridge.cache_manager import wall_cache
+from bridge.main import app
+from mcp.tools.wall_codec import decode_note
+from mcp.tools.wall_index import decode_cursor, encode_cursor, next_page_cursor, note_page_key
+from mcp.tools.wall_storage import FileNoteStorage, SegmentedNoteStorage, SegmentedThread, create_note_storage
+from mcp.tools.wall_tools import WallManager
+from scripts.migrate_wall_storage import migrate_wall
+
+
+def make_note(i, created_at=None):
+    """Создает тестовую заметку в формате Nostr"""
+    return {
+        "id": f"n{i:04d}",
+        "created_at": created_at or f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}Z",
+        "kind": 1,
+        "content": f"Заметка {i}",
+    }
+
+
+def small_storage(base, **kwargs):
+    """Хранилище с маленькими сегментами и блоками, чтобы проверить ротацию"""
+    params = dict(segment_max_bytes=1024, sparse_every=4, fsync_batch=8, compact_min_segments=100)
+    params.update(kwargs)
+    return SegmentedNoteStorage(str(base), **params)
+
+
+class TestSegmentedNoteStorage:
+    """Тесты сегментированного журнала"""
+
+    def test_append_and_tail_query(self, tmp_path):
+        """Хвост треда возвращается в порядке created_at"""
+        storage = small_storage(tmp_path)
+        for i in range(50):
+            storage.append("general", f"n{i:04d}", make_note(i))
+
+        notes = storage.query("general", limit=5)
+        assert [n["id"] for n in notes] == [f"n{i:04d}" for i in range(45, 50)]
+        assert len(os.listdir(tmp_path / "general" / "segments")) > 3  # произошла ротация
+
+    def test_out_of_order_notes(self, tmp_path):
+        """Заметка "из прошлого" не попадает в хвост, а "из будущего" попадает"""
+        storage = small_storage(tmp_path)
+        for i in range(20):
+            storage.append("general", f"n{i:04d}", make_note(i))
+        storage.append("general", "old", make_note(0, "2023-01-01T00:00:00Z") | {"id": "old"})
+        storage.append("general", "future", make_note(0, "2030-01-01T00:00:00Z") | {"id": "future"})
+        for i in range(20, 40):
+            storage.append("general", f"n{i:04d}", make_note(i))
+
+        ids = [n["id"] for n in storage.query("general", limit=3)]
+        assert ids == ["n0038", "n0039", "future"]
+        assert storage.query("general", limit=0)[0]["id"] == "old"
+
+    def test_since_filter(self, tmp_path):
+        """since отсекает старые заметки"""
+        storage = small_storage(tmp_path)
+        for i in range(30):
+            storage.append("general", f"n{i:04d}", make_note(i))
+
+        notes = storage.query("general", since="2024-01-01T00:00:25Z", limit=50)
+        assert [n["id"] for n in notes] == [f"n{i:04d}" for i in range(25, 30)]
+
+    def test_time_range_with_unix_created_at(self, tmp_path):
+        """since/until по секундам эпохи; блоки вне диапазона не читаются"""
+        storage = small_storage(tmp_path)
+        for i in range(40):
+            storage.append("general", f"n{i:04d}", make_note(i, 1704067200 + i))
+
+        notes = storage.query("general", since="2024-01-01T00:00:10Z", until=str(1704067200 + 13), limit=0)
+        assert [n["id"] for n in notes] == [f"n{i:04d}" for i in range(10, 14)]
+
+        read_block = SegmentedThread._read_block
+        blocks = []
+        with patch.object(SegmentedThread, "_read_block", lambda self, *a: blocks.append(a) or read_block(self, *a)):
+            storage.query("general", until=str(1704067200 + 2), limit=0)
+        assert len(blocks) == 1  # только первый блок первого сегмента
+
+    def test_legacy_sidx_is_rebuilt(self, tmp_path):
+        """.sidx со строковыми ключами created_at пересобирается при открытии"""
+        storage = small_storage(tmp_path, segment_max_bytes=1024 * 1024)
+        for i in range(10):
+            storage.append("general", f"n{i:04d}", make_note(i))
+        storage.close()
+        sidx = tmp_path / "general" / "segments" / "00000001.sidx"
+        blocks = [json.loads(line) for line in sidx.read_text().splitlines()]
+        sidx.write_text("".join(json.dumps(b | {"min": "2024", "max": "2024"}) + "\n" for b in blocks))
+
+        reopened = small_storage(tmp_path, segment_max_bytes=1024 * 1024)
+        assert [n["id"] for n in reopened.query("general", since="2024-01-01T00:00:08Z", limit=0)] == ["n0008", "n0009"]
+        assert all(isinstance(json.loads(line)["min"], float) for line in sidx.read_text().splitlines())
+
+    def test_reopen_uses_sparse_index(self, tmp_path):
+        """После перезапуска журнал читается по .sidx и MANIFEST"""
+        storage = small_storage(tmp_path)
+        for i in range(30):
+            storage.append("general", f"n{i:04d}", make_note(i))
+        storage.close()
+
+        reopened = small_storage(tmp_path)
+        assert len(reopened.query("general", limit=0)) == 30
+        reopened.append("general", "n0030", make_note(30))
+        assert reopened.query("general", limit=1)[0]["id"] == "n0030"
+
+    def test_torn_write_is_truncated(self, tmp_path):
+        """Оборванная последняя запись отрезается при открытии"""
+        storage = small_storage(tmp_path, segment_max_bytes=1024 * 1024)
+        for i in range(3):
+            storage.append("general", f"n{i:04d}", make_note(i))
+        storage.close()
+
+        segment = tmp_path / "general" / "segments" / "00000001.log"
+        with open(segment, 'ab') as f:
+            f.write(b'{"id": "broken", "created')
+
+        reopened = small_storage(tmp_path, segment_max_bytes=1024 * 1024)
+        assert [n["id"] for n in reopened.query("general", limit=0)] == ["n0000", "n0001", "n0002"]
+        reopened.append("general", "n0003", make_note(3))
+        assert reopened.query("general", limit=1)[0]["id"] == "n0003"
+
+    def test_compaction_sorts_and_deduplicates(self, tmp_path):
+        """Компакция удаляет повторы id и сохраняет содержимое треда"""
+        storage = small_storage(tmp_path)
+        for i in range(30):
+            storage.append("general", f"n{i:04d}", make_note(i))
+        for i in range(30):
+            storage.append("general", f"n{i:04d}", make_note(i))  # повторная доставка
+        for i in range(30, 40):
+            storage.append("general", f"n{i:04d}", make_note(i))
+
+        before = len([f for f in os.listdir(tmp_path / "general" / "segments") if f.endswith('.log')])
+        storage.compact("general")
+        after = len([f for f in os.listdir(tmp_path / "general" / "segments") if f.endswith('.log')])
+
+        assert after < before
+        assert [n["id"] for n in storage.query("general", limit=0)] == [f"n{i:04d}" for i in range(40)]
+        storage.close()
+        assert len(small_storage(tmp_path).query("general", limit=0)) == 40
+
+
+class TestSegmentMmapReads:
+    """Чтение сегментов через mmap: разбираются только нужные записи хвоста"""
+
+    def test_mmap_matches_read(self, tmp_path):
+        """С mmap и без него запросы возвращают одно и то же, в том числе для заметок не по порядку"""
+        mapped, plain = small_storage(tmp_path / "a"), small_storage(tmp_path / "b", use_mmap=False)
+        for storage in (mapped, plain):
+            for i in range(60):
+                storage.append("general", f"n{i:04d}", make_note(i))
+                if i % 7 == 0:
+                    storage.append("general", f"old{i}", make_note(0, f"2023-01-01T00:00:{i:02d}Z") | {"id": f"old{i}"})
+        for kwargs in ({"limit": 5}, {"limit": 0}, {"since": "2024-01-01T00:00:30Z", "limit": 10},
+                       {"limit": 5, "before": (1704067230.0, "n0030")}):
+            assert mapped.query("general", **kwargs) == plain.query("general", **kwargs)
+        mapped.close()
+        plain.close()
+
+    def test_tail_decodes_only_requested_records(self, tmp_path):
+        storage = small_storage(tmp_path, segment_max_bytes=1 << 20, sparse_every=64)
+        for i in range(1000):
+            storage.append("general", f"n{i:04d}", make_note(i, 1704067200 + i))
+        with patch("mcp.tools.wall_storage.decode_note", side_effect=decode_note) as decode:
+            notes = storage.query("general", limit=5)
+        assert [n["id"] for n in notes] == [f"n{i:04d}" for i in range(995, 1000)]
+        assert decode.call_count == 6  # 5 записей и одна, на которой разбор остановился
+
+    def test_active_segment_is_remapped(self, tmp_path):
+        """Отображение активного сегмента пересоздается, когда в него дописали"""
+        storage = small_storage(tmp_path, segment_max_bytes=1 << 20)
+        storage.append("general", "n0000", make_note(0))
+        assert [n["id"] for n in storage.query("general", limit=1)] == ["n0000"]
+        storage.append("general", "n0001", make_note(1))
+        assert [n["id"] for n in storage.query("general", limit=1)] == ["n0001"]
+        storage.close()
+
+
+class TestStorageIntegration:
+    """Тесты выбора бэкенда, WallManager и миграции"""
+
+    def test_backend_from_env(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("WALL_STORAGE_BACKEND", "segments")
+        assert isinstance(create_note_storage(str(tmp_path)), SegmentedNoteStorage)
+        with pytest.raises(ValueError):
+            create_note_storage(str(tmp_path), backend="unknown")
+
+    def test_wall_manager_on_segments(self, tmp_path):
+        """WallManager пишет и читает через сегментированный журнал"""
+        manager = WallManager(base_wall_path=str(tmp_path), storage=SegmentedNoteStorage(str(tmp_path)))
+        asyncio.run(manager.post_note("general", "alice", {"text": "hi"}))
+        asyncio.run(manager.post_note("general", "alice", {"text": "secret"}, is_private=True, recipient_user_id="bob"))
+
+        assert len(asyncio.run(manager.get_notes_from_thread("general", "bob"))) == 2
+        assert len(asyncio.run(manager.get_notes_from_thread("general", "carol"))) == 1
+        assert not any(f.endswith('.json') for f in os.listdir(tmp_path / "general"))
+
+    def test_wall_manager_reads_pages(self, tmp_path):
+        """Чтение треда ограничено limit: хранилище не отдает весь тред ради последних заметок"""
+        storage = SegmentedNoteStorage(str(tmp_path))
+        for i in range(30):
+            note = dict(make_note(i), is_private=i % 3 == 0, recipient_user_id="bob", author_id="alice")
+            storage.append("general", note["id"], note)
+        manager = WallManager(base_wall_path=str(tmp_path), storage=storage)
+        limits = []
+        query = storage.query
+
+        def counted(thread_id, **kwargs):
+            limits.append(kwargs["limit"])
+            return query(thread_id, **kwargs)
+
+        storage.query = counted
+        carol = asyncio.run(manager.get_notes_from_thread("general", "carol", limit=5))
+        assert [n["id"] for n in carol] == ["n0023", "n0025", "n0026", "n0028", "n0029"]
+        assert limits == [5, 5]
+        bob = asyncio.run(manager.get_notes_from_thread("general", "bob", limit=5))
+        assert [n["id"] for n in bob] == [f"n{i:04d}" for i in range(25, 30)]
+        assert len(asyncio.run(manager.get_notes_from_thread("general", "carol", limit=0))) == 20
+        storage.close()
+
+    def test_migration_is_idempotent(self, tmp_path):
+        """Миграция переносит все заметки и не дублирует их при повторном запуске"""
+        files = FileNoteStorage(str(tmp_path))
+        for i in range(10):
+            files.append("general", f"n{i:04d}", make_note(i))
+
+        assert migrate_wall(str(tmp_path))["general"]["migrated"] == 10
+        assert migrate_wall(str(tmp_path))["general"]["migrated"] == 0
+
+        migrate_wall(str(tmp_path), delete_source=True)
+        assert not any(f.endswith('.json') for f in os.listdir(tmp_path / "general"))
+        notes = SegmentedNoteStorage(str(tmp_path)).query("general", limit=0)
+        assert [n["id"] for n in notes] == [f"n{i:04d}" for i in range(10)]
+
+
+class TestKeysetPagination:
+    """Постраничное чтение треда по курсору (created_at, id)"""
+
+    @pytest.fixture(params=["files", "segments"])
+    def storage(self, request, tmp_path):
+        storage = FileNoteStorage(str(tmp_path)) if request.param == "files" else small_storage(tmp_path)
+        # Пары заметок с одинаковым created_at: порядок внутри пары задает id
+        for i in range(30):
+            note = make_note(i, f"2024-01-01T00:00:{i // 2:02d}Z")
+            storage.append("general", note["id"], note)
+        return storage
+
+    def test_pages_cover_thread_without_gaps(self, storage):
+        expected = [n["id"] for n in storage.query("general", limit=0)]
+        assert expected == [f"n{i:04d}" for i in range(30)]
+
+        pages, before = [], None
+        while True:
+            notes = storage.query("general", limit=7, before=before)
+            pages.append([n["id"] for n in notes])
+            cursor = next_page_cursor(notes, 7)
+            if cursor is None:
+                break
+            before = decode_cursor(cursor)
+
+        assert [len(page) for page in pages] == [7, 7, 7, 7, 2]
+        assert [note_id for page in reversed(pages) for note_id in page] == expected
+
+    def test_cursor_with_since(self, storage):
+        before = note_page_key(make_note(21, "2024-01-01T00:00:10Z"))
+        notes = storage.query("general", since="2024-01-01T00:00:08Z", limit=0, before=before)
+        assert [n["id"] for n in notes] == [f"n{i:04d}" for i in range(16, 21)]
+
+    def test_cursor_round_trip(self):
+        cursor = encode_cursor((1704067200.5, "заметка"))
+        assert decode_cursor(cursor) == (1704067200.5, "заметка")
+        for bad in ("!!!", encode_cursor((1.0, "b"))[:-2] + "xx", "e30", encode_cursor(("2024", "b"))):
+            with pytest.raises(ValueError):
+                decode_cursor(bad)
+
+
+class TestWallThreadsPagination:
+    """Пагинация и NDJSON-выдача /api/v1/wall/threads"""
+
+    @pytest.fixture
+    def client(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("WALL_PATH", str(tmp_path))
+        monkeypatch.setenv("WALL_STORAGE_BACKEND", "files")
+        wall = WallAPI(git_tools=AsyncMock())
+        for i in range(12):
+            note = make_note(i)
+            wall.storage.append("general", note["id"], note)
+        wall_cache.clear()
+        with patch('bridge.main.wall_api', wall):
+            yield TestClient(app)
+
+    def test_next_cursor_header(self, client):
+        first = client.get("/api/v1/wall/threads?thread_id=general&limit=5")
+        assert [n["id"] for n in first.json()] == [f"n{i:04d}" for i in range(7, 12)]
+
+        second = client.get(f"/api/v1/wall/threads?thread_id=general&limit=5&cursor={first.headers['X-Next-Cursor']}")
+        assert [n["id"] for n in second.json()] == [f"n{i:04d}" for i in range(2, 7)]
+
+        last = client.get(f"/api/v1/wall/threads?thread_id=general&limit=5&cursor={second.headers['X-Next-Cursor']}")
+        assert [n["id"] for n in last.json()] == ["n0000", "n0001"]
+        assert "X-Next-Cursor" not in last.headers
+
+        assert client.get("/api/v1/wall/threads?thread_id=general&cursor=!!!").status_code == 400
+
+    def test_ndjson_stream(self, client, monkeypatch):
+        monkeypatch.setattr("bridge.main.WALL_STREAM_PAGE_SIZE", 5)
+        response = client.get("/api/v1/wall/threads?thread_id=general&format=ndjson&limit=0")
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        ids = [json.loads(line)["id"] for line in response.text.splitlines()]
+        assert ids == [f"n{i:04d}" for i in reversed(range(12))]
+
+        response = client.get("/api/v1/wall/threads?thread_id=general&format=ndjson&limit=3")
+        assert len(response.text.splitlines()) == 3
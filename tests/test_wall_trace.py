@@ -0,0 +1,62 @@
+"""
+Тесты трассировки чтения стены (mcp/tools/wall_trace.py)
+"""
+
+import asyncio
+import logging
+import pytest
+from unittest.mock import AsyncMock
+
+from bridge.api.wall import WallAPI
+from bridge.shared_state import LocalStateBackend
+from mcp.tools import wall_trace
+from mcp.tools.wall_codec import encode_note
+
+
+class TestWallTrace:
+    """Запись на запрос со счетчиками и отсутствие вывода при off"""
+
+    @pytest.fixture(params=["files", "segments"])
+    def wall(self, request, tmp_path, monkeypatch):
+        monkeypatch.setenv("WALL_PATH", str(tmp_path))
+        monkeypatch.setenv("WALL_STORAGE_BACKEND", request.param)
+        monkeypatch.setenv("WALL_VERIFY_SIGNATURES", "off")
+        wall = WallAPI(git_tools=AsyncMock(), state=LocalStateBackend())
+        for i in range(3):
+            wall.storage.append("general", f"n{i}", {"id": f"n{i}", "created_at": 1700000000 + i, "content": "x"})
+        wall.storage.sync()
+        yield wall
+        wall.storage.close()
+        wall_trace.set_trace_level("off")
+
+    def trace_records(self, caplog, wall, thread_id="general"):
+        with caplog.at_level(logging.DEBUG, logger="wall.trace"):
+            notes = asyncio.run(wall.get_thread_notes(thread_id))
+        return notes, [r for r in caplog.records if r.name == "wall.trace"]
+
+    def test_off(self, wall, caplog, capsys):
+        wall_trace.set_trace_level("off")
+        notes, records = self.trace_records(caplog, wall)
+        assert len(notes) == 3 and records == []
+        assert wall_trace.current_span() is wall_trace.NULL_SPAN
+        assert capsys.readouterr().out == ""
+
+    def test_request_span(self, wall, caplog):
+        wall_trace.set_trace_level("request")
+        notes, records = self.trace_records(caplog, wall)
+        assert len(records) == 1 and records[0].levelno == logging.INFO
+        data = records[0].extra_data
+        assert data["span"] == "get_thread_notes" and data["thread_id"] == "general"
+        assert data["returned"] == 3 and data["files"] >= 1
+        if wall.storage.name == "files":
+            assert data["files"] == 3
+            assert data["bytes_read"] == sum(len(encode_note(note)) for note in notes)
+        assert data["parse_ms"] >= 0 and data["elapsed_ms"] >= data["parse_ms"]
+
+    def test_note_level(self, wall, caplog):
+        wall_trace.set_trace_level("note")
+        _, records = self.trace_records(caplog, wall)
+        details = [r for r in records if r.levelno == logging.DEBUG]
+        assert details and len(records) == len(details) + 1
+        _, records = self.trace_records(caplog, wall, thread_id="missing")
+        assert records[-1].extra_data["found"] is False and records[-1].extra_data["files"] == 0
@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+"""
+Тесты рассылки событий WebSocket-клиентам
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from bridge.ws_broadcaster import (
+    COALESCE, DISCONNECT, DROP_OLDEST, CLOSE_CODE_IDLE, CLOSE_CODE_SLOW_CONSUMER, EncodedEvent, EventRingBuffer, WebSocketBroadcaster
+)
+from bridge.ws_codecs import JSON_CODEC, get_codec, negotiate_codec
+from bridge.ws_subscriptions import EventFilter, SubscriptionIndex
+
+
+class FakeWebSocket:
+    """WebSocket, отправка в который ждет разрешения (имитация медленного клиента)"""
+
+    def __init__(self, name, blocked=False):
+        self.client = name
+        self.frames = []
+        self.binary = []
+        self.closed_with = None
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def send_text(self, frame):
+        await self.unblocked.wait()
+        self.frames.append(json.loads(frame))
+
+    async def send_bytes(self, frame):
+        await self.unblocked.wait()
+        self.binary.append(frame)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class TestWebSocketBroadcaster:
+    """Тесты WebSocketBroadcaster"""
+
+    @pytest.mark.asyncio
+    async def test_slow_client_does_not_block_others(self):
+        broadcaster = WebSocketBroadcaster(max_queue=10, policy=DROP_OLDEST)
+        fast, slow = FakeWebSocket("fast"), FakeWebSocket("slow", blocked=True)
+        broadcaster.register(fast)
+        broadcaster.register(slow)
+
+        for i in range(3):
+            assert broadcaster.broadcast({"type": "p2p_event", "data": {"id": i}}) == 2
+        await settle()
+
+        assert [f["data"]["id"] for f in fast.frames] == [0, 1, 2]
+        assert slow.frames == []
+
+        slow.unblocked.set()
+        await settle()
+        assert [f["data"]["id"] for f in slow.frames] == [0, 1, 2]
+        await broadcaster.close()
+
+    @pytest.mark.asyncio
+    async def test_serializes_once_per_event(self, monkeypatch):
+        broadcaster = WebSocketBroadcaster(max_queue=10)
+        for i in range(5):
+            broadcaster.register(FakeWebSocket(f"c{i}"))
+
+        calls = []
+        real_dumps = json.dumps
+        monkeypatch.setattr("bridge.ws_codecs.json.dumps", lambda *a, **k: calls.append(1) or real_dumps(*a, **k))
+        broadcaster.broadcast({"type": "p2p_event", "data": {}})
+
+        assert len(calls) == 1
+        await broadcaster.close()
+
+    @pytest.mark.asyncio
+    async def test_drop_oldest(self):
+        broadcaster = WebSocketBroadcaster(max_queue=2, policy=DROP_OLDEST)
+        slow = FakeWebSocket("slow", blocked=True)
+        broadcaster.register(slow)
+        await settle()
+
+        for i in range(5):
+            broadcaster.broadcast({"id": i})
+        assert broadcaster.stats()["dropped"] == 3
+
+        slow.unblocked.set()
+        await settle()
+        assert [f["id"] for f in slow.frames] == [3, 4]
+        await broadcaster.close()
+
+    @pytest.mark.asyncio
+    async def test_disconnect_slow_consumer(self):
+        broadcaster = WebSocketBroadcaster(max_queue=2, policy=DISCONNECT)
+        slow, fast = FakeWebSocket("slow", blocked=True), FakeWebSocket("fast")
+        broadcaster.register(slow)
+        broadcaster.register(fast)
+        await settle()
+
+        for i in range(4):
+            broadcaster.broadcast({"id": i})
+            await settle()
+
+        assert slow.closed_with == CLOSE_CODE_SLOW_CONSUMER
+        assert list(broadcaster.clients) == [fast]
+        assert broadcaster.stats()["disconnected_slow"] == 1
+        assert len(fast.frames) == 4
+        await broadcaster.close()
+
+    @pytest.mark.asyncio
+    async def test_coalesce_keeps_latest_per_key(self):
+        broadcaster = WebSocketBroadcaster(max_queue=3, policy=COALESCE)
+        slow = FakeWebSocket("slow", blocked=True)
+        broadcaster.register(slow)
+        await settle()
+
+        broadcaster.broadcast({"v": 1}, key="status")
+        broadcaster.broadcast({"v": 2}, key="status")
+        broadcaster.broadcast({"v": 3}, key="other")
+        broadcaster.broadcast({"v": 4}, key="status")
+
+        slow.unblocked.set()
+        await settle()
+        assert [f["v"] for f in slow.frames] == [2, 3, 4]
+        assert broadcaster.stats()["coalesced"] == 1
+        await broadcaster.close()
+
+    @pytest.mark.asyncio
+    async def test_replies_are_not_dropped(self):
+        broadcaster = WebSocketBroadcaster(max_queue=1, policy=DROP_OLDEST)
+        slow = FakeWebSocket("slow", blocked=True)
+        broadcaster.register(slow)
+        await settle()
+
+        broadcaster.broadcast({"id": 1})
+        assert broadcaster.send(slow, {"type": "pong"})
+        slow.unblocked.set()
+        await settle()
+        assert slow.frames == [{"id": 1}, {"type": "pong"}]
+        await broadcaster.close()
+
+    @pytest.mark.asyncio
+    async def test_drop_oldest_keeps_queued_replies(self):
+        broadcaster = WebSocketBroadcaster(max_queue=2, policy=DROP_OLDEST)
+        slow = FakeWebSocket("slow", blocked=True)
+        broadcaster.register(slow)
+        broadcaster.send(slow, {"type": "first"})  # Уже у писателя
+        await settle()
+
+        broadcaster.send(slow, {"type": "reply"})
+        for i in range(4):
+            broadcaster.broadcast({"id": i})
+        assert broadcaster.stats()["dropped"] == 2
+        slow.unblocked.set()
+        await settle()
+        assert slow.frames == [{"type": "first"}, {"type": "reply"}, {"id": 2}, {"id": 3}]
+        await broadcaster.close()
+
+    @pytest.mark.asyncio
+    async def test_unread_replies_are_bounded(self):
+        """Клиент, который шлет запросы и не читает ответы, отключается, а не растит очередь"""
+        broadcaster = WebSocketBroadcaster(max_queue=2, max_pending=3)
+        slow = FakeWebSocket("slow", blocked=True)
+        broadcaster.register(slow)
+        broadcaster.send(slow, {"type": "reply", "n": 0})  # Уже у писателя
+        await settle()
+
+        assert all(broadcaster.send(slow, {"type": "reply", "n": i}) for i in range(1, 4))
+        assert not broadcaster.send(slow, {"type": "reply", "n": 4})
+        await settle()
+        assert slow.closed_with == CLOSE_CODE_SLOW_CONSUMER
+        assert broadcaster.clients == {} and broadcaster.stats()["disconnected_slow"] == 1
+        await broadcaster.close()
+
+    @pytest.mark.asyncio
+    async def test_failed_send_removes_client(self):
+        broadcaster = WebSocketBroadcaster(max_queue=10)
+        broken = FakeWebSocket("broken")
+
+        async def fail(frame):
+            raise ConnectionError("gone")
+
+        broken.send_text = fail
+        broadcaster.register(broken)
+        broadcaster.broadcast({"id": 1})
+        await settle()
+
+        assert broadcaster.clients == {}
+
+    def test_unknown_policy(self):
+        with pytest.raises(ValueError):
+            WebSocketBroadcaster(policy="block")
+
+
+def event(event_id, pubkey="alice", kind=1, thread="general", created_at=1700000000):
+    return {"id": event_id, "pubkey": pubkey, "kind": kind, "created_at": created_at,
+            "tags": [["t", thread]], "content": event_id}
+
+
+class TestSubscriptions:
+    """Тесты подписок по фильтрам"""
+
+    def test_filter_matching(self):
+        f = EventFilter.from_dict({"kinds": [1], "authors": ["alice"], "#t": ["general", "news"], "since": 1600000000})
+        assert f.matches(event("e1"))
+        assert f.matches(event("e2", thread="news", created_at="2024-01-01T00:00:00Z"))
+        assert not f.matches(event("e3", pubkey="bob"))
+        assert not f.matches(event("e4", kind=4))
+        assert not f.matches(event("e5", thread="other"))
+        assert not f.matches(event("e6", created_at=1500000000))
+
+    def test_invalid_filters(self):
+        for bad in [{"kinds": ["1"]}, {"authors": "alice"}, {"since": "yesterday"}, {"foo": 1}, []]:
+            with pytest.raises(ValueError):
+                EventFilter.from_dict(bad)
+
+    def test_index_routes_without_scanning_all_subscriptions(self):
+        index = SubscriptionIndex()
+        clients = [object() for _ in range(1000)]
+        for i, client in enumerate(clients):
+            index.add(client, "s", [EventFilter.from_dict({"#t": [f"thread{i}"]})])
+
+        assert len(index._candidates(event("e1", thread="thread7"))) == 1
+        assert index.match(event("e1", thread="thread7")) == {clients[7]: ["s"]}
+        assert index.match(event("e2", thread="nobody")) == {}
+
+        index.remove(clients[7], "s")
+        assert index.match(event("e1", thread="thread7")) == {}
+
+    @pytest.mark.asyncio
+    async def test_broadcast_event_routes_by_subscription(self):
+        broadcaster = WebSocketBroadcaster(max_queue=10)
+        firehose, general, bob = FakeWebSocket("all"), FakeWebSocket("general"), FakeWebSocket("bob")
+        for ws in (firehose, general, bob):
+            broadcaster.register(ws)
+        broadcaster.subscribe(general, "g", [{"#t": ["general"]}])
+        broadcaster.subscribe(general, "any-alice", [{"authors": ["alice"]}])
+        broadcaster.subscribe(bob, "b", [{"authors": ["bob"]}, {"kinds": [4]}])
+
+        assert broadcaster.broadcast_event(event("e1")) == 2
+        assert broadcaster.broadcast_event(event("e2", pubkey="bob", thread="news")) == 2
+        await settle()
+
+        assert [f["data"]["id"] for f in firehose.frames] == ["e1", "e2"]
+        assert [(f["data"]["id"], f["subscriptions"]) for f in general.frames] == [("e1", ["any-alice", "g"])]
+        assert [(f["data"]["id"], f["subscriptions"]) for f in bob.frames] == [("e2", ["b"])]
+
+        # Без подписок клиент снова получает все события
+        assert broadcaster.unsubscribe(bob, "b")
+        broadcaster.broadcast_event(event("e3", pubkey="carol", thread="news"))
+        await settle()
+        assert bob.frames[-1] == {"type": "p2p_event", "data": event("e3", pubkey="carol", thread="news")}
+        await broadcaster.close()
+
+    @pytest.mark.asyncio
+    async def test_subscription_limit_and_cleanup(self):
+        broadcaster = WebSocketBroadcaster(max_queue=10, max_subscriptions=2)
+        ws = FakeWebSocket("c")
+        broadcaster.register(ws)
+        broadcaster.subscribe(ws, "a", [{"kinds": [1]}])
+        broadcaster.subscribe(ws, "b", [{"kinds": [1]}])
+        broadcaster.subscribe(ws, "a", [{"kinds": [4]}])  # замена существующей подписки
+        with pytest.raises(ValueError):
+            broadcaster.subscribe(ws, "c", [{"kinds": [1]}])
+
+        await broadcaster.unregister(ws)
+        assert len(broadcaster.subscriptions) == 0
+
+    def test_ws_endpoint_subscribe(self):
+        from fastapi.testclient import TestClient
+        from bridge.main import app
+
+        with TestClient(app).websocket_connect("/ws") as websocket:
+            websocket.send_text(json.dumps({"type": "subscribe", "id": "s1", "filters": [{"#t": ["general"]}]}))
+            assert websocket.receive_json() == {"type": "subscribed", "id": "s1"}
+
+            websocket.send_text(json.dumps({"type": "subscribe", "id": "s2", "filters": [{"kinds": "x"}]}))
+            reply = websocket.receive_json()
+            assert reply["type"] == "error" and reply["id"] == "s2"
+
+            websocket.send_text(json.dumps({"type": "unsubscribe", "id": "s1"}))
+            assert websocket.receive_json() == {"type": "unsubscribed", "id": "s1", "found": True}
+
+
+class TestReplay:
+    """Повтор пропущенных событий по last_seq"""
+
+    def test_ring_buffer(self):
+        buffer = EventRingBuffer(capacity=3)
+        assert buffer.since(0) == []
+        for seq in range(1, 6):
+            buffer.append(EncodedEvent(event(f"e{seq}"), seq))
+
+        assert [entry.seq for entry in buffer.since(2)] == [3, 4, 5]
+        assert buffer.since(5) == []
+        assert buffer.since(1) is None  # событие 2 уже вытеснено
+        assert buffer.since(9) is None  # курсор из будущего (сброс счетчика)
+
+        buffer.append(EncodedEvent(event("r1"), 1))  # счетчик начался заново
+        assert [entry.seq for entry in buffer.entries] == [1]
+
+    @pytest.mark.asyncio
+    async def test_resume_replays_missed_events(self):
+        broadcaster = WebSocketBroadcaster(max_queue=10, replay_buffer_size=10)
+        for seq in range(1, 4):
+            broadcaster.broadcast_event(event(f"e{seq}", thread="news" if seq == 2 else "general"), seq=seq)
+
+        ws = FakeWebSocket("c")
+        broadcaster.register(ws)
+        broadcaster.subscribe(ws, "g", [{"#t": ["general"]}])
+        result = await broadcaster.resume(ws, 1, snapshot=None)
+        await settle()
+
+        assert result == {"type": "resumed", "last_seq": 1, "seq": 3, "replayed": 1}
+        assert [(f.get("seq"), f["type"]) for f in ws.frames] == [(3, "p2p_event"), (3, "resumed")]
+        assert ws.frames[0]["subscriptions"] == ["g"]
+        await broadcaster.close()
+
+    @pytest.mark.asyncio
+    async def test_gap_falls_back_to_snapshot(self):
+        broadcaster = WebSocketBroadcaster(max_queue=10, replay_buffer_size=2)
+        for seq in range(1, 5):
+            broadcaster.broadcast_event(event(f"e{seq}"), seq=seq)
+
+        ws = FakeWebSocket("c")
+        broadcaster.register(ws)
+        broadcaster.subscribe(ws, "g", [{"#t": ["general", "news"]}])
+        requested = []
+
+        async def snapshot(threads):
+            requested.append(threads)
+            # Событие, пришедшее во время чтения снимка, клиент получит после снимка
+            broadcaster.broadcast_event(event("e5"), seq=5)
+            return {"threads": {t: [] for t in threads}}
+
+        result = await broadcaster.resume(ws, 1, snapshot)
+        await settle()
+
+        assert requested == [["general", "news"]]
+        assert result["type"] == "snapshot" and result["seq"] == 4
+        assert [(f["type"], f.get("seq")) for f in ws.frames] == [("snapshot", 4), ("p2p_event", 5)]
+        assert broadcaster.stats()["latest_seq"] == 5
+        await broadcaster.close()
+
+    def test_ws_endpoint_resume(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        from bridge.main import app, ws_broadcaster
+
+        # Буфер повтора общего broadcaster хранит события предыдущих тестов - начинаем с пустого
+        monkeypatch.setattr(ws_broadcaster, "history", EventRingBuffer(ws_broadcaster.history.capacity))
+        with TestClient(app).websocket_connect("/ws?last_seq=0") as websocket:
+            assert websocket.receive_json() == {"type": "resumed", "last_seq": 0, "seq": 0, "replayed": 0}
+
+            websocket.send_text(json.dumps({"type": "resume", "last_seq": -1}))
+            assert websocket.receive_json()["type"] == "error"
+
+
+class TestCodecs:
+    """Согласование кодека кадров /ws"""
+
+    def test_negotiation(self):
+        assert negotiate_codec() == (JSON_CODEC, None)
+        assert negotiate_codec(None, ["chat", "sdominanta.unknown"]) == (JSON_CODEC, None)
+        with pytest.raises(ValueError):
+            negotiate_codec("xml")
+
+        pytest.importorskip("msgpack")
+        codec, subprotocol = negotiate_codec(None, ["chat", "sdominanta.msgpack", "sdominanta.json"])
+        assert (codec.name, subprotocol) == ("msgpack", "sdominanta.msgpack")
+        codec, subprotocol = negotiate_codec("msgpack", [])
+        assert (codec.name, subprotocol) == ("msgpack", None)
+
+    @pytest.mark.parametrize("name", ["json", "msgpack", "cbor"])
+    def test_event_frame_round_trip(self, name):
+        pytest.importorskip({"json": "json", "msgpack": "msgpack", "cbor": "cbor2"}[name])
+        codec = get_codec(name)
+        encoded = EncodedEvent(event("e1"), seq=7)
+
+        frame = encoded.frame(codec, ["a", "b"])
+        assert codec.loads(frame) == {"type": "p2p_event", "seq": 7, "subscriptions": ["a", "b"], "data": event("e1")}
+        assert codec.loads(encoded.frame(codec)) == {"type": "p2p_event", "seq": 7, "data": event("e1")}
+        assert encoded.frame(codec) is encoded.frame(codec)  # кадр без подписок кодируется один раз
+
+    @pytest.mark.asyncio
+    async def test_mixed_encodings_encode_once_per_codec(self, monkeypatch):
+        msgpack = pytest.importorskip("msgpack")
+        codec = get_codec("msgpack")
+        broadcaster = WebSocketBroadcaster(max_queue=10)
+        json_clients = [FakeWebSocket(f"j{i}") for i in range(3)]
+        binary_clients = [FakeWebSocket(f"b{i}") for i in range(3)]
+        for ws in json_clients:
+            broadcaster.register(ws)
+        for ws in binary_clients:
+            broadcaster.register(ws, codec)
+
+        encoded = []
+        real_dumps = type(codec).dumps
+        monkeypatch.setattr(type(codec), "dumps",
+                            lambda self, obj: encoded.append(obj) or real_dumps(self, obj))
+        assert broadcaster.broadcast_event(event("e1"), seq=1) == 6
+        await settle()
+
+        assert [obj for obj in encoded if isinstance(obj, dict)] == [event("e1")]
+        assert all(ws.frames[0]["data"] == event("e1") for ws in json_clients)
+        assert all(msgpack.unpackb(ws.binary[0])["data"] == event("e1") for ws in binary_clients)
+        assert broadcaster.stats()["encodings"] == {"json": 3, "msgpack": 3}
+        await broadcaster.close()
+
+    def test_ws_endpoint_binary_encoding(self):
+        msgpack = pytest.importorskip("msgpack")
+        from fastapi.testclient import TestClient
+        from bridge.main import app
+
+        client = TestClient(app)
+        with client.websocket_connect("/ws", subprotocols=["sdominanta.msgpack"]) as websocket:
+            assert websocket.accepted_subprotocol == "sdominanta.msgpack"
+            websocket.send_bytes(msgpack.packb({"type": "ping"}))
+            assert msgpack.unpackb(websocket.receive_bytes())["type"] == "pong"
+
+            # Текстовые сообщения остаются JSON, ответы - в кодеке соединения
+            websocket.send_text(json.dumps({"type": "test", "data": "x"}))
+            assert msgpack.unpackb(websocket.receive_bytes())["data"] == "x"
+
+            websocket.send_bytes(b"\xc1")
+            assert msgpack.unpackb(websocket.receive_bytes()) == {"type": "error", "message": "Invalid msgpack format"}
+
+        with client.websocket_connect("/ws?encoding=xml") as websocket:
+            assert websocket.receive_json()["type"] == "error"
+
+
+class TestHeartbeat:
+    """Heartbeat и отключение неактивных клиентов"""
+
+    @pytest.mark.asyncio
+    async def test_ping_pong_measures_rtt(self):
+        broadcaster = WebSocketBroadcaster(max_queue=10, heartbeat_interval=0, idle_timeout=60)
+        ws = FakeWebSocket("c")
+        broadcaster.register(ws)
+
+        assert broadcaster.heartbeat() == 0
+        await settle()
+        ping = ws.frames[-1]
+        assert ping["type"] == "ping"
+
+        assert broadcaster.pong(ws, ping["id"] + 1) is None  # чужой id не считается
+        assert broadcaster.pong(ws, ping["id"]) >= 0
+        stats = broadcaster.stats()
+        assert stats["clients"][0]["pongs"] == 1
+        assert stats["clients"][0]["rtt_ms"] is not None and stats["rtt_avg_ms"] is not None
+        await broadcaster.close()
+
+    @pytest.mark.asyncio
+    async def test_idle_clients_are_reaped(self):
+        broadcaster = WebSocketBroadcaster(max_queue=10, heartbeat_interval=0, idle_timeout=30)
+        alive, dead = FakeWebSocket("alive"), FakeWebSocket("dead")
+        broadcaster.register(alive)
+        broadcaster.register(dead)
+        broadcaster.clients[dead].last_seen -= 31
+        broadcaster.clients[alive].last_seen -= 29
+        broadcaster.touch(alive)
+
+        assert broadcaster.heartbeat() == 1
+        await settle()
+        assert dead.closed_with == CLOSE_CODE_IDLE
+        assert list(broadcaster.clients) == [alive]
+        assert broadcaster.broadcast_event(event("e1")) == 1
+        assert broadcaster.stats()["reaped_idle"] == 1
+        await broadcaster.close()
+
+    @pytest.mark.asyncio
+    async def test_passive_subscriber_is_kept_by_default(self, monkeypatch):
+        """Без явной настройки прикладной heartbeat выключен: молчащий подписчик не отключается"""
+        monkeypatch.delenv("WS_HEARTBEAT_INTERVAL", raising=False)
+        monkeypatch.delenv("WS_IDLE_TIMEOUT", raising=False)
+        broadcaster = WebSocketBroadcaster(max_queue=10)
+        ws = FakeWebSocket("passive")
+        broadcaster.register(ws)
+        broadcaster.clients[ws].last_seen -= 3600
+
+        assert broadcaster._heartbeat is None
+        assert broadcaster.heartbeat() == 0
+        assert broadcaster.broadcast_event(event("e1")) == 1
+        await broadcaster.close()
+
+    @pytest.mark.asyncio
+    async def test_heartbeat_task_runs_periodically(self):
+        broadcaster = WebSocketBroadcaster(max_queue=10, heartbeat_interval=0.01, idle_timeout=0)
+        ws = FakeWebSocket("c")
+        broadcaster.register(ws)
+
+        await asyncio.sleep(0.05)
+        assert broadcaster.clients[ws].pings >= 2
+        await broadcaster.close()
+        assert broadcaster._heartbeat is None
+
+    def test_ws_endpoint_pong_and_stats(self):
+        from fastapi.testclient import TestClient
+        from bridge.main import app, ws_broadcaster
+
+        client = TestClient(app)
+        with client.websocket_connect("/ws") as websocket:
+            connection = next(iter(ws_broadcaster.clients.values()))
+            connection.ping()
+            ping = websocket.receive_json()
+            websocket.send_text(json.dumps({"type": "pong", "id": ping["id"]}))
+            websocket.send_text(json.dumps({"type": "ping"}))
+            assert websocket.receive_json()["type"] == "pong"
+
+            stats = client.get("/api/v1/performance/stats").json()["websockets"]
+            assert stats["clients"][0]["pongs"] == 1